@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+21年分データのインメモリ・レースキューブ
+
+historical_programs / historical_race_results / historical_payoffs を1回だけ読み込み、
+レース単位のNumPy配列（レース×6艇）に展開する。条件（号艇×当地勝率帯、場×R など）は
+ブール配列のマスクとして表し、条件グリッド全体の回収率・的中率をまとめて計算する。
+
+条件1セルごとにDBへ接続して重いCTEを実行する必要はない。
+
+- 読み込みは1接続・テーブルごとに COPY 1回（pandas.read_csv で取り込み）
+- SNAPSHOT_DIR にParquetスナップショット（parquet_snapshot.py）があればDBに接続せずに構築
+- 読み込んだキューブは .npz に保存でき、2回目以降はDBに接続せずに読み込める
+- 払戻金は100円あたりの金額。的中しなかったレースは0
+
+使用例:
+    cube = RaceCube.cached()
+    masks = {(b, low): cube.settled & between(cube.boat_feature('local_win_rate', b), low, low + 1)
+             for b in range(1, 7) for low in (4.0, 5.0, 6.0)}
+    bets = {'tansho-1': cube.payout('tansho', '1')}
+    for row in evaluate_grid(masks, bets):
+        print(row)
+"""
+
+import io
+import os
+import time
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+# キューブのキャッシュファイル
+DEFAULT_CACHE_PATH = os.environ.get('RACE_CUBE_CACHE', 'race_cube.npz')
+
+# parquet_snapshot.py で書き出したスナップショット（あればDBの代わりに使う）
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '')
+
+# 出走表から読み込む数値列（レース×6艇の float32 配列、欠損はNaN）
+PROGRAM_FEATURES = (
+    'national_win_rate', 'national_2nd_rate',
+    'local_win_rate', 'local_2nd_rate',
+    'motor_2nd_rate', 'boat_2nd_rate',
+    'age', 'weight',
+)
+
+# 級別のコード（0は不明）
+RACER_CLASSES = {'A1': 1, 'A2': 2, 'B1': 3, 'B2': 4}
+
+# 払戻金の式別
+BET_TYPES = ('tansho', 'fukusho', 'nirentan', 'nirenpuku', 'wide', 'sanrentan', 'sanrenpuku')
+
+# グリッド評価時に一度に処理するレース数（メモリ使用量の上限）
+GRID_CHUNK = 200_000
+
+# レースキー（YYYYMMDD * 10000 + 場コード * 100 + R番号）を作るSQL式
+_RACE_KEY_SQL = ("race_date::bigint * 10000 + stadium_code::int * 100 + race_no::int")
+
+
+def race_key(race_date, stadium, race_no):
+    """日付・場コード・R番号（数値または配列）からレースキーを作る"""
+    return (np.asarray(race_date, dtype=np.int64) * 10000
+            + np.asarray(stadium, dtype=np.int64) * 100
+            + np.asarray(race_no, dtype=np.int64))
+
+
+def encode_combination(combination: str) -> int:
+    """組番を数値に変換（'1-3' → 13、'1-2-3' → 123）"""
+    return int(combination.replace('-', '').replace('=', ''))
+
+
+def decode_combination(code: int) -> str:
+    """組番コードを文字列に戻す（13 → '1-3'、123 → '1-2-3'）"""
+    return '-'.join(str(int(code)))
+
+
+def between(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """low <= values < high のマスク（NaNはFalse）"""
+    return (values >= low) & (values < high)
+
+
+def _copy_to_frame(conn, query: str, dtype: Dict[str, str]) -> pd.DataFrame:
+    """COPY (query) TO STDOUT の結果をDataFrameとして読み込む"""
+    buffer = io.StringIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", buffer)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype=dtype)
+
+
+class RaceCube:
+    """
+    レース単位の列指向データ
+
+    Attributes:
+        keys: レースキー（昇順、shape=(n,)）
+        race_date / stadium / race_no: レースキーを分解した int 配列
+        features: 出走表の数値列（shape=(n, 6)、欠損はNaN）
+        racer_class: 級別コード（shape=(n, 6)、RACER_CLASSES）
+        finish: 着順（shape=(n, 6)、失格・欠場・不明は0）
+        settled: 単勝の払戻金があるレース（確定したレース）
+    """
+
+    def __init__(self, keys: np.ndarray, features: Dict[str, np.ndarray],
+                 racer_class: np.ndarray, finish: np.ndarray,
+                 payoffs: Dict[str, Dict[str, np.ndarray]]):
+        self.keys = keys
+        self.features = features
+        self.racer_class = racer_class
+        self.finish = finish
+        # 式別ごとに (race_index * 1000 + 組番) の昇順キーと払戻金を持つ
+        self.payoffs = payoffs
+
+        self.race_date = (keys // 10000).astype(np.int32)
+        self.stadium = ((keys // 100) % 100).astype(np.int8)
+        self.race_no = (keys % 100).astype(np.int8)
+        self.year = (self.race_date // 10000).astype(np.int16)
+        self.month = ((self.race_date // 100) % 100).astype(np.int8)
+        self.settled = self.has_payoff('tansho')
+
+    @property
+    def n_races(self) -> int:
+        return len(self.keys)
+
+    # ------------------------------------------------------------------
+    # 構築・保存
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def from_db(cls, database_url: Optional[str] = None,
+                start_date: Optional[str] = None, end_date: Optional[str] = None) -> 'RaceCube':
+        """
+        DBから出走表・結果・払戻金を読み込んでキューブを作る
+
+        Args:
+            database_url: 接続先（省略時は環境変数 DATABASE_URL）
+            start_date: 開始日（YYYYMMDD、含む）
+            end_date: 終了日（YYYYMMDD、含む）
+
+        Returns:
+            RaceCube
+        """
+        conditions = []
+        if start_date:
+            conditions.append(f"race_date >= '{start_date}'")
+        if end_date:
+            conditions.append(f"race_date <= '{end_date}'")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        started = time.time()
+        conn = psycopg2.connect(database_url or os.environ['DATABASE_URL'], connect_timeout=60)
+        try:
+            programs = _copy_to_frame(conn, f"""
+                SELECT {_RACE_KEY_SQL} AS race_key, boat_no::int AS boat_no, rank,
+                       {', '.join(PROGRAM_FEATURES)}
+                FROM historical_programs {where}
+            """, {'rank': 'str'})
+            print(f"  出走表: {len(programs):,}行")
+
+            results = _copy_to_frame(conn, f"""
+                SELECT {_RACE_KEY_SQL} AS race_key, boat_no::int AS boat_no,
+                       CASE WHEN rank ~ '^[0-9]+$' THEN rank::int ELSE 0 END AS place
+                FROM historical_race_results {where}
+            """, {})
+            print(f"  競走結果: {len(results):,}行")
+
+            payoffs = _copy_to_frame(conn, f"""
+                SELECT {_RACE_KEY_SQL} AS race_key, bet_type,
+                       replace(combination, '-', '')::int AS combo, payout
+                FROM historical_payoffs {where}
+                {'AND' if where else 'WHERE'} combination ~ '^[1-6](-[1-6]){{0,2}}$'
+            """, {'bet_type': 'str'})
+            print(f"  払戻金: {len(payoffs):,}行")
+        finally:
+            conn.close()
+
+        cube = cls.from_frames(programs, results, payoffs)
+        print(f"  キューブ構築完了: {cube.n_races:,}レース（{time.time() - started:.1f}秒）")
+        return cube
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir: str = SNAPSHOT_DIR) -> 'RaceCube':
+        """
+        Parquetスナップショット（parquet_snapshot.py sync で作成）からキューブを作る
+
+        Args:
+            snapshot_dir: スナップショットのルート
+
+        Returns:
+            RaceCube
+        """
+        started = time.time()
+
+        def read(table, columns):
+            frame = pd.read_parquet(os.path.join(snapshot_dir, table), columns=columns)
+            dates = pd.to_datetime(frame['race_date']).dt
+            frame['race_key'] = race_key(
+                dates.year * 10000 + dates.month * 100 + dates.day,
+                frame['stadium_code'], frame['race_no'])
+            return frame
+
+        programs = read('historical_programs',
+                        ['race_date', 'stadium_code', 'race_no', 'boat_no', 'rank', *PROGRAM_FEATURES])
+        results = read('historical_race_results',
+                       ['race_date', 'stadium_code', 'race_no', 'boat_no', 'rank'])
+        results['place'] = pd.to_numeric(results['rank'], errors='coerce').fillna(0).astype(np.int8)
+        payoffs = read('historical_payoffs',
+                       ['race_date', 'stadium_code', 'race_no', 'bet_type', 'combination', 'payout'])
+        payoffs = payoffs[payoffs['combination'].str.fullmatch(r'[1-6](-[1-6]){0,2}', na=False)]
+        payoffs = payoffs.assign(combo=payoffs['combination'].str.replace('-', '').astype(np.int64))
+
+        cube = cls.from_frames(programs, results, payoffs)
+        print(f"  キューブ構築完了: {cube.n_races:,}レース（{time.time() - started:.1f}秒）")
+        return cube
+
+    @classmethod
+    def from_frames(cls, programs: pd.DataFrame, results: pd.DataFrame,
+                    payoffs: pd.DataFrame) -> 'RaceCube':
+        """
+        縦持ちのDataFrameからキューブを作る
+
+        Args:
+            programs: race_key, boat_no, rank, PROGRAM_FEATURES の列
+            results: race_key, boat_no, place の列
+            payoffs: race_key, bet_type, combo, payout の列
+
+        Returns:
+            RaceCube
+        """
+        keys = np.unique(np.concatenate([
+            programs['race_key'].to_numpy(np.int64),
+            results['race_key'].to_numpy(np.int64),
+            payoffs['race_key'].to_numpy(np.int64),
+        ]))
+        n = len(keys)
+
+        def boat_slots(frame):
+            """(レースindex, 艇index) と 1〜6号艇の範囲内かどうか"""
+            boats = frame['boat_no'].to_numpy(np.int64)
+            valid = (boats >= 1) & (boats <= 6)
+            rows = np.searchsorted(keys, frame['race_key'].to_numpy(np.int64))
+            return rows[valid], boats[valid] - 1, valid
+
+        rows, cols, valid = boat_slots(programs)
+        features = {}
+        for name in PROGRAM_FEATURES:
+            values = np.full((n, 6), np.nan, dtype=np.float32)
+            values[rows, cols] = pd.to_numeric(programs[name], errors='coerce').to_numpy(np.float32)[valid]
+            features[name] = values
+
+        racer_class = np.zeros((n, 6), dtype=np.int8)
+        racer_class[rows, cols] = (programs['rank'].map(RACER_CLASSES).fillna(0)
+                                   .to_numpy(np.int8)[valid])
+
+        rows, cols, valid = boat_slots(results)
+        finish = np.zeros((n, 6), dtype=np.int8)
+        finish[rows, cols] = results['place'].to_numpy(np.int8)[valid]
+
+        payoff_index = {}
+        for bet_type, group in payoffs.groupby('bet_type'):
+            lookup = (np.searchsorted(keys, group['race_key'].to_numpy(np.int64)) * 1000
+                      + group['combo'].to_numpy(np.int64))
+            order = np.argsort(lookup, kind='stable')
+            payoff_index[bet_type] = {
+                'lookup': lookup[order],
+                'payout': group['payout'].to_numpy(np.int64)[order],
+            }
+
+        return cls(keys, features, racer_class, finish, payoff_index)
+
+    def save(self, path: str = DEFAULT_CACHE_PATH):
+        """キューブを .npz に保存"""
+        arrays = {'keys': self.keys, 'racer_class': self.racer_class, 'finish': self.finish}
+        for name, values in self.features.items():
+            arrays[f'feature__{name}'] = values
+        for bet_type, index in self.payoffs.items():
+            arrays[f'payoff_lookup__{bet_type}'] = index['lookup']
+            arrays[f'payoff_payout__{bet_type}'] = index['payout']
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CACHE_PATH) -> 'RaceCube':
+        """.npz に保存したキューブを読み込む"""
+        with np.load(path) as data:
+            features, payoffs = {}, {}
+            for name in data.files:
+                prefix, _, suffix = name.partition('__')
+                if prefix == 'feature':
+                    features[suffix] = data[name]
+                elif prefix == 'payoff_lookup':
+                    payoffs.setdefault(suffix, {})['lookup'] = data[name]
+                elif prefix == 'payoff_payout':
+                    payoffs.setdefault(suffix, {})['payout'] = data[name]
+            return cls(data['keys'], features, data['racer_class'], data['finish'], payoffs)
+
+    @classmethod
+    def cached(cls, database_url: Optional[str] = None, path: str = DEFAULT_CACHE_PATH,
+               refresh: bool = False) -> 'RaceCube':
+        """
+        キャッシュがあれば読み込み、なければスナップショットまたはDBから構築して保存
+
+        Args:
+            database_url: 接続先（省略時は環境変数 DATABASE_URL）
+            path: キャッシュファイル
+            refresh: Trueの場合はキャッシュを無視して作り直す
+
+        Returns:
+            RaceCube
+        """
+        if not refresh and os.path.exists(path):
+            print(f"キューブをキャッシュから読み込み: {path}")
+            return cls.load(path)
+        if SNAPSHOT_DIR and os.path.isdir(os.path.join(SNAPSHOT_DIR, 'historical_payoffs')):
+            print(f"キューブをスナップショットから構築中: {SNAPSHOT_DIR}")
+            cube = cls.from_snapshot(SNAPSHOT_DIR)
+        else:
+            print("キューブをDBから構築中...")
+            cube = cls.from_db(database_url)
+        cube.save(path)
+        print(f"キューブを保存しました: {path}")
+        return cube
+
+    # ------------------------------------------------------------------
+    # 列の参照
+    # ------------------------------------------------------------------
+
+    def feature(self, name: str) -> np.ndarray:
+        """出走表の数値列（shape=(n, 6)）"""
+        return self.features[name]
+
+    def boat_feature(self, name: str, boat: int) -> np.ndarray:
+        """指定号艇の出走表の数値列（shape=(n,)）"""
+        return self.features[name][:, boat - 1]
+
+    def has_payoff(self, bet_type: str) -> np.ndarray:
+        """指定式別の払戻金が1件以上あるレースのマスク"""
+        mask = np.zeros(self.n_races, dtype=bool)
+        index = self.payoffs.get(bet_type)
+        if index is not None:
+            mask[index['lookup'] // 1000] = True
+        return mask
+
+    def payoff_rows(self, bet_type: str):
+        """
+        指定式別の払戻金の行（同着・複勝などで1レースに複数行あり得る）
+
+        Returns:
+            (レースindex, 組番コード, 払戻金) の配列のタプル
+        """
+        index = self.payoffs.get(bet_type)
+        if index is None:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        return index['lookup'] // 1000, index['lookup'] % 1000, index['payout']
+
+    def payout_at(self, bet_type: str, combos: np.ndarray) -> np.ndarray:
+        """
+        レースごとに異なる組番を買った場合の払戻金
+
+        Args:
+            bet_type: 式別
+            combos: レースごとの組番コード（encode_combination の値、shape=(n,)）。0は購入なし
+
+        Returns:
+            100円あたりの払戻金（shape=(n,)、不的中は0）
+        """
+        payout = np.zeros(self.n_races, dtype=np.float64)
+        index = self.payoffs.get(bet_type)
+        if index is None or not len(index['lookup']):
+            return payout
+        wanted = np.arange(self.n_races, dtype=np.int64) * 1000 + np.asarray(combos, dtype=np.int64)
+        pos = np.searchsorted(index['lookup'], wanted)
+        pos = np.minimum(pos, len(index['lookup']) - 1)
+        hit = index['lookup'][pos] == wanted
+        payout[hit] = index['payout'][pos[hit]]
+        return payout
+
+    def payout(self, bet_type: str, combination: str) -> np.ndarray:
+        """全レースで同じ組番（'1', '1-3', '1-2-3' など）を買った場合の払戻金"""
+        combos = np.full(self.n_races, encode_combination(combination), dtype=np.int64)
+        return self.payout_at(bet_type, combos)
+
+
+# ----------------------------------------------------------------------
+# 集計
+# ----------------------------------------------------------------------
+
+def _stats(races: float, hits: float, payout: float, stake: int) -> Dict:
+    races = int(races)
+    return {
+        'races': races,
+        'hits': int(hits),
+        'payout': int(payout),
+        'hit_rate': float(hits / races * 100) if races else 0.0,
+        'return_rate': float(payout / (races * stake) * 100) if races else 0.0,
+    }
+
+
+def summarize(mask: np.ndarray, payout: np.ndarray, stake: int = 100) -> Dict:
+    """
+    1つの条件・買い方の成績
+
+    Args:
+        mask: 購入するレースのマスク
+        payout: レースごとの払戻金（stake円あたり）
+        stake: 1レースあたりの購入額
+
+    Returns:
+        races / hits / payout / hit_rate(%) / return_rate(%)
+    """
+    selected = payout[mask]
+    return _stats(len(selected), np.count_nonzero(selected), selected.sum(), stake)
+
+
+def group_by(mask: np.ndarray, payout: np.ndarray, groups: np.ndarray,
+             stake: int = 100, min_races: int = 0) -> Dict[int, Dict]:
+    """
+    条件に合うレースをグループ（場、R番号、年など）別に集計
+
+    Args:
+        mask: 購入するレースのマスク
+        payout: レースごとの払戻金
+        groups: レースごとのグループ値（0以上の整数、shape=(n,)）
+        stake: 1レースあたりの購入額
+        min_races: これ未満のレース数のグループは除外
+
+    Returns:
+        {グループ値: 成績}
+    """
+    codes = np.asarray(groups, dtype=np.int64)[mask]
+    selected = payout[mask]
+    races = np.bincount(codes)
+    hits = np.bincount(codes, weights=(selected > 0))
+    totals = np.bincount(codes, weights=selected)
+    return {
+        int(g): _stats(races[g], hits[g], totals[g], stake)
+        for g in np.nonzero(races)[0] if races[g] >= max(min_races, 1)
+    }
+
+
+def evaluate_grid(masks: Dict[Hashable, np.ndarray], bets: Dict[Hashable, np.ndarray],
+                  stake: int = 100, min_races: int = 0,
+                  pairs: Optional[Sequence[tuple]] = None) -> List[Dict]:
+    """
+    条件×買い方のグリッドをまとめて評価
+
+    条件マスクの行列（条件数×レース数）と払戻金の行列（レース数×買い方数）の積で、
+    全セルの払戻金合計・的中数を一度に求める。
+
+    Args:
+        masks: {条件キー: 購入するレースのマスク}
+        bets: {買い方キー: レースごとの払戻金}
+        stake: 1レースあたりの購入額
+        min_races: これ未満のレース数のセルは除外
+        pairs: 評価する (条件キー, 買い方キー) の組。省略時は全組み合わせ
+
+    Returns:
+        'filter' / 'bet' と成績を持つ辞書のリスト
+    """
+    filter_keys, bet_keys = list(masks), list(bets)
+    if not filter_keys or not bet_keys:
+        return []
+    n = len(next(iter(masks.values())))
+
+    races = np.zeros(len(filter_keys))
+    hits = np.zeros((len(filter_keys), len(bet_keys)))
+    totals = np.zeros((len(filter_keys), len(bet_keys)))
+    for start in range(0, n, GRID_CHUNK):
+        end = min(start + GRID_CHUNK, n)
+        m = np.stack([masks[k][start:end] for k in filter_keys]).astype(np.float64)
+        p = np.stack([bets[k][start:end] for k in bet_keys], axis=1)
+        races += m.sum(axis=1)
+        hits += m @ (p > 0)
+        totals += m @ p
+
+    wanted = set(pairs) if pairs is not None else None
+    rows = []
+    for i, f in enumerate(filter_keys):
+        if races[i] < max(min_races, 1):
+            continue
+        for j, b in enumerate(bet_keys):
+            if wanted is not None and (f, b) not in wanted:
+                continue
+            rows.append({'filter': f, 'bet': b, **_stats(races[i], hits[i, j], totals[i, j], stake)})
+    return rows
@@ -0,0 +1,142 @@
+-- ============================================================
+-- 当日レースのライブ配信用の変更通知（race_feed）
+-- ============================================================
+-- 目的: ダッシュボードの /api/races/today/stream（live_feed.py）が、オッズ・レース状態・
+--       結果の変更分だけをブラウザに送れるよう、書き込みのたびに変わったレースを通知する
+-- 更新: odds_latest / race_results / payoffs / races への書き込みの文ごとにトリガーで
+--       pg_notify('race_feed', json) を送る（collector のどの書き込み経路でも通知される）
+-- 通知内容: 変わったレースのキーだけ（値はダッシュボード側が1回だけ読み直す）
+--   {"kind": "odds", "date": "2026-01-01", "races": [[場コード, レース番号], ...]}
+--   {"kind": "result" | "race", "ids": [races.id, ...]}
+--   キーが多すぎて通知の上限（8000バイト）を超える場合は races / ids を null にする
+--   （ダッシュボードはその日の全レースを読み直す）
+--
+-- 実行方法: Renderのダッシュボードシェルから実行（何度実行しても問題ない）
+-- 前提: odds_latest（collector の odds_store.py が作成）
+-- ============================================================
+
+BEGIN;
+
+-- ============================================================
+-- 1. odds_latest（レースのキーは race_date / stadium_code / race_number）
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION race_feed_notify_odds() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    rec RECORD;
+    payload TEXT;
+BEGIN
+    FOR rec IN
+        SELECT race_date, json_agg(json_build_array(stadium_code, race_number)) AS races
+        FROM (SELECT DISTINCT race_date, stadium_code, race_number FROM new_rows) k
+        GROUP BY race_date
+    LOOP
+        payload := json_build_object('kind', 'odds', 'date', rec.race_date, 'races', rec.races)::text;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object('kind', 'odds', 'date', rec.race_date, 'races', NULL)::text;
+        END IF;
+        PERFORM pg_notify('race_feed', payload);
+    END LOOP;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_race_feed_odds_insert ON odds_latest;
+CREATE TRIGGER trg_race_feed_odds_insert
+    AFTER INSERT ON odds_latest
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_odds();
+
+DROP TRIGGER IF EXISTS trg_race_feed_odds_update ON odds_latest;
+CREATE TRIGGER trg_race_feed_odds_update
+    AFTER UPDATE ON odds_latest
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_odds();
+
+-- ============================================================
+-- 2. race_results / payoffs（レースのキーは race_id）
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION race_feed_notify_result() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids JSON;
+    payload TEXT;
+BEGIN
+    SELECT json_agg(DISTINCT race_id) INTO ids FROM new_rows;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+    payload := json_build_object('kind', 'result', 'ids', ids)::text;
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object('kind', 'result', 'ids', NULL)::text;
+    END IF;
+    PERFORM pg_notify('race_feed', payload);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_race_feed_results_insert ON race_results;
+CREATE TRIGGER trg_race_feed_results_insert
+    AFTER INSERT ON race_results
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_result();
+
+DROP TRIGGER IF EXISTS trg_race_feed_results_update ON race_results;
+CREATE TRIGGER trg_race_feed_results_update
+    AFTER UPDATE ON race_results
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_result();
+
+DROP TRIGGER IF EXISTS trg_race_feed_payoffs_insert ON payoffs;
+CREATE TRIGGER trg_race_feed_payoffs_insert
+    AFTER INSERT ON payoffs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_result();
+
+DROP TRIGGER IF EXISTS trg_race_feed_payoffs_update ON payoffs;
+CREATE TRIGGER trg_race_feed_payoffs_update
+    AFTER UPDATE ON payoffs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_result();
+
+-- ============================================================
+-- 3. races（追加・中止・締切時刻の変更。キーは id）
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION race_feed_notify_race() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids JSON;
+    payload TEXT;
+BEGIN
+    SELECT json_agg(id) INTO ids FROM new_rows;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+    payload := json_build_object('kind', 'race', 'ids', ids)::text;
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object('kind', 'race', 'ids', NULL)::text;
+    END IF;
+    PERFORM pg_notify('race_feed', payload);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_race_feed_races_insert ON races;
+CREATE TRIGGER trg_race_feed_races_insert
+    AFTER INSERT ON races
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_race();
+
+DROP TRIGGER IF EXISTS trg_race_feed_races_update ON races;
+CREATE TRIGGER trg_race_feed_races_update
+    AFTER UPDATE ON races
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION race_feed_notify_race();
+
+COMMIT;
+
+-- 確認（LISTEN race_feed; の後にオッズ収集が走ると通知が届く）
+SELECT tgname FROM pg_trigger WHERE tgname LIKE 'trg_race_feed_%' ORDER BY tgname;
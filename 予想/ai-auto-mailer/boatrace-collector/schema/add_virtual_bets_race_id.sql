@@ -0,0 +1,73 @@
+-- ============================================================
+-- virtual_bets に races への外部キー（race_id）を追加
+-- ============================================================
+-- 目的: virtual_bets と races の結合を型変換なしの race_id で行い、インデックスを使えるようにする
+--   （従来は vb.stadium_code::int = r.stadium_code、vb.race_date::date、
+--     LPAD(r.stadium_code::text, 2, '0') などの型変換で結合していたため、インデックスが使われなかった）
+-- 既存データ: race_date / stadium_code / race_number から race_id を埋める
+--
+-- 実行方法: Renderのダッシュボードシェルから実行（何度実行しても問題ない）
+-- 実行後に collector / dashboard をデプロイすること（新しいコードは race_id を読み書きする）
+-- ============================================================
+
+-- ============================================================
+-- 1. race_id カラム
+-- ============================================================
+
+ALTER TABLE virtual_bets
+    ADD COLUMN IF NOT EXISTS race_id INTEGER REFERENCES races(id) ON DELETE SET NULL;
+
+-- ============================================================
+-- 2. 既存データの race_id を埋める
+-- ============================================================
+
+UPDATE virtual_bets vb
+SET race_id = r.id
+FROM races r
+WHERE vb.race_id IS NULL
+  AND r.race_date = vb.race_date::date
+  AND r.stadium_code = vb.stadium_code::smallint
+  AND r.race_number = vb.race_number;
+
+-- ============================================================
+-- 3. race_id を指定しない書き込み（手動スクリプト等）向けのトリガー
+-- ============================================================
+-- INSERT 時に race_id が NULL なら race_date / stadium_code / race_number から補完する
+
+CREATE OR REPLACE FUNCTION virtual_bets_fill_race_id() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.race_id IS NULL THEN
+        SELECT r.id INTO NEW.race_id
+        FROM races r
+        WHERE r.race_date = NEW.race_date::date
+          AND r.stadium_code = NEW.stadium_code::smallint
+          AND r.race_number = NEW.race_number;
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_virtual_bets_fill_race_id ON virtual_bets;
+CREATE TRIGGER trg_virtual_bets_fill_race_id
+    BEFORE INSERT ON virtual_bets
+    FOR EACH ROW EXECUTE FUNCTION virtual_bets_fill_race_id();
+
+-- ============================================================
+-- 4. インデックス
+-- ============================================================
+-- (strategy_type, status, race_date): 戦略別の集計・状態別の一覧
+-- (race_id, strategy_type): レースとの結合・重複登録チェック
+
+CREATE INDEX IF NOT EXISTS idx_virtual_bets_strategy_status_date
+    ON virtual_bets (strategy_type, status, race_date);
+
+CREATE INDEX IF NOT EXISTS idx_virtual_bets_race_strategy
+    ON virtual_bets (race_id, strategy_type);
+
+-- races 側の結合キー（既にユニーク制約があれば不要）
+CREATE INDEX IF NOT EXISTS idx_races_date_stadium_number
+    ON races (race_date, stadium_code, race_number);
+
+-- 確認
+SELECT COUNT(*) AS total, COUNT(race_id) AS with_race_id FROM virtual_bets;
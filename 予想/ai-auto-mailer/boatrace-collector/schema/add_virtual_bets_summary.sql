@@ -0,0 +1,144 @@
+-- ============================================================
+-- virtual_bets の集計テーブル（virtual_bets_summary）
+-- ============================================================
+-- 目的: ダッシュボードの累計・日別・戦略別の統計を、virtual_bets の全件集計ではなく
+--       (レース日, 戦略, 状態) ごとの小さな集計テーブルから読む
+-- 更新: virtual_bets への INSERT / UPDATE / DELETE の文ごとにトリガーで差分を反映する
+--       （collector・dashboard・手動スクリプトのどこから書き込んでも集計がずれない）
+-- 通知: 集計が変わった場合は pg_notify('virtual_bets_changed') を送る。
+--       ダッシュボードAPIはこれを受けて統計のキャッシュを破棄する（stats_cache.py）
+--
+-- 実行方法: Renderのダッシュボードシェルから実行（何度実行しても問題ない）
+-- 前提: add_virtual_bets_race_id.sql
+-- ============================================================
+
+BEGIN;
+
+-- ============================================================
+-- 1. 集計テーブル
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS virtual_bets_summary (
+    race_date DATE NOT NULL,
+    strategy_type VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    bet_count INTEGER NOT NULL DEFAULT 0,
+    bet_amount BIGINT NOT NULL DEFAULT 0,
+    return_amount BIGINT NOT NULL DEFAULT 0,
+    profit BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (race_date, strategy_type, status)
+);
+
+-- ============================================================
+-- 2. 差分を反映するトリガー（文単位、遷移テーブルを使用）
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION virtual_bets_summary_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed INTEGER;
+BEGIN
+    -- 遷移テーブル（new_rows / old_rows）は操作の種類によって片方しかないため、分岐して集計する
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO virtual_bets_summary AS s
+            (race_date, strategy_type, status, bet_count, bet_amount, return_amount, profit)
+        SELECT race_date, strategy_type, status, SUM(n), SUM(bet_amount), SUM(return_amount), SUM(profit)
+        FROM (SELECT race_date::date AS race_date, strategy_type, status, 1 AS n,
+                     COALESCE(bet_amount, 0) AS bet_amount, COALESCE(return_amount, 0) AS return_amount,
+                     COALESCE(profit, 0) AS profit
+              FROM new_rows) d
+        WHERE race_date IS NOT NULL AND strategy_type IS NOT NULL AND status IS NOT NULL
+        GROUP BY race_date, strategy_type, status
+        HAVING SUM(n) <> 0 OR SUM(bet_amount) <> 0 OR SUM(return_amount) <> 0 OR SUM(profit) <> 0
+        ON CONFLICT (race_date, strategy_type, status) DO UPDATE
+        SET bet_count = s.bet_count + EXCLUDED.bet_count,
+            bet_amount = s.bet_amount + EXCLUDED.bet_amount,
+            return_amount = s.return_amount + EXCLUDED.return_amount,
+            profit = s.profit + EXCLUDED.profit;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO virtual_bets_summary AS s
+            (race_date, strategy_type, status, bet_count, bet_amount, return_amount, profit)
+        SELECT race_date, strategy_type, status, SUM(n), SUM(bet_amount), SUM(return_amount), SUM(profit)
+        FROM (SELECT race_date::date AS race_date, strategy_type, status, -1 AS n,
+                     -COALESCE(bet_amount, 0) AS bet_amount, -COALESCE(return_amount, 0) AS return_amount,
+                     -COALESCE(profit, 0) AS profit
+              FROM old_rows) d
+        WHERE race_date IS NOT NULL AND strategy_type IS NOT NULL AND status IS NOT NULL
+        GROUP BY race_date, strategy_type, status
+        HAVING SUM(n) <> 0 OR SUM(bet_amount) <> 0 OR SUM(return_amount) <> 0 OR SUM(profit) <> 0
+        ON CONFLICT (race_date, strategy_type, status) DO UPDATE
+        SET bet_count = s.bet_count + EXCLUDED.bet_count,
+            bet_amount = s.bet_amount + EXCLUDED.bet_amount,
+            return_amount = s.return_amount + EXCLUDED.return_amount,
+            profit = s.profit + EXCLUDED.profit;
+    ELSE
+        INSERT INTO virtual_bets_summary AS s
+            (race_date, strategy_type, status, bet_count, bet_amount, return_amount, profit)
+        SELECT race_date, strategy_type, status, SUM(n), SUM(bet_amount), SUM(return_amount), SUM(profit)
+        FROM (SELECT race_date::date AS race_date, strategy_type, status, 1 AS n,
+                     COALESCE(bet_amount, 0) AS bet_amount, COALESCE(return_amount, 0) AS return_amount,
+                     COALESCE(profit, 0) AS profit
+              FROM new_rows
+              UNION ALL
+              SELECT race_date::date AS race_date, strategy_type, status, -1 AS n,
+                     -COALESCE(bet_amount, 0) AS bet_amount, -COALESCE(return_amount, 0) AS return_amount,
+                     -COALESCE(profit, 0) AS profit
+              FROM old_rows) d
+        WHERE race_date IS NOT NULL AND strategy_type IS NOT NULL AND status IS NOT NULL
+        GROUP BY race_date, strategy_type, status
+        -- 状態・金額が変わらない更新（reason だけの更新など）は反映しない
+        HAVING SUM(n) <> 0 OR SUM(bet_amount) <> 0 OR SUM(return_amount) <> 0 OR SUM(profit) <> 0
+        ON CONFLICT (race_date, strategy_type, status) DO UPDATE
+        SET bet_count = s.bet_count + EXCLUDED.bet_count,
+            bet_amount = s.bet_amount + EXCLUDED.bet_amount,
+            return_amount = s.return_amount + EXCLUDED.return_amount,
+            profit = s.profit + EXCLUDED.profit;
+    END IF;
+    GET DIAGNOSTICS changed = ROW_COUNT;
+
+    IF changed > 0 THEN
+        PERFORM pg_notify('virtual_bets_changed', TG_OP);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_virtual_bets_summary_insert ON virtual_bets;
+CREATE TRIGGER trg_virtual_bets_summary_insert
+    AFTER INSERT ON virtual_bets
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION virtual_bets_summary_apply();
+
+DROP TRIGGER IF EXISTS trg_virtual_bets_summary_update ON virtual_bets;
+CREATE TRIGGER trg_virtual_bets_summary_update
+    AFTER UPDATE ON virtual_bets
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION virtual_bets_summary_apply();
+
+DROP TRIGGER IF EXISTS trg_virtual_bets_summary_delete ON virtual_bets;
+CREATE TRIGGER trg_virtual_bets_summary_delete
+    AFTER DELETE ON virtual_bets
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION virtual_bets_summary_apply();
+
+-- ============================================================
+-- 3. 既存データから作り直す（書き込みを止めてから集計）
+-- ============================================================
+
+LOCK TABLE virtual_bets IN SHARE ROW EXCLUSIVE MODE;
+
+TRUNCATE virtual_bets_summary;
+
+INSERT INTO virtual_bets_summary
+    (race_date, strategy_type, status, bet_count, bet_amount, return_amount, profit)
+SELECT race_date::date, strategy_type, status, COUNT(*),
+       COALESCE(SUM(bet_amount), 0), COALESCE(SUM(return_amount), 0), COALESCE(SUM(profit), 0)
+FROM virtual_bets
+WHERE race_date IS NOT NULL AND strategy_type IS NOT NULL AND status IS NOT NULL
+GROUP BY race_date::date, strategy_type, status;
+
+COMMIT;
+
+-- 確認（2つの値が一致すること）
+SELECT (SELECT COUNT(*) FROM virtual_bets) AS bets,
+       (SELECT COALESCE(SUM(bet_count), 0) FROM virtual_bets_summary) AS summarized;
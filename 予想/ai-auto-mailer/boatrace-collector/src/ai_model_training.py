@@ -11,9 +11,11 @@ load_dotenv()
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
-import pandas as pd
 import numpy as np
 
+from parquet_snapshot import has_snapshot, load_table
+from race_features import FEATURE_NAMES, build_race_features
+
 # LightGBMのインポート（インストールされていない場合はスキップ）
 try:
     import lightgbm as lgb
@@ -42,6 +44,9 @@ STADIUM_NAMES = {
 
 def fetch_training_data(cur, start_year=2015, end_year=2025):
     """学習データを取得（直近10年分）"""
+    if has_snapshot('historical_programs') and has_snapshot('historical_race_results'):
+        return fetch_training_data_from_snapshot(start_year, end_year)
+
     print(f"\n📊 学習データ取得中 ({start_year}-{end_year})...")
 
     query = """
@@ -77,90 +82,41 @@ def fetch_training_data(cur, start_year=2015, end_year=2025):
     return rows
 
 
+def fetch_training_data_from_snapshot(start_year=2015, end_year=2025):
+    """学習データをローカルのParquetスナップショットから取得（件数の上限なし）"""
+    print(f"\n📊 学習データ取得中 ({start_year}-{end_year}, スナップショット)...")
+
+    keys = ['race_date', 'stadium_code', 'race_no', 'boat_no']
+    start_date, end_date = f"{start_year}0101", f"{end_year}1231"
+    programs = load_table(
+        'historical_programs', start_date, end_date,
+        columns=keys + ['national_win_rate', 'local_win_rate', 'motor_2nd_rate', 'boat_2nd_rate', 'rank'],
+    ).rename(columns={'rank': 'racer_rank'})
+    results = load_table(
+        'historical_race_results', start_date, end_date, columns=keys + ['rank'],
+    ).rename(columns={'rank': 'finish_rank'})
+
+    rows = programs.merge(results, on=keys)
+
+    print(f"   取得件数: {len(rows):,}行")
+    return rows
+
+
 def prepare_features(rows):
-    """特徴量を準備"""
+    """特徴量を準備（レース×6艇にピボットし、1着の艇番を正解ラベルにする）"""
     print("\n🔧 特徴量準備中...")
 
-    df = pd.DataFrame(rows)
-
-    # レースごとにピボット（6艇分の特徴量を横に展開）
-    races = []
-    current_race = None
-    race_boats = []
-
-    for _, row in df.iterrows():
-        race_key = (row['race_date'], row['stadium_code'], row['race_no'])
-
-        if current_race != race_key:
-            if race_boats and len(race_boats) == 6:
-                races.append(race_boats)
-            current_race = race_key
-            race_boats = []
-
-        race_boats.append(row)
-
-    # 最後のレースを追加
-    if race_boats and len(race_boats) == 6:
-        races.append(race_boats)
-
-    print(f"   有効レース数: {len(races):,}件")
-
-    # 特徴量作成
-    X = []
-    y = []
-    race_info = []
-
-    for race in races:
-        features = []
-        winner = None
-
-        for boat in race:
-            boat_no = int(boat['boat_no'])
-
-            # 数値特徴量（安全に変換）
-            def safe_float(val):
-                if val is None:
-                    return 0.0
-                try:
-                    return float(val)
-                except (ValueError, TypeError):
-                    return 0.0
-
-            features.extend([
-                safe_float(boat['national_win_rate']),
-                safe_float(boat['local_win_rate']),
-                safe_float(boat['motor_2nd_rate']),
-                safe_float(boat['boat_2nd_rate']),
-            ])
-
-            # ランクを数値化
-            rank_map = {'A1': 4, 'A2': 3, 'B1': 2, 'B2': 1}
-            features.append(rank_map.get(boat['racer_rank'], 0))
-
-            # 勝者判定
-            try:
-                if boat['finish_rank'] == '01' or boat['finish_rank'] == 1:
-                    winner = boat_no
-            except:
-                pass
-
-        if winner is not None and len(features) == 30:  # 5特徴量 × 6艇 = 30
-            # 場コードを追加
-            stadium_code = int(race[0]['stadium_code'])
-            race_no = int(race[0]['race_no'])
-            features.extend([stadium_code, race_no])
-
-            X.append(features)
-            y.append(winner)
-            race_info.append({
-                'race_date': race[0]['race_date'],
-                'stadium_code': race[0]['stadium_code'],
-                'race_no': race[0]['race_no']
-            })
+    features = build_race_features(rows)
+    print(f"   有効レース数: {int(features.complete.sum()):,}件")
+
+    usable = features.complete & (features.winner > 0)
+    X = features.matrix()[usable]
+    y = features.winner[usable].astype(np.int64)
+    race_info = features.races[usable].to_dict('records')
 
     print(f"   学習用データ: {len(X):,}件")
 
-    return np.array(X), np.array(y), race_info
+    return X, y, race_info
 
 
 def train_model(X, y):
@@ -179,20 +135,8 @@ def train_model(X, y):
     print(f"   学習データ: {len(X_train):,}件")
     print(f"   検証データ: {len(X_val):,}件")
 
-    # 特徴量名
-    feature_names = []
-    for i in range(1, 7):
-        feature_names.extend([
-            f'boat{i}_national_win_rate',
-            f'boat{i}_local_win_rate',
-            f'boat{i}_motor_2nd_rate',
-            f'boat{i}_boat_2nd_rate',
-            f'boat{i}_rank',
-        ])
-    feature_names.extend(['stadium_code', 'race_no'])
-
     # データセット作成
-    train_data = lgb.Dataset(X_train, label=y_train - 1, feature_name=feature_names)  # 0-indexedに
+    train_data = lgb.Dataset(X_train, label=y_train - 1, feature_name=FEATURE_NAMES)  # 0-indexedに
     val_data = lgb.Dataset(X_val, label=y_val - 1, reference=train_data)
 
     # パラメータ
@@ -248,8 +192,11 @@ def save_model(model, version="v1.0"):
 
     model_path = os.path.join(MODEL_DIR, f'boatrace_ai_{version}.pkl')
 
-    with open(model_path, 'wb') as f:
+    # 予想側のレジストリが書き込み途中のファイルを読まないよう、一時ファイルから置き換える
+    tmp_path = f"{model_path}.tmp"
+    with open(tmp_path, 'wb') as f:
         pickle.dump(model, f)
+    os.replace(tmp_path, model_path)
 
     print(f"\n💾 モデル保存: {model_path}")
     return model_path
@@ -266,7 +213,7 @@ def main():
     # データ取得
     rows = fetch_training_data(cur, start_year=2015, end_year=2025)
 
-    if not rows:
+    if len(rows) == 0:
         print("❌ データが取得できませんでした。")
         conn.close()
         return
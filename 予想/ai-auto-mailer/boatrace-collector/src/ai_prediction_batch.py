@@ -4,22 +4,22 @@
 """
 import os
 import json
-import pickle
 from datetime import datetime, timezone, timedelta, date
 from dotenv import load_dotenv
 load_dotenv()
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import numpy as np
 
+from db_pool import get_connection
+from model_registry import DEFAULT_VERSION, get_registry
+from race_features import boat_summaries, build_race_features
+
 DATABASE_URL = os.environ.get('DATABASE_URL')
 JST = timezone(timedelta(hours=9))
 
-# モデルパス
-MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
-MODEL_PATH = os.path.join(MODEL_DIR, 'boatrace_ai_v1.0.pkl')
-MODEL_VERSION = 'v1.0'
+# 予想に使うモデルのバージョン（models/boatrace_ai_<バージョン>.pkl）
+MODEL_VERSION = DEFAULT_VERSION
 
 # 競艇場名マップ
 STADIUM_NAMES = {
@@ -33,76 +33,52 @@ STADIUM_NAMES = {
 
 
 def load_model():
-    """学習済みモデルを読み込み"""
-    if not os.path.exists(MODEL_PATH):
-        print(f"❌ モデルが見つかりません: {MODEL_PATH}")
+    """学習済みモデルを取得（プロセス内で1回だけ読み込み、ファイル更新時は差し替え）"""
+    model = get_registry().get(MODEL_VERSION)
+    if model is None:
+        print(f"❌ モデルが見つかりません: {MODEL_VERSION}")
         return None
 
-    with open(MODEL_PATH, 'rb') as f:
-        model = pickle.load(f)
-
-    print(f"✅ モデル読み込み完了: {MODEL_VERSION}")
     return model
 
 
-def safe_float(val):
-    """安全に数値変換"""
-    if val is None:
-        return 0.0
-    try:
-        return float(val)
-    except (ValueError, TypeError):
-        return 0.0
+def fetch_program_rows(cur, race_date, races=None):
+    """
+    出走表を1回のクエリで取得
 
+    Args:
+        cur: RealDictCursor
+        race_date: レース日（YYYYMMDD形式）
+        races: (場コード, R番号) のリスト。省略時はその日の全レース
 
-def get_race_features(cur, race_date, stadium_code, race_no):
-    """レースの特徴量を取得"""
-    cur.execute("""
+    Returns:
+        出走表の行（race_features の入力形式）
+    """
+    query = """
         SELECT
-            boat_no as boat_number,
+            race_date,
+            stadium_code,
+            race_no,
+            boat_no,
             national_win_rate,
             local_win_rate,
-            motor_2nd_rate as motor_2rate,
-            boat_2nd_rate as boat_2rate,
-            rank as grade
+            motor_2nd_rate,
+            boat_2nd_rate,
+            rank as racer_rank
         FROM historical_programs
-        WHERE race_date = %s AND stadium_code = %s AND race_no = %s
-        ORDER BY boat_no
-    """, (race_date, stadium_code, race_no))
-
-    rows = cur.fetchall()
-
-    if len(rows) != 6:
-        return None, None
-
-    # 特徴量を作成
-    features = []
-    boat_info = []
-
-    for row in rows:
-        features.extend([
-            safe_float(row['national_win_rate']),
-            safe_float(row['local_win_rate']),
-            safe_float(row['motor_2rate']),
-            safe_float(row['boat_2rate']),
-        ])
-
-        # グレードを数値化
-        grade_map = {'A1': 4, 'A2': 3, 'B1': 2, 'B2': 1}
-        features.append(grade_map.get(row['grade'], 0))
-
-        boat_info.append({
-            'boat_no': row['boat_number'],
-            'national_win_rate': safe_float(row['national_win_rate']),
-            'local_win_rate': safe_float(row['local_win_rate']),
-            'motor_2rate': safe_float(row['motor_2rate']),
-            'grade': row['grade']
-        })
-
-    # 場コード、R番号を追加
-    features.extend([int(stadium_code), int(race_no)])
+        WHERE race_date = %s
+    """
+    params = [race_date]
+    if races is not None:
+        if not races:
+            return []
+        # R番号は '01' / '1' どちらの形式でも一致させる
+        query += " AND (stadium_code, race_no::int) IN %s"
+        params.append(tuple((stadium_code, int(race_no)) for stadium_code, race_no in races))
+    query += " ORDER BY stadium_code, race_no, boat_no"
 
-    return np.array([features]), boat_info
+    cur.execute(query, params)
+    return cur.fetchall()
 
 
 def calculate_confidence(probs):
@@ -164,17 +140,8 @@ def generate_reasons(boat_info, probs):
     return reasons[:3]  # 最大3つ
 
 
-def generate_predictions(model, cur, race_date, stadium_code, race_no):
-    """1レースの予想を生成"""
-
-    # 特徴量取得
-    X, boat_info = get_race_features(cur, race_date, stadium_code, race_no)
-
-    if X is None:
-        return None
-
-    # 予測
-    probs = model.predict(X)[0]  # 6艇の勝率
+def build_prediction(probs, boat_info):
+    """6艇の予測勝率から各券種の予想・理由を作成"""
 
     # 信頼度計算
     confidence = calculate_confidence(probs)
@@ -241,9 +208,45 @@ def generate_predictions(model, cur, race_date, stadium_code, race_no):
     }
 
 
-def save_prediction(cur, race_date, stadium_code, race_no, prediction):
-    """予想をDBに保存"""
-    cur.execute("""
+def predict_races(model, rows):
+    """
+    複数レースの予想をまとめて生成（特徴量行列を1つ作り、predict は1回だけ呼ぶ）
+
+    Args:
+        model: 学習済みモデル
+        rows: 出走表の行（fetch_program_rows の結果）
+
+    Returns:
+        (レースキーの辞書, 予想) のリスト。6艇揃っていないレースは含まない
+    """
+    features = build_race_features(rows)
+    indices = np.nonzero(features.complete)[0]
+    if len(indices) == 0:
+        return []
+
+    probs = model.predict(features.matrix()[indices])
+    races = features.races.to_dict('records')
+
+    return [
+        (races[i], build_prediction(p, boat_summaries(features, i)))
+        for i, p in zip(indices, probs)
+    ]
+
+
+def save_predictions(cur, race_date, predicted):
+    """
+    予想をまとめてDBに保存（execute_values による1回のUPSERT）
+
+    Args:
+        cur: カーソル
+        race_date: レース日（date）
+        predicted: (レースキーの辞書, 予想) のリスト（predict_races の結果）
+    """
+    if not predicted:
+        return
+
+    predicted_at = datetime.now(JST)
+    execute_values(cur, """
         INSERT INTO ai_predictions (
             race_date, stadium_code, race_number,
             confidence, tansho_prediction,
@@ -251,9 +254,7 @@ def save_prediction(cur, race_date, stadium_code, race_no, prediction):
             sanrentan_prediction, sanrenfuku_prediction,
             predictions_json, reasons_json, feature_importance_json,
             model_version, predicted_at
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        )
+        ) VALUES %s
         ON CONFLICT (race_date, stadium_code, race_number)
         DO UPDATE SET
             confidence = EXCLUDED.confidence,
@@ -267,93 +268,114 @@ def save_prediction(cur, race_date, stadium_code, race_no, prediction):
             feature_importance_json = EXCLUDED.feature_importance_json,
             model_version = EXCLUDED.model_version,
             predicted_at = EXCLUDED.predicted_at
-    """, (
-        race_date, stadium_code, race_no,
-        prediction['confidence'],
-        prediction['tansho_prediction'],
-        prediction['nirentan_prediction'],
-        prediction['nirenfuku_prediction'],
-        prediction['sanrentan_prediction'],
-        prediction['sanrenfuku_prediction'],
-        json.dumps(prediction['predictions_json']),
-        json.dumps(prediction['reasons_json']),
-        json.dumps(prediction['feature_importance_json']),
-        MODEL_VERSION,
-        datetime.now(JST)
-    ))
+    """, [
+        (
+            race_date, race['stadium_code'], race['race_no'],
+            prediction['confidence'],
+            prediction['tansho_prediction'],
+            prediction['nirentan_prediction'],
+            prediction['nirenfuku_prediction'],
+            prediction['sanrentan_prediction'],
+            prediction['sanrenfuku_prediction'],
+            json.dumps(prediction['predictions_json']),
+            json.dumps(prediction['reasons_json']),
+            json.dumps(prediction['feature_importance_json']),
+            MODEL_VERSION,
+            predicted_at
+        )
+        for race, prediction in predicted
+    ])
 
 
-def predict_single_race(database_url: str, race_date: str, stadium_code: str, race_no: int) -> dict:
+def predict_races_for_date(database_url: str, race_date: str, races=None, model=None) -> list:
     """
-    直前予想: 1レース分のAI予想を生成してDBに保存
+    指定日のレースの予想をまとめて生成してDBに保存
+
+    出走表の取得・predict・UPSERT はそれぞれ1回ずつ。直前情報の更新時など、
+    一部のレースだけを締切直前に再予想する場合も races を指定して使う。
 
     Args:
         database_url: データベースURL
         race_date: レース日（YYYYMMDD形式）
-        stadium_code: 場コード（01~24）
-        race_no: レース番号（1~12）
+        races: (場コード, R番号) のリスト。省略時はその日の全レース
+        model: 学習済みモデル（省略時は読み込む）
 
     Returns:
-        dict: 予想結果（成功時）、None（失敗時）
+        list: 保存した予想の概要（失敗時は空リスト）
     """
     import logging
     logger = logging.getLogger(__name__)
 
-    # モデル読み込み
-    model = load_model()
     if model is None:
-        logger.error(f"モデル読み込み失敗")
-        return None
+        model = load_model()
+        if model is None:
+            logger.error(f"モデル読み込み失敗")
+            return []
+
+    race_date_obj = datetime.strptime(race_date, '%Y%m%d').date()
 
     conn = None
     try:
-        conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+        conn = get_connection(database_url, cursor_factory=RealDictCursor)
         cur = conn.cursor()
 
-        # 予想生成
-        prediction = generate_predictions(model, cur, race_date, stadium_code, race_no)
-
-        if prediction is None:
-            logger.warning(f"予想生成失敗: {stadium_code} {race_no}R - 特徴量取得エラー")
-            return None
+        predicted = predict_races(model, fetch_program_rows(cur, race_date, races))
+        save_predictions(cur, race_date_obj, predicted)
+        conn.commit()
 
-        # DB保存
-        # race_dateがYYYYMMDD文字列の場合、date型に変換
-        if isinstance(race_date, str) and len(race_date) == 8:
-            race_date_obj = datetime.strptime(race_date, '%Y%m%d').date()
-        else:
-            race_date_obj = race_date
+    except Exception as e:
+        logger.error(f"AI予想エラー: {race_date} - {e}")
+        if conn:
+            conn.rollback()
+        return []
 
-        save_prediction(cur, race_date_obj, stadium_code, race_no, prediction)
-        conn.commit()
+    finally:
+        if conn:
+            conn.close()
 
+    summaries = []
+    for race, prediction in predicted:
+        stadium_code = race['stadium_code']
         stadium_name = STADIUM_NAMES.get(stadium_code, stadium_code)
-        logger.info(f"✅ AI予想生成: {stadium_name} {race_no}R - 信頼度: {prediction['confidence']:.1f}%")
-
-        return {
+        logger.info(f"✅ AI予想生成: {stadium_name} {int(race['race_no'])}R - 信頼度: {prediction['confidence']:.1f}%")
+        summaries.append({
             'stadium_code': stadium_code,
             'stadium_name': stadium_name,
-            'race_number': race_no,
+            'race_number': int(race['race_no']),
             'confidence': prediction['confidence'],
             'tansho': prediction['tansho_prediction'],
             'nirentan': prediction['nirentan_prediction'],
             'nirenfuku': prediction['nirenfuku_prediction'],
             'sanrentan': prediction['sanrentan_prediction'],
-        }
+        })
+    return summaries
 
-    except Exception as e:
-        logger.error(f"AI予想エラー: {stadium_code} {race_no}R - {e}")
-        if conn:
-            conn.rollback()
+
+def predict_single_race(database_url: str, race_date: str, stadium_code: str, race_no: int) -> dict:
+    """
+    直前予想: 1レース分のAI予想を生成してDBに保存
+
+    Args:
+        database_url: データベースURL
+        race_date: レース日（YYYYMMDD形式）
+        stadium_code: 場コード（01~24）
+        race_no: レース番号（1~12）
+
+    Returns:
+        dict: 予想結果（成功時）、None（失敗時）
+    """
+    summaries = predict_races_for_date(database_url, race_date, [(stadium_code, race_no)])
+
+    if not summaries:
+        import logging
+        logging.getLogger(__name__).warning(f"予想生成失敗: {stadium_code} {race_no}R - 特徴量取得エラー")
         return None
 
-    finally:
-        if conn:
-            conn.close()
+    return summaries[0]
 
 
 def run_batch(target_date=None):
-    """バッチ実行"""
+    """バッチ実行（その日の全レースを1回の predict でまとめて予想）"""
     print("=" * 60)
     print("競艇AI予想 - 予想生成バッチ")
     print("=" * 60)
@@ -364,7 +386,7 @@ def run_batch(target_date=None):
         return
 
     # DB接続
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    conn = get_connection(DATABASE_URL, cursor_factory=RealDictCursor)
     cur = conn.cursor()
 
     # 対象日（YYYYMMDD形式の文字列に変換）
@@ -374,37 +396,24 @@ def run_batch(target_date=None):
     race_date_str = target_date.strftime('%Y%m%d')
     print(f"\n📅 対象日: {target_date} ({race_date_str})")
 
-    # 今日のレース一覧を取得
-    cur.execute("""
-        SELECT DISTINCT stadium_code, race_no as race_number
-        FROM historical_programs
-        WHERE race_date = %s
-        ORDER BY stadium_code, race_no
-    """, (race_date_str,))
-
-    races = cur.fetchall()
-    print(f"   対象レース: {len(races)}件")
-
-    # 各レースで予想生成
-    success_count = 0
-    for race in races:
-        stadium_code = race['stadium_code']
-        race_no = race['race_number']
+    # 今日の出走表を1回のクエリで取得
+    rows = fetch_program_rows(cur, race_date_str)
+    race_count = len({(row['stadium_code'], row['race_no']) for row in rows})
+    print(f"   対象レース: {race_count}件")
 
-        prediction = generate_predictions(model, cur, race_date_str, stadium_code, race_no)
+    # 全レースをまとめて予想
+    predicted = predict_races(model, rows)
+    save_predictions(cur, target_date, predicted)
 
-        if prediction:
-            save_prediction(cur, target_date, stadium_code, race_no, prediction)
-            success_count += 1
-            success_count += 1
-            stadium_name = STADIUM_NAMES.get(stadium_code, stadium_code)
-            print(f"   ✅ {stadium_name} {race_no}R - 信頼度: {prediction['confidence']:.1f}%")
+    for race, prediction in predicted:
+        stadium_name = STADIUM_NAMES.get(race['stadium_code'], race['stadium_code'])
+        print(f"   ✅ {stadium_name} {race['race_no']}R - 信頼度: {prediction['confidence']:.1f}%")
 
     conn.commit()
     conn.close()
 
     print(f"\n" + "=" * 60)
-    print(f"✅ 予想生成完了: {success_count}/{len(races)}件")
+    print(f"✅ 予想生成完了: {len(predicted)}/{race_count}件")
     print("=" * 60)
 
 
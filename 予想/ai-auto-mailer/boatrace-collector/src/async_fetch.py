@@ -0,0 +1,216 @@
+"""
+非同期HTTP一括取得エンジン
+
+オッズページ（odds2tf / oddstf）を多数のレース分まとめて取得するための
+asyncio + aiohttp ベースのフェッチャー。
+
+- 専用のイベントループスレッドと ClientSession を1つ持ち、接続プールを
+  プロセス内の全スイープで共有する
+- 同一ホストへの同時接続数を制限（TCPConnector.limit_per_host）
+- 全リクエスト共通のレート制限（スレッドをまたいで共有）
+- リクエストごとの所要時間を計測し、スイープ単位で集計をログ出力
+
+HTMLのパースはイベントループを塞がないよう呼び出し側のスレッドで行う。
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# 同一ホストへの同時接続数
+MAX_CONNECTIONS_PER_HOST = 16
+# 全体のリクエストレート上限（リクエスト/秒）
+MAX_REQUESTS_PER_SECOND = 20
+# 1リクエストのタイムアウト秒数
+REQUEST_TIMEOUT_SECONDS = 15
+# 最大リトライ回数（タイムアウト・接続エラーのみ再試行。最初の1回を含め最大 MAX_RETRIES + 1 回）
+MAX_RETRIES = 2
+
+
+class RateLimiter:
+    """全リクエスト共通のレート制限（一定間隔で発行枠を割り当てる）"""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        """発行枠を確保し、割り当て時刻まで待機"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at)
+            self._next_at = slot + self.interval
+        wait = slot - now
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class FetchMetrics:
+    """1スイープ分のリクエスト計測値"""
+
+    def __init__(self):
+        self.timings: List[Tuple[str, float, bool]] = []
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    def record(self, kind: str, elapsed: float, ok: bool):
+        self.timings.append((kind, elapsed, ok))
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    def summary(self) -> Dict:
+        """
+        集計値を取得
+
+        Returns:
+            requests, errors, wall_seconds, avg_ms, p95_ms, max_ms を持つ辞書
+        """
+        elapsed = sorted(t for _, t, _ in self.timings)
+        errors = sum(1 for _, _, ok in self.timings if not ok)
+        end = self.finished_at or time.monotonic()
+        result = {
+            'requests': len(elapsed),
+            'errors': errors,
+            'wall_seconds': round(end - self.started_at, 2),
+            'avg_ms': 0,
+            'p95_ms': 0,
+            'max_ms': 0,
+        }
+        if elapsed:
+            result['avg_ms'] = round(sum(elapsed) / len(elapsed) * 1000)
+            result['p95_ms'] = round(elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.95))] * 1000)
+            result['max_ms'] = round(elapsed[-1] * 1000)
+        return result
+
+
+class AsyncFetcher:
+    """専用イベントループ上で動く共有HTTPフェッチャー（スレッドセーフ）"""
+
+    def __init__(self, max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+                 requests_per_second: float = MAX_REQUESTS_PER_SECOND,
+                 timeout: int = REQUEST_TIMEOUT_SECONDS,
+                 retries: int = MAX_RETRIES):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = RateLimiter(requests_per_second)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+
+    def fetch_texts(self, urls: Sequence[Tuple[str, str]],
+                    sweep_timeout: float = None) -> Tuple[Dict[str, Optional[str]], FetchMetrics]:
+        """
+        複数URLを並行に取得
+
+        Args:
+            urls: (種別, URL) のリスト。種別は計測値の集計に使う
+            sweep_timeout: スイープ全体のタイムアウト秒数（Noneなら無制限）
+
+        Returns:
+            (URL -> 本文（取得失敗時はNone）, 計測値)
+        """
+        loop = self._ensure_loop()
+        metrics = FetchMetrics()
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(urls, metrics), loop)
+        try:
+            texts = future.result(timeout=sweep_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            logger.error(f"一括取得がタイムアウトしました ({sweep_timeout}秒, {len(urls)}件)")
+            texts = {url: None for _, url in urls}
+        metrics.finish()
+        return texts, metrics
+
+    def close(self):
+        """セッションとイベントループを終了"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_session(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='async-fetch-loop', daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # イベントループスレッドからのみ呼ばれるためロック不要
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.max_per_host, ttl_dns_cache=300),
+                headers={'User-Agent': USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _close_session(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _fetch_all(self, urls: Sequence[Tuple[str, str]],
+                         metrics: FetchMetrics) -> Dict[str, Optional[str]]:
+        session = await self._get_session()
+        results = await asyncio.gather(
+            *(self._fetch_one(session, kind, url, metrics) for kind, url in urls)
+        )
+        return {url: text for (_, url), text in zip(urls, results)}
+
+    async def _fetch_one(self, session: aiohttp.ClientSession, kind: str, url: str,
+                         metrics: FetchMetrics) -> Optional[str]:
+        """1URLを取得（タイムアウト・接続エラーはリトライ）"""
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    text = await response.text()
+                metrics.record(kind, time.monotonic() - started, ok=True)
+                return text
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+                metrics.record(kind, time.monotonic() - started, ok=False)
+                if attempt < self.retries:
+                    await asyncio.sleep(1)  # 1秒待ってリトライ
+                    continue
+                logger.error(f"取得エラー: {url} - {e!r}")
+            except Exception as e:
+                metrics.record(kind, time.monotonic() - started, ok=False)
+                logger.error(f"取得エラー: {url} - {e!r}")
+                break
+        return None
+
+
+# プロセス内で共有するフェッチャー
+_shared_fetcher: Optional[AsyncFetcher] = None
+_shared_lock = threading.Lock()
+
+
+def get_fetcher() -> AsyncFetcher:
+    """プロセス共有のフェッチャーを取得"""
+    global _shared_fetcher
+    with _shared_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = AsyncFetcher()
+        return _shared_fetcher
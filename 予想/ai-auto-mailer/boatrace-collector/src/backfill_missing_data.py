@@ -14,6 +14,8 @@ from bs4 import BeautifulSoup
 import time
 import re
 
+from page_parser import parse_result_list
+
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,6 +30,23 @@ def get_db_connection():
     """DB接続を取得"""
     return psycopg2.connect(DATABASE_URL)
 
+def fetch_finished_races(stadium_code: int, date_str: str):
+    """
+    場ごとの結果一覧（resultlist）から確定したレース番号を取得
+    date_str: YYYYMMDD形式
+    取得できなかった場合はNone（全レースを取りに行く）
+    """
+    url = f"https://www.boatrace.jp/owpc/pc/race/resultlist?jcd={stadium_code:02d}&hd={date_str}"
+
+    try:
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        races = parse_result_list(response.text)
+        return {race_number for race_number, race in races.items() if race['places']}
+    except Exception as e:
+        logger.error(f"結果一覧取得エラー: {stadium_code:02d} {date_str} - {e}")
+        return None
+
 def scrape_race_result(stadium_code: int, race_number: int, date_str: str):
     """
     レース結果をスクレイピングで取得
@@ -137,7 +156,12 @@ def backfill_date(conn, target_date: str):
     success_races = 0
     
     for stadium_code in STADIUM_CODES:
+        # 結果一覧で確定したレースだけ結果ページを取りに行く（非開催の場は1リクエストで済む）
+        finished = fetch_finished_races(stadium_code, target_date)
+        time.sleep(0.3)
         for race_number in range(1, 13):  # 1R〜12R
+            if finished is not None and race_number not in finished:
+                continue
             result = scrape_race_result(stadium_code, race_number, target_date)
             total_races += 1
             
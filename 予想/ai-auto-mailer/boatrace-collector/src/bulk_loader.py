@@ -0,0 +1,243 @@
+"""
+履歴データの一括ロード（COPY + 集合演算によるUPSERT）
+
+LZH（K/Bファイル）から解析した行を1行ずつ INSERT ... ON CONFLICT するのではなく、
+一時テーブルへ COPY FROM STDIN で流し込み、1回の INSERT ... SELECT ... ON CONFLICT で
+本テーブルにマージする。
+
+- 列定義に合わない行（必須列の欠落、桁あふれ、数値変換不可）は COPY 前に除外し、
+  理由付きで rejected として報告する
+- 同一キーの重複行は最後の行を採用する（ON CONFLICT は同一文内の重複キーを扱えないため）
+"""
+
+import io
+import logging
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# rejected の詳細をログに出す最大件数
+MAX_REJECT_LOG = 5
+
+
+class Column:
+    """ロード対象の列定義"""
+
+    def __init__(self, name: str, kind: str = 'str', max_length: int = None,
+                 precision: Tuple[int, int] = None, required: bool = False):
+        """
+        Args:
+            name: 列名
+            kind: 'str' / 'int' / 'decimal'
+            max_length: VARCHAR の最大長
+            precision: DECIMAL の (桁数, 小数桁数)
+            required: NOT NULL または一意キーの列
+        """
+        self.name = name
+        self.kind = kind
+        self.max_length = max_length
+        self.precision = precision
+        self.required = required
+
+    def convert(self, value):
+        """COPY 用の値に変換（不正な値は ValueError）"""
+        if value is None or (value == '' and (self.required or self.kind != 'str')):
+            if self.required:
+                raise ValueError(f"{self.name}: 必須列が空です")
+            return None
+
+        if self.kind == 'int':
+            return int(value)
+
+        if self.kind == 'decimal':
+            try:
+                number = Decimal(str(value))
+            except InvalidOperation:
+                raise ValueError(f"{self.name}: 数値ではありません ({value!r})")
+            if self.precision:
+                digits, scale = self.precision
+                if abs(number) >= Decimal(10) ** (digits - scale):
+                    raise ValueError(f"{self.name}: 桁あふれ ({value!r})")
+            return number
+
+        text = str(value)
+        if self.max_length and len(text) > self.max_length:
+            raise ValueError(f"{self.name}: {self.max_length}文字を超えています ({text!r})")
+        return text
+
+
+class TableSpec:
+    """ロード先テーブルの定義"""
+
+    def __init__(self, table: str, columns: List[Column], conflict_keys: Tuple[str, ...]):
+        self.table = table
+        self.columns = columns
+        self.conflict_keys = conflict_keys
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    @property
+    def update_columns(self) -> List[str]:
+        return [c.name for c in self.columns if c.name not in self.conflict_keys]
+
+
+class BulkLoadResult:
+    """一括ロードの結果"""
+
+    def __init__(self):
+        self.loaded = 0
+        self.duplicates = 0
+        self.rejected: List[Tuple[Dict, str]] = []
+
+    def merge(self, other: 'BulkLoadResult'):
+        self.loaded += other.loaded
+        self.duplicates += other.duplicates
+        self.rejected.extend(other.rejected)
+
+
+HISTORICAL_RACE_RESULTS = TableSpec(
+    'historical_race_results',
+    [
+        Column('race_date', max_length=8, required=True),
+        Column('stadium_code', max_length=2, required=True),
+        Column('race_no', max_length=2, required=True),
+        Column('boat_no', max_length=1, required=True),
+        Column('racer_no', max_length=4),
+        Column('rank', max_length=2),
+        Column('race_time', max_length=10),
+        Column('exhibition_time', 'decimal', precision=(4, 2)),
+    ],
+    ('race_date', 'stadium_code', 'race_no', 'boat_no'),
+)
+
+HISTORICAL_PAYOFFS = TableSpec(
+    'historical_payoffs',
+    [
+        Column('race_date', max_length=8, required=True),
+        Column('stadium_code', max_length=2, required=True),
+        Column('race_no', max_length=2, required=True),
+        Column('bet_type', max_length=20, required=True),
+        Column('combination', max_length=10, required=True),
+        Column('payout', 'int', required=True),
+        Column('popularity', 'int'),
+    ],
+    ('race_date', 'stadium_code', 'race_no', 'bet_type', 'combination'),
+)
+
+HISTORICAL_PROGRAMS = TableSpec(
+    'historical_programs',
+    [
+        Column('race_date', max_length=8, required=True),
+        Column('stadium_code', max_length=2, required=True),
+        Column('race_no', max_length=2, required=True),
+        Column('boat_no', max_length=1, required=True),
+        Column('racer_no', max_length=4),
+        Column('racer_name', max_length=20),
+        Column('age', 'int'),
+        Column('branch', max_length=10),
+        Column('weight', 'int'),
+        Column('rank', max_length=2),
+        Column('national_win_rate', 'decimal', precision=(5, 2)),
+        Column('national_2nd_rate', 'decimal', precision=(5, 2)),
+        Column('local_win_rate', 'decimal', precision=(5, 2)),
+        Column('local_2nd_rate', 'decimal', precision=(5, 2)),
+        Column('motor_no', 'int'),
+        Column('motor_2nd_rate', 'decimal', precision=(5, 2)),
+        Column('boat_no_assigned', 'int'),
+        Column('boat_2nd_rate', 'decimal', precision=(5, 2)),
+        Column('deadline_time', max_length=10),
+    ],
+    ('race_date', 'stadium_code', 'race_no', 'boat_no'),
+)
+
+
+def _copy_text(value) -> str:
+    """COPY の text 形式に変換"""
+    if value is None:
+        return r'\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _prepare_rows(spec: TableSpec, rows: Iterable[Dict]) -> Tuple[List[tuple], BulkLoadResult]:
+    """検証・型変換・重複排除を行い、COPY する行を作る"""
+    result = BulkLoadResult()
+    key_index = [spec.column_names.index(k) for k in spec.conflict_keys]
+    prepared: Dict[tuple, tuple] = {}
+
+    for row in rows:
+        try:
+            values = tuple(col.convert(row.get(col.name)) for col in spec.columns)
+        except (ValueError, TypeError) as e:
+            result.rejected.append((row, str(e)))
+            continue
+
+        key = tuple(values[i] for i in key_index)
+        if key in prepared:
+            result.duplicates += 1
+        prepared[key] = values
+
+    return list(prepared.values()), result
+
+
+def bulk_upsert(conn, spec: TableSpec, rows: Iterable[Dict], label: str = None) -> BulkLoadResult:
+    """
+    行を一時テーブルに COPY し、1回の INSERT ... ON CONFLICT でマージ
+
+    コミットは呼び出し側で行う。
+
+    Args:
+        conn: psycopg2 接続
+        spec: ロード先テーブルの定義
+        rows: 列名をキーとする辞書の iterable
+        label: ログ用のラベル（年月やファイル名）
+
+    Returns:
+        BulkLoadResult
+    """
+    values, result = _prepare_rows(spec, rows)
+    label = label or spec.table
+
+    if values:
+        columns = ', '.join(spec.column_names)
+        stage = f"_stage_{spec.table}"
+        buffer = io.StringIO()
+        for row in values:
+            buffer.write('\t'.join(_copy_text(v) for v in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in spec.update_columns)
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS pg_temp.{stage}")
+            cur.execute(f"""
+                CREATE TEMP TABLE {stage} ON COMMIT DROP AS
+                SELECT {columns} FROM {spec.table} WITH NO DATA
+            """)
+            cur.copy_expert(f"COPY {stage} ({columns}) FROM STDIN", buffer)
+            cur.execute(f"""
+                INSERT INTO {spec.table} ({columns})
+                SELECT {columns} FROM {stage}
+                ON CONFLICT ({', '.join(spec.conflict_keys)}) DO UPDATE SET {updates}
+            """)
+            result.loaded = cur.rowcount
+            cur.execute(f"DROP TABLE pg_temp.{stage}")
+
+    report_rejected(result, label)
+    return result
+
+
+def report_rejected(result: BulkLoadResult, label: str):
+    """除外行のサマリーをログに出力"""
+    if result.duplicates:
+        logger.info(f"{label}: 重複キー {result.duplicates} 行（最後の行を採用）")
+    if not result.rejected:
+        return
+    logger.warning(f"{label}: {len(result.rejected)} 行を除外しました")
+    for row, reason in result.rejected[:MAX_REJECT_LOG]:
+        logger.warning(f"  除外: {reason} - {row}")
+    if len(result.rejected) > MAX_REJECT_LOG:
+        logger.warning(f"  ...ほか {len(result.rejected) - MAX_REJECT_LOG} 行")
@@ -12,10 +12,8 @@ cur = conn.cursor(cursor_factory=RealDictCursor)
 cur.execute("""
     SELECT vb.*, r.deadline_at, rr.first_place, rr.second_place, rr.third_place, rr.race_status
     FROM virtual_bets vb
-    LEFT JOIN races r ON vb.race_date = r.race_date
-        AND vb.stadium_code::int = r.stadium_code
-        AND vb.race_number = r.race_number
-    LEFT JOIN race_results rr ON r.id = rr.race_id
+    LEFT JOIN races r ON r.id = vb.race_id
+    LEFT JOIN race_results rr ON rr.race_id = vb.race_id
     WHERE vb.status = 'confirmed'
 """)
 print("=== confirmed レコード ===")
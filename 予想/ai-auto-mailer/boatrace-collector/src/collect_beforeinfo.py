@@ -4,14 +4,14 @@
 '''
 
 import os
-import re
 import requests
-from bs4 import BeautifulSoup
 from datetime import datetime, date
 import logging
-import psycopg2
 from psycopg2.extras import execute_values
 
+from db_pool import get_connection
+from page_parser import parse_beforeinfo as parse_beforeinfo_page
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -31,7 +31,7 @@ STADIUM_CODES = {
 
 def get_db_connection():
     """データベース接続を取得"""
-    return psycopg2.connect(os.environ.get('DATABASE_URL'))
+    return get_connection(os.environ.get('DATABASE_URL'))
 
 
 def create_tables(conn):
@@ -88,173 +88,19 @@ def create_tables(conn):
 
 def parse_beforeinfo(html: str, race_date: date, stadium_code: str, race_number: int) -> tuple:
     """
-    直前情報ページをパース
+    直前情報ページをパース（page_parser.parse_beforeinfo にレースのキーを付ける）
     
     Returns:
         (beforeinfo_list, weather_dict)
     """
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    beforeinfo_list = []
-    weather_dict = {}
-    
-    # 選手情報テーブルをパース
-    table = soup.find('table', class_='is-w748')
-    if table:
-        rows = table.find_all('tr')
-        current_waku = 0
-        
-        for row in rows:
-            cells = row.find_all('td')
-            if not cells:
-                continue
-            
-            # 枠番を含む行を探す
-            first_cell = cells[0].get_text(strip=True)
-            if first_cell.isdigit() and 1 <= int(first_cell) <= 6:
-                current_waku = int(first_cell)
-                
-                # 選手名
-                racer_link = row.find('a')
-                racer_name = racer_link.get_text(strip=True) if racer_link else ''
-                
-                # 登番を抽出（リンクから）
-                racer_no = ''
-                if racer_link and racer_link.get('href'):
-                    match = re.search(r'toban=(\d+)', racer_link.get('href', ''))
-                    if match:
-                        racer_no = match.group(1)
-                
-                # 各セルの値を取得
-                cell_texts = [c.get_text(strip=True) for c in cells]
-                
-                # 固定位置からデータを取得
-                # ['1', '', '乙津　康志', '52.0kg', '6.78', '-0.5', '', '', 'R', '']
-                weight = None
-                exhibition_time = None
-                tilt = None
-                
-                # 体重（4番目）
-                if len(cell_texts) > 3 and 'kg' in cell_texts[3]:
-                    try:
-                        weight = float(cell_texts[3].replace('kg', ''))
-                    except:
-                        pass
-                
-                # 展示タイム（5番目）
-                if len(cell_texts) > 4:
-                    try:
-                        exhibition_time = float(cell_texts[4])
-                    except:
-                        pass
-                
-                # チルト（6番目）
-                if len(cell_texts) > 5:
-                    try:
-                        tilt = float(cell_texts[5])
-                    except:
-                        pass
-                
-                beforeinfo_list.append({
-                    'race_date': race_date,
-                    'stadium_code': stadium_code,
-                    'race_number': race_number,
-                    'waku': current_waku,
-                    'racer_no': racer_no,
-                    'racer_name': racer_name.replace('\u3000', ' '),
-                    'weight': weight,
-                    'exhibition_time': exhibition_time,
-                    'tilt': tilt,
-                    'propeller': '',
-                    'parts_exchange': '',
-                    'start_exhibition_course': None,
-                    'start_exhibition_st': None
-                })
+    race_key = {'race_date': race_date, 'stadium_code': stadium_code, 'race_number': race_number}
+    racers, weather = parse_beforeinfo_page(html)
     
-    # スタート展示をパース
-    st_tables = soup.find_all('table')
-    for t in st_tables:
-        if 'スタート展示' in t.get_text():
-            rows = t.find_all('tr')
-            for row in rows:
-                text = row.get_text(strip=True)
-                # "1.07" のようなパターンを探す
-                match = re.match(r'^(\d)\.(\d{2})$', text)
-                if match:
-                    course = int(match.group(1))
-                    st = float(f"0.{match.group(2)}")
-                    
-                    # 対応する選手を更新
-                    for info in beforeinfo_list:
-                        if info['waku'] == course:
-                            info['start_exhibition_course'] = course
-                            info['start_exhibition_st'] = st
-                            break
-            break
-    
-    # 水面気象情報をパース
-    weather = soup.find('div', class_='weather1')
-    if weather:
-        weather_dict = {
-            'race_date': race_date,
-            'stadium_code': stadium_code,
-            'race_number': race_number,
-            'temperature': None,
-            'weather': '',
-            'wind_direction': '',
-            'wind_speed': None,
-            'water_temperature': None,
-            'wave_height': None
-        }
-        
-        # 気温
-        temp_elem = weather.find('span', class_='weather1_bodyUnitLabelData')
-        if temp_elem:
-            match = re.search(r'([\d.]+)', temp_elem.get_text())
-            if match:
-                weather_dict['temperature'] = float(match.group(1))
-        
-        # 各項目を取得
-        items = weather.find_all('div', class_='weather1_bodyUnitLabel')
-        for item in items:
-            title = item.find('span', class_='weather1_bodyUnitLabelTitle')
-            data = item.find('span', class_='weather1_bodyUnitLabelData')
-            if title and data:
-                title_text = title.get_text(strip=True)
-                data_text = data.get_text(strip=True)
-                
-                if '気温' in title_text:
-                    match = re.search(r'([\d.]+)', data_text)
-                    if match:
-                        weather_dict['temperature'] = float(match.group(1))
-                elif '風速' in title_text:
-                    match = re.search(r'(\d+)', data_text)
-                    if match:
-                        weather_dict['wind_speed'] = int(match.group(1))
-                elif '水温' in title_text:
-                    match = re.search(r'([\d.]+)', data_text)
-                    if match:
-                        weather_dict['water_temperature'] = float(match.group(1))
-                elif '波高' in title_text:
-                    match = re.search(r'(\d+)', data_text)
-                    if match:
-                        weather_dict['wave_height'] = int(match.group(1))
-        
-        # 天候（画像から判定）
-        weather_img = weather.find('img')
-        if weather_img:
-            alt = weather_img.get('alt', '')
-            weather_dict['weather'] = alt
-        
-        # 風向（画像から判定）
-        wind_img = weather.find('p', class_='weather1_bodyUnitImage')
-        if wind_img:
-            img = wind_img.find('img')
-            if img:
-                src = img.get('src', '')
-                # 風向を画像ファイル名から判定
-                if 'icon_wind' in src:
-                    weather_dict['wind_direction'] = '不明'  # 画像から判定が必要
+    beforeinfo_list = [
+        {**race_key, **racer, 'propeller': '', 'parts_exchange': ''}
+        for racer in racers
+    ]
+    weather_dict = {**race_key, **weather} if weather else {}
     
     return beforeinfo_list, weather_dict
 
@@ -2,7 +2,8 @@
 競艇オッズ収集スクリプト
 
 確定仕様:
-- 対象: 2連単・2連複・単勝・複勝（3連は無し）
+- 対象: 2連単・2連複・単勝・複勝・3連単・3連複
+  （3連は1回の取得を odds_vectors の1行に保存。ODDS_COLLECT_3TF=0 で収集しない）
 - 締切5分前から10秒間隔で収集
 - 通常は10分間隔で収集
 - 開催日のみ稼働（毎朝チェック）
@@ -14,12 +15,19 @@ import re
 import time
 import logging
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
-from bs4 import BeautifulSoup
 import psycopg2
 from psycopg2.extras import execute_values
 
+from db_pool import get_connection
+from page_parser import parse_stadium_codes, parse_deadlines, parse_odds_2tf, parse_odds_tf, parse_odds_3tf
+from odds_store import (
+    ensure_odds_storage, ensure_partitions, upsert_latest, insert_ticks, insert_vectors,
+    filter_changed_odds, VECTOR_ODDS_TYPES,
+    encode_stadium, encode_odds_type, encode_combination,
+)
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +35,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 日本時間（scraped_at は TIMESTAMPTZ なのでタイムゾーン付きで渡す）
+JST = timezone(timedelta(hours=9))
+
+# 3連単・3連複も収集するか
+COLLECT_3TF = os.environ.get('ODDS_COLLECT_3TF', '1') != '0'
+
 # 競艇場コード
 STADIUM_CODES = {
     '01': '桐生', '02': '戸田', '03': '江戸川', '04': '平和島', '05': '多摩川',
@@ -76,7 +90,7 @@ class OddsCollector:
         """データベース接続を取得（リトライ機能付き）"""
         for attempt in range(retries):
             try:
-                return psycopg2.connect(self.db_url)
+                return get_connection(self.db_url)
             except psycopg2.OperationalError as e:
                 if attempt < retries - 1:
                     logger.warning(f"接続失敗、{delay}秒後にリトライ... ({attempt + 1}/{retries})")
@@ -85,41 +99,8 @@ class OddsCollector:
                     raise e
     
     def create_odds_table(self, conn):
-        """オッズテーブルを作成"""
-        with conn.cursor() as cur:
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS odds_history (
-                    id SERIAL PRIMARY KEY,
-                    race_date DATE NOT NULL,
-                    stadium_code VARCHAR(2) NOT NULL,
-                    race_number INTEGER NOT NULL,
-                    odds_type VARCHAR(10) NOT NULL,
-                    combination VARCHAR(10) NOT NULL,
-                    odds_value DECIMAL(10,1),
-                    odds_min DECIMAL(10,1),
-                    odds_max DECIMAL(10,1),
-                    scraped_at TIMESTAMP NOT NULL,
-                    minutes_to_deadline INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # インデックス作成
-            cur.execute('''
-                CREATE INDEX IF NOT EXISTS idx_odds_history_race 
-                ON odds_history(race_date, stadium_code, race_number)
-            ''')
-            cur.execute('''
-                CREATE INDEX IF NOT EXISTS idx_odds_history_scraped 
-                ON odds_history(scraped_at)
-            ''')
-            cur.execute('''
-                CREATE INDEX IF NOT EXISTS idx_odds_history_combination 
-                ON odds_history(combination)
-            ''')
-            
-            conn.commit()
-            logger.info("オッズテーブルを作成/確認しました")
+        """オッズテーブルを作成（月別パーティション・コード化形式。odds_store参照）"""
+        ensure_odds_storage(conn)
     
     def check_today_races(self) -> bool:
         """本日のレース開催をチェック"""
@@ -129,13 +110,11 @@ class OddsCollector:
         try:
             response = self._request_with_retry(url)
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
             # 開催場のリンクを探す
-            stadium_links = soup.find_all('a', href=re.compile(r'jcd=\d{2}'))
+            stadium_codes = parse_stadium_codes(response.text)
             
-            if stadium_links:
-                logger.info(f"本日の開催: {len(stadium_links)}場")
+            if stadium_codes:
+                logger.info(f"本日の開催: {len(stadium_codes)}場")
                 return True
             else:
                 logger.info("本日の開催はありません")
@@ -172,46 +151,28 @@ class OddsCollector:
             if response.status_code != 200:
                 return []
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            races = []
-            
             # 締切時刻行を探す
-            deadline_row = None
-            for table in soup.find_all('table'):
-                for row in table.find_all('tr'):
-                    if '締切予定時刻' in row.get_text():
-                        deadline_row = row
-                        break
-                if deadline_row:
-                    break
-            
-            if not deadline_row:
+            deadlines = parse_deadlines(response.text)
+            if not deadlines:
                 return []
             
-            cells = deadline_row.find_all(['th', 'td'])
-            race_num = 0
-            
+            races = []
             # race_dateからdatetimeオブジェクトを作成（日付を明示的に指定）
             race_date_obj = datetime.strptime(race_date, '%Y%m%d')
             
-            for cell in cells:
-                text = cell.get_text(strip=True)
-                time_match = re.match(r'(\d{1,2}):(\d{2})', text)
-                if time_match:
-                    race_num += 1
-                    hour, minute = int(time_match.group(1)), int(time_match.group(2))
-                    # 日付はrace_dateを使用（datetime.now()ではなく）
-                    deadline = race_date_obj.replace(
-                        hour=hour, minute=minute, second=0, microsecond=0
-                    )
-                    
-                    races.append({
-                        'date': race_date,
-                        'stadium_code': stadium_code,
-                        'stadium_name': STADIUM_CODES.get(stadium_code, stadium_code),
-                        'race_number': race_num,
-                        'deadline_time': deadline
-                    })
+            for race_num, (hour, minute) in enumerate(deadlines, start=1):
+                # 日付はrace_dateを使用（datetime.now()ではなく）
+                deadline = race_date_obj.replace(
+                    hour=hour, minute=minute, second=0, microsecond=0
+                )
+                
+                races.append({
+                    'date': race_date,
+                    'stadium_code': stadium_code,
+                    'stadium_name': STADIUM_CODES.get(stadium_code, stadium_code),
+                    'race_number': race_num,
+                    'deadline_time': deadline
+                })
             
             return races
             
@@ -225,86 +186,7 @@ class OddsCollector:
         
         try:
             response = self._request_with_retry(url)
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            odds_list = []
-            scraped_at = datetime.now()
-            
-            # テーブルを取得（Table 1が2連単、Table 2が2連複）
-            tables = soup.find_all('table')
-            
-            for table_idx, table in enumerate(tables):
-                rows = table.find_all('tr')
-                if len(rows) < 2:
-                    continue
-                
-                # 最初の行でヘッダーかどうか判断
-                first_row = rows[0]
-                first_cells = first_row.find_all(['th', 'td'])
-                if not first_cells:
-                    continue
-                
-                # 艇番とレーサー名のヘッダー行を探す
-                has_boat_color = any('is-boatColor' in ' '.join(c.get('class', [])) for c in first_cells)
-                if not has_boat_color:
-                    continue
-                
-                # テーブルの位置で2連単/2連複を判断
-                # Table 1 (index 1) = 2連単, Table 2 (index 2) = 2連複
-                odds_type = '2t' if table_idx == 1 else '2f'
-                
-                # ヘッダー行から1着の艇番を取得（偶数番目のセルが艇番）
-                first_place_boats = []
-                for i, cell in enumerate(first_cells):
-                    if i % 2 == 0:  # 0, 2, 4, 6, 8, 10
-                        text = cell.get_text(strip=True)
-                        if text.isdigit():
-                            first_place_boats.append(int(text))
-                
-                # 各行を処理（ヘッダー以降）
-                # 各行は「2着艇番, オッズ, 2着艇番, オッズ, ...」の繰り返し
-                for row in rows[1:]:
-                    cells = row.find_all('td')
-                    if not cells:
-                        continue
-                    
-                    # セルをペアで処理（艇番 + オッズ）
-                    for pair_idx in range(0, len(cells), 2):
-                        if pair_idx + 1 >= len(cells):
-                            break
-                        
-                        boat_cell = cells[pair_idx]
-                        odds_cell = cells[pair_idx + 1]
-                        
-                        # 2着の艇番
-                        boat_text = boat_cell.get_text(strip=True)
-                        if not boat_text.isdigit():
-                            continue
-                        second = int(boat_text)
-                        
-                        # オッズ値
-                        odds_classes = ' '.join(odds_cell.get('class', []))
-                        if 'is-disabled' in odds_classes:
-                            continue
-                        
-                        odds_text = odds_cell.get_text(strip=True)
-                        odds_value = self._parse_odds(odds_text)
-                        
-                        if odds_value:
-                            # 1着を特定（列の位置から）
-                            first_idx = pair_idx // 2
-                            if first_idx < len(first_place_boats):
-                                first = first_place_boats[first_idx]
-                                combination = f"{first}-{second}"
-                                
-                                odds_list.append({
-                                    'odds_type': odds_type,
-                                    'combination': combination,
-                                    'odds_value': odds_value,
-                                    'scraped_at': scraped_at
-                                })
-            
-            return odds_list
+            return self.parse_2tf_odds(response.text)
             
         except Exception as e:
             logger.error(f"2連オッズ取得エラー: {stadium_code} {race_number}R - {e}")
@@ -316,69 +198,112 @@ class OddsCollector:
         
         try:
             response = self._request_with_retry(url)
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            odds_list = []
-            scraped_at = datetime.now()
-            
-            tables = soup.find_all('table')
-            
-            for table in tables:
-                rows = table.find_all('tr')
-                
-                # ヘッダーからオッズ種別を判断
-                header = table.find('tr')
-                if header:
-                    header_text = header.get_text()
-                    if '単勝' in header_text:
-                        odds_type = 'win'
-                    elif '複勝' in header_text:
-                        odds_type = 'place'
-                    else:
-                        continue
-                else:
-                    continue
-                
-                for row in rows[1:]:  # ヘッダーをスキップ
-                    cells = row.find_all('td')
-                    if len(cells) >= 3:
-                        # 艇番
-                        boat_num = cells[0].get_text(strip=True)
-                        if not boat_num.isdigit():
-                            continue
-                        
-                        # オッズ値
-                        odds_text = cells[2].get_text(strip=True)
-                        
-                        if odds_type == 'win':
-                            odds_value = self._parse_odds(odds_text)
-                            # 0.0も有効なオッズとして保存（発売前や投票が少ない場合）
-                            if odds_value is not None:
-                                odds_list.append({
-                                    'odds_type': 'win',
-                                    'combination': boat_num,
-                                    'odds_value': odds_value,
-                                    'scraped_at': scraped_at
-                                })
-                        else:  # 複勝（範囲オッズ）
-                            odds_range = self._parse_odds_range(odds_text)
-                            if odds_range:
-                                odds_list.append({
-                                    'odds_type': 'place',
-                                    'combination': boat_num,
-                                    'odds_min': odds_range[0],
-                                    'odds_max': odds_range[1],
-                                    'scraped_at': scraped_at
-                                })
-            
-            return odds_list
+            return self.parse_tf_odds(response.text)
             
         except Exception as e:
             logger.error(f"単複オッズ取得エラー: {stadium_code} {race_number}R - {e}")
             return []
     
+    def fetch_3tf_odds(self, stadium_code: str, race_number: int, race_date: str) -> List[Dict]:
+        """3連単・3連複オッズを取得"""
+        odds_list = []
+        for page, parser in (('odds3t', self.parse_3t_odds), ('odds3f', self.parse_3f_odds)):
+            url = f"{self.BASE_URL}/{page}?rno={race_number}&jcd={stadium_code}&hd={race_date}"
+            try:
+                response = self._request_with_retry(url)
+                odds_list.extend(parser(response.text))
+            except Exception as e:
+                logger.error(f"3連オッズ取得エラー ({page}): {stadium_code} {race_number}R - {e}")
+        return odds_list
+    
+    def parse_2tf_odds(self, html: str) -> List[Dict]:
+        """2連単・2連複オッズページ（odds2tf）をパース"""
+        odds_list = []
+        scraped_at = datetime.now(JST)
+        
+        for cell in parse_odds_2tf(html):
+            # 発売されていない組み合わせ
+            if cell['disabled']:
+                continue
+            
+            odds_value = self._parse_odds(cell['odds_text'])
+            if odds_value:
+                odds_list.append({
+                    'odds_type': cell['odds_type'],
+                    'combination': f"{cell['first']}-{cell['second']}",
+                    'odds_value': odds_value,
+                    'scraped_at': scraped_at
+                })
+        
+        return odds_list
+    
+    def parse_tf_odds(self, html: str) -> List[Dict]:
+        """単勝・複勝オッズページ（oddstf）をパース"""
+        odds_list = []
+        scraped_at = datetime.now(JST)
+        
+        for cell in parse_odds_tf(html):
+            if cell['odds_type'] == 'win':
+                odds_value = self._parse_odds(cell['odds_text'])
+                # 0.0も有効なオッズとして保存（発売前や投票が少ない場合）
+                if odds_value is not None:
+                    odds_list.append({
+                        'odds_type': 'win',
+                        'combination': cell['boat'],
+                        'odds_value': odds_value,
+                        'scraped_at': scraped_at
+                    })
+            else:  # 複勝（範囲オッズ）
+                odds_range = self._parse_odds_range(cell['odds_text'])
+                if odds_range:
+                    odds_list.append({
+                        'odds_type': 'place',
+                        'combination': cell['boat'],
+                        'odds_min': odds_range[0],
+                        'odds_max': odds_range[1],
+                        'scraped_at': scraped_at
+                    })
+        
+        return odds_list
+    
+    def parse_3t_odds(self, html: str) -> List[Dict]:
+        """3連単オッズページ（odds3t）をパース"""
+        return self._parse_3tf_odds(html, '3t')
+    
+    def parse_3f_odds(self, html: str) -> List[Dict]:
+        """3連複オッズページ（odds3f）をパース"""
+        return self._parse_3tf_odds(html, '3f')
+    
+    def _parse_3tf_odds(self, html: str, odds_type: str) -> List[Dict]:
+        odds_list = []
+        seen = set()
+        scraped_at = datetime.now(JST)
+        
+        for cell in parse_odds_3tf(html, odds_type):
+            if cell['disabled']:
+                continue
+            boats = [cell['first'], cell['second'], cell['third']]
+            if odds_type == '3f':
+                # 3連複は艇番の順序を問わない
+                boats.sort()
+            combination = '-'.join(map(str, boats))
+            if len(set(boats)) < 3 or combination in seen:
+                continue
+            
+            odds_value = self._parse_odds(cell['odds_text'])
+            if odds_value:
+                seen.add(combination)
+                odds_list.append({
+                    'odds_type': odds_type,
+                    'combination': combination,
+                    'odds_value': odds_value,
+                    'scraped_at': scraped_at
+                })
+        
+        return odds_list
+    
     def fetch_all_odds(self, stadium_code: str, race_number: int, race_date: str) -> List[Dict]:
-        """全オッズを取得（2連単・2連複・単勝・複勝）"""
+        """全オッズを取得（2連単・2連複・単勝・複勝、COLLECT_3TF なら3連単・3連複も）"""
         all_odds = []
         
         # 2連単・2連複
@@ -389,8 +314,60 @@ class OddsCollector:
         odds_tf = self.fetch_tf_odds(stadium_code, race_number, race_date)
         all_odds.extend(odds_tf)
         
+        # 3連単・3連複
+        if COLLECT_3TF:
+            all_odds.extend(self.fetch_3tf_odds(stadium_code, race_number, race_date))
+        
         return all_odds
-    
+
+    def fetch_odds_for_races(self, races: List[Dict],
+                             sweep_timeout: float = None) -> Dict[Tuple[str, int, str], List[Dict]]:
+        """
+        複数レースの全オッズを並行に一括取得（async_fetch.AsyncFetcher）
+
+        Args:
+            races: stadium_code（'01'形式）, race_number, date（YYYYMMDD形式）を持つレースのリスト
+            sweep_timeout: 一括取得全体のタイムアウト秒数
+
+        Returns:
+            (stadium_code, race_number, date) -> オッズリスト（取得できなかったレースは空リスト）
+        """
+        from async_fetch import get_fetcher
+
+        pages = [('odds2tf', self.parse_2tf_odds), ('oddstf', self.parse_tf_odds)]
+        if COLLECT_3TF:
+            pages += [('odds3t', self.parse_3t_odds), ('odds3f', self.parse_3f_odds)]
+
+        urls = []
+        for race in races:
+            params = f"rno={race['race_number']}&jcd={race['stadium_code']}&hd={race['date']}"
+            for kind, _ in pages:
+                urls.append((kind, f"{self.BASE_URL}/{kind}?{params}"))
+
+        texts, metrics = get_fetcher().fetch_texts(urls, sweep_timeout=sweep_timeout)
+
+        # パースはイベントループではなくこのスレッドで行う
+        results = {}
+        for i, race in enumerate(races):
+            key = (race['stadium_code'], race['race_number'], race['date'])
+            odds_list = []
+            race_urls = urls[len(pages) * i:len(pages) * (i + 1)]
+            for (kind, url), (_, parser) in zip(race_urls, pages):
+                text = texts.get(url)
+                if text is None:
+                    continue
+                try:
+                    odds_list.extend(parser(text))
+                except Exception as e:
+                    logger.error(f"オッズパースエラー ({kind}): {race['stadium_code']} {race['race_number']}R - {e}")
+            results[key] = odds_list
+
+        summary = metrics.summary()
+        logger.info(f"オッズ一括取得: {len(races)}レース {summary['requests']}リクエスト "
+                    f"(エラー{summary['errors']}件) {summary['wall_seconds']}秒 "
+                    f"[avg {summary['avg_ms']}ms / p95 {summary['p95_ms']}ms / max {summary['max_ms']}ms]")
+        return results
+
     def _parse_odds(self, text: str) -> Optional[float]:
         """オッズ文字列をパース"""
         try:
@@ -412,41 +389,72 @@ class OddsCollector:
         return None
     
     def save_odds(self, conn, race_date: str, stadium_code: str, race_number: int,
-                  odds_list: List[Dict], minutes_to_deadline: int = None):
-        """オッズをデータベースに保存"""
+                  odds_list: List[Dict], minutes_to_deadline: int = None) -> int:
+        """
+        オッズをデータベースに保存（odds_history に追記し、odds_latest を更新）
+
+        odds_latest から値が変わった買い目だけを書き、取得時刻は odds_ticks に残す
+        （odds_store.filter_changed_odds 参照）。3連単・3連複は種別ごとに odds_vectors の1行にする。
+
+        Returns:
+            書き込んだ買い目数
+        """
         if not odds_list:
-            return
+            return 0
+        
+        # 日付をフォーマット
+        if len(race_date) == 8:
+            formatted_date = f"{race_date[:4]}-{race_date[4:6]}-{race_date[6:8]}"
+        else:
+            formatted_date = race_date
+        ensure_partitions(conn, [formatted_date])
+        
+        values = []
+        vectors = {}
+        for odds in odds_list:
+            if odds['odds_type'] in VECTOR_ODDS_TYPES:
+                vector = vectors.setdefault(odds['odds_type'], {'scraped_at': odds['scraped_at'], 'odds': {}})
+                vector['odds'][odds['combination']] = odds.get('odds_value')
+                continue
+            # 場コード・オッズ種別・買い目はコード化して保存
+            values.append((
+                formatted_date,
+                encode_stadium(stadium_code),
+                race_number,
+                encode_odds_type(odds['odds_type']),
+                encode_combination(odds['combination']),
+                odds.get('odds_value'),
+                odds.get('odds_min'),
+                odds.get('odds_max'),
+                odds['scraped_at'],
+                minutes_to_deadline
+            ))
         
         with conn.cursor() as cur:
-            values = []
-            for odds in odds_list:
-                # 日付をフォーマット
-                if len(race_date) == 8:
-                    formatted_date = f"{race_date[:4]}-{race_date[4:6]}-{race_date[6:8]}"
-                else:
-                    formatted_date = race_date
-                
-                values.append((
-                    formatted_date,
-                    stadium_code,
-                    race_number,
-                    odds['odds_type'],
-                    odds['combination'],
-                    odds.get('odds_value'),
-                    odds.get('odds_min'),
-                    odds.get('odds_max'),
-                    odds['scraped_at'],
-                    minutes_to_deadline
-                ))
-            
-            execute_values(cur, '''
-                INSERT INTO odds_history (
-                    race_date, stadium_code, race_number, odds_type, combination,
-                    odds_value, odds_min, odds_max, scraped_at, minutes_to_deadline
-                ) VALUES %s
-            ''', values)
+            changed = filter_changed_odds(cur, values)
+            if changed:
+                execute_values(cur, '''
+                    INSERT INTO odds_history (
+                        race_date, stadium_code, race_number, odds_type, combination,
+                        odds_value, odds_min, odds_max, scraped_at, minutes_to_deadline
+                    ) VALUES %s
+                ''', changed)
+                # 最新値テーブルも同じトランザクションで更新
+                upsert_latest(cur, changed)
+            insert_vectors(cur, [
+                (formatted_date, stadium_code, race_number, odds_type,
+                 vector['scraped_at'], minutes_to_deadline, vector['odds'])
+                for odds_type, vector in vectors.items()
+            ])
+            # 値が変わらなくても取得した時刻は残す
+            if values:
+                insert_ticks(cur, [(
+                    formatted_date, encode_stadium(stadium_code), race_number,
+                    max(row[8] for row in values), minutes_to_deadline, len(changed)
+                )])
             
             conn.commit()
+        return len(changed)
     
     def collect_race_odds(self, stadium_code: str, race_number: int, race_date: str,
                           deadline_time: datetime = None, high_freq_minutes: int = 5,
@@ -493,10 +501,10 @@ class OddsCollector:
                 odds_list = self.fetch_all_odds(stadium_code, race_number, race_date)
                 
                 if odds_list:
-                    self.save_odds(conn, race_date, stadium_code, race_number,
-                                  odds_list, minutes_to_deadline)
+                    saved = self.save_odds(conn, race_date, stadium_code, race_number,
+                                           odds_list, minutes_to_deadline)
                     total_collected += len(odds_list)
-                    logger.info(f"収集: {len(odds_list)}件 (残り{minutes_to_deadline}分)")
+                    logger.info(f"収集: {len(odds_list)}件 変化{saved}件 (残り{minutes_to_deadline}分)")
                 
                 # 次の収集間隔を決定
                 if deadline_time and minutes_to_deadline is not None:
@@ -522,116 +530,57 @@ class OddsCollector:
     
     def run_scheduler(self):
         """
-        スケジューラーを実行
-        - 毎朝8:00に開催チェック
-        - 開催があれば10分間隔で監視
-        - 締切5分前から10秒間隔で収集
+        スケジューラーを実行（締切時刻駆動）
+        - 当日の全レースにレースごとのタイマーを設定（race_events.RaceEventScheduler）
+        - 通常は10分間隔、締切5分前から10秒間隔で収集
+        - 全場のレースを並行に収集（次の1レースだけを追わない）
         """
+        from race_events import RaceEventScheduler, EVENT_ODDS
+        from race_schedule import RaceScheduleCache
+
         logger.info("オッズ収集スケジューラー開始")
-        
-        # 運用時間: 8:00〜21:30
-        start_hour = 8
-        end_hour = 21
-        end_minute = 30
-        
-        while True:
-            now = datetime.now()
-            
-            # 運用時間外は待機
-            if now.hour < start_hour:
-                wait_until = now.replace(hour=start_hour, minute=0, second=0)
-                wait_seconds = (wait_until - now).total_seconds()
-                logger.info(f"運用時間外。{start_hour}:00まで待機します")
-                time.sleep(wait_seconds)
-                continue
-            
-            if now.hour > end_hour or (now.hour == end_hour and now.minute > end_minute):
-                # 翌日の8:00まで待機
-                tomorrow = now + timedelta(days=1)
-                wait_until = tomorrow.replace(hour=start_hour, minute=0, second=0)
-                wait_seconds = (wait_until - now).total_seconds()
-                logger.info(f"運用時間終了。翌日{start_hour}:00まで待機します")
-                time.sleep(wait_seconds)
-                continue
-            
-            # 本日の開催をチェック
-            if not self.check_today_races():
-                # 開催なし → 翌日まで待機
-                tomorrow = now + timedelta(days=1)
-                wait_until = tomorrow.replace(hour=start_hour, minute=0, second=0)
-                wait_seconds = (wait_until - now).total_seconds()
-                logger.info(f"本日の開催なし。翌日{start_hour}:00まで待機します")
-                time.sleep(wait_seconds)
-                continue
-            
-            # レーススケジュールを取得
-            races = self.get_today_race_schedule()
-            
-            if not races:
-                # スケジュール取得失敗 → 10分後に再試行
-                logger.warning("スケジュール取得失敗。10分後に再試行します")
-                time.sleep(600)
-                continue
-            
-            # 次のレースを探す
-            next_race = None
-            for race in races:
-                deadline = race.get('deadline_time')
-                if deadline and deadline > now:
-                    next_race = race
-                    break
-            
-            if not next_race:
-                # 本日のレース終了 → 翌日まで待機
-                logger.info("本日のレース終了")
-                tomorrow = now + timedelta(days=1)
-                wait_until = tomorrow.replace(hour=start_hour, minute=0, second=0)
-                wait_seconds = (wait_until - now).total_seconds()
-                time.sleep(wait_seconds)
-                continue
-            
-            # 次のレースまでの時間を計算
-            deadline = next_race['deadline_time']
-            minutes_to_deadline = (deadline - now).total_seconds() / 60
-            
-            if minutes_to_deadline <= 5:
-                # 締切5分以内 → 高頻度収集開始
-                logger.info(f"高頻度収集開始: {next_race['stadium_name']} {next_race['race_number']}R")
-                self.collect_race_odds(
-                    stadium_code=next_race['stadium_code'],
-                    race_number=next_race['race_number'],
-                    race_date=next_race['date'],
-                    deadline_time=deadline,
-                    high_freq_minutes=5,
-                    high_freq_interval=10
-                )
-            else:
-                # 通常収集（1回だけ）
-                odds_list = self.fetch_all_odds(
-                    next_race['stadium_code'],
-                    next_race['race_number'],
-                    next_race['date']
-                )
-                
-                if odds_list:
-                    conn = self.get_db_connection()
-                    self.create_odds_table(conn)
-                    self.save_odds(
-                        conn, next_race['date'],
-                        next_race['stadium_code'],
-                        next_race['race_number'],
-                        odds_list,
-                        int(minutes_to_deadline)
+
+        conn = self.get_db_connection()
+        self.create_odds_table(conn)
+        conn.close()
+
+        def collect(races: List[Dict]):
+            # 同時に発火したレースはまとめて並行取得する
+            odds_by_race = self.fetch_odds_for_races(races, sweep_timeout=600)
+            conn = self.get_db_connection()
+            try:
+                for race in races:
+                    odds_list = odds_by_race.get(
+                        (race['stadium_code'], race['race_number'], race['date'])
                     )
-                    conn.close()
-                    logger.info(f"通常収集: {next_race['stadium_name']} {next_race['race_number']}R {len(odds_list)}件")
-                
-                # 次の収集まで待機（10分または締切5分前まで）
-                wait_minutes = min(10, minutes_to_deadline - 5)
-                if wait_minutes > 0:
-                    logger.info(f"次の収集まで{wait_minutes:.1f}分待機")
-                    time.sleep(wait_minutes * 60)
+                    if odds_list:
+                        minutes_to_deadline = int(race['seconds_to_deadline'] / 60)
+                        saved = self.save_odds(
+                            conn, race['date'], race['stadium_code'], race['race_number'],
+                            odds_list, minutes_to_deadline
+                        )
+                        logger.info(f"収集: {race['stadium_name']} {race['race_number']}R "
+                                    f"{len(odds_list)}件 変化{saved}件 (残{minutes_to_deadline}分)")
+            finally:
+                conn.close()
 
+        scheduler = RaceEventScheduler(
+            RaceScheduleCache(self.db_url),
+            handlers={EVENT_ODDS: collect},
+            batch_types=(EVENT_ODDS,),
+            regular_interval=600,
+            burst_seconds_before=300,
+            burst_interval=10,
+        )
+        scheduler.start()
+
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            logger.info("スケジューラーを停止します")
+        finally:
+            scheduler.shutdown()
 
     def collect_near_deadline_races(self, minutes_before: int = 5, 
                                       interval_seconds: int = 10, iterations: int = 9):
@@ -671,33 +620,33 @@ class OddsCollector:
         
         logger.info(f"高頻度収集対象: {len(target_races)}レース")
         
-        # 指定回数収集
+        # 指定回数収集（毎回、締切前のレースをまとめて並行取得）
         for i in range(iterations):
-            for race in target_races:
+            now = datetime.now()
+            open_races = [
+                race for race in target_races
+                if not race.get('deadline_time') or now <= race['deadline_time']
+            ]
+            odds_by_race = self.fetch_odds_for_races(open_races, sweep_timeout=interval_seconds * 3)
+            
+            for race in open_races:
                 deadline = race.get('deadline_time')
                 now = datetime.now()
-                
-                # 締切を過ぎたらスキップ
-                if deadline and now > deadline:
-                    continue
-                
                 minutes_to_deadline = int((deadline - now).total_seconds() / 60) if deadline else None
                 
-                odds_list = self.fetch_all_odds(
-                    race['stadium_code'],
-                    race['race_number'],
-                    race['date']
+                odds_list = odds_by_race.get(
+                    (race['stadium_code'], race['race_number'], race['date'])
                 )
                 
                 if odds_list:
-                    self.save_odds(
+                    saved = self.save_odds(
                         conn, race['date'],
                         race['stadium_code'],
                         race['race_number'],
                         odds_list,
                         minutes_to_deadline
                     )
-                    logger.info(f"収集: {race['stadium_name']} {race['race_number']}R {len(odds_list)}件 (残{minutes_to_deadline}分)")
+                    logger.info(f"収集: {race['stadium_name']} {race['race_number']}R {len(odds_list)}件 変化{saved}件 (残{minutes_to_deadline}分)")
             
             # 次の収集まで待機
             if i < iterations - 1:
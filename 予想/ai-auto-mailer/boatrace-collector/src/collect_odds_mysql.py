@@ -19,10 +19,11 @@ from datetime import datetime, timedelta, timezone
 # JSTタイムゾーン定義
 JST = timezone(timedelta(hours=9))
 from typing import Dict, List, Optional, Tuple
-from bs4 import BeautifulSoup
 import mysql.connector
 from mysql.connector import Error as MySQLError
 
+from page_parser import parse_stadium_codes, parse_deadlines, parse_odds_2tf, parse_odds_tf
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -163,13 +164,11 @@ class OddsCollector:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
             # 開催場のリンクを探す
-            stadium_links = soup.find_all('a', href=re.compile(r'jcd=\d{2}'))
+            stadium_codes = parse_stadium_codes(response.text)
             
-            if stadium_links:
-                logger.info(f"本日の開催: {len(stadium_links)}場")
+            if stadium_codes:
+                logger.info(f"本日の開催: {len(stadium_codes)}場")
                 return True
             else:
                 logger.info("本日の開催はありません")
@@ -206,42 +205,22 @@ class OddsCollector:
             if response.status_code != 200:
                 return []
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            races = []
-            
             # 締切時刻行を探す
-            deadline_row = None
-            for table in soup.find_all('table'):
-                for row in table.find_all('tr'):
-                    if '締切予定時刻' in row.get_text():
-                        deadline_row = row
-                        break
-                if deadline_row:
-                    break
-            
-            if not deadline_row:
-                return []
-            
-            cells = deadline_row.find_all(['th', 'td'])
-            race_num = 0
+            deadlines = parse_deadlines(response.text)
+            races = []
             
-            for cell in cells:
-                text = cell.get_text(strip=True)
-                time_match = re.match(r'(\d{1,2}):(\d{2})', text)
-                if time_match:
-                    race_num += 1
-                    hour, minute = int(time_match.group(1)), int(time_match.group(2))
-                    deadline = datetime.now(JST).replace(
-                        hour=hour, minute=minute, second=0, microsecond=0
-                    )
-                    
-                    races.append({
-                        'date': race_date,
-                        'stadium_code': stadium_code,
-                        'stadium_name': STADIUM_CODES.get(stadium_code, stadium_code),
-                        'race_number': race_num,
-                        'deadline_time': deadline
-                    })
+            for race_num, (hour, minute) in enumerate(deadlines, start=1):
+                deadline = datetime.now(JST).replace(
+                    hour=hour, minute=minute, second=0, microsecond=0
+                )
+                
+                races.append({
+                    'date': race_date,
+                    'stadium_code': stadium_code,
+                    'stadium_name': STADIUM_CODES.get(stadium_code, stadium_code),
+                    'race_number': race_num,
+                    'deadline_time': deadline
+                })
             
             return races
             
@@ -258,72 +237,21 @@ class OddsCollector:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
             odds_list = []
             scraped_at = datetime.now(JST)
             
-            # テーブルを取得
-            tables = soup.find_all('table')
-            
-            for table_idx, table in enumerate(tables):
-                rows = table.find_all('tr')
-                if len(rows) < 2:
-                    continue
-                
-                first_row = rows[0]
-                first_cells = first_row.find_all(['th', 'td'])
-                if not first_cells:
+            for cell in parse_odds_2tf(response.text):
+                if cell['disabled']:
                     continue
                 
-                has_boat_color = any('is-boatColor' in ' '.join(c.get('class', [])) for c in first_cells)
-                if not has_boat_color:
-                    continue
-                
-                odds_type = '2t' if table_idx == 1 else '2f'
-                
-                first_place_boats = []
-                for i, cell in enumerate(first_cells):
-                    if i % 2 == 0:
-                        text = cell.get_text(strip=True)
-                        if text.isdigit():
-                            first_place_boats.append(int(text))
-                
-                for row in rows[1:]:
-                    cells = row.find_all('td')
-                    if not cells:
-                        continue
-                    
-                    for pair_idx in range(0, len(cells), 2):
-                        if pair_idx + 1 >= len(cells):
-                            break
-                        
-                        boat_cell = cells[pair_idx]
-                        odds_cell = cells[pair_idx + 1]
-                        
-                        boat_text = boat_cell.get_text(strip=True)
-                        if not boat_text.isdigit():
-                            continue
-                        second = int(boat_text)
-                        
-                        odds_classes = ' '.join(odds_cell.get('class', []))
-                        if 'is-disabled' in odds_classes:
-                            continue
-                        
-                        odds_text = odds_cell.get_text(strip=True)
-                        odds_value = self._parse_odds(odds_text)
-                        
-                        if odds_value:
-                            first_idx = pair_idx // 2
-                            if first_idx < len(first_place_boats):
-                                first = first_place_boats[first_idx]
-                                combination = f"{first}-{second}"
-                                
-                                odds_list.append({
-                                    'odds_type': odds_type,
-                                    'combination': combination,
-                                    'odds_value': odds_value,
-                                    'scraped_at': scraped_at
-                                })
+                odds_value = self._parse_odds(cell['odds_text'])
+                if odds_value:
+                    odds_list.append({
+                        'odds_type': cell['odds_type'],
+                        'combination': f"{cell['first']}-{cell['second']}",
+                        'odds_value': odds_value,
+                        'scraped_at': scraped_at
+                    })
             
             return odds_list
             
@@ -340,55 +268,29 @@ class OddsCollector:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
             odds_list = []
             scraped_at = datetime.now(JST)
             
-            tables = soup.find_all('table')
-            
-            for table in tables:
-                rows = table.find_all('tr')
-                
-                header = table.find('tr')
-                if header:
-                    header_text = header.get_text()
-                    if '単勝' in header_text:
-                        odds_type = 'win'
-                    elif '複勝' in header_text:
-                        odds_type = 'place'
-                    else:
-                        continue
+            for cell in parse_odds_tf(response.text):
+                if cell['odds_type'] == 'win':
+                    odds_value = self._parse_odds(cell['odds_text'])
+                    if odds_value:
+                        odds_list.append({
+                            'odds_type': 'win',
+                            'combination': cell['boat'],
+                            'odds_value': odds_value,
+                            'scraped_at': scraped_at
+                        })
                 else:
-                    continue
-                
-                for row in rows[1:]:
-                    cells = row.find_all('td')
-                    if len(cells) >= 3:
-                        boat_num = cells[0].get_text(strip=True)
-                        if not boat_num.isdigit():
-                            continue
-                        
-                        odds_text = cells[2].get_text(strip=True)
-                        
-                        if odds_type == 'win':
-                            odds_value = self._parse_odds(odds_text)
-                            if odds_value:
-                                odds_list.append({
-                                    'odds_type': 'win',
-                                    'combination': boat_num,
-                                    'odds_value': odds_value,
-                                    'scraped_at': scraped_at
-                                })
-                        else:
-                            odds_range = self._parse_odds_range(odds_text)
-                            if odds_range:
-                                odds_list.append({
-                                    'odds_type': 'place',
-                                    'combination': boat_num,
-                                    'odds_min': odds_range[0],
-                                    'odds_max': odds_range[1],
-                                    'scraped_at': scraped_at
-                                })
+                    odds_range = self._parse_odds_range(cell['odds_text'])
+                    if odds_range:
+                        odds_list.append({
+                            'odds_type': 'place',
+                            'combination': cell['boat'],
+                            'odds_min': odds_range[0],
+                            'odds_max': odds_range[1],
+                            'scraped_at': scraped_at
+                        })
             
             return odds_list
             
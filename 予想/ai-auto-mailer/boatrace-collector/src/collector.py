@@ -9,12 +9,13 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any, Tuple
 import json
 
-import psycopg2
 from psycopg2.extras import execute_values, Json
 from pyjpboatrace import PyJPBoatrace
 import requests
-from bs4 import BeautifulSoup
-import re
+
+from db_pool import get_connection
+from page_parser import parse_stadium_codes, parse_race_index_deadlines, parse_race_result, parse_result_list
+from odds_store import ensure_odds_storage, insert_vectors
 
 # ロギング設定
 logging.basicConfig(
@@ -48,7 +49,7 @@ class BoatraceCollector:
     def connect_db(self):
         '''データベースに接続'''
         if self.conn is None or self.conn.closed:
-            self.conn = psycopg2.connect(self.database_url)
+            self.conn = get_connection(self.database_url)
             logger.info("データベースに接続しました")
 
     def close_db(self):
@@ -67,18 +68,8 @@ class BoatraceCollector:
             url = f"https://www.boatrace.jp/owpc/pc/race/index?hd={date_str}"
             logger.info(f"URL created: {url}")
             response = requests.get(url, timeout=30)
-            soup = BeautifulSoup(response.text, 'html.parser')
-
             # 開催場のリンクを抽出（jcdパラメータから場コードを取得）
-            stadium_codes = set()
-            links = soup.find_all('a', href=True)
-            for link in links:
-                href = link['href']
-                if 'raceindex' in href and 'jcd=' in href:
-                    # jcd=XX を抽出
-                    match = re.search(r'jcd=(\d+)', href)
-                    if match:
-                        stadium_codes.add(int(match.group(1)))
+            stadium_codes = {int(code) for code in parse_stadium_codes(response.text)}
 
             if not stadium_codes:
                 logger.info("開催中のレース情報はありませんでした。")
@@ -113,30 +104,12 @@ class BoatraceCollector:
             url = f'https://www.boatrace.jp/owpc/pc/race/raceindex?jcd={stadium_code:02d}&hd={target_date.strftime("%Y%m%d")}'
             logger.info(f"URL created: {url}")
             response = requests.get(url, timeout=30)
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # 各レースの行を探す
-            race_rows = soup.select('table tr')
-            for row in race_rows:
-                cells = row.select('td')
-                if len(cells) >= 2:
-                    race_text = cells[0].text.strip()
-                    time_text = cells[1].text.strip()
-
-                    # レース番号を抽出
-                    race_match = re.match(r'(\d+)R', race_text)
-                    if race_match:
-                        race_num = int(race_match.group(1))
-                        # 時刻を抽出
-                        time_match = re.match(r'(\d{1,2}):(\d{2})', time_text)
-                        if time_match:
-                            hour = int(time_match.group(1))
-                            minute = int(time_match.group(2))
-                            deadline = target_date.replace(
-                                hour=hour, minute=minute, second=0, microsecond=0,
-                                tzinfo=JST
-                            )
-                            deadlines[race_num] = deadline
+            # 各レースの行からレース番号と締切時刻を取得
+            for race_num, (hour, minute) in parse_race_index_deadlines(response.text).items():
+                deadlines[race_num] = target_date.replace(
+                    hour=hour, minute=minute, second=0, microsecond=0,
+                    tzinfo=JST
+                )
 
             logger.info(f"場{stadium_code}: {len(deadlines)}件の締切時刻を取得")
         except Exception as e:
@@ -259,6 +232,9 @@ class BoatraceCollector:
         '''特定レースのオッズを収集'''
         odds_data = {
             "scraped_at": datetime.now(JST),
+            "race_date": target_date.strftime('%Y-%m-%d'),
+            "stadium_code": stadium_code,
+            "race_number": race_number,
             "trifecta": {},
             "trio": {},
             "exacta": {},
@@ -268,22 +244,6 @@ class BoatraceCollector:
         }
 
         try:
-            # 3連単オッズ（データ量削減のため収集を無効化）
-            # trifecta = self.boatrace.get_odds_trifecta(
-            #     d=target_date.date(), stadium=stadium_code, race=race_number
-            # )
-            # for key, value in trifecta.items():
-            #     if key not in ['update', 'date', 'stadium', 'race'] and isinstance(value, (int, float)):
-            #         odds_data["trifecta"][key] = float(value)
-
-            # 3連複オッズ（データ量削減のため収集を無効化）
-            # trio = self.boatrace.get_odds_trio(
-            #     d=target_date.date(), stadium=stadium_code, race=race_number
-            # )
-            # for key, value in trio.items():
-            #     if key not in ['update', 'date', 'stadium', 'race'] and isinstance(value, (int, float)):
-            #         odds_data["trio"][key] = float(value)
-
             # 2連単・2連複オッズ
             exacta_quinella = self.boatrace.get_odds_exacta_quinella(
                 d=target_date.date(), stadium=stadium_code, race=race_number
@@ -313,6 +273,21 @@ class BoatraceCollector:
                             "max": float(value[1])
                         }
 
+            # 3連単・3連複オッズ（保存時に1回の取得を odds_vectors の1行にまとめる）
+            trifecta = self.boatrace.get_odds_trifecta(
+                d=target_date.date(), stadium=stadium_code, race=race_number
+            )
+            for key, value in trifecta.items():
+                if key not in ['update', 'date', 'stadium', 'race'] and isinstance(value, (int, float)):
+                    odds_data["trifecta"][key] = float(value)
+
+            trio = self.boatrace.get_odds_trio(
+                d=target_date.date(), stadium=stadium_code, race=race_number
+            )
+            for key, value in trio.items():
+                if key not in ['update', 'date', 'stadium', 'race'] and isinstance(value, (int, float)):
+                    odds_data["trio"][key] = float(value)
+
         except Exception as e:
             logger.error(f"オッズ取得エラー (場:{stadium_code}, R:{race_number}): {e}")
 
@@ -324,13 +299,13 @@ class BoatraceCollector:
         scraped_at = odds_data["scraped_at"]
         records = []
 
-        # 3連単（データ量削減のため収集を無効化）
-        # for combo, value in odds_data.get("trifecta", {}).items():
-        #     records.append((race_id, scraped_at, 'trifecta', combo, value, None, None))
-
-        # 3連複（データ量削減のため収集を無効化）
-        # for combo, value in odds_data.get("trio", {}).items():
-        #     records.append((race_id, scraped_at, 'trio', combo, value, None, None))
+        # 3連単・3連複は組み合わせごとの行にせず、odds_vectors に1回の取得につき1行で保存
+        vectors = [
+            (odds_data["race_date"], odds_data["stadium_code"], odds_data["race_number"],
+             odds_type, scraped_at, None, odds_data[key])
+            for key, odds_type in (("trifecta", '3t'), ("trio", '3f'))
+            if odds_data.get(key) and "race_date" in odds_data
+        ]
 
         # 2連単
         for combo, value in odds_data.get("exacta", {}).items():
@@ -349,7 +324,10 @@ class BoatraceCollector:
             if isinstance(value, dict):
                 records.append((race_id, scraped_at, 'place_show', combo, None, value.get("min"), value.get("max")))
 
-        if not records:
+        if vectors:
+            ensure_odds_storage(self.conn)
+
+        if not records and not vectors:
             return
 
         with self.conn.cursor() as cur:
@@ -362,9 +340,11 @@ class BoatraceCollector:
                     odds_max = EXCLUDED.odds_max
             '''
             try:
-                execute_values(cur, insert_query, records)
+                if records:
+                    execute_values(cur, insert_query, records)
+                insert_vectors(cur, vectors)
                 self.conn.commit()
-                logger.info(f"race_id={race_id}: {len(records)} 件のオッズを保存")
+                logger.info(f"race_id={race_id}: {len(records)} 件のオッズを保存（3連 {len(vectors)} 件）")
             except Exception as e:
                 logger.error(f"オッズ保存エラー: {e}")
                 self.conn.rollback()
@@ -411,150 +391,130 @@ class BoatraceCollector:
             }
             response = requests.get(url, headers=headers, timeout=30)
             response.raise_for_status()
+            return self._parse_result_page(response.text, stadium_code, race_number)
+
+        except Exception as e:
+            logger.error(f"結果取得エラー (場:{stadium_code}, R:{race_number}): {e}")
+            return None
 
-            # 「データがありません」チェック
-            if 'データがありません' in response.text:
-                logger.info(f"結果なし (場:{stadium_code}, R:{race_number}): データがありません")
-                return None
+    def _parse_result_page(self, html: str, stadium_code: int, race_number: int) -> Optional[Dict]:
+        '''結果ページ（raceresult）から着順・払戻金を取得（結果がなければNone）'''
+        # 「データがありません」チェック
+        if 'データがありません' in html:
+            logger.info(f"結果なし (場:{stadium_code}, R:{race_number}): データがありません")
+            return None
 
-            soup = BeautifulSoup(response.text, 'html.parser')
+        # 着順・払戻金をパース
+        result_data = parse_race_result(html)
 
-            result_data = {
-                "result": {},
-                "payoff": {}
-            }
+        # 結果が取得できたかチェック
+        if result_data["result"]:
+            logger.info(f"結果取得成功 (場:{stadium_code}, R:{race_number})")
+            return result_data
 
-            # 着順テーブルを探す（class='is-w495'で7行のテーブル）
-            tables = soup.find_all('table')
-            result_table = None
-            for table in tables:
-                table_class = table.get('class', [])
-                if 'is-w495' in table_class:
-                    rows = table.find_all('tr')
-                    if len(rows) == 7:  # ヘッダー + 6艇
-                        header = rows[0].find_all(['td', 'th'])
-                        if len(header) >= 4 and '着' in header[0].get_text(strip=True):
-                            result_table = table
-                            break
-
-            if result_table:
-                rows = result_table.find_all('tr')
-                for row in rows[1:]:  # ヘッダーをスキップ
-                    cells = row.find_all(['td', 'th'])
-                    if len(cells) >= 4:
-                        first_cell_text = cells[0].get_text(strip=True)
-                        # 着順を探す（１、２、３、４、５、６）
-                        rank_map = {'１': 1, '２': 2, '３': 3, '４': 4, '５': 5, '６': 6}
-                        if first_cell_text in rank_map:
-                            rank = rank_map[first_cell_text]
-                            waku = cells[1].get_text(strip=True)
-                            if waku.isdigit():
-                                boat_num = int(waku)
-
-                                # ボートレーサー列から登番を抽出（4桁数字）
-                                racer_text = cells[2].get_text(strip=True)
-                                racer_no_match = re.match(r'(\d{4})', racer_text)
-                                racer_no = racer_no_match.group(1) if racer_no_match else ''
-
-                                # レースタイムを取得
-                                race_time = cells[3].get_text(strip=True)
-                                # タイムが空の場合は空文字
-                                if not race_time or race_time == '-':
-                                    race_time = ''
-
-                                result_data["result"][str(boat_num)] = {
-                                    "rank": rank,
-                                    "racer_no": racer_no,
-                                    "race_time": race_time
-                                }
-
-            # 払戻金テーブルを探す
-            # rowspan対応: 複勝・ワイドは複数行に分かれ、2行目以降は勝式セルがない
-            last_bet_type = None  # 前回の勝式を記憶
-            for table in tables:
-                rows = table.find_all('tr')
-                for row in rows:
-                    cells = row.find_all(['td', 'th'])
-                    if len(cells) >= 2:  # 最低2セル（組番、払戻金）があれば処理
-                        bet_type_text = cells[0].get_text(strip=True)
-
-                        # 勝式を判定（日本語表記に統一）
-                        bet_type = None
-                        if '3連単' in bet_type_text:
-                            bet_type = '3連単'
-                        elif '3連複' in bet_type_text:
-                            bet_type = '3連複'
-                        elif '2連単' in bet_type_text:
-                            bet_type = '2連単'
-                        elif '2連複' in bet_type_text:
-                            bet_type = '2連複'
-                        elif '単勝' in bet_type_text:
-                            bet_type = '単勝'
-                        elif '複勝' in bet_type_text:
-                            bet_type = '複勝'
-                        elif '拡連複' in bet_type_text or 'ワイド' in bet_type_text:
-                            bet_type = 'ワイド'
-
-                        # 勝式が見つかった場合、記憶して処理
-                        if bet_type:
-                            last_bet_type = bet_type
-                            # 組番と払戻金を取得（セル[1]とセル[2]）
-                            if len(cells) >= 3:
-                                combination = cells[1].get_text(strip=True).replace('\n', '').replace(' ', '')
-                                payout_text = cells[2].get_text(strip=True)
-                                popularity = None
-                                if len(cells) >= 4:
-                                    pop_text = cells[3].get_text(strip=True)
-                                    if pop_text.isdigit():
-                                        popularity = int(pop_text)
-                        # 勝式セルがないがlast_bet_typeが複勝・ワイドの場合、継続行として処理
-                        elif last_bet_type in ['複勝', 'ワイド'] and len(cells) >= 2:
-                            bet_type = last_bet_type
-                            # rowspanの継続行: セル[0]が組番、セル[1]が払戻金
-                            combination = cells[0].get_text(strip=True).replace('\n', '').replace(' ', '')
-                            payout_text = cells[1].get_text(strip=True)
-                            popularity = None
-                            if len(cells) >= 3:
-                                pop_text = cells[2].get_text(strip=True)
-                                if pop_text.isdigit():
-                                    popularity = int(pop_text)
-                        else:
-                            # 勝式が判定できない場合はリセット
-                            if not bet_type_text.replace('-', '').replace('=', '').isdigit():
-                                last_bet_type = None
-                            continue
-
-                        # 払戻金を数値に変換
-                        payout_match = re.search(r'[\d,]+', payout_text.replace('¥', '').replace(',', ''))
-                        if payout_match:
-                            payout = int(payout_match.group().replace(',', ''))
-
-                            result_data["payoff"][bet_type] = {
-                                "result": combination,
-                                "payoff": payout,
-                                "popularity": popularity
-                            }
-                            # 複勝・ワイドはリストとしても保存（複数組の場合に対応）
-                            if bet_type in ['複勝', 'ワイド']:
-                                if bet_type + '_list' not in result_data["payoff"]:
-                                    result_data["payoff"][bet_type + '_list'] = []
-                                result_data["payoff"][bet_type + '_list'].append({
-                                    "result": combination,
-                                    "payoff": payout,
-                                    "popularity": popularity
-                                })
-
-            # 結果が取得できたかチェック
-            if result_data["result"]:
-                logger.info(f"結果取得成功 (場:{stadium_code}, R:{race_number})")
-                return result_data
-
-            logger.warning(f"結果パース失敗 (場:{stadium_code}, R:{race_number})")
-            return None
+        logger.warning(f"結果パース失敗 (場:{stadium_code}, R:{race_number})")
+        return None
+
+    def collect_results_for_stadiums(self, pending: Dict[int, List[int]],
+                                     target_date: datetime) -> Dict[Tuple[int, int], Dict]:
+        '''
+        結果未取得のレースの結果を、場ごとの結果一覧（resultlist）を起点にまとめて収集
+
+        結果未取得のレースがある場の結果一覧を並行に取得し、確定したレースは結果一覧の
+        1〜3着と払戻金（単勝・2連単・2連複・3連単・3連複）から結果データを作る。
+        精算に必要な着順・払戻金はこれで揃うため、結果ページ（raceresult）は取りに行かない
+        （1回の収集は場の数だけのリクエストで済む）。4〜6着・登番・タイム・複勝・拡連複は
+        締切後の結果イベント（collect_single_race_result）か翌日のLZH取込で登録される。
+
+        結果一覧が取得できない・読み取れない（空、または確定したレースが1つもない）場は、
+        結果未取得の全レースの結果ページを並行に取得する。
+
+        Args:
+            pending: 場コード -> 結果未取得のレース番号のリスト
+            target_date: 対象日
+
+        Returns:
+            (場コード, レース番号) -> 結果データ（collect_result_for_race と同じ形式。
+            結果一覧から作った結果は登番・タイムを持たない）
+        '''
+        from async_fetch import get_fetcher
 
+        date_str = target_date.strftime('%Y%m%d')
+        fetcher = get_fetcher()
+
+        list_urls = {
+            stadium_code: f"https://www.boatrace.jp/owpc/pc/race/resultlist?jcd={stadium_code:02d}&hd={date_str}"
+            for stadium_code in pending
+        }
+        texts, metrics = fetcher.fetch_texts(
+            [('resultlist', url) for url in list_urls.values()], sweep_timeout=300
+        )
+        list_requests = metrics.summary()['requests']
+
+        results = {}
+        fallback = []
+        for stadium_code, race_numbers in pending.items():
+            race_list = self._parse_stadium_result_list(texts.get(list_urls[stadium_code]), stadium_code)
+            if race_list is None:
+                fallback.extend((stadium_code, race_number) for race_number in race_numbers)
+                continue
+            for race_number in race_numbers:
+                result_data = self._result_from_list(race_list.get(race_number))
+                if result_data:
+                    results[(stadium_code, race_number)] = result_data
+        from_list = len(results)
+
+        result_urls = {
+            key: f"https://www.boatrace.jp/owpc/pc/race/raceresult?rno={key[1]}&jcd={key[0]:02d}&hd={date_str}"
+            for key in fallback
+        }
+        page_requests = 0
+        if result_urls:
+            texts, metrics = fetcher.fetch_texts(
+                [('raceresult', url) for url in result_urls.values()], sweep_timeout=300
+            )
+            page_requests = metrics.summary()['requests']
+
+            for (stadium_code, race_number), url in result_urls.items():
+                text = texts.get(url)
+                if text is None:
+                    continue
+                try:
+                    result_data = self._parse_result_page(text, stadium_code, race_number)
+                except Exception as e:
+                    logger.error(f"結果パースエラー (場:{stadium_code}, R:{race_number}): {e}")
+                    continue
+                if result_data:
+                    results[(stadium_code, race_number)] = result_data
+
+        logger.info(f"結果一括取得: 結果一覧 {list_requests}件 + 結果ページ {page_requests}件 "
+                    f"(未取得 {sum(len(r) for r in pending.values())}レース / 結果一覧から {from_list}レース "
+                    f"/ 結果ページから {len(results) - from_list}レース)")
+        return results
+
+    def _parse_stadium_result_list(self, html: Optional[str], stadium_code: int) -> Optional[Dict[int, Dict]]:
+        '''結果一覧をパース（取得できない・読み取れない場合はNone）'''
+        if html is None:
+            return None
+        try:
+            race_list = parse_result_list(html)
         except Exception as e:
-            logger.error(f"結果取得エラー (場:{stadium_code}, R:{race_number}): {e}")
+            logger.error(f"結果一覧パースエラー (場:{stadium_code}): {e}")
             return None
+        if not any(race.get("places") for race in race_list.values()):
+            logger.warning(f"結果一覧から確定したレースを読み取れません (場:{stadium_code})。結果ページで取得します")
+            return None
+        return race_list
+
+    @staticmethod
+    def _result_from_list(race: Optional[Dict]) -> Optional[Dict]:
+        '''結果一覧の1レース分を結果データに変換（未確定・中止ならNone）'''
+        if not race or not race.get("places"):
+            return None
+        return {
+            "result": {str(boat): {"rank": rank} for rank, boat in enumerate(race["places"], start=1)},
+            "payoff": dict(race["payoff"]),
+        }
 
     def save_result(self, race_id: int, result_data: Dict[str, Any], race_date: str = None, stadium_code: int = None, race_number: int = None):
         '''レース結果をDBに保存'''
@@ -577,7 +537,8 @@ class BoatraceCollector:
                         places[rank - 1] = boat_num
 
                         # historical_race_results用のデータを作成
-                        if race_date and stadium_code and race_number:
+                        # （結果一覧から作った結果は登番・タイムがないため書かない）
+                        if race_date and stadium_code and race_number and 'racer_no' in boat_info:
                             historical_results.append({
                                 'race_date': race_date,
                                 'stadium_code': str(stadium_code).zfill(2),
@@ -744,8 +705,8 @@ def run_odds_regular_collection(database_url: str):
 
         if race_id:
             odds_data = collector.collect_odds_for_race(today, race['stadium_code'], race['race_number'])
-            # 2連単または単勝オッズが取得できた場合のみ保存（3連は使わない）
-            if odds_data.get("exacta") or odds_data.get("win"):
+            # いずれかのオッズが取得できた場合のみ保存
+            if odds_data.get("exacta") or odds_data.get("win") or odds_data.get("trifecta"):
                 collector.save_odds(race_id, odds_data)
                 collected_count += 1
 
@@ -753,6 +714,53 @@ def run_odds_regular_collection(database_url: str):
     collector.close_db()
 
 
+def collect_single_race_result(database_url: str, race_date: str, stadium_code: str,
+                               race_number: int) -> bool:
+    '''
+    1レース分の結果を収集（締切時刻駆動の結果収集イベント用）
+
+    Args:
+        race_date: レース日（YYYYMMDD形式）
+        stadium_code: 競艇場コード（'01'形式）
+        race_number: レース番号
+
+    Returns:
+        結果を保存できた場合（取得済みの場合を含む）はTrue
+    '''
+    collector = BoatraceCollector(database_url)
+    target_date = datetime.strptime(race_date, '%Y%m%d').replace(tzinfo=JST)
+
+    try:
+        collector.connect_db()
+        with collector.conn.cursor() as cur:
+            cur.execute('''
+                SELECT r.id, rr.first_place
+                FROM races r
+                LEFT JOIN race_results rr ON r.id = rr.race_id
+                WHERE r.race_date = %s::date
+                AND r.stadium_code = %s
+                AND r.race_number = %s
+            ''', (target_date.strftime('%Y-%m-%d'), int(stadium_code), race_number))
+            row = cur.fetchone()
+
+        if not row:
+            logger.warning(f"レースが見つかりません: {race_date} 場{stadium_code} {race_number}R")
+            return False
+
+        race_id, first_place = row
+        if first_place is not None:
+            return True
+
+        result_data = collector.collect_result_for_race(int(stadium_code), race_number, target_date)
+        if not result_data:
+            return False
+
+        collector.save_result(race_id, result_data, race_date, int(stadium_code), race_number)
+        return True
+    finally:
+        collector.close_db()
+
+
 def run_result_collection(database_url: str, target_date: datetime = None):
     '''結果収集を実行（DBベースで結果未取得のレースを収集）'''
     collector = BoatraceCollector(database_url)
@@ -784,10 +792,15 @@ def run_result_collection(database_url: str, target_date: datetime = None):
 
     logger.info(f"結果収集対象: {len(races_to_collect)} レース")
 
+    # 場ごとの結果一覧から確定したレースの結果を作る（読み取れない場だけ結果ページを取得する）
+    pending: Dict[int, List[int]] = {}
+    for race_id, race_date, stadium_code, race_number in races_to_collect:
+        pending.setdefault(stadium_code, []).append(race_number)
+    results = collector.collect_results_for_stadiums(pending, target_date) if pending else {}
+
     collected_count = 0
     for race_id, race_date, stadium_code, race_number in races_to_collect:
-        # 結果を取得
-        result_data = collector.collect_result_for_race(stadium_code, race_number, target_date)
+        result_data = results.get((stadium_code, race_number))
         if result_data:
             # race_dateをYYYYMMDD形式の文字列に変換
             race_date_str = race_date.strftime('%Y%m%d') if hasattr(race_date, 'strftime') else str(race_date).replace('-', '')
@@ -18,6 +18,13 @@ logger = logging.getLogger(__name__)
 # 日本時間
 JST = timezone(timedelta(hours=9))
 
+# 競艇場名
+STADIUM_NAMES = {'01': '桐生', '02': '戸田', '03': '江戸川', '04': '平和島', '05': '多摩川',
+                 '06': '浜名湖', '07': '蒲郡', '08': '常滑', '09': '津', '10': '三国',
+                 '11': '琵琶湖', '12': '住之江', '13': '尼崎', '14': '鳴門', '15': '丸亀',
+                 '16': '児島', '17': '宮島', '18': '徳山', '19': '下関', '20': '若松',
+                 '21': '芦屋', '22': '福岡', '23': '唐津', '24': '大村'}
+
 # 運用時間設定
 OPERATION_START_HOUR = 8   # 8:00 JST
 OPERATION_END_HOUR = 21    # 21:30 JST
@@ -53,69 +60,11 @@ def get_database_url():
     return url
 
 
-def has_races_near_deadline(minutes: int = 2) -> bool:
-    """
-    締切N分以内のレースがあるかをチェック（軽量版）
-
-    v9.2: DBからスケジュール取得に変更（公式サイトスクレイピング→SQLで高速化）
-
-    Args:
-        minutes: 締切まで何分以内のレースを対象とするか
-
-    Returns:
-        bool: 締切N分以内のレースがあればTrue
-    """
-    try:
-        import psycopg2
-        from psycopg2.extras import RealDictCursor
-
-        database_url = get_database_url()
-        now = datetime.now(JST)
-        deadline_threshold = now + timedelta(minutes=minutes)
-
-        conn = psycopg2.connect(database_url)
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute("""
-                    SELECT stadium_code, race_number, deadline_at
-                    FROM races
-                    WHERE race_date = %s
-                    AND deadline_at IS NOT NULL
-                    AND deadline_at > %s
-                    AND deadline_at <= %s
-                    LIMIT 1
-                """, (now.date(), now, deadline_threshold))
-                race = cursor.fetchone()
-
-                if race:
-                    deadline = race['deadline_at']
-                    if deadline.tzinfo is None:
-                        deadline = deadline.replace(tzinfo=JST)
-                    delta = (deadline - now).total_seconds() / 60
-                    stadium_names = {'01': '桐生', '02': '戸田', '03': '江戸川', '04': '平和島', '05': '多摩川',
-                                   '06': '浜名湖', '07': '蒲郡', '08': '常滑', '09': '津', '10': '三国',
-                                   '11': '琵琶湖', '12': '住之江', '13': '尼崎', '14': '鳴門', '15': '丸亀',
-                                   '16': '児島', '17': '宮島', '18': '徳山', '19': '下関', '20': '若松',
-                                   '21': '芦屋', '22': '福岡', '23': '唐津', '24': '大村'}
-                    stadium_code = f"{race['stadium_code']:02d}"
-                    stadium_name = stadium_names.get(stadium_code, stadium_code)
-                    logger.info(f"締切{delta:.1f}分前のレースあり: {stadium_name} {race['race_number']}R")
-                    return True
-                return False
-        finally:
-            conn.close()
-
-    except Exception as e:
-        logger.warning(f"レーススケジュール取得エラー（処理続行）: {e}")
-        # エラー時は念のため処理を実行する
-        return True
-
-
 def has_races_after_deadline(minutes: int = 15) -> bool:
     """
     締切後N分以内のレースがあるかをチェック（結果収集用）
 
-    DB接続せずに公式サイトのスケジュールから判断。
+    当日スケジュールキャッシュ（racesテーブル、未登録時は公式サイト）から判断。
     従量課金を最小化するための早期終了チェック用。
 
     Args:
@@ -125,28 +74,15 @@ def has_races_after_deadline(minutes: int = 15) -> bool:
         bool: 締切後N分以内のレースがあればTrue
     """
     try:
-        from collect_odds import OddsCollector
-
-        collector = OddsCollector()
-        races = collector.get_today_race_schedule()
-
-        if not races:
-            return False
+        from race_schedule import get_schedule_cache
 
-        now = datetime.now(JST)
-
-        for race in races:
-            deadline = race.get('deadline_time')
-            if deadline:
-                # タイムゾーンなしの場合はJSTを付与
-                if deadline.tzinfo is None:
-                    deadline = deadline.replace(tzinfo=JST)
-                delta = (now - deadline).total_seconds() / 60  # 締切後なので逆
-                # 締切後N分以内のレースがあればTrue（結果待ち）
-                if 0 < delta <= minutes:
-                    logger.info(f"締切後{delta:.1f}分のレースあり: {race.get('stadium_name', '')} {race.get('race_number', '')}R")
-                    return True
+        races = get_schedule_cache(os.environ.get('DATABASE_URL')).races_after_deadline(minutes)
 
+        if races:
+            race = races[0]
+            delta = (datetime.now(JST) - race['deadline_time']).total_seconds() / 60  # 締切後なので逆
+            logger.info(f"締切後{delta:.1f}分のレースあり: {race.get('stadium_name', '')} {race.get('race_number', '')}R")
+            return True
         return False
 
     except Exception as e:
@@ -185,7 +121,7 @@ def fetch_today_programs(database_url: str):
     import requests
     import re
     from bs4 import BeautifulSoup
-    import psycopg2
+    from db_pool import get_connection
     from psycopg2.extras import RealDictCursor
 
     logger.info("=== 当日番組表取得開始 ===")
@@ -194,7 +130,7 @@ def fetch_today_programs(database_url: str):
     today = now.strftime('%Y%m%d')
 
     # 本日開催の競艇場をDBから取得
-    conn = psycopg2.connect(database_url)
+    conn = get_connection(database_url)
     stadiums = []
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -218,7 +154,7 @@ def fetch_today_programs(database_url: str):
 
     # 各場の番組表を取得
     total_saved = 0
-    conn = psycopg2.connect(database_url)
+    conn = get_connection(database_url)
 
     try:
         for stadium_code in stadiums:
@@ -344,8 +280,8 @@ def job_odds_collection_high_freq():
     締切5分前のレースのオッズを10秒間隔で収集。
 
     仕様（確定）:
-    - 3連単・3連複は使わない
-    - 2連単・2連複・単勝・複勝のみ
+    - 2連単・2連複・単勝・複勝
+    - 3連単・3連複は1回の取得を odds_vectors の1行に保存（ODDS_COLLECT_3TF=0 で収集しない）
     - 締切5分前から10秒間隔で収集
     - 通常は10分間隔
     - レース開催日のみ稼働（毎朝チェック）
@@ -409,131 +345,14 @@ def job_result_collection():
         logger.info(f"結果収集対象日: {target_date.strftime('%Y-%m-%d')}")
         run_result_collection(database_url, target_date)
 
-        # PostgreSQLのvirtual_betsを更新
+        # PostgreSQLのvirtual_betsを精算（結果・払戻金の結合と資金更新を1トランザクションで）
         try:
-            import psycopg2
-            from psycopg2.extras import RealDictCursor
+            from db_pool import get_connection
+            from settlement import settle_virtual_bets
 
-            conn = psycopg2.connect(database_url)
+            conn = get_connection(database_url)
             try:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    # confirmedステータスで結果が確定しているレコードを取得
-                    cur.execute("""
-                        SELECT vb.id, vb.bet_type, vb.combination, vb.bet_amount,
-                               vb.strategy_type,
-                               rr.first_place, rr.second_place, rr.third_place,
-                               r.id as race_id
-                        FROM virtual_bets vb
-                        JOIN races r ON vb.race_date = r.race_date
-                            AND vb.stadium_code::int = r.stadium_code
-                            AND vb.race_number = r.race_number
-                        JOIN race_results rr ON r.id = rr.race_id
-                        WHERE vb.status = 'confirmed'
-                          AND rr.first_place IS NOT NULL
-                    """)
-                    confirmed_bets = cur.fetchall()
-
-                    # 払戻金を一括取得
-                    if confirmed_bets:
-                        race_ids = [b['race_id'] for b in confirmed_bets]
-                        cur.execute("""
-                            SELECT race_id, bet_type, combination, payoff
-                            FROM payoffs
-                            WHERE race_id = ANY(%s)
-                        """, (race_ids,))
-                        bet_type_map = {
-                            '2連複': 'quinella', '2連単': 'exacta',
-                            '単勝': 'win', '複勝': 'place',
-                        }
-                        payoffs_map = {}
-                        for p in cur.fetchall():
-                            bt = p['bet_type']
-                            bt_en = bet_type_map.get(bt, bt)
-                            key = (p['race_id'], bt_en, p['combination'])
-                            payoffs_map[key] = p['payoff']
-
-                    updated_count = 0
-                    for bet in confirmed_bets:
-                        bet_type = bet['bet_type']
-                        combination = bet['combination']
-                        bet_amount = bet['bet_amount'] or 100
-                        strategy_type = bet['strategy_type']
-
-                        # 的中判定
-                        is_hit = False
-                        payoff = 0
-
-                        if bet_type in ('quinella', 'auto'):
-                            actual_pair = set([str(bet['first_place']), str(bet['second_place'])])
-                            bet_pair = set(combination.replace('-', '=').split('='))
-                            is_hit = actual_pair == bet_pair
-                            if is_hit:
-                                pair_list = sorted([str(bet['first_place']), str(bet['second_place'])])
-                                payoff_comb = f"{pair_list[0]}={pair_list[1]}"
-                                payoff = payoffs_map.get((bet['race_id'], 'quinella', payoff_comb), 0) or 0
-                        elif bet_type == 'exacta':
-                            actual_exacta = f"{bet['first_place']}-{bet['second_place']}"
-                            is_hit = actual_exacta == combination
-                            if is_hit:
-                                payoff = payoffs_map.get((bet['race_id'], 'exacta', actual_exacta), 0) or 0
-                        elif bet_type == 'win':
-                            is_hit = str(bet['first_place']) == combination
-                            if is_hit:
-                                payoff = payoffs_map.get((bet['race_id'], 'win', str(bet['first_place'])), 0) or 0
-
-                        # 払戻金と損益を計算
-                        return_amount = int((payoff / 100) * bet_amount) if payoff else 0
-                        profit = return_amount - bet_amount if is_hit else -bet_amount
-                        new_status = 'won' if is_hit else 'lost'
-                        actual_result = f"{bet['first_place']}-{bet['second_place']}-{bet['third_place']}"
-
-                        # virtual_betsを更新
-                        cur.execute("""
-                            UPDATE virtual_bets
-                            SET status = %s, actual_result = %s,
-                                payoff = %s, return_amount = %s, profit = %s
-                            WHERE id = %s
-                        """, (new_status, actual_result, payoff if is_hit else 0,
-                              return_amount, profit, bet['id']))
-
-                        # virtual_fundsを更新
-                        cur.execute("""
-                            SELECT * FROM virtual_funds
-                            WHERE strategy_type = %s AND is_active = TRUE
-                            LIMIT 1
-                        """, (strategy_type,))
-                        fund = cur.fetchone()
-
-                        if fund:
-                            current_fund = float(fund['current_fund']) + profit
-                            total_profit = float(fund['total_profit']) + profit
-                            total_bets = fund['total_bets'] + 1
-                            total_hits = fund['total_hits'] + (1 if is_hit else 0)
-                            hit_rate = (total_hits / total_bets * 100) if total_bets > 0 else 0
-                            total_bet_amount = float(fund['total_bet_amount']) + bet_amount
-                            total_return_amount = float(fund['total_return_amount']) + return_amount
-                            return_rate = (total_return_amount / total_bet_amount * 100) if total_bet_amount > 0 else 0
-
-                            cur.execute("""
-                                UPDATE virtual_funds
-                                SET current_fund = %s,
-                                    total_profit = %s,
-                                    total_bets = %s,
-                                    total_hits = %s,
-                                    hit_rate = %s,
-                                    total_bet_amount = %s,
-                                    total_return_amount = %s,
-                                    return_rate = %s,
-                                    updated_at = NOW()
-                                WHERE id = %s
-                            """, (current_fund, total_profit, total_bets, total_hits, hit_rate,
-                                  total_bet_amount, total_return_amount, return_rate, fund['id']))
-                            logger.info(f"資金更新: {strategy_type}, profit={profit}, current={current_fund}")
-
-                        updated_count += 1
-
-                    conn.commit()
-                    logger.info(f"仮想購入結果更新完了: {updated_count}件")
+                settle_virtual_bets(conn)
             finally:
                 conn.close()
         except Exception as e:
@@ -564,7 +383,7 @@ def update_manus_virtual_bets(boatrace_db_url: str):
     try:
         import pymysql
         from pymysql.cursors import DictCursor
-        import psycopg2
+        from db_pool import get_connection
         from psycopg2.extras import DictCursor as PgDictCursor
         import json
         import re
@@ -599,7 +418,7 @@ def update_manus_virtual_bets(boatrace_db_url: str):
         manus_conn = pymysql.connect(**manus_config)
 
         # 外部DBに接続
-        pg_conn = psycopg2.connect(boatrace_db_url)
+        pg_conn = get_connection(boatrace_db_url)
 
         try:
             # confirmedステータスで結果未確定のレースを取得
@@ -617,11 +436,7 @@ def update_manus_virtual_bets(boatrace_db_url: str):
 
             logger.info(f"結果確認対象: {len(confirmed_bets)}件")
 
-            for bet in confirmed_bets:
-                try:
-                    process_single_bet_result(bet, manus_conn, pg_conn)
-                except Exception as e:
-                    logger.error(f"結果処理エラー: bet_id={bet['id']}, error={e}")
+            settle_manus_bets(confirmed_bets, manus_conn, pg_conn)
 
         finally:
             manus_conn.close()
@@ -635,355 +450,126 @@ def update_manus_virtual_bets(boatrace_db_url: str):
         logger.error(f"Manus Space DB更新エラー: {e}")
 
 
-def process_single_bet_result(bet: dict, manus_conn, pg_conn):
-    """単一の購入結果を処理"""
-    from psycopg2.extras import DictCursor as PgDictCursor
-    import json
+def settle_manus_bets(bets: list, manus_conn, pg_conn):
+    """
+    Manus Space DBの購入結果をまとめて精算
 
-    bet_id = bet['id']
-    strategy_type = bet['strategyType']
-    race_date = bet['raceDate'].strftime('%Y%m%d') if hasattr(bet['raceDate'], 'strftime') else str(bet['raceDate']).replace('-', '')
-    stadium_code = bet['stadiumCode']
-    race_number = bet['raceNumber']
-    combination = bet['combination']
-    bet_type = bet['betType']
-    bet_amount = float(bet['betAmount'])
+    - 対象レースの着順・払戻金は外部DBから1回のクエリで取得
+    - virtualBetsの更新は executemany、virtualFundsは戦略ごとに集計して1回ずつ更新
+    - すべて1トランザクションでコミット（失敗時はロールバック）
+    """
+    from psycopg2.extras import DictCursor as PgDictCursor
+    from settlement import collect_fund_deltas, fetch_race_outcomes, judge_bet
 
-    logger.info(f"結果確認: {stadium_code} {race_number}R {combination}")
+    def race_key(bet: dict):
+        race_date = bet['raceDate'].strftime('%Y%m%d') if hasattr(bet['raceDate'], 'strftime') else str(bet['raceDate']).replace('-', '')
+        return (race_date, str(bet['stadiumCode']).zfill(2), int(bet['raceNumber']))
 
-    # 外部DBから結果を取得
+    # 外部DBから結果を一括取得
     with pg_conn.cursor(cursor_factory=PgDictCursor) as cursor:
-        # historical_race_resultsから結果を取得
-        cursor.execute("""
-            SELECT
-                hrr.stadium_code,
-                hrr.race_no::integer as race_number,
-                hrr.race_date,
-                MAX(CASE WHEN hrr.rank IN ('1', '01') THEN hrr.boat_no::integer END) as rank1,
-                MAX(CASE WHEN hrr.rank IN ('2', '02') THEN hrr.boat_no::integer END) as rank2,
-                MAX(CASE WHEN hrr.rank IN ('3', '03') THEN hrr.boat_no::integer END) as rank3
-            FROM historical_race_results hrr
-            WHERE hrr.stadium_code = %s
-              AND hrr.race_no = %s
-              AND hrr.race_date = %s
-            GROUP BY hrr.stadium_code, hrr.race_no, hrr.race_date
-        """, (stadium_code, str(race_number).zfill(2), race_date))
-        result = cursor.fetchone()
-
-        if not result:
-            # race_resultsテーブルからも試す
-            cursor.execute("""
-                SELECT
-                    rr.first_place as rank1,
-                    rr.second_place as rank2,
-                    rr.third_place as rank3
-                FROM race_results rr
-                JOIN races r ON rr.race_id = r.id
-                WHERE r.stadium_code = %s
-                  AND r.race_number = %s
-                  AND r.race_date = %s
-            """, (int(stadium_code), race_number, race_date.replace('/', '-') if '/' in race_date else f"{race_date[:4]}-{race_date[4:6]}-{race_date[6:8]}"))
-            result = cursor.fetchone()
-
-        if not result or not result['rank1']:
-            logger.info(f"レース結果未確定: {stadium_code} {race_number}R")
-            return
-
-        # 的中判定
-        actual_result = str(result['rank1'])
-        is_hit = False
-        payoff = 0
+        outcomes = fetch_race_outcomes(cursor, [race_key(bet) for bet in bets])
 
+    now = datetime.now(JST)
+    settled = []
+    rows = []
+    for bet in bets:
+        result = outcomes.get(race_key(bet))
+        if not result or not result['rank2']:
+            continue
+
+        bet_type = bet['betType']
+        bet_amount = float(bet['betAmount'])
+        rank1, rank2 = result['rank1'], result['rank2']
+        is_hit, payoff_key = judge_bet(bet_type, bet['combination'], rank1, rank2)
+
+        # 的中判定に使った着順（単勝は1着、2連複は小さい艇番から）
         if bet_type == 'win':
-            # 単勝の場合
-            is_hit = (combination == actual_result)
-            if is_hit:
-                # 払戻金を取得
-                cursor.execute("""
-                    SELECT payoff FROM payoffs p
-                    JOIN races r ON p.race_id = r.id
-                    WHERE r.stadium_code = %s
-                      AND r.race_number = %s
-                      AND r.race_date = %s
-                      AND p.bet_type = 'win'
-                """, (int(stadium_code), race_number, f"{race_date[:4]}-{race_date[4:6]}-{race_date[6:8]}"))
-                payoff_row = cursor.fetchone()
-                if payoff_row:
-                    payoff = float(payoff_row['payoff'])
-
-        elif bet_type == 'quinella':
-            # 2連複の場合
-            result_combo = f"{min(result['rank1'], result['rank2'])}-{max(result['rank1'], result['rank2'])}"
-            actual_result = result_combo
-            is_hit = (combination == result_combo)
-            if is_hit:
-                cursor.execute("""
-                    SELECT payoff FROM payoffs p
-                    JOIN races r ON p.race_id = r.id
-                    WHERE r.stadium_code = %s
-                      AND r.race_number = %s
-                      AND r.race_date = %s
-                      AND p.bet_type = 'quinella'
-                      AND p.combination = %s
-                """, (int(stadium_code), race_number, f"{race_date[:4]}-{race_date[4:6]}-{race_date[6:8]}", combination))
-                payoff_row = cursor.fetchone()
-                if payoff_row:
-                    payoff = float(payoff_row['payoff'])
-
+            actual_result = str(rank1)
         elif bet_type == 'exacta':
-            # 2連単の場合
-            result_combo = f"{result['rank1']}-{result['rank2']}"
-            actual_result = result_combo
-            is_hit = (combination == result_combo)
-            if is_hit:
-                cursor.execute("""
-                    SELECT payoff FROM payoffs p
-                    JOIN races r ON p.race_id = r.id
-                    WHERE r.stadium_code = %s
-                      AND r.race_number = %s
-                      AND r.race_date = %s
-                      AND p.bet_type = 'exacta'
-                      AND p.combination = %s
-                """, (int(stadium_code), race_number, f"{race_date[:4]}-{race_date[4:6]}-{race_date[6:8]}", combination))
-                payoff_row = cursor.fetchone()
-                if payoff_row:
-                    payoff = float(payoff_row['payoff'])
-
-    # 回収額と損益を計算
-    return_amount = (payoff / 100 * bet_amount) if is_hit else 0
-    profit = return_amount - bet_amount
-
-    # Manus Space DBを更新
-    now = datetime.now(JST)
-    status = 'won' if is_hit else 'lost'
-
-    with manus_conn.cursor() as cursor:
-        # virtualBetsを更新
-        cursor.execute("""
-            UPDATE virtualBets
-            SET status = %s,
-                actualResult = %s,
-                payoff = %s,
-                returnAmount = %s,
-                profit = %s,
-                resultConfirmedAt = %s,
-                updatedAt = %s
-            WHERE id = %s
-        """, (status, actual_result, payoff, return_amount, profit, now, now, bet_id))
-
-        # virtualFundsを更新
-        cursor.execute("""
-            SELECT * FROM virtualFunds
-            WHERE strategyType = %s AND isActive = 1
-            LIMIT 1
-        """, (strategy_type,))
-        fund = cursor.fetchone()
-
-        if fund:
-            current_fund = float(fund['currentFund']) + profit
-            total_profit = float(fund['totalProfit']) + profit
-            total_bets = fund['totalBets'] + 1
-            total_hits = fund['totalHits'] + (1 if is_hit else 0)
-            hit_rate = (total_hits / total_bets * 100) if total_bets > 0 else 0
-
-            total_bet_amount = float(fund['totalBetAmount']) + bet_amount
-            total_return_amount = float(fund['totalReturnAmount']) + return_amount
-            return_rate = (total_return_amount / total_bet_amount * 100) if total_bet_amount > 0 else 0
-
-            cursor.execute("""
-                UPDATE virtualFunds
-                SET currentFund = %s,
-                    totalProfit = %s,
-                    totalBets = %s,
-                    totalHits = %s,
-                    hitRate = %s,
-                    totalBetAmount = %s,
-                    totalReturnAmount = %s,
-                    returnRate = %s,
-                    updatedAt = %s
-                WHERE id = %s
-            """, (current_fund, total_profit, total_bets, total_hits, hit_rate,
-                  total_bet_amount, total_return_amount, return_rate, now, fund['id']))
-
-        manus_conn.commit()
-
-    logger.info(f"結果更新完了: bet_id={bet_id}, status={status}, profit={profit}")
-
-
-def job_betting_process():
-    """
-    オッズ収集+購入判断ジョブ
-    1分ごとに実行。
-
-    v9.0（2026/01/25）:
-    - 締切10分以内のレースがあればオッズ収集
-    - 締切2分以内のレースがあれば購入判断
-    - どちらもなければ早期終了（従量課金を最小化）
-
-    処理内容:
-    1. 締切10分以内のレースのオッズを収集
-    2. 締切2分以内のpendingレースの購入判断
-    3. 締切超過のpendingレースをskippedに更新
-    """
-    logger.info("=== オッズ収集+購入判断ジョブ開始 (v9.1) ===")
+            actual_result = f"{rank1}-{rank2}"
+        else:
+            actual_result = f"{min(rank1, rank2)}-{max(rank1, rank2)}"
 
-    # 運用時間チェック
-    if not is_within_operation_hours():
-        now_jst = datetime.now(JST)
-        logger.info(f"運用時間外のためスキップ (現在: {now_jst.strftime('%H:%M')} JST)")
-        logger.info("=== オッズ収集+購入判断ジョブ完了 ===")
-        return
+        payoff = float(result['payoffs'].get((bet_type, payoff_key), 0) or 0) if is_hit else 0
+        return_amount = (payoff / 100 * bet_amount) if is_hit else 0
+        profit = return_amount - bet_amount
+        status = 'won' if is_hit else 'lost'
 
-    # 早期チェック: 締切5分以内のレースがあるか確認
-    # v9.2: オッズ収集と購入判断の両方で5分以内をチェック
-    has_odds_target = has_races_near_deadline(minutes=5)
-    # v9.3: 締切超過対策により3分前に拡大
-    has_betting_target = has_races_near_deadline(minutes=3)
+        rows.append((status, actual_result, payoff, return_amount, profit, now, now, bet['id']))
+        settled.append({
+            'strategy_type': bet['strategyType'], 'status': status,
+            'bet_amount': bet_amount, 'return_amount': return_amount,
+        })
 
-    if not has_odds_target and not has_betting_target:
-        logger.info("締切10分以内のレースがないためスキップ")
-        logger.info("=== オッズ収集+購入判断ジョブ完了 ===")
+    if not rows:
+        logger.info("結果が確定した購入はありません")
         return
 
-    database_url = get_database_url()
-
+    deltas = collect_fund_deltas(settled)
     try:
-        # Step 1: オッズ収集（締切5分以内のレース）
-        # v9.2: DBからスケジュール取得に変更（公式サイト24場スクレイピング→SQLで数秒）
-        if has_odds_target:
-            logger.info("--- オッズ収集 ---")
-            try:
-                from collect_odds import OddsCollector
-                import psycopg2
-                from psycopg2.extras import RealDictCursor
-
-                collector = OddsCollector(database_url)
-                now = datetime.now(JST)
-                deadline_threshold = now + timedelta(minutes=5)  # 締切5分以内
-
-                # DBからスケジュール取得（高速化）
-                conn = psycopg2.connect(database_url)
-                try:
-                    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                        cursor.execute("""
-                            SELECT stadium_code, race_number, deadline_at, race_date
-                            FROM races
-                            WHERE race_date = %s
-                            AND deadline_at IS NOT NULL
-                            AND deadline_at > %s
-                            AND deadline_at <= %s
-                            ORDER BY deadline_at
-                        """, (now.date(), now, deadline_threshold))
-                        races = cursor.fetchall()
-
-                    logger.info(f"締切5分以内のレース: {len(races)}件")
-
-                    collected_count = 0
-                    odds_conn = None
-
-                    for race in races:
-                        stadium_code = f"{race['stadium_code']:02d}"
-                        race_number = race['race_number']
-                        race_date = race['race_date'].strftime('%Y%m%d') if hasattr(race['race_date'], 'strftime') else str(race['race_date']).replace('-', '')
-                        deadline = race['deadline_at']
-                        if deadline.tzinfo is None:
-                            deadline = deadline.replace(tzinfo=JST)
-                        delta = (deadline - now).total_seconds() / 60
-
-                        if odds_conn is None:
-                            odds_conn = collector.get_db_connection()
-                            collector.create_odds_table(odds_conn)
-
-                        # リアルタイムでオッズ取得（公式サイトから）
-                        odds_list = collector.fetch_all_odds(stadium_code, race_number, race_date)
-
-                        if odds_list:
-                            collector.save_odds(odds_conn, race_date, stadium_code, race_number, odds_list, int(delta))
-                            collected_count += len(odds_list)
-                            # 場名を取得
-                            stadium_names = {'01': '桐生', '02': '戸田', '03': '江戸川', '04': '平和島', '05': '多摩川',
-                                           '06': '浜名湖', '07': '蒲郡', '08': '常滑', '09': '津', '10': '三国',
-                                           '11': '琵琶湖', '12': '住之江', '13': '尼崎', '14': '鳴門', '15': '丸亀',
-                                           '16': '児島', '17': '宮島', '18': '徳山', '19': '下関', '20': '若松',
-                                           '21': '芦屋', '22': '福岡', '23': '唐津', '24': '大村'}
-                            stadium_name = stadium_names.get(stadium_code, stadium_code)
-                            logger.info(f"  {stadium_name} {race_number}R: {len(odds_list)}件収集")
-
-                    if odds_conn:
-                        odds_conn.close()
-                finally:
-                    conn.close()
-
-                logger.info(f"オッズ収集完了: {collected_count}件")
-
-                # Step 1.5: 直前AI予想生成（締切15-5分前のレース）
-                # v9.5: 直前のデータを使った予想生成
-                try:
-                    from ai_prediction_batch import predict_single_race
-
-                    # 締切15-5分前のレースを取得
-                    ai_conn = psycopg2.connect(database_url)
-                    try:
-                        with ai_conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                            now_for_ai = datetime.now(JST)
-                            ai_min_threshold = now_for_ai + timedelta(minutes=5)
-                            ai_max_threshold = now_for_ai + timedelta(minutes=15)
-
-                            cursor.execute("""
-                                SELECT stadium_code, race_number, deadline_at, race_date
-                                FROM races
-                                WHERE race_date = %s
-                                AND deadline_at IS NOT NULL
-                                AND deadline_at > %s
-                                AND deadline_at <= %s
-                                ORDER BY deadline_at
-                            """, (now_for_ai.date(), ai_min_threshold, ai_max_threshold))
-                            ai_races = cursor.fetchall()
-
-                        if ai_races:
-                            logger.info(f"--- 直前AI予想 (締切15-5分前) ---")
-                            ai_count = 0
-                            for race in ai_races:
-                                stadium_code = f"{race['stadium_code']:02d}"
-                                race_number = race['race_number']
-                                race_date_str = race['race_date'].strftime('%Y%m%d') if hasattr(race['race_date'], 'strftime') else str(race['race_date']).replace('-', '')
-
-                                result = predict_single_race(database_url, race_date_str, stadium_code, race_number)
-                                if result:
-                                    ai_count += 1
-
-                            logger.info(f"AI予想生成完了: {ai_count}件")
-                    finally:
-                        ai_conn.close()
-
-                except ImportError as e:
-                    logger.warning(f"AI予想モジュール読み込みエラー（スキップ）: {e}")
-                except Exception as e:
-                    logger.warning(f"AI予想生成エラー（続行）: {e}")
-
-            except Exception as e:
-                logger.warning(f"オッズ収集エラー（続行）: {e}")
+        with manus_conn.cursor() as cursor:
+            cursor.executemany("""
+                UPDATE virtualBets
+                SET status = %s,
+                    actualResult = %s,
+                    payoff = %s,
+                    returnAmount = %s,
+                    profit = %s,
+                    resultConfirmedAt = %s,
+                    updatedAt = %s
+                WHERE id = %s
+            """, rows)
+
+            # 戦略ごとのアクティブな資金を一括取得
+            strategies = list(deltas)
+            cursor.execute(f"""
+                SELECT * FROM virtualFunds
+                WHERE isActive = 1 AND strategyType IN ({', '.join(['%s'] * len(strategies))})
+                ORDER BY id
+            """, strategies)
+            funds = {}
+            for fund in cursor.fetchall():
+                funds.setdefault(fund['strategyType'], fund)
+
+            for strategy_type, d in deltas.items():
+                fund = funds.get(strategy_type)
+                if not fund:
+                    logger.warning(f"アクティブな資金が見つかりません: {strategy_type}")
+                    continue
 
-        # Step 2: 購入判断（締切3分以内のレース）
-        if has_betting_target:
-            logger.info("--- 購入判断 ---")
-            from virtual_betting import VirtualBettingManager
-            manager = VirtualBettingManager(database_url)
+                current_fund = float(fund['currentFund']) + d['profit']
+                total_profit = float(fund['totalProfit']) + d['profit']
+                total_bets = fund['totalBets'] + d['bets']
+                total_hits = fund['totalHits'] + d['hits']
+                hit_rate = (total_hits / total_bets * 100) if total_bets > 0 else 0
 
-            # 締切2分前のレースの購入判断を実行
-            manager.process_deadline_bets()
+                total_bet_amount = float(fund['totalBetAmount']) + d['bet_amount']
+                total_return_amount = float(fund['totalReturnAmount']) + d['return_amount']
+                return_rate = (total_return_amount / total_bet_amount * 100) if total_bet_amount > 0 else 0
 
-            # 締切超過のレースを見送りに更新
-            expired_count = manager.expire_overdue_bets()
-            logger.info(f"締切超過で見送り: {expired_count}件")
+                cursor.execute("""
+                    UPDATE virtualFunds
+                    SET currentFund = %s,
+                        totalProfit = %s,
+                        totalBets = %s,
+                        totalHits = %s,
+                        hitRate = %s,
+                        totalBetAmount = %s,
+                        totalReturnAmount = %s,
+                        returnRate = %s,
+                        updatedAt = %s
+                    WHERE id = %s
+                """, (current_fund, total_profit, total_bets, total_hits, hit_rate,
+                      total_bet_amount, total_return_amount, return_rate, now, fund['id']))
+                logger.info(f"資金更新: {strategy_type}, {d['bets']}件, profit={d['profit']:+.0f}, current={current_fund}")
 
-        logger.info("=== オッズ収集+購入判断ジョブ完了 ===")
+        manus_conn.commit()
+    except Exception:
+        manus_conn.rollback()
+        raise
 
-    except Exception as e:
-        logger.error(f"オッズ収集+購入判断ジョブ失敗: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
+    hits = sum(1 for bet in settled if bet['status'] == 'won')
+    logger.info(f"仮想購入結果更新完了: {len(rows)}件（的中{hits}件）")
 
 
 def job_test():
@@ -991,13 +577,13 @@ def job_test():
     テストジョブ
     デプロイ確認用。DB接続をテストして終了。
     """
-    import psycopg2
+    from db_pool import get_connection
 
     logger.info("=== テストジョブ開始 ===")
     database_url = get_database_url()
 
     try:
-        conn = psycopg2.connect(database_url)
+        conn = get_connection(database_url)
         with conn.cursor() as cur:
             cur.execute("SELECT COUNT(*) FROM stadiums")
             count = cur.fetchone()[0]
@@ -1103,6 +689,22 @@ def job_daily_batch():
     except Exception as e:
         logger.warning(f"購入予定登録エラー（続行）: {e}")
 
+    # オッズ履歴の保持期間処理（古い月を集約してパーティションを削除）
+    logger.info("")
+    logger.info("--- オッズ履歴メンテナンス ---")
+    try:
+        from db_pool import get_connection
+        from odds_store import ensure_odds_storage, apply_retention
+        conn = get_connection(database_url)
+        try:
+            ensure_odds_storage(conn)
+            dropped = apply_retention(conn)
+            logger.info(f"オッズ履歴メンテナンス完了: {dropped}パーティション集約")
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"オッズ履歴メンテナンスエラー（続行）: {e}")
+
     logger.info("")
     logger.info("=" * 60)
     logger.info("=== 統合日次バッチ完了 ===")
@@ -1111,7 +713,7 @@ def job_daily_batch():
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print("Usage: python cron_jobs.py <job_name>")
-        print("Available jobs: daily_batch, betting, result, daily, odds_regular, test")
+        print("Available jobs: daily_batch, result, daily, odds_regular, test")
         sys.exit(1)
 
     job_name = sys.argv[1]
@@ -1119,7 +721,6 @@ if __name__ == '__main__':
     jobs = {
         # 新しい統合バッチ（推奨）
         'daily_batch': job_daily_batch,      # 毎朝6時: LZH+過去データ+レース情報+購入予定
-        'betting': job_betting_process,       # 毎分: オッズ収集+購入判断
         # レガシー（後方互換性のため残す）
         'daily': job_daily_collection,
         'odds_regular': job_odds_collection_regular,
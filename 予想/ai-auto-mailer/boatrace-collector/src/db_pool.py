@@ -0,0 +1,238 @@
+"""
+PostgreSQLコネクションプール
+
+Render の Postgres はリモート（SSL必須）のため、接続のたびに TLS ハンドシェイクが
+発生する。接続をプロセス内で使い回し、各モジュールの
+get_db_connection() はここから接続を借りる。
+
+- 最大接続数の上限（DB_POOL_MAX）。上限に達した場合は空きが出るまで待機
+- 貸し出し時のヘルスチェック（切断済み・一定時間アイドルの接続は SELECT 1 で確認）
+- 返却時に未完了のトランザクションをロールバックし、壊れた接続は破棄
+- 借りた接続の close() はプールへの返却になるため、既存の
+  「conn = get_db_connection() ... finally: conn.close()」のコードはそのまま使える
+- 新しいコードでは with connection() as conn: を使う
+
+boatrace-collector/src/db_pool.py と boatrace-dashboard/db_pool.py は同じ内容のコピー（別サービスとしてデプロイするため）。
+変更時は両方を揃えること（boatrace-collector/tests/test_shared_modules.py で一致を確認している）。
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import psycopg2
+import psycopg2.pool
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# プールの最大接続数（貸し出し中＋アイドル）
+POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX', '10'))
+# 空き接続を待つ最大秒数
+POOL_WAIT_SECONDS = 30
+# この秒数以上アイドルだった接続は貸し出し前に SELECT 1 で確認する
+HEALTH_CHECK_IDLE_SECONDS = 60
+
+
+class PooledConnection:
+    """プールから借りた接続のラッパー（close()でプールに返却）"""
+
+    def __init__(self, owner: 'ConnectionPool', conn):
+        self._owner = owner
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_owner', '_conn'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    @property
+    def closed(self) -> int:
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        """プールに返却（二重呼び出しは無視）"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._owner.release(conn)
+
+    def __enter__(self):
+        # psycopg2と同じく、withブロックはトランザクション単位（接続は閉じない）
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    ヘルスチェック・上限付きのスレッドセーフなコネクションプール
+
+    psycopg2.pool は minconn を超えた返却接続を閉じてしまうため、
+    アイドル接続を最大 maxconn まで保持する簡易プールとして実装している。
+    """
+
+    def __init__(self, dsn: str, maxconn: int = POOL_MAX_CONNECTIONS):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.pid = os.getpid()
+        self._idle: List[Tuple[object, float]] = []  # (接続, 返却時刻)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def acquire(self, cursor_factory=None, timeout: float = POOL_WAIT_SECONDS) -> PooledConnection:
+        """
+        接続を借りる
+
+        Args:
+            cursor_factory: 接続のデフォルトカーソル（RealDictCursor等）
+            timeout: 空き接続を待つ最大秒数
+
+        Returns:
+            PooledConnection（close()で返却）
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError(f"接続プールが上限({self.maxconn})に達しています")
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        conn.cursor_factory = cursor_factory
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """接続を返却（未完了のトランザクションはロールバックし、壊れた接続は破棄）"""
+        try:
+            reusable = not conn.closed
+            if reusable:
+                try:
+                    status = conn.get_transaction_status()
+                    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                        reusable = False
+                    elif status != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    if reusable and conn.autocommit:
+                        conn.autocommit = False
+                except Exception:
+                    reusable = False
+
+            if reusable:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                _close_quietly(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """アイドル接続をすべて閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+    def _checkout_healthy(self):
+        """ヘルスチェック済みのアイドル接続を取り出す（なければ新規接続）"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                # 直近に返却された接続から使う（長時間アイドルの接続は自然に減る）
+                conn, returned_at = self._idle.pop()
+
+            if self._is_healthy(conn, returned_at):
+                return conn
+            logger.info("切断済みのプール接続を破棄して再接続します")
+            _close_quietly(conn)
+
+        return psycopg2.connect(self.dsn)
+
+    def _is_healthy(self, conn, returned_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < HEALTH_CHECK_IDLE_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+# DSNごとのプロセス共有プール
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: str = None) -> ConnectionPool:
+    """DSNに対応する共有プールを取得（未作成なら作成）"""
+    dsn = dsn or os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise ValueError("DATABASE_URL is required")
+    with _pools_lock:
+        current = _pools.get(dsn)
+        # fork後の子プロセスでは親の接続を共有しないよう作り直す
+        if current is None or current.pid != os.getpid():
+            current = _pools[dsn] = ConnectionPool(dsn)
+        return current
+
+
+def get_connection(dsn: str = None, cursor_factory=None) -> PooledConnection:
+    """
+    プールから接続を借りる（psycopg2.connect の置き換え）
+
+    Args:
+        dsn: 接続URL（省略時はDATABASE_URL）
+        cursor_factory: 接続のデフォルトカーソル
+
+    Returns:
+        PooledConnection（close()でプールに返却）
+    """
+    return get_pool(dsn).acquire(cursor_factory=cursor_factory)
+
+
+@contextmanager
+def connection(dsn: str = None, cursor_factory=None):
+    """with connection() as conn: の形で接続を借りて自動返却する"""
+    conn = get_connection(dsn, cursor_factory=cursor_factory)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def close_all():
+    """全プールの接続を閉じる（プロセス終了時など）"""
+    with _pools_lock:
+        for p in _pools.values():
+            p.closeall()
+        _pools.clear()
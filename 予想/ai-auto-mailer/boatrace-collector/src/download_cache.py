@@ -0,0 +1,292 @@
+"""
+ダウンロードファイルのローカルキャッシュ（mbrace.or.jp の K/B ファイル・ファン手帳のLZH）
+
+過去データの再インポートやスキーマ変更のたびに、同じLZHを公式サイトから取り直していた
+（進捗テーブルが記録しているのはDBへのインポート状況だけで、ファイルではない）。
+取得したファイルは内容の sha256 をキーに保存し、URLとの対応をマニフェストに記録する。
+
+- 保存先: DOWNLOAD_CACHE_DIR/objects/<sha256の先頭2文字>/<sha256>
+- マニフェスト: DOWNLOAD_CACHE_DIR/manifest.jsonl（1行1エントリの追記形式。同じURLは後の行が有効）
+    {"url", "status": "ok" | "missing", "size", "sha256", "fetched_at", "etag", "last_modified"}
+- マニフェストにあるURLはネットワークに出ずにキャッシュから返す。max_age を指定した場合は
+  If-None-Match / If-Modified-Since で再検証し、304 ならキャッシュをそのまま使う
+  （当月分は公開後に差し替わることがあるため、呼び出し側は recent_max_age() を渡す）
+- 404 のURLも記録し、MISSING_RETRY_SECONDS の間は取りに行かない（公開前の当日分など）
+- 取得はタイムアウト・接続エラー・429・5xx のとき指数バックオフでリトライする
+- fetch_many() で複数URLを並行に取得して、それぞれの保存先に置く
+- DOWNLOAD_CACHE_OFFLINE=1 のときはネットワークに出ない（キャッシュにないURLは None）
+
+各スクリプトの download_file() は fetch_to() で従来の保存先にファイルを置く
+（キャッシュからはハードリンク、できなければコピー）。
+
+使用方法:
+  python download_cache.py status  - キャッシュの件数・容量を表示
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 日本時間
+JST = timezone(timedelta(hours=9))
+
+DOWNLOAD_CACHE_DIR = os.environ.get(
+    'DOWNLOAD_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'download_cache'))
+# ネットワークに出ない（キャッシュだけで再インポートする）
+OFFLINE = os.environ.get('DOWNLOAD_CACHE_OFFLINE', '0') == '1'
+
+MANIFEST_FILE = 'manifest.jsonl'
+# 1リクエストのタイムアウト秒数
+REQUEST_TIMEOUT_SECONDS = 60
+# 最大試行回数と、リトライ間隔の基準秒数（1, 2, 4, ... 秒 + ゆらぎ）
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+# リトライするHTTPステータス
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 404 だったURLを取りに行かない秒数
+MISSING_RETRY_SECONDS = int(os.environ.get('DOWNLOAD_CACHE_MISSING_RETRY', '3600'))
+# fetch_many の同時取得数
+DOWNLOAD_WORKERS = 8
+# 当月のファイルを再検証する間隔（秒）
+RECENT_MAX_AGE_SECONDS = int(os.environ.get('DOWNLOAD_CACHE_RECENT_MAX_AGE', '3600'))
+
+_manifest: Optional[Dict[str, Dict]] = None
+_lock = threading.Lock()
+
+
+def object_path(sha256: str, cache_dir: str = DOWNLOAD_CACHE_DIR) -> str:
+    """内容の sha256 から保存先のパスを求める"""
+    return os.path.join(cache_dir, 'objects', sha256[:2], sha256)
+
+
+def _manifest_path(cache_dir: str = DOWNLOAD_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, MANIFEST_FILE)
+
+
+def _load_manifest() -> Dict[str, Dict]:
+    """マニフェストを読み込む（プロセス内で1回。_lock を持って呼ぶ）"""
+    global _manifest
+    if _manifest is None:
+        _manifest = {}
+        path = _manifest_path()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 書き込み途中で終了した行
+                    _manifest[entry['url']] = entry
+    return _manifest
+
+
+def _record(entry: Dict):
+    """マニフェストに1行追記"""
+    with _lock:
+        manifest = _load_manifest()
+        os.makedirs(DOWNLOAD_CACHE_DIR, exist_ok=True)
+        with open(_manifest_path(), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        manifest[entry['url']] = entry
+
+
+def lookup(url: str) -> Optional[Dict]:
+    """URLのマニフェストエントリ（なければ None）"""
+    with _lock:
+        return _load_manifest().get(url)
+
+
+def _cached_path(entry: Optional[Dict]) -> Optional[str]:
+    """取得済みエントリの保存先（ファイルが消えていれば None）"""
+    if not entry or entry.get('status') != 'ok':
+        return None
+    path = object_path(entry['sha256'])
+    return path if os.path.exists(path) else None
+
+
+def recent_max_age(year: int, month: int) -> Optional[float]:
+    """
+    ファイルの年月に応じた max_age
+
+    当月（当日分を含む）のファイルは公開後に差し替わることがあるため
+    RECENT_MAX_AGE_SECONDS ごとに再検証する。それ以前の月は再検証しない（None）。
+    """
+    today = datetime.now(JST).date()
+    return RECENT_MAX_AGE_SECONDS if (year, month) == (today.year, today.month) else None
+
+
+def fetch(url: str, max_age: Optional[float] = None, retries: int = MAX_RETRIES) -> Optional[str]:
+    """
+    URLのファイルをキャッシュ経由で取得
+
+    Args:
+        url: 取得するURL
+        max_age: キャッシュを再検証せずに使う秒数（None なら再検証しない）
+        retries: 最大試行回数
+
+    Returns:
+        キャッシュ内のファイルパス（存在しない・取得できない場合は None）
+    """
+    entry = lookup(url)
+    path = _cached_path(entry)
+    now = time.time()
+
+    if path and (OFFLINE or max_age is None or now - entry['fetched_at'] < max_age):
+        return path
+    if entry and entry.get('status') == 'missing' and (OFFLINE or now - entry['fetched_at'] < MISSING_RETRY_SECONDS):
+        return None
+    if OFFLINE:
+        return None
+    return _download(url, entry if path else None, retries)
+
+
+def _download(url: str, cached: Optional[Dict], retries: int) -> Optional[str]:
+    """ネットワークから取得してキャッシュに保存（cached があれば条件付きGET）"""
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    error = None
+    for attempt in range(retries):
+        try:
+            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            error = e
+        else:
+            if response.status_code == 304 and cached:
+                _record(dict(cached, fetched_at=time.time()))
+                return object_path(cached['sha256'])
+            if response.status_code == 200:
+                return _store(url, response)
+            if response.status_code == 404:
+                _record({'url': url, 'status': 'missing', 'fetched_at': time.time()})
+                logger.debug(f"ファイルが存在しません: {url}")
+                return None
+            error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUS:
+                break
+
+        if attempt < retries - 1:
+            wait = BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, BACKOFF_SECONDS / 2)
+            logger.warning(f"ダウンロードエラー (試行 {attempt + 1}/{retries}): {url} - {error}（{wait:.1f}秒後に再試行）")
+            time.sleep(wait)
+
+    logger.warning(f"ダウンロード失敗: {url} - {error}")
+    return None
+
+
+def _store(url: str, response) -> str:
+    """取得した内容を sha256 の名前で保存してマニフェストに記録"""
+    content = response.content
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = object_path(sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    _record({
+        'url': url,
+        'status': 'ok',
+        'size': len(content),
+        'sha256': sha256,
+        'fetched_at': time.time(),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    })
+    logger.info(f"ダウンロード完了: {url} ({len(content)} bytes)")
+    return path
+
+
+def fetch_to(url: str, filepath: str, max_age: Optional[float] = None,
+             retries: int = MAX_RETRIES) -> Optional[str]:
+    """
+    URLのファイルをキャッシュ経由で取得し、filepath に置く
+
+    filepath が既にあれば、max_age を指定しない限りそのまま返す。max_age を指定した場合は
+    キャッシュを再検証し、内容が変わっていれば filepath を置き換える
+    （再検証できなかった場合は既存の filepath を返す）。
+
+    Returns:
+        filepath（存在しない・取得できない場合は None）
+    """
+    exists = os.path.exists(filepath)
+    if exists and max_age is None:
+        return filepath
+
+    path = fetch(url, max_age=max_age, retries=retries)
+    if not path:
+        return filepath if exists else None
+    if exists and os.path.samefile(path, filepath):
+        return filepath
+
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(path, tmp_path)
+    except OSError:
+        shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, filepath)
+    return filepath
+
+
+def fetch_many(targets: Dict[str, str], max_age: Optional[float] = None,
+               max_workers: int = DOWNLOAD_WORKERS) -> Dict[str, Optional[str]]:
+    """
+    複数URLを並行に取得し、それぞれの保存先に置く（fetch_to を並行に実行）
+
+    Args:
+        targets: URL -> 保存先のファイルパス
+        max_age: キャッシュを再検証せずに使う秒数（None なら再検証しない）
+        max_workers: 同時取得数
+
+    Returns:
+        URL -> 保存先のファイルパス（存在しない・取得できなかったURLは None）
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = executor.map(lambda url: fetch_to(url, targets[url], max_age=max_age), targets)
+        return dict(zip(targets, paths))
+
+
+def print_status():
+    """キャッシュの件数・容量を表示"""
+    with _lock:
+        entries = list(_load_manifest().values())
+    ok = [e for e in entries if e.get('status') == 'ok']
+    missing = len(entries) - len(ok)
+    objects = {e['sha256']: e['size'] for e in ok if os.path.exists(object_path(e['sha256']))}
+    print(f"ダウンロードキャッシュ: {os.path.abspath(DOWNLOAD_CACHE_DIR)}")
+    print(f"  URL: {len(ok)}件（存在しない: {missing}件）")
+    print(f"  ファイル: {len(objects)}件 {sum(objects.values()) / 1024 / 1024:.1f}MB")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'status':
+        print("使用方法:")
+        print("  python download_cache.py status  - キャッシュの件数・容量を表示")
+        sys.exit(1)
+
+    print_status()
@@ -4,13 +4,13 @@
 '''
 
 import os
-import requests
-import subprocess
 import logging
 from datetime import datetime, timedelta, timezone
 JST = timezone(timedelta(hours=9))
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
+
+from download_cache import fetch_to, recent_max_age
+from lzh_archive import extract_lzh_to_dir
 
 # ログ設定
 logging.basicConfig(
@@ -31,74 +31,36 @@ RESULT_BASE_URL = "https://www1.mbrace.or.jp/od2/K"
 PROGRAM_BASE_URL = "https://www1.mbrace.or.jp/od2/B"
 
 
-def download_file(url, filepath, max_retries=3):
+def download_file(url, filepath, max_retries=3, max_age=None):
     """
     指定されたURLからファイルをダウンロード
+
+    download_cache 経由で取得する（取得済みのURLはネットワークに出ない。
+    max_age を指定した場合はキャッシュを再検証する）。
     """
     # 既にダウンロード済みの場合はスキップ
-    if os.path.exists(filepath):
+    if os.path.exists(filepath) and max_age is None:
         logger.debug(f"既にダウンロード済み: {os.path.basename(filepath)}")
         return filepath
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=60)
-            
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                logger.info(f"ダウンロード完了: {os.path.basename(filepath)} ({len(response.content)} bytes)")
-                return filepath
-            elif response.status_code == 404:
-                logger.debug(f"ファイルが存在しません: {url}")
-                return None
-            else:
-                logger.warning(f"ダウンロード失敗: {url} (HTTP {response.status_code})")
-                
-        except Exception as e:
-            logger.warning(f"ダウンロードエラー (試行 {attempt + 1}/{max_retries}): {url} - {e}")
-            time.sleep(1)
-    
-    return None
+
+    return fetch_to(url, filepath, retries=max_retries, max_age=max_age)
 
 
 def extract_lzh(filepath, output_dir):
     """
-    LZHファイルを解凍
+    LZHファイルを解凍（lzh_archive でメモリ上に展開して書き出す）
+
+    外部コマンド（lha/unar）には依存しない。
     """
     if not filepath or not os.path.exists(filepath):
         return None
-    
-    os.makedirs(output_dir, exist_ok=True)
-    
-    try:
-        # lhaコマンドで解凍
-        result = subprocess.run(
-            ['lha', '-xw=' + output_dir, filepath],
-            check=True,
-            capture_output=True,
-            timeout=30
-        )
+
+    if extract_lzh_to_dir(filepath, output_dir) > 0:
         logger.debug(f"解凍完了: {os.path.basename(filepath)}")
         return output_dir
-    except FileNotFoundError:
-        # lhaがない場合はunarを試す
-        try:
-            subprocess.run(
-                ['unar', '-o', output_dir, '-f', filepath],
-                check=True,
-                capture_output=True,
-                timeout=30
-            )
-            logger.debug(f"解凍完了 (unar): {os.path.basename(filepath)}")
-            return output_dir
-        except Exception as e:
-            logger.error(f"解凍エラー: {os.path.basename(filepath)} - {e}")
-            return None
-    except Exception as e:
-        logger.error(f"解凍エラー: {os.path.basename(filepath)} - {e}")
-        return None
+
+    logger.error(f"解凍エラー: {os.path.basename(filepath)}")
+    return None
 
 
 def get_date_range(start_date, end_date):
@@ -129,7 +91,8 @@ def download_race_results(date):
     url = f"{RESULT_BASE_URL}/{yyyymm}/k{yymm}{dd}.lzh"
     filepath = os.path.join(RESULT_DOWNLOAD_DIR, yyyymm, f"k{yymm}{dd}.lzh")
     
-    downloaded = download_file(url, filepath)
+    # 当月分はキャッシュを再検証
+    downloaded = download_file(url, filepath, max_age=recent_max_age(year, month))
     if downloaded:
         output_dir = os.path.join(RESULT_EXTRACTED_DIR, yyyymm)
         extract_lzh(downloaded, output_dir)
@@ -153,7 +116,8 @@ def download_program(date):
     url = f"{PROGRAM_BASE_URL}/{yyyymm}/b{yymm}{dd}.lzh"
     filepath = os.path.join(PROGRAM_DOWNLOAD_DIR, yyyymm, f"b{yymm}{dd}.lzh")
     
-    downloaded = download_file(url, filepath)
+    # 当月分（本日の番組表を含む）はキャッシュを再検証
+    downloaded = download_file(url, filepath, max_age=recent_max_age(year, month))
     if downloaded:
         output_dir = os.path.join(PROGRAM_EXTRACTED_DIR, yyyymm)
         extract_lzh(downloaded, output_dir)
@@ -6,18 +6,13 @@ Render環境対応: lhafileライブラリを使用（システムコマンド
 '''
 
 import os
-import requests
 import logging
 from datetime import datetime, timezone, timedelta
 JST = timezone(timedelta(hours=9))
 
-# lhafileライブラリをインポート（純粋Python実装）
-try:
-    import lhafile
-    LHAFILE_AVAILABLE = True
-except ImportError:
-    LHAFILE_AVAILABLE = False
-    logging.warning("lhafileライブラリがインストールされていません。pip install lhafile を実行してください。")
+# LZHの展開は純粋Pythonのlhafileを使う共通モジュールで行う
+from lzh_archive import extract_lzh_to_dir
+from download_cache import fetch_to
 
 # ログ設定
 logging.basicConfig(
@@ -68,45 +63,31 @@ def get_file_list():
 def download_file(filename):
     """
     指定されたファイルをダウンロード
+
+    download_cache 経由で取得する（取得済みのURLはネットワークに出ない）。
     """
     url = f"{BASE_URL}/{filename}"
     filepath = os.path.join(DOWNLOAD_DIR, filename)
-    
+
     # 既にダウンロード済みの場合はスキップ
     if os.path.exists(filepath):
         logger.info(f"既にダウンロード済み: {filename}")
         return filepath
-    
-    try:
-        logger.info(f"ダウンロード中: {url}")
-        response = requests.get(url, timeout=60)
-        
-        if response.status_code == 200:
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            logger.info(f"ダウンロード完了: {filename} ({len(response.content)} bytes)")
-            return filepath
-        elif response.status_code == 404:
-            logger.warning(f"ファイルが存在しません: {filename}")
-            return None
-        else:
-            logger.error(f"ダウンロード失敗: {filename} (HTTP {response.status_code})")
-            return None
-            
-    except Exception as e:
-        logger.error(f"ダウンロードエラー: {filename} - {e}")
-        return None
+
+    logger.info(f"ダウンロード中: {url}")
+    filepath = fetch_to(url, filepath)
+    if not filepath:
+        logger.warning(f"ダウンロードできませんでした: {filename}")
+    return filepath
 
 
 def extract_lzh(filepath):
     """
-    LZHファイルを解凍（lhafileライブラリを使用）
-    
-    Render環境対応: システムコマンド（lha/7z/unar）に依存せず、
-    純粋Pythonのlhafileライブラリを使用
-    
-    注意: LhaFileオブジェクトはcontext managerをサポートしていないため、
-    with文を使用せずに直接操作する
+    LZHファイルを解凍（lzh_archive でメモリ上に展開して書き出す）
+
+    Render環境対応: システムコマンド（lha/7z/unar）に依存しない。
+    期別成績のインポート（import_racer_data）はディレクトリ単位で読むため、
+    展開結果はファイルとして書き出す。
     """
     if not filepath or not os.path.exists(filepath):
         return None
@@ -119,87 +100,12 @@ def extract_lzh(filepath):
         logger.info(f"既に解凍済み: {filename}")
         return output_dir
     
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # lhafileライブラリを使用して解凍
-    if LHAFILE_AVAILABLE:
-        try:
-            # LhaFileはcontext managerをサポートしていないため、with文を使用しない
-            lzh = lhafile.Lhafile(filepath)
-            try:
-                for info in lzh.infolist():
-                    # ファイル名を取得（パスセパレータを正規化）
-                    member_name = info.filename.replace('\\', '/').split('/')[-1]
-                    if not member_name:
-                        continue
-                    
-                    # ファイルを解凍
-                    output_path = os.path.join(output_dir, member_name)
-                    with open(output_path, 'wb') as f:
-                        f.write(lzh.read(info.filename))
-                    logger.debug(f"解凍: {member_name}")
-            finally:
-                # LhaFileにはclose()メソッドがないため、何もしない
-                pass
-            
-            logger.info(f"解凍完了 (lhafile): {filename}")
-            return output_dir
-            
-        except Exception as e:
-            logger.error(f"lhafile解凍エラー: {filename} - {e}")
-            # フォールバック: システムコマンドを試す
-            return _extract_lzh_system_command(filepath, output_dir, filename)
-    else:
-        # lhafileが利用できない場合はシステムコマンドを試す
-        return _extract_lzh_system_command(filepath, output_dir, filename)
-
-
-def _extract_lzh_system_command(filepath, output_dir, filename):
-    """
-    システムコマンドを使用してLZHファイルを解凍（フォールバック用）
-    """
-    import subprocess
+    if extract_lzh_to_dir(filepath, output_dir) > 0:
+        logger.info(f"解凍完了: {filename}")
+        return output_dir
     
-    try:
-        # lhaコマンドで解凍（Linuxの場合）
-        try:
-            subprocess.run(
-                ['lha', '-xw=' + output_dir, filepath],
-                check=True,
-                capture_output=True
-            )
-            logger.info(f"解凍完了 (lha): {filename}")
-            return output_dir
-        except FileNotFoundError:
-            # lhaがない場合は7zを試す
-            try:
-                subprocess.run(
-                    ['7z', 'x', '-o' + output_dir, filepath, '-y'],
-                    check=True,
-                    capture_output=True
-                )
-                logger.info(f"解凍完了 (7z): {filename}")
-                return output_dir
-            except FileNotFoundError:
-                # unarを試す
-                try:
-                    subprocess.run(
-                        ['unar', '-o', output_dir, filepath],
-                        check=True,
-                        capture_output=True
-                    )
-                    logger.info(f"解凍完了 (unar): {filename}")
-                    return output_dir
-                except FileNotFoundError:
-                    logger.error(f"解凍ツールが見つかりません: lha, 7z, unar のいずれかをインストールしてください")
-                    return None
-                
-    except subprocess.CalledProcessError as e:
-        logger.error(f"解凍エラー: {filename} - {e}")
-        return None
-    except Exception as e:
-        logger.error(f"解凍エラー: {filename} - {e}")
-        return None
+    logger.error(f"解凍エラー: {filename}")
+    return None
 
 
 def download_all():
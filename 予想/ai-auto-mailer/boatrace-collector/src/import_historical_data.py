@@ -13,24 +13,10 @@ Renderのバッチジョブとして実行することを想定
 
 import os
 import sys
-import glob
 import logging
 import psycopg2
 from datetime import datetime, timedelta, timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
-import subprocess
-import time
 import re
-import struct
-import io
-
-# lhafileライブラリ（-lh5-圧縮対応）
-try:
-    import lhafile
-    HAS_LHAFILE = True
-except ImportError:
-    HAS_LHAFILE = False
 
 # ログ設定
 logging.basicConfig(
@@ -39,13 +25,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-if not HAS_LHAFILE:
-    logger.warning("lhafileライブラリがインストールされていません。pip install lhafile を実行してください。")
-
 # .envファイルの読み込み
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
+from bulk_loader import bulk_upsert, HISTORICAL_RACE_RESULTS, HISTORICAL_PAYOFFS, HISTORICAL_PROGRAMS
+from lzh_archive import read_lzh_members
+from download_cache import fetch_to, fetch_many, recent_max_age
+
 # データベース接続
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
@@ -66,9 +53,10 @@ PROGRESS_TABLE = 'historical_import_progress'
 # 日本時間
 JST = timezone(timedelta(hours=9))
 
-# 1回の実行で処理する最大月数（タイムアウト防止）
-# 環境変数で上書き可能。デフォルト24ヶ月（約2年分）
-MAX_MONTHS_PER_RUN = int(os.environ.get('MAX_MONTHS_PER_RUN', 100))
+# 1回の実行で処理する最大月数（0 = 無制限）
+# COPYによる一括ロードでタイムアウトの心配はなくなったため、デフォルトは無制限。
+# 環境変数で上書き可能
+MAX_MONTHS_PER_RUN = int(os.environ.get('MAX_MONTHS_PER_RUN', 0))
 
 # 並列処理のワーカー数
 PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', 5))
@@ -183,188 +171,28 @@ def get_payoffs_missing_months():
         conn.close()
 
 
-def download_file(url, filepath, max_retries=3):
-    """ファイルをダウンロード"""
-    if os.path.exists(filepath):
-        return filepath
-
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=60)
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                return filepath
-            elif response.status_code == 404:
-                return None
-        except Exception as e:
-            logger.warning(f"ダウンロードエラー (試行 {attempt + 1}/{max_retries}): {url} - {e}")
-            time.sleep(2)
-    return None
-
-
-def extract_lzh(filepath, output_dir):
-    """LZHファイルを解凍（Python純正実装）"""
-    if not filepath or not os.path.exists(filepath):
-        return None
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    # まず外部コマンドを試す
-    try:
-        subprocess.run(['lha', '-xw=' + output_dir, filepath],
-                      check=True, capture_output=True, timeout=30)
-        return output_dir
-    except FileNotFoundError:
-        pass
-    except Exception:
-        pass
-
-    try:
-        subprocess.run(['unar', '-o', output_dir, '-f', filepath],
-                      check=True, capture_output=True, timeout=30)
-        return output_dir
-    except FileNotFoundError:
-        pass
-    except Exception:
-        pass
-
-    # 外部コマンドがない場合、Pythonで解凍を試みる
-    try:
-        return extract_lzh_python(filepath, output_dir)
-    except Exception as e:
-        logger.error(f"解凍エラー: {filepath} - {e}")
-        return None
-
-
-def extract_lzh_python(filepath, output_dir):
-    """PythonでLZHファイルを解凍（lhafileライブラリ使用、-lh0-/-lh5-/-lh6-/-lh7-対応）"""
-
-    # 出力ディレクトリを作成
-    os.makedirs(output_dir, exist_ok=True)
-
-    # lhafileライブラリが利用可能な場合はそれを使用
-    if HAS_LHAFILE:
-        try:
-            lzh = lhafile.Lhafile(filepath)
-            extracted_count = 0
-            for info in lzh.infolist():
-                # ファイル名を取得
-                filename = info.filename
-                basename = os.path.basename(filename.replace('\\', '/'))
-                if not basename:
-                    continue
-
-                # ファイルを解凍して保存
-                try:
-                    file_data = lzh.read(info.filename)
-                    output_path = os.path.join(output_dir, basename)
-                    with open(output_path, 'wb') as out_f:
-                        out_f.write(file_data)
-                    extracted_count += 1
-                except Exception as e:
-                    logger.warning(f"ファイル解凍エラー: {basename} - {e}")
-
-            # LhaFileオブジェクトにはclose()メソッドがないため、明示的なクローズは不要
-            if extracted_count > 0:
-                return output_dir
-            return None
-        except Exception as e:
-            logger.warning(f"lhafile解凍エラー: {filepath} - {e}")
-            # フォールバックとして手動パースを試みる
-
-    # lhafileが使えない場合、手動パースを試みる（-lh0-のみ対応）
-    with open(filepath, 'rb') as f:
-        data = f.read()
-
-    pos = 0
-    extracted_count = 0
-
-    while pos < len(data):
-        # ヘッダサイズを読み取り
-        if pos + 21 > len(data):
-            break
-
-        header_size = data[pos]
-        if header_size == 0:
-            break
-
-        # チェックサム
-        checksum = data[pos + 1]
+def download_file(url, filepath, max_retries=3, max_age=None):
+    """ファイルをダウンロード（download_cache 経由。取得済みのURLはネットワークに出ない）"""
+    return fetch_to(url, filepath, retries=max_retries, max_age=max_age)
 
-        # 圧縮方式（-lh0-, -lh5-等）
-        method = data[pos + 2:pos + 7].decode('ascii', errors='ignore')
 
-        # 圧縮後サイズ、元サイズ
-        compressed_size = struct.unpack('<I', data[pos + 7:pos + 11])[0]
-        original_size = struct.unpack('<I', data[pos + 11:pos + 15])[0]
-
-        # ファイル名長
-        name_length = data[pos + 21]
-        filename = data[pos + 22:pos + 22 + name_length].decode('shift_jis', errors='ignore')
-
-        # ヘッダー全体のサイズ
-        total_header_size = header_size + 2
-
-        # データ部分の開始位置
-        data_start = pos + total_header_size
-        data_end = data_start + compressed_size
-
-        if data_end > len(data):
-            break
-
-        # -lh0-は無圧縮なのでそのまま保存
-        if method == '-lh0-':
-            file_data = data[data_start:data_end]
-
-            # ファイル名からディレクトリ部分を除去
-            basename = os.path.basename(filename.replace('\\', '/'))
-            if basename:
-                output_path = os.path.join(output_dir, basename)
-                with open(output_path, 'wb') as out_f:
-                    out_f.write(file_data)
-                extracted_count += 1
-        else:
-            # -lh5-等の圧縮形式はlhafileがないと対応できない
-            logger.warning(f"未対応の圧縮形式（lhafileが必要）: {method} - {filename}")
-
-        pos = data_end
-
-    if extracted_count > 0:
-        return output_dir
-    return None
+def download_month(year_month, data_type):
+    """
+    指定年月の全日分のLZHを並列ダウンロード（download_cache.fetch_many）
 
+    当月分は公開後に差し替わることがあるため、キャッシュを再検証する。
 
+    Args:
+        year_month: 対象年月（YYYYMM形式）
+        data_type: 'results'（Kファイル）または 'programs'（Bファイル）
 
-def download_single_day(args):
-    """1日分のデータをダウンロード（並列処理用）"""
-    year_month, day, data_type = args
+    Returns:
+        取得できたファイル数
+    """
     year = int(year_month[:4])
     month = int(year_month[4:6])
     yymm = f"{year % 100:02d}{month:02d}"
 
-    if data_type == 'results':
-        url = f"{RESULT_BASE_URL}/{year_month}/k{yymm}{day:02d}.lzh"
-        filepath = os.path.join(RESULT_DOWNLOAD_DIR, year_month, f"k{yymm}{day:02d}.lzh")
-        output_dir = os.path.join(RESULT_EXTRACTED_DIR, year_month)
-    else:
-        url = f"{PROGRAM_BASE_URL}/{year_month}/b{yymm}{day:02d}.lzh"
-        filepath = os.path.join(PROGRAM_DOWNLOAD_DIR, year_month, f"b{yymm}{day:02d}.lzh")
-        output_dir = os.path.join(PROGRAM_EXTRACTED_DIR, year_month)
-
-    downloaded = download_file(url, filepath)
-    if downloaded:
-        extract_lzh(downloaded, output_dir)
-        return 1
-    return 0
-
-
-def download_month_results(year_month):
-    """指定年月のレース結果を並列ダウンロード"""
-    year = int(year_month[:4])
-    month = int(year_month[4:6])
-
     # その月の日数を計算
     if month == 12:
         next_month = datetime(year + 1, 1, 1)
@@ -372,42 +200,55 @@ def download_month_results(year_month):
         next_month = datetime(year, month + 1, 1)
     days_in_month = (next_month - datetime(year, month, 1)).days
 
-    # 並列ダウンロード
-    tasks = [(year_month, day, 'results') for day in range(1, days_in_month + 1)]
+    targets = {}
+    for day in range(1, days_in_month + 1):
+        if data_type == 'results':
+            url = f"{RESULT_BASE_URL}/{year_month}/k{yymm}{day:02d}.lzh"
+            targets[url] = os.path.join(RESULT_DOWNLOAD_DIR, year_month, f"k{yymm}{day:02d}.lzh")
+        else:
+            url = f"{PROGRAM_BASE_URL}/{year_month}/b{yymm}{day:02d}.lzh"
+            targets[url] = os.path.join(PROGRAM_DOWNLOAD_DIR, year_month, f"b{yymm}{day:02d}.lzh")
 
-    success_count = 0
-    with ThreadPoolExecutor(max_workers=PARALLEL_WORKERS) as executor:
-        futures = [executor.submit(download_single_day, task) for task in tasks]
-        for future in as_completed(futures):
-            success_count += future.result()
+    # 解凍はインポート時にメモリ上で行う（lzh_archive）
+    paths = fetch_many(targets, max_age=recent_max_age(year, month), max_workers=PARALLEL_WORKERS)
+    return sum(1 for path in paths.values() if path)
 
-    return success_count
+
+def download_month_results(year_month):
+    """指定年月のレース結果を並列ダウンロード"""
+    return download_month(year_month, 'results')
 
 
 def download_month_programs(year_month):
     """指定年月の番組表を並列ダウンロード"""
-    year = int(year_month[:4])
-    month = int(year_month[4:6])
+    return download_month(year_month, 'programs')
 
-    if month == 12:
-        next_month = datetime(year + 1, 1, 1)
-    else:
-        next_month = datetime(year, month + 1, 1)
-    days_in_month = (next_month - datetime(year, month, 1)).days
 
-    # 並列ダウンロード
-    tasks = [(year_month, day, 'programs') for day in range(1, days_in_month + 1)]
+def read_text_file(filepath):
+    """K/Bファイルを読み込み、Shift-JISでデコードした本文を返す"""
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    return content.decode('shift_jis', errors='ignore')
 
-    success_count = 0
-    with ThreadPoolExecutor(max_workers=PARALLEL_WORKERS) as executor:
-        futures = [executor.submit(download_single_day, task) for task in tasks]
-        for future in as_completed(futures):
-            success_count += future.result()
 
-    return success_count
+def iter_source_texts(filepath):
+    """
+    K/Bファイルの本文を取得（LZHアーカイブはメモリ上で展開）
 
+    Args:
+        filepath: LZHアーカイブ、または解凍済みのTXTファイル
 
-def parse_result_file(filepath):
+    Yields:
+        (ファイル名, Shift-JISでデコードした本文)
+    """
+    if filepath.lower().endswith('.lzh'):
+        for name, content in read_lzh_members(filepath):
+            yield name, content.decode('shift_jis', errors='ignore')
+    else:
+        yield os.path.basename(filepath), read_text_file(filepath)
+
+
+def parse_result_file(filepath, text=None):
     """
     レース結果ファイル（Kファイル）をパース
 
@@ -420,11 +261,9 @@ def parse_result_file(filepath):
     results = []
 
     try:
-        with open(filepath, 'rb') as f:
-            content = f.read()
-
-        # Shift-JISでデコード
-        text = content.decode('shift_jis', errors='ignore')
+        # Shift-JISでデコード（デコード済みの本文が渡された場合はそれを使う）
+        if text is None:
+            text = read_text_file(filepath)
         lines = text.replace('\r', '').split('\n')
 
         # ファイル名から日付を取得 (K050101.TXT -> 20050101)
@@ -530,7 +369,7 @@ def parse_result_file(filepath):
     return results
 
 
-def parse_payoffs_from_result_file(filepath):
+def parse_payoffs_from_result_file(filepath, text=None):
     """
     レース結果ファイル（Kファイル）から払戻金データをパース
 
@@ -546,11 +385,9 @@ def parse_payoffs_from_result_file(filepath):
     payoffs = []
 
     try:
-        with open(filepath, 'rb') as f:
-            content = f.read()
-
-        # Shift-JISでデコード
-        text = content.decode('shift_jis', errors='ignore')
+        # Shift-JISでデコード（デコード済みの本文が渡された場合はそれを使う）
+        if text is None:
+            text = read_text_file(filepath)
         lines = text.replace('\r', '').split('\n')
 
         # ファイル名から日付を取得 (K050101.TXT -> 20050101)
@@ -717,16 +554,45 @@ def parse_payoffs_from_result_file(filepath):
     return payoffs
 
 
-def parse_program_file(filepath):
-    """番組表ファイルをパース"""
+def parse_k_file(filepath):
+    """Kファイル（LZHまたはTXT）を1回だけ読み込み、競走結果と払戻金を両方パース
+
+    Returns:
+        (競走結果のリスト, 払戻金のリスト)
+    """
+    results = []
+    payoffs = []
+    try:
+        for name, text in iter_source_texts(filepath):
+            if not name.upper().startswith('K'):
+                continue
+            results.extend(parse_result_file(name, text))
+            payoffs.extend(parse_payoffs_from_result_file(name, text))
+    except OSError as e:
+        logger.error(f"ファイル読み込みエラー: {filepath} - {e}")
+    return results, payoffs
+
+
+def parse_b_file(filepath):
+    """Bファイル（LZHまたはTXT）をパース"""
     programs = []
     try:
-        with open(filepath, 'rb') as f:
-            content = f.read()
+        for name, text in iter_source_texts(filepath):
+            if name.upper().startswith('B'):
+                programs.extend(parse_program_file(name, text))
+    except OSError as e:
+        logger.error(f"ファイル読み込みエラー: {filepath} - {e}")
+    return programs
+
 
+def parse_program_file(filepath, text=None):
+    """番組表ファイルをパース"""
+    programs = []
+    try:
         # Shift_JISでデコードし、\rを削除
-        text = content.decode('shift_jis', errors='ignore').replace('\r', '')
-        lines = text.strip().split('\n')
+        if text is None:
+            text = read_text_file(filepath)
+        lines = text.replace('\r', '').strip().split('\n')
 
         current_stadium = None
         current_race_date = None
@@ -818,22 +684,46 @@ def parse_program_file(filepath):
 
 def import_programs_to_db(year_month):
     """番組表をDBにインポート"""
-    extracted_dir = os.path.join(PROGRAM_EXTRACTED_DIR, year_month)
-    if not os.path.exists(extracted_dir):
-        return 0
-
     all_programs = []
-    for filename in os.listdir(extracted_dir):
-        if not filename.upper().endswith('.TXT'):
+    for filepath in _find_program_files(year_month):
+        all_programs.extend(parse_b_file(filepath))
+
+    return save_programs_to_db(all_programs, label=f"番組表 {year_month}")
+
+
+def _find_source_files(download_dir, extracted_dir, prefix):
+    """
+    1ヶ月分のK/Bファイル一覧を取得
+
+    ダウンロード済みのLZHを優先し、なければ旧方式で解凍済みのTXTを使う。
+    """
+    for directory, suffix in ((download_dir, '.LZH'), (extracted_dir, '.TXT')):
+        if not os.path.isdir(directory):
             continue
-        filepath = os.path.join(extracted_dir, filename)
-        all_programs.extend(parse_program_file(filepath))
+        files = sorted(os.path.join(directory, filename) for filename in os.listdir(directory)
+                       if filename.upper().startswith(prefix) and filename.upper().endswith(suffix))
+        if files:
+            return files
+    return []
 
-    return save_programs_to_db(all_programs)
 
+def _find_program_files(year_month):
+    """1ヶ月分のBファイル一覧を取得"""
+    return _find_source_files(os.path.join(PROGRAM_DOWNLOAD_DIR, year_month),
+                              os.path.join(PROGRAM_EXTRACTED_DIR, year_month), 'B')
 
-def save_programs_to_db(programs, database_url=None):
-    """番組表データをDBに保存"""
+
+def _list_months(*base_dirs):
+    """ダウンロード済み（または解凍済み）の年月ディレクトリ一覧"""
+    months = set()
+    for base_dir in base_dirs:
+        if os.path.exists(base_dir):
+            months.update(d for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d)))
+    return sorted(months)
+
+
+def save_programs_to_db(programs, database_url=None, label='historical_programs'):
+    """番組表データをDBに保存（COPYで一括ロード）"""
     if not programs:
         return 0
 
@@ -845,128 +735,52 @@ def save_programs_to_db(programs, database_url=None):
         return 0
 
     conn = psycopg2.connect(database_url)
-    total_count = 0
 
     try:
-        with conn.cursor() as cur:
-            for prog in programs:
-                try:
-                    cur.execute('''
-                        INSERT INTO historical_programs
-                        (race_date, stadium_code, race_no, boat_no, racer_no, racer_name,
-                         age, branch, weight, rank, national_win_rate, national_2nd_rate,
-                         local_win_rate, local_2nd_rate, motor_no, motor_2nd_rate,
-                         boat_no_assigned, boat_2nd_rate, deadline_time)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (race_date, stadium_code, race_no, boat_no) DO UPDATE SET
-                            racer_no = EXCLUDED.racer_no,
-                            racer_name = EXCLUDED.racer_name,
-                            age = EXCLUDED.age,
-                            branch = EXCLUDED.branch,
-                            weight = EXCLUDED.weight,
-                            rank = EXCLUDED.rank,
-                            national_win_rate = EXCLUDED.national_win_rate,
-                            national_2nd_rate = EXCLUDED.national_2nd_rate,
-                            local_win_rate = EXCLUDED.local_win_rate,
-                            local_2nd_rate = EXCLUDED.local_2nd_rate,
-                            motor_no = EXCLUDED.motor_no,
-                            motor_2nd_rate = EXCLUDED.motor_2nd_rate,
-                            boat_no_assigned = EXCLUDED.boat_no_assigned,
-                            boat_2nd_rate = EXCLUDED.boat_2nd_rate,
-                            deadline_time = EXCLUDED.deadline_time
-                    ''', (
-                        prog['race_date'], prog['stadium_code'], prog['race_no'],
-                        prog['boat_no'], prog['racer_no'], prog['racer_name'],
-                        prog['age'], prog['branch'], prog['weight'], prog['rank'],
-                        prog['national_win_rate'], prog['national_2nd_rate'],
-                        prog['local_win_rate'], prog['local_2nd_rate'],
-                        prog['motor_no'], prog['motor_2nd_rate'],
-                        prog['boat_no_assigned'], prog['boat_2nd_rate'],
-                        prog['deadline_time']
-                    ))
-                    total_count += 1
-                except Exception as e:
-                    continue
-
-            conn.commit()
+        result = bulk_upsert(conn, HISTORICAL_PROGRAMS, programs, label=label)
+        conn.commit()
     finally:
         conn.close()
 
-    return total_count
+    return result.loaded
 
 
-def import_results_to_db(year_month):
-    """レース結果と払戻金をDBにインポート"""
-    extracted_dir = os.path.join(RESULT_EXTRACTED_DIR, year_month)
-    if not os.path.exists(extracted_dir):
-        return 0
-
-    conn = get_db_connection()
-    total_count = 0
-    payoff_count = 0
+def _find_result_files(year_month):
+    """1ヶ月分のKファイル一覧を取得"""
+    return _find_source_files(os.path.join(RESULT_DOWNLOAD_DIR, year_month),
+                              os.path.join(RESULT_EXTRACTED_DIR, year_month), 'K')
 
-    try:
-        # K*.TXTファイルを検索
-        pattern = os.path.join(extracted_dir, 'K*.TXT')
-        files = glob.glob(pattern, recursive=True)
 
-        if not files:
-            # 小文字も試す
-            pattern = os.path.join(extracted_dir, 'k*.txt')
-            files = glob.glob(pattern, recursive=True)
+def import_results_to_db(year_month):
+    """レース結果と払戻金をDBにインポート（月単位でCOPYによる一括ロード）"""
+    files = _find_result_files(year_month)
+    if not files:
+        return 0
 
-        for filepath in files:
-            results = parse_result_file(filepath)
+    results = []
+    payoffs = []
+    for filepath in files:
+        file_results, file_payoffs = parse_k_file(filepath)
+        results.extend(file_results)
+        payoffs.extend(file_payoffs)
 
-            with conn.cursor() as cur:
-                for r in results:
-                    try:
-                        # historical_race_resultsテーブルに挿入
-                        cur.execute('''
-                            INSERT INTO historical_race_results
-                            (race_date, stadium_code, race_no, boat_no, racer_no, rank, race_time, exhibition_time)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (race_date, stadium_code, race_no, boat_no)
-                            DO UPDATE SET
-                                racer_no = EXCLUDED.racer_no,
-                                rank = EXCLUDED.rank,
-                                race_time = EXCLUDED.race_time,
-                                exhibition_time = EXCLUDED.exhibition_time
-                        ''', (
-                            r['race_date'], r['stadium_code'], r['race_no'],
-                            r['boat_no'], r['racer_no'], r['rank'], r['race_time'], r.get('exhibition_time')
-                        ))
-                        total_count += 1
-                    except Exception as e:
-                        continue
-
-            # 払戻金もインポート
-            payoffs = parse_payoffs_from_result_file(filepath)
-            with conn.cursor() as cur:
-                for p in payoffs:
-                    try:
-                        cur.execute('''
-                            INSERT INTO historical_payoffs
-                            (race_date, stadium_code, race_no, bet_type, combination, payout, popularity)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (race_date, stadium_code, race_no, bet_type, combination)
-                            DO UPDATE SET payout = EXCLUDED.payout, popularity = EXCLUDED.popularity
-                        ''', (
-                            p['race_date'], p['stadium_code'], p['race_no'],
-                            p['bet_type'], p['combination'], p['payout'], p.get('popularity')
-                        ))
-                        payoff_count += 1
-                    except Exception as e:
-                        continue
+    return save_results_to_db(year_month, results, payoffs)
 
-            conn.commit()
 
-        if payoff_count > 0:
-            logger.info(f"払戻金インポート: {payoff_count} 件")
+def save_results_to_db(year_month, results, payoffs):
+    """1ヶ月分の競走結果と払戻金を1トランザクションで保存（COPYで一括ロード）"""
+    conn = get_db_connection()
+    try:
+        result_load = bulk_upsert(conn, HISTORICAL_RACE_RESULTS, results, label=f"競走結果 {year_month}")
+        payoff_load = bulk_upsert(conn, HISTORICAL_PAYOFFS, payoffs, label=f"払戻金 {year_month}")
+        conn.commit()
     finally:
         conn.close()
 
-    return total_count
+    if payoff_load.loaded > 0:
+        logger.info(f"払戻金インポート: {payoff_load.loaded} 件")
+
+    return result_load.loaded
 
 
 def create_historical_tables():
@@ -1086,53 +900,31 @@ def create_payoffs_table():
 
 
 def import_payoffs_to_db(year_month):
-    """払戻金データをDBにインポート"""
-    extracted_dir = os.path.join(RESULT_EXTRACTED_DIR, year_month)
-    if not os.path.exists(extracted_dir):
-        logger.warning(f"ディレクトリが存在しません: {extracted_dir}")
+    """払戻金データをDBにインポート（月単位でCOPYによる一括ロード）"""
+    files = _find_result_files(year_month)
+    if not files:
+        logger.warning(f"Kファイルが存在しません: {year_month}")
         return 0
 
-    conn = get_db_connection()
-    total_count = 0
-
-    try:
-        # K*.TXTファイルを検索
-        pattern = os.path.join(extracted_dir, 'K*.TXT')
-        files = glob.glob(pattern, recursive=True)
-
-        if not files:
-            # 小文字も試す
-            pattern = os.path.join(extracted_dir, 'k*.txt')
-            files = glob.glob(pattern, recursive=True)
-
-        logger.info(f"処理対象ファイル数: {len(files)}")
-
-        for filepath in files:
-            payoffs = parse_payoffs_from_result_file(filepath)
+    logger.info(f"処理対象ファイル数: {len(files)}")
 
-            with conn.cursor() as cur:
-                for p in payoffs:
-                    try:
-                        cur.execute('''
-                            INSERT INTO historical_payoffs
-                            (race_date, stadium_code, race_no, bet_type, combination, payout, popularity)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (race_date, stadium_code, race_no, bet_type, combination)
-                            DO UPDATE SET payout = EXCLUDED.payout, popularity = EXCLUDED.popularity
-                        ''', (
-                            p['race_date'], p['stadium_code'], p['race_no'],
-                            p['bet_type'], p['combination'], p['payout'], p['popularity']
-                        ))
-                        total_count += 1
-                    except Exception as e:
-                        logger.warning(f"払戻金インポートエラー: {e}")
-                        continue
+    payoffs = []
+    for filepath in files:
+        try:
+            for name, text in iter_source_texts(filepath):
+                if name.upper().startswith('K'):
+                    payoffs.extend(parse_payoffs_from_result_file(name, text))
+        except OSError as e:
+            logger.error(f"ファイル読み込みエラー: {filepath} - {e}")
 
-            conn.commit()
+    conn = get_db_connection()
+    try:
+        result = bulk_upsert(conn, HISTORICAL_PAYOFFS, payoffs, label=f"払戻金 {year_month}")
+        conn.commit()
     finally:
         conn.close()
 
-    return total_count
+    return result.loaded
 
 
 def run_download(start_year=2005):
@@ -1143,11 +935,11 @@ def run_download(start_year=2005):
 
     # 競走結果のダウンロード
     pending = get_pending_months('download_results', start_year)
-    logger.info(f"競走結果ダウンロード対象: {len(pending)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN} ヶ月）")
+    logger.info(f"競走結果ダウンロード対象: {len(pending)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN or '無制限'} ヶ月）")
 
     for year_month in pending:
         # 月数制限チェック
-        if processed_count >= MAX_MONTHS_PER_RUN:
+        if MAX_MONTHS_PER_RUN and processed_count >= MAX_MONTHS_PER_RUN:
             logger.info(f"月数制限に達しました（{MAX_MONTHS_PER_RUN}ヶ月）。残りは次回実行時に処理します。")
             break
 
@@ -1170,7 +962,7 @@ def run_download(start_year=2005):
     program_processed = 0
     for year_month in pending_programs:
         # 番組表も同じ月数制限を適用
-        if program_processed >= MAX_MONTHS_PER_RUN:
+        if MAX_MONTHS_PER_RUN and program_processed >= MAX_MONTHS_PER_RUN:
             logger.info(f"番組表の月数制限に達しました（{MAX_MONTHS_PER_RUN}ヶ月）。残りは次回実行時に処理します。")
             break
 
@@ -1188,91 +980,66 @@ def run_download(start_year=2005):
 
 
 def run_import():
-    """インポート処理を実行（月数制限あり）"""
+    """インポート処理を実行（月数制限あり）
+
+    K/Bファイルのパースはプロセスプールで並列に行い（parse_pipeline）、
+    DBへの書き込みと進捗更新は月単位でこのプロセスが順に行う。
+    """
+    from parse_pipeline import iter_parsed_months
+
     init_progress_table()
     create_historical_tables()
     create_payoffs_table()  # 払戻金テーブルも作成
 
-    processed_count = 0
-
-    # === 競走結果のインポート ===
-    downloaded_dirs = []
-    if os.path.exists(RESULT_EXTRACTED_DIR):
-        downloaded_dirs = [d for d in os.listdir(RESULT_EXTRACTED_DIR)
-                         if os.path.isdir(os.path.join(RESULT_EXTRACTED_DIR, d))]
+    # 競走結果（＋払戻金）と番組表のダウンロード済み年月
+    downloaded_dirs = _list_months(RESULT_DOWNLOAD_DIR, RESULT_EXTRACTED_DIR)
+    program_dirs = _list_months(PROGRAM_DOWNLOAD_DIR, PROGRAM_EXTRACTED_DIR)
 
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(f'''
-                SELECT year_month FROM {PROGRESS_TABLE}
-                WHERE task_type = 'import_results' AND status = 'completed'
+                SELECT task_type, year_month FROM {PROGRESS_TABLE}
+                WHERE task_type IN ('import_results', 'import_programs') AND status = 'completed'
             ''')
-            imported = set(row[0] for row in cur.fetchall())
+            completed = set((row[0], row[1]) for row in cur.fetchall())
     finally:
         conn.close()
 
     # 新しい順（最新データを優先）
-    pending = [ym for ym in sorted(downloaded_dirs, reverse=True) if ym not in imported]
-    logger.info(f"競走結果インポート対象: {len(pending)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN} ヶ月）")
+    pending = [ym for ym in sorted(downloaded_dirs, reverse=True)
+               if ('import_results', ym) not in completed]
+    pending_programs = [ym for ym in sorted(program_dirs, reverse=True)
+                        if ('import_programs', ym) not in completed]
+    logger.info(f"競走結果インポート対象: {len(pending)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN or '無制限'} ヶ月）")
+    logger.info(f"番組表インポート対象: {len(pending_programs)} ヶ月")
 
-    for year_month in pending:
-        # 月数制限チェック
-        if processed_count >= MAX_MONTHS_PER_RUN:
+    # 月数制限（番組表も同じ月数制限を適用）
+    if MAX_MONTHS_PER_RUN:
+        if len(pending) > MAX_MONTHS_PER_RUN or len(pending_programs) > MAX_MONTHS_PER_RUN:
             logger.info(f"月数制限に達しました（{MAX_MONTHS_PER_RUN}ヶ月）。残りは次回実行時に処理します。")
-            break
-
-        logger.info(f"競走結果インポート開始: {year_month}")
-        update_progress('import_results', year_month, 'running')
-
-        try:
-            count = import_results_to_db(year_month)
-            update_progress('import_results', year_month, 'completed', count)
-            logger.info(f"競走結果インポート完了: {year_month} ({count} レコード)")
-            processed_count += 1
-        except Exception as e:
-            update_progress('import_results', year_month, 'failed', error_message=str(e))
-            logger.error(f"競走結果インポート失敗: {year_month} - {e}")
+        pending = pending[:MAX_MONTHS_PER_RUN]
+        pending_programs = pending_programs[:MAX_MONTHS_PER_RUN]
 
-    # === 番組表のインポート ===
-    program_dirs = []
-    if os.path.exists(PROGRAM_EXTRACTED_DIR):
-        program_dirs = [d for d in os.listdir(PROGRAM_EXTRACTED_DIR)
-                       if os.path.isdir(os.path.join(PROGRAM_EXTRACTED_DIR, d))]
+    units = [('import_results', ym, _find_result_files(ym)) for ym in pending]
+    units += [('import_programs', ym, _find_program_files(ym)) for ym in pending_programs]
 
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(f'''
-                SELECT year_month FROM {PROGRESS_TABLE}
-                WHERE task_type = 'import_programs' AND status = 'completed'
-            ''')
-            imported_programs = set(row[0] for row in cur.fetchall())
-    finally:
-        conn.close()
-
-    # 新しい順（最新データを優先）
-    pending_programs = [ym for ym in sorted(program_dirs, reverse=True) if ym not in imported_programs]
-    logger.info(f"番組表インポート対象: {len(pending_programs)} ヶ月")
-
-    program_processed = 0
-    for year_month in pending_programs:
-        # 番組表も同じ月数制限を適用
-        if program_processed >= MAX_MONTHS_PER_RUN:
-            logger.info(f"番組表の月数制限に達しました（{MAX_MONTHS_PER_RUN}ヶ月）。残りは次回実行時に処理します。")
-            break
-
-        logger.info(f"番組表インポート開始: {year_month}")
-        update_progress('import_programs', year_month, 'running')
+    for parsed in iter_parsed_months(units):
+        task_type, year_month = parsed.task_type, parsed.year_month
+        label = '競走結果' if task_type == 'import_results' else '番組表'
+        logger.info(f"{label}インポート開始: {year_month} ({parsed.files} ファイル)")
+        update_progress(task_type, year_month, 'running')
 
         try:
-            count = import_programs_to_db(year_month)
-            update_progress('import_programs', year_month, 'completed', count)
-            logger.info(f"番組表インポート完了: {year_month} ({count} レコード)")
-            program_processed += 1
+            if task_type == 'import_results':
+                count = save_results_to_db(year_month, parsed.results, parsed.payoffs)
+            else:
+                count = save_programs_to_db(parsed.programs, label=f"番組表 {year_month}")
+            update_progress(task_type, year_month, 'completed', count)
+            logger.info(f"{label}インポート完了: {year_month} ({count} レコード)")
         except Exception as e:
-            update_progress('import_programs', year_month, 'failed', error_message=str(e))
-            logger.error(f"番組表インポート失敗: {year_month} - {e}")
+            update_progress(task_type, year_month, 'failed', error_message=str(e))
+            logger.error(f"{label}インポート失敗: {year_month} - {e}")
 
 
 def run_import_payoffs():
@@ -1282,11 +1049,8 @@ def run_import_payoffs():
 
     processed_count = 0
 
-    # 解凍済みディレクトリを取得
-    downloaded_dirs = []
-    if os.path.exists(RESULT_EXTRACTED_DIR):
-        downloaded_dirs = [d for d in os.listdir(RESULT_EXTRACTED_DIR)
-                         if os.path.isdir(os.path.join(RESULT_EXTRACTED_DIR, d))]
+    # ダウンロード済みの年月を取得
+    downloaded_dirs = _list_months(RESULT_DOWNLOAD_DIR, RESULT_EXTRACTED_DIR)
 
     # 完了済みの年月を取得
     conn = get_db_connection()
@@ -1302,11 +1066,11 @@ def run_import_payoffs():
 
     # 未処理の年月を新しい順にソート（最新データを優先）
     pending = [ym for ym in sorted(downloaded_dirs, reverse=True) if ym not in imported]
-    logger.info(f"払戻金インポート対象: {len(pending)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN} ヶ月）")
+    logger.info(f"払戻金インポート対象: {len(pending)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN or '無制限'} ヶ月）")
 
     for year_month in pending:
         # 月数制限チェック
-        if processed_count >= MAX_MONTHS_PER_RUN:
+        if MAX_MONTHS_PER_RUN and processed_count >= MAX_MONTHS_PER_RUN:
             logger.info(f"月数制限に達しました（{MAX_MONTHS_PER_RUN}ヶ月）。残りは次回実行時に処理します。")
             break
 
@@ -1340,13 +1104,13 @@ def run_payoffs_only():
         return
 
     logger.info(f"=== 払戻金のみダウンロード＆インポート開始 ===")
-    logger.info(f"対象: {len(missing_months)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN} ヶ月）")
+    logger.info(f"対象: {len(missing_months)} ヶ月（今回の上限: {MAX_MONTHS_PER_RUN or '無制限'} ヶ月）")
 
     processed_count = 0
 
     for year_month in missing_months:
         # 月数制限チェック
-        if processed_count >= MAX_MONTHS_PER_RUN:
+        if MAX_MONTHS_PER_RUN and processed_count >= MAX_MONTHS_PER_RUN:
             logger.info(f"月数制限に達しました（{MAX_MONTHS_PER_RUN}ヶ月）。残りは次回実行時に処理します。")
             break
 
@@ -1527,20 +1291,14 @@ def run_date_range_import(start_date: str, end_date: str):
 
         logger.info(f"番組表ダウンロード: {target_date_str}")
 
-        # ダウンロード
-        downloaded = download_file(url, filepath)
+        # ダウンロード（当月分はキャッシュを再検証）
+        downloaded = download_file(url, filepath, max_age=recent_max_age(current_date.year, current_date.month))
         if downloaded:
-            output_dir = os.path.join(PROGRAM_EXTRACTED_DIR, ym)
-            extract_lzh(downloaded, output_dir)
-
-            # パースして保存
+            # メモリ上で解凍してパース・保存
             base_fn = f"B{yymm}{dd}.TXT"
-            txt_path = os.path.join(output_dir, base_fn)
-            if not os.path.exists(txt_path):
-                 txt_path = os.path.join(output_dir, base_fn.lower())
+            programs = parse_b_file(downloaded)
 
-            if os.path.exists(txt_path):
-                programs = parse_program_file(txt_path)
+            if programs:
                 count = save_programs_to_db(programs)
                 logger.info(f"{target_date_str} 番組表: {count}件保存")
             else:
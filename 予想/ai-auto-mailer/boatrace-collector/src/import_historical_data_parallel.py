@@ -18,18 +18,12 @@ import psycopg2
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-import subprocess
 import time
 import re
 import struct
 import io
 
-# lhafileライブラリ（-lh5-圧縮対応）
-try:
-    import lhafile
-    HAS_LHAFILE = True
-except ImportError:
-    HAS_LHAFILE = False
+from lzh_archive import extract_lzh_to_dir
 
 # ログ設定
 logging.basicConfig(
@@ -38,9 +32,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-if not HAS_LHAFILE:
-    logger.warning("lhafileライブラリがインストールされていません。pip install lhafile を実行してください。")
-
 # データベース接続
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
@@ -179,30 +170,8 @@ def download_file(url, filepath, max_retries=3):
 
 
 def extract_lzh(lzh_path, output_dir):
-    """LZHファイルを解凍"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    if HAS_LHAFILE:
-        try:
-            with lhafile.LhaFile(lzh_path) as lha:
-                for name in lha.namelist():
-                    data = lha.read(name)
-                    output_path = os.path.join(output_dir, name)
-                    with open(output_path, 'wb') as f:
-                        f.write(data)
-            return True
-        except Exception as e:
-            logger.warning(f"lhafile解凍失敗 ({lzh_path}): {e}")
-    
-    # フォールバック: lhaコマンド
-    try:
-        subprocess.run(['lha', '-xw=' + output_dir, lzh_path], 
-                      check=True, capture_output=True)
-        return True
-    except Exception as e:
-        logger.warning(f"lhaコマンド解凍失敗 ({lzh_path}): {e}")
-    
-    return False
+    """LZHファイルを解凍（lzh_archive でメモリ上に展開して書き出す）"""
+    return extract_lzh_to_dir(lzh_path, output_dir) > 0
 
 
 def download_single_day(args):
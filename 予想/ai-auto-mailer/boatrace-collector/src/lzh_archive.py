@@ -0,0 +1,145 @@
+"""
+LZHアーカイブのメモリ上展開
+
+公式サイトのK/Bファイル・期別成績（fan*.lzh）はLZH形式で配布されている。
+ダウンロードしたバイト列をそのままメモリ上で展開し、(ファイル名, 本文バイト列) を返す。
+外部コマンド（lha / unar / 7z）は起動しない。
+ファイル単位で読むツール向けに、展開結果をディレクトリへ書き出す extract_lzh_to_dir も用意している。
+
+- -lh5- / -lh6- / -lh7- は lhafile ライブラリで展開
+- lhafile が使えない場合は無圧縮（-lh0-）のみ自前で展開
+"""
+
+import io
+import os
+import struct
+import logging
+from typing import Iterator, List, Tuple
+
+# lhafileライブラリ（-lh5-圧縮対応）
+try:
+    import lhafile
+    HAS_LHAFILE = True
+except ImportError:
+    HAS_LHAFILE = False
+
+logger = logging.getLogger(__name__)
+
+if not HAS_LHAFILE:
+    logger.warning("lhafileライブラリがインストールされていません。pip install lhafile を実行してください。")
+
+
+def _member_basename(filename: str) -> str:
+    """アーカイブ内のパスからディレクトリ部分を除去"""
+    return os.path.basename(filename.replace('\\', '/'))
+
+
+def iter_lzh_members(data: bytes, name: str = '') -> Iterator[Tuple[str, bytes]]:
+    """
+    LZHアーカイブをメモリ上で展開
+
+    Args:
+        data: アーカイブのバイト列
+        name: ログ用のアーカイブ名
+
+    Yields:
+        (ファイル名, 本文バイト列)。ファイル名はディレクトリ部分を除いたもの
+    """
+    if HAS_LHAFILE:
+        try:
+            # LhaFileオブジェクトにはclose()メソッドがないため、明示的なクローズは不要
+            lzh = lhafile.Lhafile(io.BytesIO(data))
+            infos = lzh.infolist()
+        except Exception as e:
+            logger.warning(f"lhafile解凍エラー: {name} - {e}")
+            # フォールバックとして手動パースを試みる
+        else:
+            for info in infos:
+                basename = _member_basename(info.filename)
+                if not basename:
+                    continue
+                try:
+                    member = lzh.read(info.filename)
+                except Exception as e:
+                    logger.warning(f"ファイル解凍エラー: {basename} - {e}")
+                    continue
+                yield basename, member
+            return
+
+    yield from _iter_lh0_members(data)
+
+
+def _iter_lh0_members(data: bytes) -> Iterator[Tuple[str, bytes]]:
+    """無圧縮（-lh0-）のメンバーのみを展開（lhafileが使えない場合の手動パース）"""
+    pos = 0
+    while pos + 21 < len(data):
+        header_size = data[pos]
+        if header_size == 0:
+            break
+
+        # 圧縮方式（-lh0-, -lh5-等）
+        method = data[pos + 2:pos + 7].decode('ascii', errors='ignore')
+        # 圧縮後サイズ
+        compressed_size = struct.unpack('<I', data[pos + 7:pos + 11])[0]
+        # ファイル名長
+        name_length = data[pos + 21]
+        filename = data[pos + 22:pos + 22 + name_length].decode('shift_jis', errors='ignore')
+
+        # データ部分の範囲（ヘッダー全体のサイズ = header_size + 2）
+        data_start = pos + header_size + 2
+        data_end = data_start + compressed_size
+        if data_end > len(data):
+            break
+
+        basename = _member_basename(filename)
+        if method == '-lh0-':
+            if basename:
+                yield basename, data[data_start:data_end]
+        else:
+            # -lh5-等の圧縮形式はlhafileがないと対応できない
+            logger.warning(f"未対応の圧縮形式（lhafileが必要）: {method} - {filename}")
+
+        pos = data_end
+
+
+def read_lzh_members(filepath: str) -> List[Tuple[str, bytes]]:
+    """
+    保存済みのLZHファイルを読み込んでメモリ上で展開
+
+    Args:
+        filepath: LZHファイルのパス
+
+    Returns:
+        (ファイル名, 本文バイト列) のリスト（失敗時は空リスト）
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        return list(iter_lzh_members(data, os.path.basename(filepath)))
+    except Exception as e:
+        logger.error(f"解凍エラー: {filepath} - {e}")
+        return []
+
+
+def extract_lzh_to_dir(filepath: str, output_dir: str) -> int:
+    """
+    LZHファイルを展開してディレクトリに書き出す
+
+    ファイル単位で読むツール（期別成績のインポート等）向け。
+
+    Args:
+        filepath: LZHファイルのパス
+        output_dir: 書き出し先ディレクトリ
+
+    Returns:
+        書き出したファイル数
+    """
+    members = read_lzh_members(filepath)
+    if not members:
+        return 0
+
+    os.makedirs(output_dir, exist_ok=True)
+    for basename, member in members:
+        with open(os.path.join(output_dir, basename), 'wb') as out_f:
+            out_f.write(member)
+    return len(members)
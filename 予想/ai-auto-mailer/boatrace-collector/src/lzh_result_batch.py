@@ -8,13 +8,14 @@ LZHファイルからの結果取得バッチ処理
 import os
 import sys
 import logging
-import requests
 import psycopg2
 import re
-import lhafile
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict
 
+from lzh_archive import read_lzh_members
+from download_cache import fetch_to, recent_max_age
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -28,91 +29,31 @@ JST = timezone(timedelta(hours=9))
 # ダウンロード先ディレクトリ
 BASE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
 RESULT_DOWNLOAD_DIR = os.path.join(BASE_DIR, 'race_results_lzh')
-RESULT_EXTRACTED_DIR = os.path.join(BASE_DIR, 'race_results')
 
 # 公式サイトのURL
 RESULT_BASE_URL = "https://www1.mbrace.or.jp/od2/K"
 
 
-def download_file(url: str, filepath: str, max_retries: int = 3) -> Optional[str]:
+def download_file(url: str, filepath: str, max_retries: int = 3,
+                  max_age: Optional[float] = None) -> Optional[str]:
     """
     指定されたURLからファイルをダウンロード
-    """
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=60)
-
-            if response.status_code == 200:
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                logger.info(f"ダウンロード完了: {os.path.basename(filepath)} ({len(response.content)} bytes)")
-                return filepath
-            elif response.status_code == 404:
-                logger.info(f"ファイルが存在しません: {url}")
-                return None
-            else:
-                logger.warning(f"ダウンロード失敗: {url} (HTTP {response.status_code})")
-
-        except Exception as e:
-            logger.warning(f"ダウンロードエラー (試行 {attempt + 1}/{max_retries}): {url} - {e}")
-
-    return None
-
 
-def extract_lzh(filepath: str, output_dir: str) -> Optional[str]:
+    download_cache 経由で取得する（取得済みのURLはネットワークに出ない。
+    max_age を指定した場合はキャッシュを再検証する）。
     """
-    LZHファイルを解凍（Pythonライブラリを使用）
-    """
-    if not filepath or not os.path.exists(filepath):
-        return None
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    try:
-        # lhafileライブラリで解凍（コンテキストマネージャ非対応）
-        lha = lhafile.Lhafile(filepath)
-        extracted_count = 0
-
-        for info in lha.infolist():
-            # ファイル名を取得
-            filename = info.filename
-            # パスの区切り文字を正規化
-            if '\\' in filename:
-                filename = filename.replace('\\', '/')
-            # ディレクトリ部分を除去してファイル名のみ取得
-            basename = os.path.basename(filename)
-            if not basename:
-                continue
-
-            # ファイルを解凍
-            try:
-                output_path = os.path.join(output_dir, basename)
-                with open(output_path, 'wb') as f:
-                    f.write(lha.read(info.filename))
-                extracted_count += 1
-                logger.debug(f"解凍: {basename}")
-            except Exception as e:
-                logger.warning(f"ファイル解凍エラー: {basename} - {e}")
-
-        if extracted_count > 0:
-            logger.info(f"解凍完了: {os.path.basename(filepath)} ({extracted_count}ファイル)")
-            return output_dir
-        else:
-            logger.warning(f"解凍ファイルなし: {os.path.basename(filepath)}")
-            return None
-
-    except Exception as e:
-        logger.error(f"解凍エラー: {os.path.basename(filepath)} - {e}")
-        return None
+    return fetch_to(url, filepath, retries=max_retries, max_age=max_age)
 
 
 def download_race_results_for_date(target_date: datetime) -> Optional[str]:
     """
-    指定日の競走成績LZHファイルをダウンロード・解凍
+    指定日の競走成績LZHファイルをダウンロード
+
+    解凍はパース時にメモリ上で行う（解凍先ディレクトリには書き出さない）。
+    ダウンロードしたLZHはバックフィルの取得済み判定に使うため保存しておく。
 
     Returns:
-        解凍先ディレクトリのパス、失敗時はNone
+        LZHファイルのパス、失敗時はNone
     """
     year = target_date.year
     month = target_date.month
@@ -128,16 +69,11 @@ def download_race_results_for_date(target_date: datetime) -> Optional[str]:
 
     logger.info(f"LZHファイルダウンロード: {url}")
 
-    downloaded = download_file(url, filepath)
-    if downloaded:
-        output_dir = os.path.join(RESULT_EXTRACTED_DIR, yyyymm)
-        extracted = extract_lzh(downloaded, output_dir)
-        return extracted
+    # 当月分は公開後に差し替わることがあるためキャッシュを再検証
+    return download_file(url, filepath, max_age=recent_max_age(year, month))
 
-    return None
 
-
-def parse_result_file(filepath: str) -> List[Dict]:
+def parse_result_file(filepath: str, text: Optional[str] = None) -> List[Dict]:
     """
     レース結果ファイル（Kファイル）をパース
 
@@ -150,11 +86,10 @@ def parse_result_file(filepath: str) -> List[Dict]:
     results = []
 
     try:
-        with open(filepath, 'rb') as f:
-            content = f.read()
-
-        # Shift-JISでデコード
-        text = content.decode('shift_jis', errors='ignore')
+        # Shift-JISでデコード（解凍済みの本文が渡された場合はそれを使う）
+        if text is None:
+            with open(filepath, 'rb') as f:
+                text = f.read().decode('shift_jis', errors='ignore')
         lines = text.replace('\r', '').split('\n')
 
         # ファイル名から日付を取得 (K260123.TXT -> 20260123)
@@ -362,36 +297,29 @@ def process_single_date(target_date: datetime, database_url: str) -> Dict:
     """
     logger.info(f"対象日: {target_date.strftime('%Y-%m-%d')}")
 
-    # LZHファイルをダウンロード・解凍
-    extracted_dir = download_race_results_for_date(target_date)
+    # LZHファイルをダウンロード
+    lzh_path = download_race_results_for_date(target_date)
 
-    if not extracted_dir:
+    if not lzh_path:
         logger.warning(f"LZHファイルのダウンロードに失敗: {target_date.strftime('%Y-%m-%d')}")
         return {'date': target_date.strftime('%Y-%m-%d'), 'saved_count': 0, 'status': 'download_failed'}
 
-    # 解凍されたファイルを探す
+    # メモリ上で解凍し、結果ファイルを探す（大文字小文字の違いを考慮）
     yymm = f"{target_date.year % 100:02d}{target_date.month:02d}"
     dd = f"{target_date.day:02d}"
     result_filename = f"K{yymm}{dd}.TXT"
-    result_filepath = os.path.join(extracted_dir, result_filename)
-
-    # 大文字小文字の違いを考慮
-    if not os.path.exists(result_filepath):
-        result_filepath = os.path.join(extracted_dir, result_filename.lower())
-
-    if not os.path.exists(result_filepath):
-        # ディレクトリ内のファイルを探す
-        for f in os.listdir(extracted_dir):
-            if f.upper() == result_filename:
-                result_filepath = os.path.join(extracted_dir, f)
-                break
+    content = None
+    for name, member in read_lzh_members(lzh_path):
+        if name.upper() == result_filename:
+            content = member
+            break
 
-    if not os.path.exists(result_filepath):
+    if content is None:
         logger.warning(f"結果ファイルが見つかりません: {result_filename}")
         return {'date': target_date.strftime('%Y-%m-%d'), 'saved_count': 0, 'status': 'file_not_found'}
 
     # ファイルをパース
-    results = parse_result_file(result_filepath)
+    results = parse_result_file(result_filename, content.decode('shift_jis', errors='ignore'))
 
     if not results:
         logger.warning(f"パース結果が空です: {target_date.strftime('%Y-%m-%d')}")
@@ -0,0 +1,229 @@
+"""
+AI予想モデルのレジストリ（プロセス内キャッシュ＋ホットリロード）
+
+models/ 以下のモデルファイルをプロセスごとに1回だけ読み込み、複数バージョンをメモリに保持する。
+新しいファイルが置かれた・更新された場合は、次の参照時に読み込んでから差し替える
+（読み込み中も参照側は古いモデルをそのまま使える）。
+
+- ファイル名: boatrace_ai_<バージョン>.pkl（pickle）または .txt（LightGBM の save_model 形式）
+- 読み込みに失敗したファイル（書き込み途中など）は、更新時刻が変わるまで再試行しない
+- 保持するのは既定バージョンと、更新時刻が新しい順に MAX_LOADED_VERSIONS 件まで
+
+使用例:
+    from model_registry import predict
+    predictions = predict([('20261017', '01', 12)])
+"""
+
+import os
+import re
+import time
+import pickle
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
+MODEL_FILE_PATTERN = re.compile(r'^boatrace_ai_(?P<version>v[\w.\-]+?)\.(?P<ext>pkl|txt)$')
+
+# 予想に使う既定のバージョン
+DEFAULT_VERSION = os.environ.get('AI_MODEL_VERSION', 'v1.0')
+# メモリに保持するバージョン数（既定バージョンを除く）
+MAX_LOADED_VERSIONS = int(os.environ.get('AI_MODEL_MAX_VERSIONS', '3'))
+# models/ の更新を確認する間隔（秒）
+RELOAD_INTERVAL = float(os.environ.get('AI_MODEL_RELOAD_INTERVAL', '30'))
+
+
+class LoadedModel:
+    """読み込み済みのモデル"""
+
+    def __init__(self, version: str, path: str, mtime: float, model):
+        self.version = version
+        self.path = path
+        self.mtime = mtime
+        self.model = model
+        self.loaded_at = time.time()
+
+
+def _load_file(path: str):
+    """モデルファイルを読み込む"""
+    if path.endswith('.txt'):
+        import lightgbm as lgb
+        return lgb.Booster(model_file=path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class ModelRegistry:
+    """モデルのバージョン管理とホットリロード"""
+
+    def __init__(self, model_dir: str = MODEL_DIR, default_version: str = DEFAULT_VERSION,
+                 max_versions: int = MAX_LOADED_VERSIONS, reload_interval: float = RELOAD_INTERVAL):
+        self.model_dir = model_dir
+        self.default_version = default_version
+        self.max_versions = max_versions
+        self.reload_interval = reload_interval
+
+        # 参照側はロックを取らずにこの辞書を読む。更新時は辞書ごと差し替える
+        self._models: Dict[str, LoadedModel] = {}
+        # 読み込みに失敗したファイルの (パス, 更新時刻)
+        self._failed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+
+    def _scan(self) -> Dict[str, Tuple[str, float]]:
+        """models/ のモデルファイルを列挙（バージョン -> (パス, 更新時刻)）"""
+        found: Dict[str, Tuple[str, float]] = {}
+        if not os.path.isdir(self.model_dir):
+            return found
+        for name in os.listdir(self.model_dir):
+            match = MODEL_FILE_PATTERN.match(name)
+            if not match:
+                continue
+            path = os.path.join(self.model_dir, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            version = match.group('version')
+            # 同じバージョンに .pkl と .txt がある場合は新しい方
+            if version not in found or mtime > found[version][1]:
+                found[version] = (path, mtime)
+        return found
+
+    def refresh(self, force: bool = False):
+        """
+        models/ を確認し、追加・更新されたモデルを読み込んで差し替える
+
+        別スレッドが読み込み中の場合は待たずに戻る（参照側は読み込み済みのモデルを使う）。
+        まだ1つも読み込んでいない場合と force の場合は読み込みの完了を待つ。
+
+        Args:
+            force: Trueの場合は確認間隔に関係なく確認する
+        """
+        now = time.time()
+        if not force and now - self._checked_at < self.reload_interval:
+            return
+
+        if not self._lock.acquire(blocking=force or not self._models):
+            return
+        try:
+            if not force and now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+
+            found = self._scan()
+            newest = sorted(found, key=lambda v: found[v][1], reverse=True)[:self.max_versions]
+            wanted = set(newest)
+            if self.default_version in found:
+                wanted.add(self.default_version)
+
+            current = self._models
+            models: Dict[str, LoadedModel] = {}
+            for version in wanted:
+                path, mtime = found[version]
+                loaded = current.get(version)
+                if loaded and loaded.path == path and loaded.mtime == mtime:
+                    models[version] = loaded
+                    continue
+                if self._failed.get(path) == mtime:
+                    if loaded:
+                        models[version] = loaded
+                    continue
+                try:
+                    models[version] = LoadedModel(version, path, mtime, _load_file(path))
+                    self._failed.pop(path, None)
+                    logger.info(f"モデル読み込み: {version} ({os.path.basename(path)})")
+                except Exception as e:
+                    self._failed[path] = mtime
+                    logger.warning(f"モデル読み込みエラー: {path} - {e}")
+                    if loaded:
+                        models[version] = loaded
+
+            self._models = models
+        finally:
+            self._lock.release()
+
+    def get(self, version: Optional[str] = None):
+        """
+        モデルを取得
+
+        Args:
+            version: バージョン（省略時は既定バージョン）
+
+        Returns:
+            モデル（見つからない場合は None）
+        """
+        self.refresh()
+        loaded = self._models.get(version or self.default_version)
+        return loaded.model if loaded else None
+
+    def versions(self) -> List[Dict]:
+        """読み込み済みのバージョン一覧"""
+        return [
+            {
+                'version': m.version,
+                'file': os.path.basename(m.path),
+                'loaded_at': m.loaded_at,
+                'default': m.version == self.default_version,
+            }
+            for m in sorted(self._models.values(), key=lambda m: m.mtime, reverse=True)
+        ]
+
+    def predict(self, race_keys: Iterable[Tuple[str, str, int]], version: Optional[str] = None,
+                database_url: Optional[str] = None) -> Dict[Tuple[str, str, int], Dict]:
+        """
+        指定レースの予想を生成（DBへの保存は行わない）
+
+        Args:
+            race_keys: (レース日 YYYYMMDD, 場コード, R番号) の iterable
+            version: モデルのバージョン（省略時は既定バージョン）
+            database_url: 出走表を読むDB（省略時は環境変数）
+
+        Returns:
+            {(レース日, 場コード, R番号): 予想}。6艇揃っていないレースは含まない
+        """
+        from psycopg2.extras import RealDictCursor
+        from db_pool import get_connection
+        from ai_prediction_batch import fetch_program_rows, predict_races
+
+        model = self.get(version)
+        if model is None:
+            logger.error(f"モデルがありません: {version or self.default_version}")
+            return {}
+
+        races_by_date: Dict[str, List[Tuple[str, int]]] = {}
+        for race_date, stadium_code, race_no in race_keys:
+            races_by_date.setdefault(race_date, []).append((stadium_code, int(race_no)))
+
+        predictions = {}
+        conn = get_connection(database_url, cursor_factory=RealDictCursor)
+        try:
+            cur = conn.cursor()
+            for race_date, races in races_by_date.items():
+                for race, prediction in predict_races(model, fetch_program_rows(cur, race_date, races)):
+                    predictions[(race_date, race['stadium_code'], int(race['race_no']))] = prediction
+        finally:
+            conn.close()
+        return predictions
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """プロセス共通のレジストリ"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
+
+
+def predict(race_keys: Iterable[Tuple[str, str, int]], version: Optional[str] = None,
+            database_url: Optional[str] = None) -> Dict[Tuple[str, str, int], Dict]:
+    """プロセス共通のレジストリで予想を生成（ModelRegistry.predict を参照）"""
+    return get_registry().predict(race_keys, version, database_url)
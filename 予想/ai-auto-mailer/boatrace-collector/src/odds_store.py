@@ -0,0 +1,671 @@
+"""
+オッズ時系列（odds_history）のストレージ
+
+締切前は5〜10秒ごとに全組み合わせのオッズを書き込むため、odds_history は
+数億行規模まで増える。そのため以下の形で保存する。
+
+- race_date による月単位のレンジパーティション（odds_history_pYYYYMM）
+- 場コード・オッズ種別・買い目は smallint のコードで保存
+    - 場コード: '01' -> 1
+    - オッズ種別: ODDS_TYPES の順に 1, 2, ...（'win' -> 1, '2t' -> 3 等）
+    - 買い目: 数字を連結（'1-3' / '1=3' -> 13, '1' -> 1）
+- 最新値検索用のカバリングインデックス
+  (race_date, stadium_code, race_number, odds_type, combination, scraped_at DESC) INCLUDE (odds_value)
+- 保持期間（ODDS_RETENTION_MONTHS）を過ぎた月は odds_history_rollup に
+  レース×種別×買い目ごとの始値・終値・最小・最大へ集約してからパーティションを削除
+- 最新値は odds_latest（レース×種別×買い目ごとに1行）に書き込み時に同じトランザクションで
+  UPSERT する。最新オッズの参照は履歴をソートせず odds_latest の主キーで引く
+- 締切前の高頻度収集ではほとんどの買い目が前回と同じ値のため、odds_history / odds_latest には
+  odds_latest の値から変わった買い目だけを書く（filter_changed_odds）。比較は書き込みと同じ
+  トランザクションでDB上の odds_latest に対して行うため、Workerと Cron Job が同じレースを
+  書いても最新値は遅れない。ある時刻のオッズは「その時刻以前の最後の行」で復元できる。
+  取得した時刻は odds_ticks（レースごとに取得1回につき1行、変わった買い目の数つき）に
+  残すので時間分解能は落ちない。値が同じでも ODDS_KEYFRAME_SECONDS ごとに書き直す
+
+3連単（120通り）・3連複（20通り）は1回の取得を odds_vectors の1行に保存する。
+オッズは VECTOR_COMBINATIONS の順に並べた REAL[] で、発売なし・取得できない買い目は NULL。
+Pythonからは decode_odds_vector() / load_latest_vector_odds()、SQLからは
+unnest(odds, odds_vector_combinations(odds_type)) で買い目ごとに展開する。
+
+読み出し側はDB関数 odds_type_code() / odds_type_name() / odds_combination_code() /
+odds_combination_text() で変換する（ダッシュボードからも同じ関数を使う）。
+
+使用方法:
+  python odds_store.py migrate    - 旧形式の odds_history を odds_history_legacy にリネームし、
+                                    パーティションへ移行
+  python odds_store.py retention  - 保持期間を過ぎたパーティションを集約して削除
+"""
+
+import os
+import sys
+import logging
+import threading
+from datetime import date, datetime
+from itertools import combinations, permutations
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# オッズ種別（コードは 1 始まりの添字）
+ODDS_TYPES = ('win', 'place', '2t', '2f', '3t', '3f')
+ODDS_TYPE_CODES = {name: i + 1 for i, name in enumerate(ODDS_TYPES)}
+
+# 1回の取得を配列1行で保存するオッズ種別と、配列の並び順の買い目（'1-2-3' 形式）
+VECTOR_COMBINATIONS = {
+    '3t': tuple('-'.join(map(str, c)) for c in permutations(range(1, 7), 3)),
+    '3f': tuple('-'.join(map(str, c)) for c in combinations(range(1, 7), 3)),
+}
+VECTOR_ODDS_TYPES = tuple(VECTOR_COMBINATIONS)
+_VECTOR_INDEX = {
+    odds_type: {combo: i for i, combo in enumerate(combos)}
+    for odds_type, combos in VECTOR_COMBINATIONS.items()
+}
+
+# 生データを保持する月数（それより古い月は集約して削除）
+ODDS_RETENTION_MONTHS = int(os.environ.get('ODDS_RETENTION_MONTHS', '6'))
+
+# 値が変わっていなくても買い目を書き直す間隔（秒）
+ODDS_KEYFRAME_SECONDS = int(os.environ.get('ODDS_KEYFRAME_SECONDS', '300'))
+
+# パーティション作成の排他用（pg_advisory_xact_lock のキー）
+_PARTITION_LOCK_KEY = 'odds_history_partitions'
+
+# 作成済みパーティション（プロセス内キャッシュ）
+_known_partitions: Set[str] = set()
+_storage_ready = False
+_lock = threading.Lock()
+
+
+def encode_stadium(stadium_code) -> int:
+    """場コードをコード化（'01' -> 1）"""
+    return int(stadium_code)
+
+
+def encode_odds_type(odds_type: str) -> int:
+    """オッズ種別をコード化（'2t' -> 3）"""
+    return ODDS_TYPE_CODES[odds_type]
+
+
+def encode_combination(combination: str) -> int:
+    """買い目をコード化（'1-3' / '1=3' -> 13）"""
+    return int(''.join(c for c in combination if c.isdigit()))
+
+
+def vector_index(odds_type: str, combination: str) -> Optional[int]:
+    """
+    買い目の配列内の位置（'3t': '1-2-3' -> 0）
+
+    3連複は艇番の順序を問わない（'3=1=2' も '1-2-3' と同じ位置）。該当しなければ None。
+    """
+    boats = [c for c in combination if c.isdigit()]
+    if odds_type == '3f':
+        boats.sort()
+    return _VECTOR_INDEX[odds_type].get('-'.join(boats))
+
+
+def encode_odds_vector(odds_type: str, odds: Dict[str, float]) -> List[Optional[float]]:
+    """
+    買い目 -> オッズ を VECTOR_COMBINATIONS の順の配列にする（ない買い目は None）
+
+    Args:
+        odds_type: '3t' / '3f'
+        odds: 買い目（'1-2-3' / '1=2=3' 等）-> オッズ
+    """
+    vector = [None] * len(VECTOR_COMBINATIONS[odds_type])
+    for combination, value in odds.items():
+        index = vector_index(odds_type, combination)
+        if index is not None:
+            vector[index] = value
+    return vector
+
+
+def decode_odds_vector(odds_type: str, vector: Sequence[Optional[float]]) -> Dict[str, float]:
+    """配列を 買い目（'1-2-3' 形式）-> オッズ に戻す（None の買い目は含めない）"""
+    return {
+        combination: float(value)
+        for combination, value in zip(VECTOR_COMBINATIONS[odds_type], vector)
+        if value is not None
+    }
+
+
+def decode_odds_type(code: int) -> str:
+    """コードからオッズ種別を復元"""
+    return ODDS_TYPES[code - 1]
+
+
+def decode_combination(code: int) -> str:
+    """コードから買い目を復元（13 -> '1-3'）"""
+    return '-'.join(str(code))
+
+
+def _first(row):
+    """1列目の値（RealDictCursor / 通常カーソルの両方に対応）"""
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _month_start(value) -> date:
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        digits = value.replace('-', '')
+        value = date(int(digits[:4]), int(digits[4:6]), 1)
+    return value.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """月のパーティション名（odds_history_p202610）"""
+    return f"odds_history_p{month.year:04d}{month.month:02d}"
+
+
+def _function_ddl() -> List[str]:
+    """コード変換用のDB関数（ODDS_TYPES から生成）"""
+    type_cases = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in ODDS_TYPE_CODES.items())
+    type_names = ', '.join(f"'{name}'" for name in ODDS_TYPES)
+    vector_cases = ' '.join(
+        f"WHEN {ODDS_TYPE_CODES[name]} THEN ARRAY[{', '.join(repr(c) for c in combos)}]"
+        for name, combos in VECTOR_COMBINATIONS.items()
+    )
+    return [
+        f"""
+        CREATE OR REPLACE FUNCTION odds_type_code(t text) RETURNS smallint
+        LANGUAGE sql IMMUTABLE AS $$ SELECT (CASE t {type_cases} END)::smallint $$
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION odds_type_name(c smallint) RETURNS text
+        LANGUAGE sql IMMUTABLE AS $$ SELECT (ARRAY[{type_names}])[c] $$
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION odds_vector_combinations(c smallint) RETURNS text[]
+        LANGUAGE sql IMMUTABLE AS $$ SELECT (CASE c {vector_cases} END)::text[] $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION odds_combination_code(c text) RETURNS smallint
+        LANGUAGE sql IMMUTABLE AS $$ SELECT NULLIF(regexp_replace(c, '[^0-9]', '', 'g'), '')::smallint $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION odds_combination_text(c smallint) RETURNS text
+        LANGUAGE sql IMMUTABLE AS $$ SELECT array_to_string(regexp_split_to_array(c::text, ''), '-') $$
+        """,
+    ]
+
+
+def ensure_odds_storage(conn):
+    """
+    odds_history（パーティション親テーブル）と関連オブジェクトを作成/確認
+
+    旧形式の非パーティションテーブルが残っている場合は RuntimeError を送出する
+    （リネームと移行は `python odds_store.py migrate` で明示的に行う）。
+    プロセス内で一度だけ実行され、コミットまで行う。
+    """
+    global _storage_ready
+    with _lock:
+        if _storage_ready:
+            return
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (_PARTITION_LOCK_KEY,))
+            if _is_legacy_table(cur):
+                conn.rollback()
+                raise RuntimeError("旧形式（非パーティション）の odds_history が残っています。"
+                                   "python odds_store.py migrate で移行してから起動してください")
+
+            for ddl in _function_ddl():
+                cur.execute(ddl)
+
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS odds_history (
+                    race_date DATE NOT NULL,
+                    stadium_code SMALLINT NOT NULL,
+                    race_number SMALLINT NOT NULL,
+                    odds_type SMALLINT NOT NULL,
+                    combination SMALLINT NOT NULL,
+                    odds_value REAL,
+                    odds_min REAL,
+                    odds_max REAL,
+                    scraped_at TIMESTAMPTZ NOT NULL,
+                    minutes_to_deadline SMALLINT
+                ) PARTITION BY RANGE (race_date)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_odds_history_latest
+                ON odds_history (race_date, stadium_code, race_number, odds_type, combination, scraped_at DESC)
+                INCLUDE (odds_value)
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS odds_history_rollup (
+                    race_date DATE NOT NULL,
+                    stadium_code SMALLINT NOT NULL,
+                    race_number SMALLINT NOT NULL,
+                    odds_type SMALLINT NOT NULL,
+                    combination SMALLINT NOT NULL,
+                    first_odds REAL,
+                    last_odds REAL,
+                    min_odds REAL,
+                    max_odds REAL,
+                    samples INTEGER NOT NULL,
+                    last_scraped_at TIMESTAMPTZ,
+                    PRIMARY KEY (race_date, stadium_code, race_number, odds_type, combination)
+                )
+            """)
+
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS odds_vectors (
+                    race_date DATE NOT NULL,
+                    stadium_code SMALLINT NOT NULL,
+                    race_number SMALLINT NOT NULL,
+                    odds_type SMALLINT NOT NULL,
+                    scraped_at TIMESTAMPTZ NOT NULL,
+                    minutes_to_deadline SMALLINT,
+                    odds REAL[] NOT NULL,
+                    PRIMARY KEY (race_date, stadium_code, race_number, odds_type, scraped_at)
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS odds_ticks (
+                    race_date DATE NOT NULL,
+                    stadium_code SMALLINT NOT NULL,
+                    race_number SMALLINT NOT NULL,
+                    scraped_at TIMESTAMPTZ NOT NULL,
+                    minutes_to_deadline SMALLINT,
+                    changed SMALLINT NOT NULL,
+                    PRIMARY KEY (race_date, stadium_code, race_number, scraped_at)
+                )
+            """)
+
+            cur.execute("SELECT to_regclass('odds_latest') IS NOT NULL")
+            latest_exists = _first(cur.fetchone())
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS odds_latest (
+                    race_date DATE NOT NULL,
+                    stadium_code SMALLINT NOT NULL,
+                    race_number SMALLINT NOT NULL,
+                    odds_type SMALLINT NOT NULL,
+                    combination SMALLINT NOT NULL,
+                    odds_value REAL,
+                    odds_min REAL,
+                    odds_max REAL,
+                    scraped_at TIMESTAMPTZ NOT NULL,
+                    minutes_to_deadline SMALLINT,
+                    PRIMARY KEY (race_date, stadium_code, race_number, odds_type, combination)
+                )
+            """)
+            if not latest_exists:
+                # 作成直後は前日以降の履歴から最新値を作っておく
+                cur.execute("""
+                    INSERT INTO odds_latest
+                    SELECT DISTINCT ON (race_date, stadium_code, race_number, odds_type, combination)
+                           race_date, stadium_code, race_number, odds_type, combination,
+                           odds_value, odds_min, odds_max, scraped_at, minutes_to_deadline
+                    FROM odds_history
+                    WHERE race_date >= CURRENT_DATE - 1
+                    ORDER BY race_date, stadium_code, race_number, odds_type, combination, scraped_at DESC
+                """)
+
+            # 当月と翌月のパーティションは常に用意しておく（日付をまたぐ収集に備える）
+            this_month = _month_start(date.today())
+            for month in (this_month, _next_month(this_month)):
+                _create_partition(cur, month)
+
+        conn.commit()
+        _storage_ready = True
+        logger.info("オッズテーブルを作成/確認しました")
+
+
+def _is_legacy_table(cur) -> bool:
+    """odds_history が旧形式の非パーティションテーブル（relkind 'r'）か"""
+    cur.execute("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'odds_history' AND n.nspname = current_schema()
+    """)
+    row = cur.fetchone()
+    return bool(row) and _first(row) == 'r'
+
+
+def rename_legacy_table(conn) -> bool:
+    """
+    旧形式の odds_history を odds_history_legacy にリネーム
+
+    Returns:
+        リネームした場合True（旧形式のテーブルがない場合はFalse）
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (_PARTITION_LOCK_KEY,))
+        if not _is_legacy_table(cur):
+            conn.rollback()
+            return False
+        cur.execute("ALTER TABLE odds_history RENAME TO odds_history_legacy")
+    conn.commit()
+    logger.info("旧形式のodds_historyをodds_history_legacyにリネームしました")
+    return True
+
+
+def ensure_partitions(conn, race_dates: Iterable):
+    """
+    指定日付を含む月のパーティションを作成（作成済みならなにもしない）
+
+    作成した場合は、後続の書き込みが失敗してもパーティションが残るようすぐにコミットする。
+
+    Args:
+        conn: psycopg2 接続
+        race_dates: date / datetime / 'YYYYMMDD' / 'YYYY-MM-DD'
+    """
+    months = {_month_start(d) for d in race_dates}
+    missing = [m for m in months if partition_name(m) not in _known_partitions]
+    if not missing:
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (_PARTITION_LOCK_KEY,))
+        for month in missing:
+            _create_partition(cur, month)
+    conn.commit()
+
+
+def _create_partition(cur, month: date):
+    name = partition_name(month)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF odds_history
+        FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')
+    """)
+    _known_partitions.add(name)
+
+
+def upsert_latest(cur, rows: Sequence[tuple]):
+    """
+    odds_latest を更新（save_odds と同じトランザクションで呼ぶ）
+
+    既により新しい取得時刻の値がある場合は上書きしない。
+
+    Args:
+        cur: カーソル
+        rows: odds_history と同じ列順のタプル
+              (race_date, stadium_code, race_number, odds_type, combination,
+               odds_value, odds_min, odds_max, scraped_at, minutes_to_deadline)
+    """
+    # 同一キーが1文に2回現れると ON CONFLICT DO UPDATE がエラーになるため後勝ちで重複排除
+    latest = {row[:5]: row for row in rows}
+    if not latest:
+        return
+    execute_values(cur, """
+        INSERT INTO odds_latest (
+            race_date, stadium_code, race_number, odds_type, combination,
+            odds_value, odds_min, odds_max, scraped_at, minutes_to_deadline
+        ) VALUES %s
+        ON CONFLICT (race_date, stadium_code, race_number, odds_type, combination) DO UPDATE SET
+            odds_value = EXCLUDED.odds_value,
+            odds_min = EXCLUDED.odds_min,
+            odds_max = EXCLUDED.odds_max,
+            scraped_at = EXCLUDED.scraped_at,
+            minutes_to_deadline = EXCLUDED.minutes_to_deadline
+        WHERE odds_latest.scraped_at <= EXCLUDED.scraped_at
+    """, list(latest.values()))
+
+
+def filter_changed_odds(cur, rows: Sequence[tuple]) -> List[tuple]:
+    """
+    odds_latest と比べて値が変わった買い目だけを選ぶ（save_odds と同じトランザクションで呼ぶ）
+
+    odds_latest にない買い目と、odds_latest の取得時刻から ODDS_KEYFRAME_SECONDS 以上
+    経った買い目は値が同じでも返す。同じレースを複数プロセスが同時に書く場合に
+    同じ変化を二重に書かないよう、コミットまでレース単位のアドバイザリロックを取る。
+
+    Args:
+        cur: カーソル
+        rows: odds_history と同じ列順のタプル（upsert_latest と同じ）
+
+    Returns:
+        書き込む行
+    """
+    if not rows:
+        return []
+
+    # デッドロックしないよう常に同じ順でロックする
+    for race_key in sorted({tuple(str(v) for v in row[:3]) for row in rows}):
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ('odds_latest:' + ':'.join(race_key),))
+
+    # REAL 列と比べるため、比較はDB側で同じ型に揃えて行う
+    result = execute_values(cur, f"""
+        SELECT v.idx
+        FROM (VALUES %s) AS v (idx, race_date, stadium_code, race_number, odds_type, combination,
+                               odds_value, odds_min, odds_max, scraped_at)
+        LEFT JOIN odds_latest l
+          ON l.race_date = v.race_date::date
+         AND l.stadium_code = v.stadium_code::smallint
+         AND l.race_number = v.race_number::smallint
+         AND l.odds_type = v.odds_type::smallint
+         AND l.combination = v.combination::smallint
+        WHERE l.race_date IS NULL
+           OR l.odds_value IS DISTINCT FROM v.odds_value::real
+           OR l.odds_min IS DISTINCT FROM v.odds_min::real
+           OR l.odds_max IS DISTINCT FROM v.odds_max::real
+           OR l.scraped_at <= v.scraped_at::timestamptz - interval '{ODDS_KEYFRAME_SECONDS} seconds'
+    """, [(i,) + tuple(row[:9]) for i, row in enumerate(rows)], page_size=len(rows), fetch=True)
+
+    changed = {_first(row) for row in result}
+    return [row for i, row in enumerate(rows) if i in changed]
+
+
+def insert_ticks(cur, ticks: Sequence[tuple]):
+    """
+    オッズを取得した時刻を odds_ticks に記録（save_odds と同じトランザクションで呼ぶ）
+
+    Args:
+        cur: カーソル
+        ticks: (race_date, stadium_code, race_number, scraped_at, minutes_to_deadline, changed) のタプル
+    """
+    if not ticks:
+        return
+    execute_values(cur, """
+        INSERT INTO odds_ticks (
+            race_date, stadium_code, race_number, scraped_at, minutes_to_deadline, changed
+        ) VALUES %s
+        ON CONFLICT DO NOTHING
+    """, list(ticks))
+
+
+def insert_vectors(cur, rows: Sequence[tuple]):
+    """
+    3連単・3連複のオッズを1回の取得につき1行で odds_vectors に保存
+
+    Args:
+        cur: カーソル
+        rows: (race_date, stadium_code, race_number, odds_type, scraped_at, minutes_to_deadline, odds)
+              のタプル。odds_type は名前（'3t' / '3f'）、odds は 買い目 -> オッズ の dict
+    """
+    values = [
+        (race_date, encode_stadium(stadium_code), race_number, encode_odds_type(odds_type),
+         scraped_at, minutes_to_deadline, encode_odds_vector(odds_type, odds))
+        for race_date, stadium_code, race_number, odds_type, scraped_at, minutes_to_deadline, odds in rows
+        if odds
+    ]
+    if not values:
+        return
+    execute_values(cur, """
+        INSERT INTO odds_vectors (
+            race_date, stadium_code, race_number, odds_type, scraped_at, minutes_to_deadline, odds
+        ) VALUES %s
+        ON CONFLICT (race_date, stadium_code, race_number, odds_type, scraped_at) DO UPDATE SET
+            odds = EXCLUDED.odds,
+            minutes_to_deadline = EXCLUDED.minutes_to_deadline
+    """, values)
+
+
+def load_latest_vector_odds(cur, race_date, stadium_code, race_number) -> Dict[str, Dict[str, float]]:
+    """
+    レースの最新の3連単・3連複オッズを取得
+
+    Returns:
+        オッズ種別（'3t' / '3f'）-> 買い目（'1-2-3' 形式）-> オッズ
+    """
+    cur.execute("""
+        SELECT DISTINCT ON (odds_type) odds_type, odds
+        FROM odds_vectors
+        WHERE race_date = %s AND stadium_code = %s AND race_number = %s
+        ORDER BY odds_type, scraped_at DESC
+    """, (race_date, encode_stadium(stadium_code), race_number))
+    result = {}
+    for row in cur.fetchall():
+        odds_type, vector = (row['odds_type'], row['odds']) if isinstance(row, dict) else row
+        name = decode_odds_type(odds_type)
+        result[name] = decode_odds_vector(name, vector)
+    return result
+
+
+def list_partitions(conn) -> List[str]:
+    """odds_history のパーティション名一覧（古い順）"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname AS name FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'odds_history'::regclass
+            ORDER BY c.relname
+        """)
+        return [_first(row) for row in cur.fetchall()]
+
+
+def apply_retention(conn, keep_months: int = ODDS_RETENTION_MONTHS) -> int:
+    """
+    保持期間を過ぎたパーティションを odds_history_rollup に集約して削除
+
+    パーティションごとにコミットする。
+
+    Args:
+        conn: psycopg2 接続
+        keep_months: 生データを残す月数（当月を含む）
+
+    Returns:
+        削除したパーティション数
+    """
+    if keep_months <= 0:
+        return 0
+
+    cutoff = _month_start(date.today())
+    for _ in range(keep_months - 1):
+        cutoff = date(cutoff.year - (cutoff.month == 1), (cutoff.month - 2) % 12 + 1, 1)
+    cutoff_name = partition_name(cutoff)
+
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM odds_latest WHERE race_date < %s", (cutoff,))
+        cur.execute("DELETE FROM odds_ticks WHERE race_date < %s", (cutoff,))
+        cur.execute("DELETE FROM odds_vectors WHERE race_date < %s", (cutoff,))
+    conn.commit()
+
+    dropped = 0
+    for name in list_partitions(conn):
+        if name >= cutoff_name:
+            continue
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO odds_history_rollup (
+                    race_date, stadium_code, race_number, odds_type, combination,
+                    first_odds, last_odds, min_odds, max_odds, samples, last_scraped_at
+                )
+                SELECT race_date, stadium_code, race_number, odds_type, combination,
+                       (array_agg(odds_value ORDER BY scraped_at))[1],
+                       (array_agg(odds_value ORDER BY scraped_at DESC))[1],
+                       MIN(odds_value), MAX(odds_value), COUNT(*), MAX(scraped_at)
+                FROM {name}
+                GROUP BY race_date, stadium_code, race_number, odds_type, combination
+                ON CONFLICT DO NOTHING
+            """)
+            rolled_up = cur.rowcount
+            cur.execute(f"DROP TABLE {name}")
+        conn.commit()
+        _known_partitions.discard(name)
+        dropped += 1
+        logger.info(f"オッズ履歴を集約して削除: {name} ({rolled_up} 組み合わせ)")
+
+    return dropped
+
+
+def migrate_legacy(conn) -> int:
+    """
+    旧形式の odds_history を odds_history_legacy にリネームし、月ごとにパーティションへ移行
+
+    移行済みの月は再実行時にスキップする。移行後の odds_history_legacy は
+    内容を確認してから手動で削除する。旧形式の scraped_at がタイムゾーンなしの
+    TIMESTAMP の場合は JST として解釈する（schema/migrate_to_timestamptz.sql と同じ）。
+
+    Returns:
+        移行した行数
+    """
+    rename_legacy_table(conn)
+    ensure_odds_storage(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('odds_history_legacy') IS NOT NULL")
+        if not _first(cur.fetchone()):
+            logger.info("odds_history_legacy がありません（移行不要）")
+            return 0
+        cur.execute("""
+            SELECT DISTINCT date_trunc('month', race_date)::date AS month
+            FROM odds_history_legacy ORDER BY 1
+        """)
+        months = [_first(row) for row in cur.fetchall()]
+        cur.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'odds_history_legacy' AND column_name = 'scraped_at'
+        """)
+        if _first(cur.fetchone()) == 'timestamp without time zone':
+            scraped_at = "scraped_at AT TIME ZONE 'Asia/Tokyo'"
+        else:
+            scraped_at = "scraped_at"
+
+    total = 0
+    for month in months:
+        ensure_partitions(conn, [month])
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {partition_name(month)})")
+            if _first(cur.fetchone()):
+                logger.info(f"移行済みのためスキップ: {month:%Y-%m}")
+                conn.rollback()
+                continue
+            cur.execute(f"""
+                INSERT INTO odds_history (
+                    race_date, stadium_code, race_number, odds_type, combination,
+                    odds_value, odds_min, odds_max, scraped_at, minutes_to_deadline
+                )
+                SELECT race_date, stadium_code::smallint, race_number,
+                       odds_type_code(odds_type), odds_combination_code(combination),
+                       odds_value, odds_min, odds_max, {scraped_at}, minutes_to_deadline
+                FROM odds_history_legacy
+                WHERE race_date >= %s AND race_date < %s
+                AND odds_type_code(odds_type) IS NOT NULL
+                AND odds_combination_code(combination) IS NOT NULL
+            """, (month, _next_month(month)))
+            count = cur.rowcount
+        conn.commit()
+        total += count
+        logger.info(f"オッズ履歴を移行: {month:%Y-%m} ({count} 行)")
+
+    logger.info(f"移行完了: {total} 行（odds_history_legacy は確認後に削除してください）")
+    return total
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    from db_pool import get_connection
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('migrate', 'retention'):
+        print("使用方法:")
+        print("  python odds_store.py migrate    - 旧形式のオッズ履歴をパーティションへ移行")
+        print("  python odds_store.py retention  - 保持期間を過ぎたパーティションを集約して削除")
+        sys.exit(1)
+
+    conn = get_connection()
+    try:
+        if sys.argv[1] == 'migrate':
+            migrate_legacy(conn)
+        else:
+            ensure_odds_storage(conn)
+            apply_retention(conn)
+    finally:
+        conn.close()
@@ -1,17 +1,24 @@
 """
 競艇オッズ高頻度収集Worker
 
-常時起動のBackground Workerとして動作し、APSchedulerを使用して
-締切直前のレースのオッズを収集します。
+常時起動のBackground Workerとして動作し、締切時刻駆動のイベント
+スケジューラ（race_events.RaceEventScheduler）でレースごとに処理します。
 
 実装仕様:
-- 締切60秒前から60秒間隔で収集
-- 通常時は10分間隔で全レースのオッズを収集
-- 運用時間: 8:00〜21:30 JST
+- 通常時は10分間隔でレースごとにオッズを収集
+- 締切5分前からバースト間隔（10秒）で収集
+- 締切6分前に直前AI予想、締切3分前に購入判断
+- 締切後5分・10分・20分に結果収集（取得できた時点で終了）
+- 全24場のレースを並行に処理
+- 同時刻に発火したレースのオッズは非同期HTTPでまとめて取得（async_fetch）
 
 修正（2026/01/24 v8.8）:
 - オッズ取得間隔を30秒から60秒に変更（負荷軽減）
 - 仮想購入処理をboatrace-betting-process Cron Jobに移行
+
+修正（締切時刻駆動）:
+- 毎分ポーリングしていたboatrace-betting-process Cron Jobを廃止し、
+  直前AI予想・購入判断もこのWorkerのイベントで行う
 """
 
 import os
@@ -19,12 +26,14 @@ import sys
 import time
 import logging
 import signal
-from datetime import datetime, timedelta, timezone
+import threading
+from datetime import timedelta, timezone
 from typing import List, Dict, Optional
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
+from race_schedule import get_schedule_cache
+from race_events import (
+    RaceEventScheduler, EVENT_ODDS, EVENT_PREDICTION, EVENT_DECISION, EVENT_RESULT, race_key
+)
 
 # ログ設定
 logging.basicConfig(
@@ -36,39 +45,27 @@ logger = logging.getLogger(__name__)
 # 日本時間
 JST = timezone(timedelta(hours=9))
 
-# 運用時間設定
-OPERATION_START_HOUR = 8
-OPERATION_END_HOUR = 21
-OPERATION_END_MINUTE = 30
-
-# 高頻度収集設定
-HIGH_FREQ_SECONDS_BEFORE = 60  # 締切60秒前から高頻度収集開始
-HIGH_FREQ_INTERVAL = 60  # 60秒間隔（負荷軽減のため増加）
+# オッズ収集設定
 NORMAL_INTERVAL_MINUTES = 10  # 通常は10分間隔
+BURST_SECONDS_BEFORE = 300  # 締切5分前からバースト収集
+BURST_INTERVAL_SECONDS = 10  # バースト収集は10秒間隔
+
+# 直前AI予想・購入判断設定
+PREDICTION_SECONDS_BEFORE = 360  # 締切6分前に直前AI予想
+DECISION_SECONDS_BEFORE = 180  # 締切3分前に購入判断
 
 # 結果収集設定
-RESULT_COLLECTION_INTERVAL_MINUTES = 5  # 5分間隔で結果収集
+RESULT_DELAYS_MINUTES = (5, 10, 20)  # 締切後5分・10分・20分に結果収集
 
-# 注意: 仮想購入処理は boatrace-betting-process Cron Job で1分ごとに実行
+# イベント処理のワーカースレッド数（24場を並行に処理）
+EVENT_WORKERS = 8
 
 # グローバル変数
 scheduler = None
 running = True
 
-
-def is_within_operation_hours() -> bool:
-    """運用時間内かどうかをチェック"""
-    now_jst = datetime.now(JST)
-
-    if now_jst.hour < OPERATION_START_HOUR:
-        return False
-
-    if now_jst.hour > OPERATION_END_HOUR:
-        return False
-    if now_jst.hour == OPERATION_END_HOUR and now_jst.minute > OPERATION_END_MINUTE:
-        return False
-
-    return True
+# 購入判断は1パスずつ実行する（同時刻に複数レースが発火しても二重購入しない）
+_decision_lock = threading.Lock()
 
 
 def get_database_url() -> Optional[str]:
@@ -85,180 +82,149 @@ def get_database_url() -> Optional[str]:
     return url
 
 
-def collect_high_frequency_odds():
+def sweep_timeout_for(races: List[Dict]) -> int:
     """
-    締切直前のレースのオッズを高頻度で収集
-    この関数は5秒ごとに呼び出される
-    """
-    if not is_within_operation_hours():
-        return
-
-    try:
-        database_url = get_database_url()
-        if not database_url:
-            return  # 環境変数未設定の場合はスキップ
-
-        from collect_odds import OddsCollector
-
-        collector = OddsCollector(database_url)
-
-        # 本日のレーススケジュールを取得
-        races = collector.get_today_race_schedule()
-        if not races:
-            return
-
-        now = datetime.now(JST)
-
-        # 締切30秒以内のレースを探す
-        for race in races:
-            deadline = race.get('deadline_time')
-            if not deadline:
-                continue
+    オッズ収集1回の制限時間（秒）
 
-            delta = (deadline - now).total_seconds()
-
-            # 締切30秒以内かつ締切前のレース
-            if 0 < delta <= HIGH_FREQ_SECONDS_BEFORE:
-                logger.info(f"高頻度収集: {race['stadium_name']} {race['race_number']}R (残り{delta:.0f}秒)")
-
-                # オッズを取得して保存
-                conn = collector.get_db_connection()
-                collector.create_odds_table(conn)
-
-                odds_list = collector.fetch_all_odds(
-                    race['stadium_code'],
-                    race['race_number'],
-                    race['date']
-                )
-
-                if odds_list:
-                    minutes_to_deadline = int(delta / 60)
-                    collector.save_odds(
-                        conn, race['date'],
-                        race['stadium_code'],
-                        race['race_number'],
-                        odds_list,
-                        minutes_to_deadline
-                    )
-                    logger.info(f"  -> {len(odds_list)}件保存")
-
-                conn.close()
-
-    except Exception as e:
-        logger.error(f"高頻度収集エラー: {e}", exc_info=True)
+    同時に取得するレースのうち、次の収集が最も早いレースまでの間隔。
+    バースト中のレースはバースト間隔、それ以外は通常間隔かバースト開始までの短い方。
+    """
+    intervals = []
+    for race in races:
+        until_burst = race['seconds_to_deadline'] - BURST_SECONDS_BEFORE
+        if until_burst <= 0:
+            intervals.append(BURST_INTERVAL_SECONDS)
+        else:
+            intervals.append(min(NORMAL_INTERVAL_MINUTES * 60, until_burst))
+    return max(int(min(intervals)), BURST_INTERVAL_SECONDS)
 
 
-def collect_regular_odds():
+def collect_odds_event(races: List[Dict]):
     """
-    通常のオッズ収集（10分間隔）
-    全ての未終了レースのオッズを収集
+    オッズ収集イベント
+    スケジューラから締切時刻に合わせて呼び出される（通常10分間隔、締切5分前から10秒間隔）
+    同時に発火したレースはまとめて並行に取得する
     """
-    if not is_within_operation_hours():
-        logger.info("運用時間外のためスキップ")
+    database_url = get_database_url()
+    if not database_url:
         return
 
-    try:
-        database_url = get_database_url()
-        if not database_url:
-            return  # 環境変数未設定の場合はスキップ
-
-        from collect_odds import OddsCollector
-
-        collector = OddsCollector(database_url)
-
-        logger.info("=== 定期オッズ収集開始 ===")
+    from collect_odds import OddsCollector
 
-        # 本日のレーススケジュールを取得
-        races = collector.get_today_race_schedule()
-        if not races:
-            logger.info("本日のレースがありません")
-            return
-
-        now = datetime.now(JST)
-        conn = collector.get_db_connection()
-        collector.create_odds_table(conn)
+    races = [race for race in races if race['seconds_to_deadline'] > 0]
+    if not races:
+        return
 
-        collected_count = 0
+    collector = OddsCollector(database_url)
+    # 次の収集までに必ず終わらせる（収集が重ならないようにする）
+    odds_by_race = collector.fetch_odds_for_races(races, sweep_timeout=sweep_timeout_for(races))
 
+    conn = collector.get_db_connection()
+    try:
         for race in races:
-            deadline = race.get('deadline_time')
-            if not deadline:
-                continue
-
-            # 締切前のレースのみ
-            if now > deadline:
-                continue
-
-            # 締切30秒以内は高頻度収集に任せる
-            delta = (deadline - now).total_seconds()
-            if delta <= HIGH_FREQ_SECONDS_BEFORE:
-                continue
-
-            # オッズを取得して保存
-            odds_list = collector.fetch_all_odds(
-                race['stadium_code'],
-                race['race_number'],
-                race['date']
-            )
-
+            odds_list = odds_by_race.get((race['stadium_code'], race['race_number'], race['date']))
             if odds_list:
+                delta = race['seconds_to_deadline']
                 minutes_to_deadline = int(delta / 60)
-                collector.save_odds(
+                saved = collector.save_odds(
                     conn, race['date'],
                     race['stadium_code'],
                     race['race_number'],
                     odds_list,
                     minutes_to_deadline
                 )
-                collected_count += len(odds_list)
-
+                logger.info(f"オッズ収集: {race['stadium_name']} {race['race_number']}R "
+                            f"{len(odds_list)}件 変化{saved}件 (残り{delta:.0f}秒)")
+    finally:
         conn.close()
-        logger.info(f"=== 定期オッズ収集完了: {collected_count}件 ===")
 
-    except Exception as e:
-        logger.error(f"定期オッズ収集エラー: {e}", exc_info=True)
 
+def predict_event(races: List[Dict]):
+    """
+    直前AI予想イベント
+    締切6分前に発火したレースの予想を生成する（日付ごとにまとめて1回）
+    """
+    database_url = get_database_url()
+    if not database_url:
+        return
+
+    from ai_prediction_batch import predict_races_for_date
+
+    races_by_date = {}
+    for race in races:
+        if race['seconds_to_deadline'] > 0:
+            races_by_date.setdefault(race['date'], []).append((race['stadium_code'], race['race_number']))
+
+    for race_date, date_races in races_by_date.items():
+        saved = predict_races_for_date(database_url, race_date, date_races)
+        logger.info(f"直前AI予想: {race_date} {len(date_races)}レース 保存{len(saved)}件")
 
-def collect_race_results_job():
+
+def betting_decision_event(races: List[Dict]):
     """
-    レース結果収集ジョブ
-    5分ごとに実行され、終了したレースの結果と払戻金を収集
-    結果はhistorical_race_resultsとhistorical_payoffsテーブルにも保存
+    購入判断イベント
+    締切3分前に発火したレースについて購入判断を行い、締切超過分を見送りにする
     """
-    if not is_within_operation_hours():
+    database_url = get_database_url()
+    if not database_url:
         return
 
-    try:
-        database_url = get_database_url()
-        if not database_url:
-            return
+    from virtual_betting import VirtualBettingManager
 
-        from collector import run_result_collection
-        from datetime import datetime
+    names = ', '.join(f"{r['stadium_name']} {r['race_number']}R" for r in races)
+    logger.info(f"=== 購入判断: {names} ===")
 
-        logger.info("=== レース結果収集開始 ===")
+    with _decision_lock:
+        manager = VirtualBettingManager(database_url)
+        manager.process_deadline_bets()
 
-        # 今日の結果を収集
-        now_jst = datetime.now(JST)
-        run_result_collection(database_url, now_jst)
+        expired_count = manager.expire_overdue_bets()
+        if expired_count > 0:
+            logger.info(f"締切超過で見送り: {expired_count}件")
 
-        # 履歴テーブルにも保存
-        save_results_to_historical(database_url, now_jst)
 
-        logger.info("=== レース結果収集完了 ===")
+def collect_result_event(races: List[Dict]) -> List[tuple]:
+    """
+    結果収集イベント
+    締切後に発火したレースの結果と払戻金を収集し、履歴テーブルにも保存する
 
-    except Exception as e:
-        logger.error(f"レース結果収集エラー: {e}", exc_info=True)
+    Returns:
+        結果を取得できたレースのキー（再試行不要）
+    """
+    database_url = get_database_url()
+    if not database_url:
+        return []
+
+    from collector import collect_single_race_result
+
+    done = []
+    for race in races:
+        if not collect_single_race_result(database_url, race['date'],
+                                          race['stadium_code'], race['race_number']):
+            logger.info(f"結果未確定: {race['stadium_name']} {race['race_number']}R（再試行予定）")
+            continue
 
+        save_results_to_historical(
+            database_url, race['deadline_time'],
+            stadium_code=int(race['stadium_code']),
+            race_number=race['race_number']
+        )
+        done.append(race_key(race))
+    return done
 
-def save_results_to_historical(database_url: str, target_date):
+
+def save_results_to_historical(database_url: str, target_date,
+                               stadium_code: int = None, race_number: int = None):
     """
     当日の結果をhistorical_race_resultsとhistorical_payoffsテーブルにも保存
+
+    stadium_code・race_numberを指定した場合はそのレースのみ保存
     """
-    import psycopg2
+    from db_pool import get_connection
 
+    conn = None
     try:
-        conn = psycopg2.connect(database_url)
+        conn = get_connection(database_url)
 
         # historical_race_resultsテーブルが存在するか確認
         with conn.cursor() as cur:
@@ -286,7 +252,10 @@ def save_results_to_historical(database_url: str, target_date):
                 JOIN race_results rr ON r.id = rr.race_id
                 WHERE r.race_date = %s::date
                 AND rr.first_place IS NOT NULL
-            """, (target_date.strftime('%Y-%m-%d'),))
+                AND (%s IS NULL OR r.stadium_code = %s)
+                AND (%s IS NULL OR r.race_number = %s)
+            """, (target_date.strftime('%Y-%m-%d'),
+                  stadium_code, stadium_code, race_number, race_number))
 
             results = cur.fetchall()
 
@@ -365,8 +334,10 @@ def save_results_to_historical(database_url: str, target_date):
             conn.close()
 
 
-# 仮想購入処理は boatrace-betting-process Cron Job に移行しました
-# cron_jobs.py の job_betting_process() を使用
+def reload_schedule_handler(signum, frame):
+    """SIGHUP: レーススケジュールの再読み込みを要求"""
+    logger.info(f"シグナル {signum} を受信しました。レーススケジュールを再読み込みします")
+    get_schedule_cache().invalidate()
 
 
 def signal_handler(signum, frame):
@@ -382,12 +353,12 @@ def main():
     """メイン関数"""
     global scheduler, running
 
-    logger.info("=== 競艇オッズ収集Worker起動 (v8.8 軽量版) ===")
-    logger.info(f"高頻度収集: 締切{HIGH_FREQ_SECONDS_BEFORE}秒前から{HIGH_FREQ_INTERVAL}秒間隔")
+    logger.info("=== 競艇オッズ収集Worker起動 (締切時刻駆動) ===")
     logger.info(f"通常収集: {NORMAL_INTERVAL_MINUTES}分間隔")
-    logger.info(f"結果収集: {RESULT_COLLECTION_INTERVAL_MINUTES}分間隔")
-    logger.info(f"運用時間: {OPERATION_START_HOUR}:00〜{OPERATION_END_HOUR}:{OPERATION_END_MINUTE:02d} JST")
-    logger.info("注意: 仮想購入処理は boatrace-betting-process で実行されます")
+    logger.info(f"バースト収集: 締切{BURST_SECONDS_BEFORE}秒前から{BURST_INTERVAL_SECONDS}秒間隔")
+    logger.info(f"直前AI予想: 締切{PREDICTION_SECONDS_BEFORE}秒前")
+    logger.info(f"購入判断: 締切{DECISION_SECONDS_BEFORE}秒前")
+    logger.info(f"結果収集: 締切後{'/'.join(str(m) for m in RESULT_DELAYS_MINUTES)}分")
 
     # 環境変数チェック（起動時に警告を出す）
     database_url = os.environ.get('DATABASE_URL')
@@ -397,52 +368,43 @@ def main():
     else:
         logger.info("DATABASE_URL: 設定済み")
 
+        # オッズテーブルは起動時に一度だけ作成/確認する
+        from collect_odds import OddsCollector
+        collector = OddsCollector(database_url)
+        conn = collector.get_db_connection()
+        try:
+            collector.create_odds_table(conn)
+        finally:
+            conn.close()
+
     # シグナルハンドラを設定
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
-
-    # スケジューラを作成（オッズ収集と結果収集用）
-    scheduler = BackgroundScheduler(timezone=JST)
-
-    # 高頻度収集ジョブ（5秒間隔）
-    scheduler.add_job(
-        collect_high_frequency_odds,
-        IntervalTrigger(seconds=HIGH_FREQ_INTERVAL),
-        id='high_freq_odds',
-        name='高頻度オッズ収集',
-        max_instances=1,
-        coalesce=True
-    )
-
-    # 通常収集ジョブ（10分間隔）
-    scheduler.add_job(
-        collect_regular_odds,
-        IntervalTrigger(minutes=NORMAL_INTERVAL_MINUTES),
-        id='regular_odds',
-        name='定期オッズ収集',
-        max_instances=1,
-        coalesce=True
+    signal.signal(signal.SIGHUP, reload_schedule_handler)
+
+    # 締切時刻駆動のイベントスケジューラを作成
+    scheduler = RaceEventScheduler(
+        get_schedule_cache(database_url),
+        handlers={
+            EVENT_ODDS: collect_odds_event,
+            EVENT_PREDICTION: predict_event,
+            EVENT_DECISION: betting_decision_event,
+            EVENT_RESULT: collect_result_event,
+        },
+        max_workers=EVENT_WORKERS,
+        batch_types=(EVENT_ODDS, EVENT_PREDICTION, EVENT_DECISION),
+        regular_interval=NORMAL_INTERVAL_MINUTES * 60,
+        burst_seconds_before=BURST_SECONDS_BEFORE,
+        burst_interval=BURST_INTERVAL_SECONDS,
+        prediction_seconds_before=PREDICTION_SECONDS_BEFORE,
+        decision_seconds_before=DECISION_SECONDS_BEFORE,
+        result_delays=tuple(m * 60 for m in RESULT_DELAYS_MINUTES),
     )
 
-    # 結果収集ジョブ（5分間隔）
-    scheduler.add_job(
-        collect_race_results_job,
-        IntervalTrigger(minutes=RESULT_COLLECTION_INTERVAL_MINUTES),
-        id='result_collection',
-        name='レース結果収集',
-        max_instances=1,
-        coalesce=True
-    )
-
-    # 注意: 仮想購入処理は boatrace-betting-process Cron Job に移行しました
     # 注意: LZHバッチはboatrace-historical-importサービスに移動しました
 
-    # スケジューラを開始
+    # スケジューラを開始（起動時に全レースのタイマーを設定）
     scheduler.start()
-    logger.info("スケジューラを開始しました")
-
-    # 起動時に一度通常収集を実行
-    collect_regular_odds()
 
     # メインループ - シンプルにスケジューラの監視のみ
     try:
@@ -451,8 +413,7 @@ def main():
     except (KeyboardInterrupt, SystemExit):
         logger.info("シャットダウン要求を受信しました")
     finally:
-        if scheduler and scheduler.running:
-            scheduler.shutdown(wait=False)
+        scheduler.shutdown(wait=False)
         logger.info("=== Worker終了 ===")
 
 
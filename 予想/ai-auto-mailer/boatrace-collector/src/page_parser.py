@@ -0,0 +1,625 @@
+"""
+boatrace.jp のページパーサ（lxml）
+
+締切前のオッズ収集では、1巡で数百ページを取得してパースする。BeautifulSoup の
+html.parser（純Python）では HTTP の待ち時間よりパースのCPU時間のほうが長くなるため、
+各収集スクリプトのパース処理をここにまとめ、C実装の lxml で行う。
+
+- HTML は lxml.html で1回だけ木にする
+- ページ種別ごとの探索は、モジュール読み込み時にコンパイルした XPath で行う
+- 戻り値は各収集スクリプトがそのまま使える素のデータ（文字列・数値・dict）。
+  オッズ文字列の数値化など、スクリプトごとに異なる判定は呼び出し側に残す
+
+ページ種別:
+    index       : parse_stadium_codes（開催場）
+    raceindex   : parse_race_index_deadlines（場ごとの各レースの締切時刻）
+    odds2tf     : parse_odds_2tf（2連単・2連複）、parse_deadlines（全レースの締切予定時刻）
+    oddstf      : parse_odds_tf（単勝・複勝）
+    odds3t/3f   : parse_odds_3tf（3連単・3連複）
+    raceresult  : parse_race_result（着順・払戻金）
+    resultlist  : parse_result_list（場ごとの全レースの1〜3着・払戻金）
+    beforeinfo  : parse_beforeinfo（展示・スタート展示・水面気象）
+
+使用例:
+    from page_parser import parse_odds_2tf
+
+    for cell in parse_odds_2tf(response.text):
+        ...
+"""
+
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+from lxml import html as lxml_html
+
+logger = logging.getLogger(__name__)
+
+# 文字コードはページの meta に関係なく UTF-8 として読む（requests の response.text を渡す前提）
+_HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+
+# ==================== コンパイル済み XPath ====================
+
+_TABLES = etree.XPath('//table')
+_ROWS = etree.XPath('.//tr')
+_ALL_ROWS = etree.XPath('//table//tr')
+_FIRST_ROW = etree.XPath('(.//tr)[1]')
+_CELLS = etree.XPath('.//*[self::th or self::td]')
+_TDS = etree.XPath('.//td')
+_FIRST_LINK = etree.XPath('(.//a)[1]')
+_LINK_HREFS = etree.XPath('//a/@href')
+
+# 3連オッズ表（oddsPoint のセルを持つテーブル）
+_ODDS_POINT_TABLES = etree.XPath(
+    '//table[.//td[contains(concat(" ", normalize-space(@class), " "), " oddsPoint ")]]')
+
+# 着順テーブル（class に is-w495 を含む）
+_RESULT_TABLES = etree.XPath(
+    '//table[contains(concat(" ", normalize-space(@class), " "), " is-w495 ")]')
+
+# 直前情報
+_BEFOREINFO_TABLE = etree.XPath(
+    '(//table[contains(concat(" ", normalize-space(@class), " "), " is-w748 ")])[1]')
+_WEATHER = etree.XPath(
+    '(//div[contains(concat(" ", normalize-space(@class), " "), " weather1 ")])[1]')
+_WEATHER_FIRST_DATA = etree.XPath(
+    '(.//span[contains(concat(" ", normalize-space(@class), " "), " weather1_bodyUnitLabelData ")])[1]')
+_WEATHER_LABELS = etree.XPath(
+    './/div[contains(concat(" ", normalize-space(@class), " "), " weather1_bodyUnitLabel ")]')
+_WEATHER_LABEL_TITLE = etree.XPath(
+    '(.//span[contains(concat(" ", normalize-space(@class), " "), " weather1_bodyUnitLabelTitle ")])[1]')
+_WEATHER_LABEL_DATA = etree.XPath(
+    '(.//span[contains(concat(" ", normalize-space(@class), " "), " weather1_bodyUnitLabelData ")])[1]')
+_FIRST_IMG = etree.XPath('(.//img)[1]')
+_WIND_IMG = etree.XPath(
+    '((.//p[contains(concat(" ", normalize-space(@class), " "), " weather1_bodyUnitImage ")])[1]//img)[1]')
+
+_JCD = re.compile(r'jcd=(\d{2})')
+_TIME = re.compile(r'(\d{1,2}):(\d{2})')
+_RACE_NUMBER = re.compile(r'(\d+)R')
+_RACE_LABEL = re.compile(r'(\d{1,2})R')
+_RACER_NO = re.compile(r'(\d{4})')
+_TOBAN = re.compile(r'toban=(\d+)')
+_START_EXHIBITION = re.compile(r'^(\d)\.(\d{2})$')
+_PAYOUT = re.compile(r'\d+')
+
+# 着順（全角）
+RANK_MAP = {'１': 1, '２': 2, '３': 3, '４': 4, '５': 5, '６': 6}
+
+
+def parse_html(html: str):
+    """HTML を lxml の木にする"""
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    return lxml_html.document_fromstring(html, parser=_HTML_PARSER)
+
+
+def text(element) -> str:
+    """要素内のテキストを、各テキストの前後の空白を除いて連結（BeautifulSoup の get_text(strip=True) 相当）"""
+    if element is None:
+        return ''
+    return ''.join(t.strip() for t in element.itertext())
+
+
+def class_text(element) -> str:
+    return element.get('class') or ''
+
+
+def _first(elements):
+    return elements[0] if elements else None
+
+
+# ==================== 開催場（index） ====================
+
+def parse_stadium_codes(html: str) -> List[str]:
+    """
+    レース一覧ページ（index）のリンクから開催場の場コードを取得
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        場コード（'01' 形式）のリスト（昇順）
+    """
+    codes = set()
+    for href in _LINK_HREFS(parse_html(html)):
+        match = _JCD.search(href)
+        if match:
+            codes.add(match.group(1))
+    return sorted(codes)
+
+
+def parse_race_index_deadlines(html: str) -> Dict[int, Tuple[int, int]]:
+    """
+    場ごとのレース一覧ページ（raceindex）から各レースの締切時刻を取得
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        レース番号 -> (時, 分)
+    """
+    deadlines = {}
+    for row in _ALL_ROWS(parse_html(html)):
+        cells = _TDS(row)
+        if len(cells) < 2:
+            continue
+        race_match = _RACE_NUMBER.match(text(cells[0]))
+        time_match = _TIME.match(text(cells[1]))
+        if race_match and time_match:
+            deadlines[int(race_match.group(1))] = (int(time_match.group(1)), int(time_match.group(2)))
+    return deadlines
+
+
+# ==================== オッズ（odds2tf / oddstf） ====================
+
+def parse_odds_2tf(html: str) -> List[Dict]:
+    """
+    2連単・2連複オッズページ（odds2tf）をパース
+
+    1行目に艇色のセルがあるテーブルがオッズ表。ページ内で index 1 のテーブルが2連単、
+    それ以外が2連複。1行目の偶数番目のセルが1着の艇番、以降の行は
+    「2着艇番, オッズ」の組が1着の列順に並ぶ。
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        {'odds_type': '2t' | '2f', 'first': 1着艇番, 'second': 2着艇番,
+         'odds_text': オッズ文字列, 'disabled': 発売なし（is-disabled）かどうか} のリスト
+    """
+    cells_out = []
+    for table_idx, table in enumerate(_TABLES(parse_html(html))):
+        rows = _ROWS(table)
+        if len(rows) < 2:
+            continue
+
+        first_cells = _CELLS(rows[0])
+        if not first_cells:
+            continue
+        if not any('is-boatColor' in class_text(c) for c in first_cells):
+            continue
+
+        odds_type = '2t' if table_idx == 1 else '2f'
+
+        # ヘッダー行から1着の艇番を取得（偶数番目のセルが艇番）
+        first_place_boats = []
+        for i, cell in enumerate(first_cells):
+            if i % 2 == 0:
+                boat_text = text(cell)
+                if boat_text.isdigit():
+                    first_place_boats.append(int(boat_text))
+
+        for row in rows[1:]:
+            cells = _TDS(row)
+            for pair_idx in range(0, len(cells) - 1, 2):
+                boat_text = text(cells[pair_idx])
+                if not boat_text.isdigit():
+                    continue
+                first_idx = pair_idx // 2
+                if first_idx >= len(first_place_boats):
+                    continue
+                odds_cell = cells[pair_idx + 1]
+                cells_out.append({
+                    'odds_type': odds_type,
+                    'first': first_place_boats[first_idx],
+                    'second': int(boat_text),
+                    'odds_text': text(odds_cell),
+                    'disabled': 'is-disabled' in class_text(odds_cell),
+                })
+    return cells_out
+
+
+def parse_odds_tf(html: str) -> List[Dict]:
+    """
+    単勝・複勝オッズページ（oddstf）をパース
+
+    1行目に「単勝」「複勝」を含むテーブルがオッズ表。各行の1列目が艇番、3列目がオッズ
+    （複勝は「1.0-1.2」の範囲）。
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        {'odds_type': 'win' | 'place', 'boat': 艇番（文字列）, 'odds_text': オッズ文字列} のリスト
+    """
+    odds = []
+    for table in _TABLES(parse_html(html)):
+        header = _first(_FIRST_ROW(table))
+        if header is None:
+            continue
+        header_text = header.text_content()
+        if '単勝' in header_text:
+            odds_type = 'win'
+        elif '複勝' in header_text:
+            odds_type = 'place'
+        else:
+            continue
+
+        for row in _ROWS(table)[1:]:
+            cells = _TDS(row)
+            if len(cells) < 3:
+                continue
+            boat = text(cells[0])
+            if not boat.isdigit():
+                continue
+            odds.append({'odds_type': odds_type, 'boat': boat, 'odds_text': text(cells[2])})
+    return odds
+
+
+def parse_odds_3tf(html: str, odds_type: str) -> List[Dict]:
+    """
+    3連単・3連複オッズページ（odds3t / odds3f）をパース
+
+    ヘッダー行の艇色セルが1着（3連複は1番目）の艇番で、以降の行は1着の列ごとに
+    「2着艇番（rowspan で下の行に続く）, 3着艇番, オッズ」が並ぶ。2着のセルがない行は
+    同じ列の直前の2着を引き継ぐ。
+
+    Args:
+        html: ページのHTML
+        odds_type: '3t' または '3f'（戻り値にそのまま入れる）
+
+    Returns:
+        {'odds_type', 'first', 'second', 'third', 'odds_text', 'disabled'} のリスト
+        （3連複は艇番を並べ替えていないので、組み合わせは呼び出し側で正規化する）
+    """
+    cells_out = []
+    for table in _ODDS_POINT_TABLES(parse_html(html)):
+        first_place_boats = []
+        seconds = {}  # 列 -> 直前の2着艇番
+        for row in _ROWS(table):
+            cells = _CELLS(row)
+            if not any('oddsPoint' in class_text(c) for c in cells):
+                # オッズのない行は、艇色セルの艇番をヘッダーとして読む
+                if not first_place_boats:
+                    first_place_boats = [
+                        int(text(c)) for c in cells
+                        if 'is-boatColor' in class_text(c) and text(c).isdigit()
+                    ]
+                continue
+            if not first_place_boats:
+                continue
+
+            group = 0
+            boats = []
+            for cell in cells:
+                if 'oddsPoint' not in class_text(cell):
+                    boat_text = text(cell)
+                    if boat_text.isdigit():
+                        boats.append(int(boat_text))
+                    continue
+                if len(boats) >= 2:
+                    seconds[group] = boats[-2]
+                if boats and group in seconds and group < len(first_place_boats):
+                    cells_out.append({
+                        'odds_type': odds_type,
+                        'first': first_place_boats[group],
+                        'second': seconds[group],
+                        'third': boats[-1],
+                        'odds_text': text(cell),
+                        'disabled': 'is-disabled' in class_text(cell),
+                    })
+                group += 1
+                boats = []
+        if first_place_boats:
+            break
+    return cells_out
+
+
+def parse_deadlines(html: str) -> List[Tuple[int, int]]:
+    """
+    オッズページ（odds2tf 等）の「締切予定時刻」行から全レースの締切時刻を取得
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        1R から順の (時, 分) のリスト（行がなければ空）
+    """
+    for table in _TABLES(parse_html(html)):
+        for row in _ROWS(table):
+            if '締切予定時刻' not in row.text_content():
+                continue
+            deadlines = []
+            for cell in _CELLS(row):
+                match = _TIME.match(text(cell))
+                if match:
+                    deadlines.append((int(match.group(1)), int(match.group(2))))
+            return deadlines
+    return []
+
+
+# ==================== 結果（raceresult） ====================
+
+def _normalize_bet_type(bet_type_text: str) -> Optional[str]:
+    """勝式のセルを日本語表記に統一（該当しなければ None）"""
+    if '3連単' in bet_type_text:
+        return '3連単'
+    if '3連複' in bet_type_text:
+        return '3連複'
+    if '2連単' in bet_type_text:
+        return '2連単'
+    if '2連複' in bet_type_text:
+        return '2連複'
+    if '単勝' in bet_type_text:
+        return '単勝'
+    if '複勝' in bet_type_text:
+        return '複勝'
+    if '拡連複' in bet_type_text or 'ワイド' in bet_type_text:
+        return 'ワイド'
+    return None
+
+
+def parse_race_result(html: str) -> Dict[str, Dict]:
+    """
+    結果ページ（raceresult）をパース
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        {"result": {艇番(str): {"rank", "racer_no", "race_time"}},
+         "payoff": {勝式: {"result", "payoff", "popularity"}, "複勝_list": [...], "ワイド_list": [...]}}
+    """
+    root = parse_html(html)
+    result_data = {"result": {}, "payoff": {}}
+
+    # 着順テーブル（class='is-w495' でヘッダー + 6艇の7行）
+    result_table = None
+    for table in _RESULT_TABLES(root):
+        rows = _ROWS(table)
+        if len(rows) == 7:
+            header = _CELLS(rows[0])
+            if len(header) >= 4 and '着' in text(header[0]):
+                result_table = table
+                break
+
+    if result_table is not None:
+        for row in _ROWS(result_table)[1:]:
+            cells = _CELLS(row)
+            if len(cells) < 4:
+                continue
+            rank = RANK_MAP.get(text(cells[0]))
+            waku = text(cells[1])
+            if rank is None or not waku.isdigit():
+                continue
+            # ボートレーサー列から登番を抽出（4桁数字）
+            racer_no_match = _RACER_NO.match(text(cells[2]))
+            race_time = text(cells[3])
+            result_data["result"][str(int(waku))] = {
+                "rank": rank,
+                "racer_no": racer_no_match.group(1) if racer_no_match else '',
+                # タイムが空の場合は空文字
+                "race_time": '' if race_time == '-' else race_time,
+            }
+
+    # 払戻金テーブル
+    # rowspan対応: 複勝・ワイドは複数行に分かれ、2行目以降は勝式セルがない
+    last_bet_type = None
+    for table in _TABLES(root):
+        for row in _ROWS(table):
+            cells = _CELLS(row)
+            if len(cells) < 2:
+                continue
+            cell_texts = [text(c) for c in cells]
+            bet_type = _normalize_bet_type(cell_texts[0])
+
+            if bet_type:
+                last_bet_type = bet_type
+                if len(cell_texts) < 3:
+                    continue
+                combination, payout_text = cell_texts[1], cell_texts[2]
+                pop_text = cell_texts[3] if len(cell_texts) >= 4 else ''
+            elif last_bet_type in ('複勝', 'ワイド'):
+                # rowspanの継続行: セル[0]が組番、セル[1]が払戻金
+                bet_type = last_bet_type
+                combination, payout_text = cell_texts[0], cell_texts[1]
+                pop_text = cell_texts[2] if len(cell_texts) >= 3 else ''
+            else:
+                # 勝式が判定できない場合はリセット
+                if not cell_texts[0].replace('-', '').replace('=', '').isdigit():
+                    last_bet_type = None
+                continue
+
+            # 払戻金を数値に変換
+            payout_match = _PAYOUT.search(payout_text.replace('¥', '').replace(',', ''))
+            if not payout_match:
+                continue
+            entry = {
+                "result": combination.replace('\n', '').replace(' ', ''),
+                "payoff": int(payout_match.group()),
+                "popularity": int(pop_text) if pop_text.isdigit() else None,
+            }
+            result_data["payoff"][bet_type] = entry
+            # 複勝・ワイドはリストとしても保存（複数組の場合に対応）
+            if bet_type in ('複勝', 'ワイド'):
+                result_data["payoff"].setdefault(bet_type + '_list', []).append(dict(entry))
+
+    return result_data
+
+
+def parse_result_list(html: str) -> Dict[int, Dict]:
+    """
+    場ごとの結果一覧ページ（resultlist）をパース
+
+    1列目が「1R」のようなレース番号の行が各レースの結果で、ヘッダー行の勝式の順に
+    「組番, 払戻金」の組が並ぶ。中止・未確定のレースは払戻金がない。
+    払戻金が1つに読めないセル（複勝の2組が1セルにある等）は読まない。
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        レース番号 -> {"places": 3連単の組番から読んだ [1着, 2着, 3着]（未確定なら空）,
+                       "payoff": {勝式: {"result", "payoff", "popularity"}}}
+    """
+    races = {}
+    for table in _TABLES(parse_html(html)):
+        bet_types = []
+        for row in _ROWS(table):
+            cell_texts = [text(c) for c in _CELLS(row)]
+            if not cell_texts:
+                continue
+            race_match = _RACE_LABEL.fullmatch(cell_texts[0])
+            if not race_match:
+                header_types = [t for t in map(_normalize_bet_type, cell_texts) if t]
+                if header_types:
+                    bet_types = header_types
+                continue
+            if not bet_types:
+                continue
+
+            race = races.setdefault(int(race_match.group(1)), {"places": [], "payoff": {}})
+            values = cell_texts[1:]
+            for i, bet_type in enumerate(bet_types):
+                if 2 * i + 1 >= len(values):
+                    break
+                combination = values[2 * i].replace('\n', '').replace(' ', '')
+                payout_match = _PAYOUT.fullmatch(values[2 * i + 1].replace('¥', '').replace(',', ''))
+                if not combination or not payout_match:
+                    continue
+                race["payoff"][bet_type] = {
+                    "result": combination,
+                    "payoff": int(payout_match.group()),
+                    "popularity": None,
+                }
+
+            trifecta = race["payoff"].get('3連単')
+            if trifecta:
+                boats = [int(c) for c in trifecta["result"] if c.isdigit()]
+                if len(boats) == 3 and len(set(boats)) == 3:
+                    race["places"] = boats
+    return races
+
+
+# ==================== 直前情報（beforeinfo） ====================
+
+def _to_float(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_beforeinfo(html: str) -> Tuple[List[Dict], Optional[Dict]]:
+    """
+    直前情報ページ（beforeinfo）をパース
+
+    Args:
+        html: ページのHTML
+
+    Returns:
+        (選手ごとの直前情報のリスト, 水面気象情報（なければ None）)。
+        直前情報は waku, racer_no, racer_name, weight, exhibition_time, tilt,
+        start_exhibition_course, start_exhibition_st を持つ
+    """
+    root = parse_html(html)
+    racers = []
+
+    # 選手情報テーブル（is-w748）
+    table = _first(_BEFOREINFO_TABLE(root))
+    if table is not None:
+        for row in _ROWS(table):
+            cells = _TDS(row)
+            if not cells:
+                continue
+            first_cell = text(cells[0])
+            if not (first_cell.isdigit() and 1 <= int(first_cell) <= 6):
+                continue
+
+            # 選手名・登番（リンクから）
+            racer_link = _first(_FIRST_LINK(row))
+            racer_name = text(racer_link)
+            match = _TOBAN.search(racer_link.get('href', '')) if racer_link is not None else None
+
+            # 固定位置からデータを取得
+            # ['1', '', '乙津　康志', '52.0kg', '6.78', '-0.5', '', '', 'R', '']
+            cell_texts = [text(c) for c in cells]
+            weight = None
+            if len(cell_texts) > 3 and 'kg' in cell_texts[3]:
+                weight = _to_float(cell_texts[3].replace('kg', ''))
+
+            racers.append({
+                'waku': int(first_cell),
+                'racer_no': match.group(1) if match else '',
+                'racer_name': racer_name.replace('\u3000', ' '),
+                'weight': weight,
+                'exhibition_time': _to_float(cell_texts[4]) if len(cell_texts) > 4 else None,
+                'tilt': _to_float(cell_texts[5]) if len(cell_texts) > 5 else None,
+                'start_exhibition_course': None,
+                'start_exhibition_st': None,
+            })
+
+    # スタート展示（"1.07" のような行。コースと同じ枠の選手に入れる）
+    for t in _TABLES(root):
+        if 'スタート展示' not in t.text_content():
+            continue
+        for row in _ROWS(t):
+            match = _START_EXHIBITION.match(text(row))
+            if not match:
+                continue
+            course = int(match.group(1))
+            for info in racers:
+                if info['waku'] == course:
+                    info['start_exhibition_course'] = course
+                    info['start_exhibition_st'] = float(f"0.{match.group(2)}")
+                    break
+        break
+
+    # 水面気象情報
+    weather = _first(_WEATHER(root))
+    if weather is None:
+        return racers, None
+
+    weather_dict = {
+        'temperature': None,
+        'weather': '',
+        'wind_direction': '',
+        'wind_speed': None,
+        'water_temperature': None,
+        'wave_height': None,
+    }
+
+    # 気温
+    temp_elem = _first(_WEATHER_FIRST_DATA(weather))
+    if temp_elem is not None:
+        match = re.search(r'([\d.]+)', temp_elem.text_content())
+        if match:
+            weather_dict['temperature'] = _to_float(match.group(1))
+
+    # 各項目を取得
+    for item in _WEATHER_LABELS(weather):
+        title = _first(_WEATHER_LABEL_TITLE(item))
+        data = _first(_WEATHER_LABEL_DATA(item))
+        if title is None or data is None:
+            continue
+        title_text, data_text = text(title), text(data)
+        if '気温' in title_text:
+            match = re.search(r'([\d.]+)', data_text)
+            if match:
+                weather_dict['temperature'] = _to_float(match.group(1))
+        elif '風速' in title_text:
+            match = re.search(r'(\d+)', data_text)
+            if match:
+                weather_dict['wind_speed'] = int(match.group(1))
+        elif '水温' in title_text:
+            match = re.search(r'([\d.]+)', data_text)
+            if match:
+                weather_dict['water_temperature'] = _to_float(match.group(1))
+        elif '波高' in title_text:
+            match = re.search(r'(\d+)', data_text)
+            if match:
+                weather_dict['wave_height'] = int(match.group(1))
+
+    # 天候（画像の alt）
+    weather_img = _first(_FIRST_IMG(weather))
+    if weather_img is not None:
+        weather_dict['weather'] = weather_img.get('alt', '')
+
+    # 風向（画像ファイル名からは判定できないため不明とする）
+    wind_img = _first(_WIND_IMG(weather))
+    if wind_img is not None and 'icon_wind' in wind_img.get('src', ''):
+        weather_dict['wind_direction'] = '不明'
+
+    return racers, weather_dict
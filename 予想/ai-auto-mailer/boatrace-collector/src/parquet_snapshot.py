@@ -0,0 +1,520 @@
+"""
+履歴テーブルのローカルParquetスナップショット
+
+分析・学習スクリプトが毎回リモートのPostgreSQLから数百万行を取得しなくて済むよう、
+履歴テーブルを型付きのParquetファイルとしてローカルに書き出し、そこから読み込む。
+
+- 出力先: SNAPSHOT_DIR/<テーブル>/year=YYYY/month=MM/data.parquet
+  （racer_period_stats は data_year=YYYY/data_period=P）
+- race_date は date32、場コード・R番号・艇番は整数、率は float32 に変換して保存
+- 同期は差分のみ: 前回書き出した最後の月（未確定の可能性がある）以降を月単位で上書き
+- 書き出しは一時ファイル経由で置き換えるため、同期中でも読み込み側は壊れたファイルを見ない
+
+使用方法:
+  python parquet_snapshot.py sync [テーブル ...]         - 差分を同期
+  python parquet_snapshot.py sync --full [テーブル ...]  - 全期間を書き出し直す
+  python parquet_snapshot.py status                      - 同期状況を表示
+
+読み込み:
+  from parquet_snapshot import load_table
+  df = load_table('historical_programs', start_date='20150101', end_date='20251231')
+"""
+
+import io
+import os
+import sys
+import json
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# pyarrow（Parquetの読み書き）
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'snapshot'))
+
+MANIFEST_FILE = '_manifest.json'
+PARQUET_COMPRESSION = 'zstd'
+
+
+class SnapshotTable:
+    """スナップショット対象テーブルの定義"""
+
+    def __init__(self, name: str, columns: List[Tuple[str, str, str]], order_by: Sequence[str],
+                 partition: str = 'month', date_is_text: bool = True):
+        """
+        Args:
+            name: テーブル名
+            columns: (列名, 型, SELECT式) のリスト。型は _ARROW_TYPES のキー、SELECT式が空なら列名
+            order_by: ファイル内の並び順
+            partition: 'month'（race_date の年月）または 'period'（data_year / data_period）
+            date_is_text: race_date が 'YYYYMMDD' の文字列列かどうか（False は DATE 型）
+        """
+        self.name = name
+        self.columns = columns
+        self.order_by = order_by
+        self.partition = partition
+        self.date_is_text = date_is_text
+
+    @property
+    def column_names(self) -> List[str]:
+        return [c[0] for c in self.columns]
+
+    def select_list(self) -> str:
+        return ', '.join(f"{expr or name} AS {name}" for name, _, expr in self.columns)
+
+
+_RACE_DATE = ('race_date', 'date', "to_date(race_date, 'YYYYMMDD')")
+_STADIUM = ('stadium_code', 'int8', 'stadium_code::smallint')
+_RACE_NO = ('race_no', 'int8', 'race_no::smallint')
+_BOAT_NO = ('boat_no', 'int8', 'boat_no::smallint')
+
+TABLES: Dict[str, SnapshotTable] = {t.name: t for t in (
+    SnapshotTable('historical_programs', [
+        _RACE_DATE, _STADIUM, _RACE_NO, _BOAT_NO,
+        ('racer_no', 'string', ''),
+        ('racer_name', 'string', ''),
+        ('age', 'int8', ''),
+        ('branch', 'string', ''),
+        ('weight', 'int8', ''),
+        ('rank', 'string', ''),
+        ('national_win_rate', 'float32', ''),
+        ('national_2nd_rate', 'float32', ''),
+        ('local_win_rate', 'float32', ''),
+        ('local_2nd_rate', 'float32', ''),
+        ('motor_no', 'int16', ''),
+        ('motor_2nd_rate', 'float32', ''),
+        ('boat_no_assigned', 'int16', ''),
+        ('boat_2nd_rate', 'float32', ''),
+        ('deadline_time', 'string', ''),
+    ], ('race_date', 'stadium_code', 'race_no', 'boat_no')),
+    SnapshotTable('historical_race_results', [
+        _RACE_DATE, _STADIUM, _RACE_NO, _BOAT_NO,
+        ('racer_no', 'string', ''),
+        ('rank', 'string', ''),
+        ('race_time', 'string', ''),
+        ('exhibition_time', 'float32', ''),
+    ], ('race_date', 'stadium_code', 'race_no', 'boat_no')),
+    SnapshotTable('historical_payoffs', [
+        _RACE_DATE, _STADIUM, _RACE_NO,
+        ('bet_type', 'string', ''),
+        ('combination', 'string', ''),
+        ('payout', 'int32', ''),
+        ('popularity', 'int16', ''),
+    ], ('race_date', 'stadium_code', 'race_no', 'bet_type', 'combination')),
+    SnapshotTable('odds_history', [
+        ('race_date', 'date', ''),
+        ('stadium_code', 'int8', ''),
+        ('race_number', 'int8', ''),
+        ('odds_type', 'int8', ''),
+        ('combination', 'int16', ''),
+        ('odds_value', 'float32', ''),
+        ('odds_min', 'float32', ''),
+        ('odds_max', 'float32', ''),
+        ('scraped_at', 'timestamp', '(extract(epoch FROM scraped_at) * 1000000)::bigint'),
+        ('minutes_to_deadline', 'int16', ''),
+    ], ('race_date', 'stadium_code', 'race_number', 'odds_type', 'combination', 'scraped_at'),
+        date_is_text=False),
+    SnapshotTable('racer_period_stats', [
+        ('racer_no', 'string', ''),
+        ('data_year', 'int16', ''),
+        ('data_period', 'int8', ''),
+        ('name_kanji', 'string', ''),
+        ('name_kana', 'string', ''),
+        ('branch', 'string', ''),
+        ('rank', 'string', ''),
+        ('gender', 'int8', ''),
+        ('age', 'int8', ''),
+        ('height', 'int16', ''),
+        ('weight', 'int16', ''),
+        ('win_rate', 'float32', ''),
+        ('place_rate', 'float32', ''),
+        ('first_count', 'int16', ''),
+        ('second_count', 'int16', ''),
+        ('race_count', 'int16', ''),
+        ('final_count', 'int16', ''),
+        ('win_count', 'int16', ''),
+        ('avg_start_timing', 'float32', ''),
+        ('prev_rank', 'string', ''),
+        ('prev2_rank', 'string', ''),
+        ('prev3_rank', 'string', ''),
+        ('prev_ability_index', 'float32', ''),
+        ('current_ability_index', 'float32', ''),
+        ('calc_start_date', 'string', ''),
+        ('calc_end_date', 'string', ''),
+        ('training_period', 'int16', ''),
+        ('birthplace', 'string', ''),
+    ], ('data_year', 'data_period', 'racer_no'), partition='period'),
+)}
+
+
+def _arrow_type(kind: str):
+    """列の型名から pyarrow の型（COPY結果の読み込み時の型）を返す"""
+    return {
+        'date': pa.date32(),
+        'int8': pa.int8(),
+        'int16': pa.int16(),
+        'int32': pa.int32(),
+        'float32': pa.float32(),
+        'string': pa.string(),
+        # エポックマイクロ秒として読み込み、後で timestamp に変換
+        'timestamp': pa.int64(),
+    }[kind]
+
+
+def _require_pyarrow():
+    if not HAS_PYARROW:
+        raise RuntimeError("pyarrowがインストールされていません。pip install pyarrow を実行してください。")
+
+
+# ----------------------------------------------------------------------
+# パーティション
+# ----------------------------------------------------------------------
+
+def _month_key(value) -> str:
+    """日付（date / 'YYYYMMDD' / 'YYYY-MM-DD'）から 'YYYYMM'"""
+    if isinstance(value, (date, datetime)):
+        return f"{value.year:04d}{value.month:02d}"
+    return str(value).replace('-', '')[:6]
+
+
+def _iter_months(first: str, last: str) -> Iterator[str]:
+    """'YYYYMM' の範囲（両端を含む）"""
+    year, month = int(first[:4]), int(first[4:])
+    while f"{year:04d}{month:02d}" <= last:
+        yield f"{year:04d}{month:02d}"
+        year, month = year + (month == 12), month % 12 + 1
+
+
+def _partition_dir(root: str, spec: SnapshotTable, key: str) -> str:
+    """パーティションのディレクトリ（key は 'YYYYMM' または 'YYYYP'）"""
+    if spec.partition == 'period':
+        return os.path.join(root, spec.name, f"data_year={key[:4]}", f"data_period={key[4:]}")
+    return os.path.join(root, spec.name, f"year={key[:4]}", f"month={key[4:]}")
+
+
+def list_partitions(table: str, snapshot_dir: str = SNAPSHOT_DIR) -> List[str]:
+    """
+    書き出し済みのパーティションキーを昇順で返す
+
+    Args:
+        table: テーブル名
+        snapshot_dir: スナップショットのルート
+
+    Returns:
+        'YYYYMM'（racer_period_stats は 'YYYYP'）のリスト
+    """
+    base = os.path.join(snapshot_dir, table)
+    if not os.path.isdir(base):
+        return []
+    keys = []
+    for outer in os.listdir(base):
+        if '=' not in outer:
+            continue
+        for inner in os.listdir(os.path.join(base, outer)):
+            if '=' not in inner or not os.path.exists(os.path.join(base, outer, inner, 'data.parquet')):
+                continue
+            year, sub = outer.split('=', 1)[1], inner.split('=', 1)[1]
+            keys.append(f"{int(year):04d}{sub}")
+    return sorted(keys)
+
+
+def has_snapshot(table: str, snapshot_dir: str = SNAPSHOT_DIR) -> bool:
+    """テーブルのスナップショットが存在するか"""
+    return bool(list_partitions(table, snapshot_dir))
+
+
+# ----------------------------------------------------------------------
+# マニフェスト（同期状況）
+# ----------------------------------------------------------------------
+
+def read_manifest(snapshot_dir: str = SNAPSHOT_DIR) -> Dict:
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest: Dict, snapshot_dir: str):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# ----------------------------------------------------------------------
+# 書き出し
+# ----------------------------------------------------------------------
+
+def _source_keys(conn, spec: SnapshotTable) -> List[str]:
+    """DB上のパーティションキーの範囲（month は最小〜最大の全月、period は存在する期）"""
+    with conn.cursor() as cur:
+        if spec.partition == 'period':
+            cur.execute(f"""
+                SELECT DISTINCT data_year, data_period FROM {spec.name}
+                ORDER BY data_year, data_period
+            """)
+            return [f"{int(r[0]):04d}{int(r[1])}" for r in _tuples(cur.fetchall())]
+
+        cur.execute(f"SELECT MIN(race_date), MAX(race_date) FROM {spec.name}")
+        first, last = _tuples(cur.fetchall())[0]
+    if first is None:
+        return []
+    return list(_iter_months(_month_key(first), _month_key(last)))
+
+
+def _tuples(rows) -> List[tuple]:
+    """RealDictCursor / 通常カーソルの両方の結果をタプルのリストに"""
+    return [tuple(r.values()) if isinstance(r, dict) else tuple(r) for r in rows]
+
+
+def _partition_where(spec: SnapshotTable, key: str) -> str:
+    """パーティション1つ分の WHERE 句（race_date のインデックス・パーティションを使える形）"""
+    if spec.partition == 'period':
+        return f"data_year = {int(key[:4])} AND data_period = {int(key[4:])}"
+    year, month = int(key[:4]), int(key[4:])
+    next_year, next_month = year + (month == 12), month % 12 + 1
+    if spec.date_is_text:
+        return (f"race_date >= '{year:04d}{month:02d}01' "
+                f"AND race_date < '{next_year:04d}{next_month:02d}01'")
+    return (f"race_date >= DATE '{year:04d}-{month:02d}-01' "
+            f"AND race_date < DATE '{next_year:04d}-{next_month:02d}-01'")
+
+
+def _fetch_partition(conn, spec: SnapshotTable, key: str):
+    """パーティション1つ分を COPY で取得し、型付きの Arrow テーブルにする"""
+    buffer = io.BytesIO()
+    query = f"""
+        SELECT {spec.select_list()} FROM {spec.name}
+        WHERE {_partition_where(spec, key)}
+        ORDER BY {', '.join(spec.order_by)}
+    """
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", buffer)
+    buffer.seek(0)
+
+    table = pa_csv.read_csv(
+        buffer,
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: _arrow_type(kind) for name, kind, _ in spec.columns},
+            include_columns=spec.column_names,
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+        ),
+    )
+    for name, kind, _ in spec.columns:
+        if kind == 'timestamp':
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, table[name].cast(pa.timestamp('us', tz='UTC')))
+    return table
+
+
+def export_partition(conn, spec: SnapshotTable, key: str, snapshot_dir: str = SNAPSHOT_DIR) -> int:
+    """
+    パーティション1つ分を書き出す（行がなければ既存ファイルを削除）
+
+    Returns:
+        書き出した行数
+    """
+    table = _fetch_partition(conn, spec, key)
+    directory = _partition_dir(snapshot_dir, spec, key)
+    path = os.path.join(directory, 'data.parquet')
+
+    if table.num_rows == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return 0
+
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    pq.write_table(table, tmp, compression=PARQUET_COMPRESSION)
+    os.replace(tmp, path)
+    return table.num_rows
+
+
+def sync_table(conn, table: str, snapshot_dir: str = SNAPSHOT_DIR, full: bool = False) -> int:
+    """
+    テーブルのスナップショットを差分同期
+
+    前回書き出した最後のパーティション（当月など未確定の可能性がある）から、
+    DB上の最新パーティションまでを書き出す。パーティションごとにマニフェストを更新するため、
+    途中で止まっても次回はそこから再開する。
+
+    Args:
+        conn: psycopg2 接続
+        table: テーブル名（TABLES のキー）
+        snapshot_dir: スナップショットのルート
+        full: Trueの場合は全期間を書き出し直す
+
+    Returns:
+        書き出した行数
+    """
+    _require_pyarrow()
+    spec = TABLES[table]
+    manifest = read_manifest(snapshot_dir)
+    state = manifest.setdefault(table, {})
+
+    keys = _source_keys(conn, spec)
+    watermark = None if full else state.get('last_partition')
+    if watermark:
+        keys = [k for k in keys if k >= watermark]
+    if not keys:
+        logger.info(f"{table}: 同期対象なし")
+        return 0
+
+    logger.info(f"{table}: {keys[0]}〜{keys[-1]} の {len(keys)} パーティションを書き出し")
+    total = 0
+    for key in keys:
+        rows = export_partition(conn, spec, key, snapshot_dir)
+        total += rows
+        if rows:
+            logger.info(f"  {table} {key}: {rows:,}行")
+        state['last_partition'] = key
+        state['synced_at'] = datetime.now().isoformat(timespec='seconds')
+        _write_manifest(manifest, snapshot_dir)
+
+    logger.info(f"{table}: 同期完了 {total:,}行")
+    return total
+
+
+def sync_all(conn, tables: Optional[Sequence[str]] = None, snapshot_dir: str = SNAPSHOT_DIR,
+             full: bool = False) -> Dict[str, int]:
+    """
+    複数テーブルを同期
+
+    Returns:
+        {テーブル名: 書き出した行数}
+    """
+    return {table: sync_table(conn, table, snapshot_dir, full) for table in (tables or TABLES)}
+
+
+# ----------------------------------------------------------------------
+# 読み込み
+# ----------------------------------------------------------------------
+
+def load_arrow(table: str, start_date=None, end_date=None, columns: Optional[Sequence[str]] = None,
+               snapshot_dir: str = SNAPSHOT_DIR):
+    """
+    スナップショットを Arrow テーブルとして読み込む
+
+    Args:
+        table: テーブル名
+        start_date: 開始日（date / 'YYYYMMDD' / 'YYYY-MM-DD'、含む）。racer_period_stats では無視
+        end_date: 終了日（含む）
+        columns: 読み込む列（省略時は全列）
+        snapshot_dir: スナップショットのルート
+
+    Returns:
+        pyarrow.Table
+    """
+    _require_pyarrow()
+    spec = TABLES[table]
+    keys = list_partitions(table, snapshot_dir)
+    if not keys:
+        raise FileNotFoundError(f"{table} のスナップショットがありません（parquet_snapshot.py sync を実行してください）")
+
+    filters = []
+    if spec.partition == 'month':
+        if start_date:
+            keys = [k for k in keys if k >= _month_key(start_date)]
+            filters.append(('race_date', '>=', _to_date(start_date)))
+        if end_date:
+            keys = [k for k in keys if k <= _month_key(end_date)]
+            filters.append(('race_date', '<=', _to_date(end_date)))
+
+    schema = pa.schema([(name, pa.timestamp('us', tz='UTC') if kind == 'timestamp' else _arrow_type(kind))
+                        for name, kind, _ in spec.columns])
+    if columns:
+        schema = pa.schema([schema.field(c) for c in columns])
+
+    parts = [
+        pq.read_table(os.path.join(_partition_dir(snapshot_dir, spec, key), 'data.parquet'),
+                      columns=list(columns) if columns else None, filters=filters or None)
+        for key in keys
+    ]
+    if not parts:
+        return schema.empty_table()
+    return pa.concat_tables(parts)
+
+
+def load_table(table: str, start_date=None, end_date=None, columns: Optional[Sequence[str]] = None,
+               snapshot_dir: str = SNAPSHOT_DIR):
+    """
+    スナップショットを pandas.DataFrame として読み込む
+
+    引数は load_arrow と同じ。race_date は datetime64 になる。
+
+    Returns:
+        pandas.DataFrame
+    """
+    return load_arrow(table, start_date, end_date, columns, snapshot_dir).to_pandas(date_as_object=False)
+
+
+def _to_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    digits = str(value).replace('-', '')
+    return date(int(digits[:4]), int(digits[4:6]), int(digits[6:8]))
+
+
+def print_status(snapshot_dir: str = SNAPSHOT_DIR):
+    """同期状況を表示"""
+    manifest = read_manifest(snapshot_dir)
+    print(f"スナップショット: {os.path.abspath(snapshot_dir)}")
+    for table in TABLES:
+        keys = list_partitions(table, snapshot_dir)
+        state = manifest.get(table, {})
+        if not keys:
+            print(f"  {table}: 未同期")
+            continue
+        print(f"  {table}: {keys[0]}〜{keys[-1]}（{len(keys)}パーティション, "
+              f"最終同期 {state.get('synced_at', '-')}）")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ('sync', 'status'):
+        print("使用方法:")
+        print("  python parquet_snapshot.py sync [テーブル ...]         - 差分を同期")
+        print("  python parquet_snapshot.py sync --full [テーブル ...]  - 全期間を書き出し直す")
+        print("  python parquet_snapshot.py status                      - 同期状況を表示")
+        print(f"  テーブル: {', '.join(TABLES)}")
+        sys.exit(1)
+
+    if args[0] == 'status':
+        print_status()
+        sys.exit(0)
+
+    full = '--full' in args
+    tables = [a for a in args[1:] if a != '--full']
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        print(f"不明なテーブル: {', '.join(unknown)}")
+        sys.exit(1)
+
+    from db_pool import get_connection
+
+    conn = get_connection()
+    try:
+        sync_all(conn, tables or None, full=full)
+    finally:
+        conn.close()
@@ -0,0 +1,148 @@
+"""
+K/Bファイルのマルチプロセス解析パイプライン
+
+20年分のバックフィルではファイルのパース（Shift-JISデコード＋正規表現）が
+CPUボトルネックになるため、パースをプロセスプールで並列化し、
+解析済みの月単位のデータを上限付きキューでDB書き込み側に渡す。
+
+- 各ファイルは1回だけ読み込み・展開・デコードし、Kファイルは競走結果と払戻金を同時にパース
+- 先読みする月数を制限し、書き込みが追いつかない場合はパース側が待機する（メモリ上限）
+- DB書き込みと進捗更新は呼び出し側（メインプロセス）で行う
+
+使用例:
+    units = [('import_results', '202401', files), ...]
+    for parsed in iter_parsed_months(units):
+        save_results_to_db(parsed.year_month, parsed.results, parsed.payoffs)
+"""
+
+import os
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from import_historical_data import parse_b_file, parse_k_file
+
+logger = logging.getLogger(__name__)
+
+# パースに使うプロセス数（デフォルトはCPUコア数）
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 1))
+# 書き込み待ちのキューに置く最大月数
+QUEUE_MONTHS = 2
+# キュー以外に並列でパース中にしておく最大月数
+PREFETCH_MONTHS = 2
+
+_DONE = object()
+
+
+class ParsedMonth:
+    """1ヶ月分の解析結果"""
+
+    def __init__(self, task_type: str, year_month: str):
+        self.task_type = task_type
+        self.year_month = year_month
+        self.results: List[Dict] = []
+        self.payoffs: List[Dict] = []
+        self.programs: List[Dict] = []
+        self.files = 0
+
+    def add(self, parsed: Dict[str, List[Dict]]):
+        self.files += 1
+        self.results.extend(parsed.get('results', ()))
+        self.payoffs.extend(parsed.get('payoffs', ()))
+        self.programs.extend(parsed.get('programs', ()))
+
+
+def parse_file(filepath: str) -> Dict[str, List[Dict]]:
+    """
+    K/Bファイルを1つパース（ワーカープロセスで実行）
+
+    Args:
+        filepath: K/BファイルのLZHアーカイブ（ワーカー内でメモリ上に展開）または解凍済みのTXT
+
+    Returns:
+        'results' / 'payoffs' / 'programs' をキーとする辞書
+    """
+    name = os.path.basename(filepath).upper()
+    if name.startswith('K'):
+        results, payoffs = parse_k_file(filepath)
+        return {'results': results, 'payoffs': payoffs}
+    if name.startswith('B'):
+        return {'programs': parse_b_file(filepath)}
+    return {}
+
+
+def iter_parsed_months(units: Iterable[Tuple[str, str, Sequence[str]]],
+                       workers: int = PARSE_WORKERS,
+                       queue_months: int = QUEUE_MONTHS) -> Iterator[ParsedMonth]:
+    """
+    月単位のファイル群を並列にパースし、入力順に ParsedMonth を返す
+
+    途中でループを抜けた場合はパース側も停止する。
+
+    Args:
+        units: (タスク種別, 年月, ファイルパスのリスト) の iterable
+        workers: パースに使うプロセス数
+        queue_months: 書き込み待ちとして保持する最大月数
+
+    Yields:
+        ParsedMonth
+    """
+    parsed_queue: queue.Queue = queue.Queue(maxsize=queue_months)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # 書き込み側が終了した場合に備え、停止フラグを見ながら待つ
+        while not stop.is_set():
+            try:
+                parsed_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def collect(task_type, year_month, futures) -> bool:
+        parsed = ParsedMonth(task_type, year_month)
+        for future in futures:
+            parsed.add(future.result())
+        return put(parsed)
+
+    def produce():
+        try:
+            with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+                inflight = deque()
+                for task_type, year_month, files in units:
+                    if stop.is_set():
+                        break
+                    futures = [pool.submit(parse_file, f) for f in files]
+                    inflight.append((task_type, year_month, futures))
+                    if len(inflight) > PREFETCH_MONTHS and not collect(*inflight.popleft()):
+                        break
+                while inflight and not stop.is_set():
+                    if not collect(*inflight.popleft()):
+                        break
+                for _, _, futures in inflight:
+                    for future in futures:
+                        future.cancel()
+        except BaseException as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    producer = threading.Thread(target=produce, name='parse-pipeline', daemon=True)
+    producer.start()
+    logger.info(f"パースパイプライン開始（{workers}プロセス）")
+
+    try:
+        while True:
+            item = parsed_queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
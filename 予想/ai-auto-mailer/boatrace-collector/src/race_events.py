@@ -0,0 +1,302 @@
+"""
+締切時刻駆動のレースイベントスケジューラ
+
+races.deadline_at をキーにした優先度付きキュー（heapq）でレースごとの
+タイマーを管理し、一定間隔のポーリングではなく必要な時刻にだけ処理を行う。
+
+イベント種別:
+- odds:       オッズスナップショット（通常は10分間隔、締切5分前からはバースト間隔）
+- prediction: 直前AI予想（締切6分前）
+- decision:   購入判断（締切3分前）
+- result:     結果収集（締切後N分、取得できるまで数回再試行）
+
+発火したイベントはワーカースレッドで並行に処理される（24場を1レースずつ
+順番に処理しない）。batch_types に指定した種別は、同時刻に発火したレースを
+まとめて1回のハンドラ呼び出しで処理する。
+"""
+
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from race_schedule import RaceScheduleCache
+
+logger = logging.getLogger(__name__)
+
+# 日本時間
+JST = timezone(timedelta(hours=9))
+
+# イベント種別
+EVENT_ODDS = 'odds'
+EVENT_PREDICTION = 'prediction'
+EVENT_DECISION = 'decision'
+EVENT_RESULT = 'result'
+EVENT_SYNC = 'sync'
+
+# デフォルトのタイミング設定（秒）
+REGULAR_INTERVAL_SECONDS = 600       # 通常のオッズ収集間隔
+BURST_SECONDS_BEFORE = 300           # 締切5分前からバースト収集
+BURST_INTERVAL_SECONDS = 10          # バースト収集間隔
+PREDICTION_SECONDS_BEFORE = 360      # 締切6分前に直前AI予想
+DECISION_SECONDS_BEFORE = 180        # 締切3分前に購入判断
+RESULT_DELAYS_SECONDS = (300, 600, 1200)  # 締切後5分・10分・20分に結果収集
+SYNC_INTERVAL_SECONDS = 300          # スケジュールとの突き合わせ間隔
+
+RaceKey = Tuple[str, str, int]
+# ハンドラ: 同時に発火したレースのリストを受け取り、完了したレースキーを返す（任意）
+EventHandler = Callable[[List[Dict]], Optional[Iterable[RaceKey]]]
+
+
+def race_key(race: Dict) -> RaceKey:
+    """レースのキー（日付, 場コード, レース番号）"""
+    return (race['date'], race['stadium_code'], race['race_number'])
+
+
+class RaceEventScheduler:
+    """レースごとのタイマーを優先度付きキューで管理するスケジューラ"""
+
+    def __init__(self, schedule: RaceScheduleCache, handlers: Dict[str, EventHandler],
+                 max_workers: int = 8,
+                 batch_types: Tuple[str, ...] = (EVENT_PREDICTION, EVENT_DECISION),
+                 regular_interval: int = REGULAR_INTERVAL_SECONDS,
+                 burst_seconds_before: int = BURST_SECONDS_BEFORE,
+                 burst_interval: int = BURST_INTERVAL_SECONDS,
+                 prediction_seconds_before: int = PREDICTION_SECONDS_BEFORE,
+                 decision_seconds_before: int = DECISION_SECONDS_BEFORE,
+                 result_delays: Tuple[int, ...] = RESULT_DELAYS_SECONDS,
+                 sync_interval: int = SYNC_INTERVAL_SECONDS):
+        """
+        Args:
+            schedule: 当日レーススケジュールのキャッシュ
+            handlers: イベント種別 -> ハンドラ（未登録の種別はタイマーを設定しない）
+            max_workers: ハンドラを実行するワーカースレッド数
+            batch_types: 同時に発火したレースをまとめて処理するイベント種別
+        """
+        self.schedule = schedule
+        self.handlers = handlers
+        self.batch_types = set(batch_types)
+        self.regular_interval = timedelta(seconds=regular_interval)
+        self.burst_window = timedelta(seconds=burst_seconds_before)
+        self.burst_interval = timedelta(seconds=burst_interval)
+        self.prediction_offset = timedelta(seconds=prediction_seconds_before)
+        self.decision_offset = timedelta(seconds=decision_seconds_before)
+        self.result_delays = [timedelta(seconds=s) for s in result_delays]
+        self.sync_interval = timedelta(seconds=sync_interval)
+
+        self._heap: List[Tuple[datetime, int, str, Optional[RaceKey], int]] = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._races: Dict[RaceKey, Dict] = {}
+        self._generation: Dict[RaceKey, int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='race-event')
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    # ------------------------------------------------------------
+    # 公開API
+    # ------------------------------------------------------------
+
+    def start(self):
+        """スケジューラを開始（バックグラウンドスレッド）"""
+        self._running = True
+        self.sync()
+        self._push(datetime.now(JST) + self.sync_interval, EVENT_SYNC, None, 0)
+        self._thread = threading.Thread(target=self._run, name='race-event-scheduler', daemon=True)
+        self._thread.start()
+        logger.info("レースイベントスケジューラを開始しました")
+
+    def shutdown(self, wait: bool = False):
+        """スケジューラを停止"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+        logger.info("レースイベントスケジューラを停止しました")
+
+    def sync(self):
+        """
+        スケジュールキャッシュと突き合わせてタイマーを設定
+
+        新規レースにはタイマーを設定し、締切時刻が変わったレースは
+        世代番号を上げて古いタイマーを無効化した上で再設定する。
+        前日以前のレースは破棄する（キューに残ったタイマーは世代番号の不一致で捨てられる）。
+        """
+        now = datetime.now(JST)
+        today = now.strftime('%Y%m%d')
+        races = self.schedule.get_races()
+        planned = 0
+
+        with self._cond:
+            for key in [key for key in self._races if key[0] < today]:
+                del self._races[key]
+                self._generation.pop(key, None)
+
+            for race in races:
+                key = race_key(race)
+                known = self._races.get(key)
+                if known and known['deadline_time'] == race['deadline_time']:
+                    continue
+
+                self._races[key] = race
+                generation = self._generation.get(key, 0) + 1
+                self._generation[key] = generation
+                self._plan_race(race, generation, now)
+                planned += 1
+
+            self._cond.notify_all()
+
+        if planned:
+            logger.info(f"タイマー設定: {planned}レース (待機イベント{len(self._heap)}件)")
+
+    def pending_events(self) -> int:
+        """待機中のイベント数"""
+        with self._cond:
+            return len(self._heap)
+
+    # ------------------------------------------------------------
+    # タイマー設定
+    # ------------------------------------------------------------
+
+    def _plan_race(self, race: Dict, generation: int, now: datetime):
+        """1レース分のタイマーを設定（_condを保持した状態で呼ぶこと）"""
+        key = race_key(race)
+        deadline = race['deadline_time']
+
+        if EVENT_ODDS in self.handlers and now < deadline:
+            self._push(now, EVENT_ODDS, key, generation)
+
+        if EVENT_PREDICTION in self.handlers and now < deadline:
+            self._push(max(deadline - self.prediction_offset, now), EVENT_PREDICTION, key, generation)
+
+        if EVENT_DECISION in self.handlers and now < deadline:
+            self._push(max(deadline - self.decision_offset, now), EVENT_DECISION, key, generation)
+
+        if EVENT_RESULT in self.handlers and self.result_delays:
+            result_at = deadline + self.result_delays[0]
+            last_at = deadline + self.result_delays[-1]
+            if now <= last_at:
+                self._push(max(result_at, now), EVENT_RESULT, key, generation)
+
+    def _push(self, fire_at: datetime, event_type: str, key: Optional[RaceKey], generation: int):
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_at, self._seq, event_type, key, generation))
+
+    def _next_odds_time(self, race: Dict, now: datetime) -> Optional[datetime]:
+        """次のオッズ収集時刻（締切を過ぎる場合はNone）"""
+        deadline = race['deadline_time']
+        burst_start = deadline - self.burst_window
+
+        if now >= burst_start:
+            next_at = now + self.burst_interval
+        else:
+            next_at = min(now + self.regular_interval, burst_start)
+
+        return next_at if next_at < deadline else None
+
+    def _next_result_time(self, race: Dict, now: datetime) -> Optional[datetime]:
+        """次の結果収集の再試行時刻（再試行を使い切った場合はNone）"""
+        deadline = race['deadline_time']
+        for delay in self.result_delays:
+            if deadline + delay > now:
+                return deadline + delay
+        return None
+
+    # ------------------------------------------------------------
+    # 実行ループ
+    # ------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+
+                now = datetime.now(JST)
+                if not self._heap or self._heap[0][0] > now:
+                    timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+                    self._cond.wait(timeout=timeout)
+                    continue
+
+                due = self._pop_due(now)
+
+            if due.pop(EVENT_SYNC, None) is not None:
+                self._handle_sync()
+
+            try:
+                for event_type, races in due.items():
+                    if event_type in self.batch_types:
+                        self._executor.submit(self._dispatch, event_type, races)
+                    else:
+                        for race in races:
+                            self._executor.submit(self._dispatch, event_type, [race])
+            except RuntimeError:
+                # shutdown()後の投入
+                return
+
+    def _pop_due(self, now: datetime) -> Dict[str, List[Dict]]:
+        """発火時刻に達したイベントを種別ごとにまとめて取り出す"""
+        due: Dict[str, List[Dict]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, _, event_type, key, generation = heapq.heappop(self._heap)
+
+            if event_type == EVENT_SYNC:
+                due[EVENT_SYNC] = []
+                continue
+
+            # 締切変更などで無効化された古いタイマーは捨てる
+            if self._generation.get(key) != generation:
+                continue
+
+            # 繰り返し型イベントの次回タイマーは処理完了後に設定するため、
+            # 同じレース・種別の処理が重なることはない
+            race = dict(self._races[key], _generation=generation)
+            due.setdefault(event_type, []).append(race)
+        return due
+
+    def _handle_sync(self):
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"スケジュール同期エラー: {e}", exc_info=True)
+        finally:
+            with self._cond:
+                self._push(datetime.now(JST) + self.sync_interval, EVENT_SYNC, None, 0)
+
+    def _dispatch(self, event_type: str, races: List[Dict]):
+        """ハンドラを実行し、結果に応じて次のタイマーを設定"""
+        now = datetime.now(JST)
+        for race in races:
+            race['seconds_to_deadline'] = (race['deadline_time'] - now).total_seconds()
+
+        done = set()
+        try:
+            result = self.handlers[event_type](races)
+            if result:
+                done = set(result)
+        except Exception as e:
+            logger.error(f"イベント処理エラー ({event_type}, {len(races)}レース): {e}", exc_info=True)
+        finally:
+            with self._cond:
+                now = datetime.now(JST)
+                for race in races:
+                    key = race_key(race)
+                    self._rearm(event_type, key, race['_generation'], now, done=key in done)
+                self._cond.notify_all()
+
+    def _rearm(self, event_type: str, key: RaceKey, generation: int, now: datetime, done: bool):
+        """繰り返し型イベントの次回タイマーを設定（_condを保持した状態で呼ぶこと）"""
+        if self._generation.get(key) != generation:
+            return
+        race = self._races[key]
+
+        next_at = None
+        if event_type == EVENT_ODDS:
+            next_at = self._next_odds_time(race, now)
+        elif event_type == EVENT_RESULT and not done:
+            next_at = self._next_result_time(race, now)
+
+        if next_at is not None:
+            self._push(next_at, event_type, key, generation)
@@ -0,0 +1,155 @@
+"""
+AI予想モデルの特徴量（学習・推論で共通）
+
+出走表の縦持ちデータ（1行 = 1レース × 1艇）を、レース × 6艇 × 特徴量 のテンソルへ
+1回のベクトル演算でピボットする。学習（ai_model_training）と推論（ai_prediction_batch）は
+どちらもこのモジュールで特徴量を作るため、列の並びや欠損値の扱いがずれることはない。
+
+入力の列:
+    race_date, stadium_code, race_no, boat_no,
+    national_win_rate, local_win_rate, motor_2nd_rate, boat_2nd_rate, racer_rank
+    （学習時は着順 finish_rank も）
+
+モデル入力の並び（FEATURE_NAMES）:
+    1〜6号艇 × (全国勝率, 当地勝率, モーター2連率, ボート2連率, 級別) + 場コード + R番号
+"""
+
+import logging
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RACE_KEYS = ('race_date', 'stadium_code', 'race_no')
+
+# 艇ごとの数値特徴量（欠損・数値変換不可は0）
+NUMERIC_FEATURES = ('national_win_rate', 'local_win_rate', 'motor_2nd_rate', 'boat_2nd_rate')
+
+# 級別の数値化（不明は0）
+RANK_VALUES = {'A1': 4, 'A2': 3, 'B1': 2, 'B2': 1}
+
+BOAT_FEATURES = NUMERIC_FEATURES + ('racer_rank',)
+
+FEATURE_NAMES = [
+    f'boat{boat}_{name}'
+    for boat in range(1, 7)
+    for name in ('national_win_rate', 'local_win_rate', 'motor_2nd_rate', 'boat_2nd_rate', 'rank')
+] + ['stadium_code', 'race_no']
+
+
+class RaceFeatures:
+    """
+    レース単位の特徴量
+
+    Attributes:
+        races: レースキー（race_date, stadium_code, race_no）の DataFrame（キー順）
+        tensor: 艇ごとの特徴量（shape=(レース数, 6, len(BOAT_FEATURES))、float32）
+        complete: 6艇すべての出走表が揃っているレース
+        stadium / race_no: 場コード・R番号（int）
+        winner: 1着の艇番（着順がない・不明の場合は0）
+        grades: 級別の文字列（shape=(レース数, 6)、予想理由の表示用）
+    """
+
+    def __init__(self, races: pd.DataFrame, tensor: np.ndarray, complete: np.ndarray,
+                 winner: np.ndarray, grades: np.ndarray):
+        self.races = races
+        self.tensor = tensor
+        self.complete = complete
+        self.winner = winner
+        self.grades = grades
+        self.stadium = pd.to_numeric(races['stadium_code'], errors='coerce').fillna(0).to_numpy(np.float32)
+        self.race_no = pd.to_numeric(races['race_no'], errors='coerce').fillna(0).to_numpy(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.races)
+
+    def matrix(self) -> np.ndarray:
+        """
+        モデル入力の行列（shape=(レース数, len(FEATURE_NAMES))、列は FEATURE_NAMES の順）
+        """
+        n = len(self.races)
+        return np.hstack([
+            self.tensor.reshape(n, -1),
+            self.stadium[:, None],
+            self.race_no[:, None],
+        ])
+
+
+def _numeric(column: pd.Series) -> np.ndarray:
+    return pd.to_numeric(column, errors='coerce').fillna(0).to_numpy(np.float32)
+
+
+def build_race_features(rows: Union[pd.DataFrame, Iterable[Dict]]) -> RaceFeatures:
+    """
+    出走表の縦持ちデータをレース × 6艇 × 特徴量 にピボット
+
+    Args:
+        rows: 1行 = 1艇 の DataFrame または辞書のリスト（モジュール冒頭の列）
+
+    Returns:
+        RaceFeatures（レースはキー順）
+    """
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+    if frame.empty:
+        return RaceFeatures(
+            pd.DataFrame(columns=list(RACE_KEYS)),
+            np.zeros((0, 6, len(BOAT_FEATURES)), dtype=np.float32),
+            np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int8),
+            np.empty((0, 6), dtype=object))
+
+    grouped = frame.groupby(list(RACE_KEYS), sort=True)
+    race_idx = grouped.ngroup().to_numpy()
+    races = grouped.size().index.to_frame(index=False)
+    n = len(races)
+
+    boat_idx = pd.to_numeric(frame['boat_no'], errors='coerce').fillna(0).to_numpy(np.int64) - 1
+    valid = (race_idx >= 0) & (boat_idx >= 0) & (boat_idx < 6)
+    rows_, cols_ = race_idx[valid], boat_idx[valid]
+
+    values = np.column_stack(
+        [_numeric(frame[name]) for name in NUMERIC_FEATURES]
+        + [frame['racer_rank'].map(RANK_VALUES).fillna(0).to_numpy(np.float32)]
+    )
+    tensor = np.zeros((n, 6, len(BOAT_FEATURES)), dtype=np.float32)
+    tensor[rows_, cols_] = values[valid]
+
+    grades = np.full((n, 6), None, dtype=object)
+    grades[rows_, cols_] = frame['racer_rank'].to_numpy(object)[valid]
+
+    # 6艇分の行がちょうど1行ずつあるレースのみ有効
+    filled = np.zeros((n, 6), dtype=np.int16)
+    np.add.at(filled, (rows_, cols_), 1)
+    complete = (filled == 1).all(axis=1) & (np.bincount(race_idx[race_idx >= 0], minlength=n) == 6)
+
+    winner = np.zeros(n, dtype=np.int8)
+    if 'finish_rank' in frame.columns:
+        first = (pd.to_numeric(frame['finish_rank'], errors='coerce') == 1).to_numpy() & valid
+        winner[race_idx[first]] = boat_idx[first] + 1
+
+    return RaceFeatures(races, tensor, complete, winner, grades)
+
+
+def boat_summaries(features: RaceFeatures, index: int) -> List[Dict]:
+    """
+    予想理由の表示用に、1レース分の艇ごとの値を辞書にする
+
+    Args:
+        features: build_race_features の結果
+        index: レースの位置
+
+    Returns:
+        1〜6号艇の辞書のリスト
+    """
+    boats = features.tensor[index]
+    return [
+        {
+            'boat_no': boat + 1,
+            'national_win_rate': float(boats[boat, 0]),
+            'local_win_rate': float(boats[boat, 1]),
+            'motor_2rate': float(boats[boat, 2]),
+            'grade': features.grades[index, boat],
+        }
+        for boat in range(6)
+    ]
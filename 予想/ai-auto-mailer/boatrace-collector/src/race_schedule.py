@@ -0,0 +1,188 @@
+"""
+当日レーススケジュールのキャッシュ
+
+odds_worker の高頻度・定期・結果収集ジョブで共有するスケジュール。
+1日1回 races テーブル（未登録なら公式サイト）から読み込み、以降は
+長い間隔での再読み込みか invalidate() による変更通知でのみ更新する。
+
+これにより高頻度ジョブは毎ティック24場分の odds2tf ページを取得する
+必要がなくなり、オッズ取得そのものに時間を使えるようになる。
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+from db_pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+# 日本時間
+JST = timezone(timedelta(hours=9))
+
+# 再読み込み間隔（締切変更などを拾うための長い間隔）
+SCHEDULE_REFRESH_MINUTES = 60
+# スケジュールが空だった場合の再試行間隔（日次収集前の起動など）
+EMPTY_RETRY_MINUTES = 10
+
+
+class RaceScheduleCache:
+    """当日レーススケジュールのキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, database_url: str = None,
+                 refresh_minutes: int = SCHEDULE_REFRESH_MINUTES):
+        self.database_url = database_url or os.environ.get('DATABASE_URL')
+        self.refresh_interval = timedelta(minutes=refresh_minutes)
+        self._lock = threading.Lock()
+        self._races: List[Dict] = []
+        self._loaded_date = None
+        self._loaded_at: Optional[datetime] = None
+        self._dirty = False
+
+    def invalidate(self):
+        """変更通知: 次回参照時にスケジュールを再読み込みする"""
+        self._dirty = True
+        logger.info("レーススケジュールのキャッシュを無効化しました")
+
+    def get_races(self) -> List[Dict]:
+        """
+        本日のレーススケジュールを取得（締切時刻順）
+
+        Returns:
+            レース情報のリスト。各要素は OddsCollector.get_today_race_schedule()
+            と同じキー（date, stadium_code, stadium_name, race_number, deadline_time）
+            を持ち、deadline_time は JST の aware datetime。
+        """
+        now = datetime.now(JST)
+        with self._lock:
+            if self._needs_refresh(now):
+                self._refresh(now)
+            return list(self._races)
+
+    def races_near_deadline(self, seconds_before: int, now: datetime = None) -> List[Dict]:
+        """締切までseconds_before秒以内（締切前）のレースを取得"""
+        now = now or datetime.now(JST)
+        return [
+            race for race in self.get_races()
+            if 0 < (race['deadline_time'] - now).total_seconds() <= seconds_before
+        ]
+
+    def races_before_deadline(self, min_seconds: int = 0, now: datetime = None) -> List[Dict]:
+        """締切までmin_seconds秒より多く残っているレースを取得"""
+        now = now or datetime.now(JST)
+        return [
+            race for race in self.get_races()
+            if (race['deadline_time'] - now).total_seconds() > min_seconds
+        ]
+
+    def races_after_deadline(self, minutes: int, now: datetime = None) -> List[Dict]:
+        """締切後minutes分以内のレースを取得（結果待ち）"""
+        now = now or datetime.now(JST)
+        return [
+            race for race in self.get_races()
+            if 0 < (now - race['deadline_time']).total_seconds() / 60 <= minutes
+        ]
+
+    def _needs_refresh(self, now: datetime) -> bool:
+        if self._dirty or self._loaded_at is None:
+            return True
+        if self._loaded_date != now.date():
+            return True
+        interval = self.refresh_interval if self._races else timedelta(minutes=EMPTY_RETRY_MINUTES)
+        return now - self._loaded_at >= interval
+
+    def _refresh(self, now: datetime):
+        """スケジュールを再読み込み（DB優先、なければ公式サイト）"""
+        races = self._load_from_db(now.date())
+        source = 'races'
+        if not races:
+            races = self._load_from_website()
+            source = 'website'
+
+        if races or self._loaded_date != now.date():
+            # 同日内の再読み込みで取得失敗した場合は既存のスケジュールを維持する
+            self._races = races
+
+        self._loaded_date = now.date()
+        self._loaded_at = now
+        self._dirty = False
+        logger.info(f"レーススケジュールを読み込みました: {len(self._races)}レース (source={source})")
+
+    def _load_from_db(self, target_date) -> List[Dict]:
+        """racesテーブルから本日のスケジュールを取得"""
+        if not self.database_url:
+            return []
+
+        from collect_odds import STADIUM_CODES
+
+        try:
+            conn = get_connection(self.database_url)
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT stadium_code, race_number, deadline_at
+                        FROM races
+                        WHERE race_date = %s
+                        AND deadline_at IS NOT NULL
+                        ORDER BY deadline_at
+                    """, (target_date,))
+                    rows = cursor.fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"racesテーブルからのスケジュール取得エラー: {e}")
+            return []
+
+        date_str = target_date.strftime('%Y%m%d')
+        races = []
+        for row in rows:
+            stadium_code = f"{row['stadium_code']:02d}"
+            races.append({
+                'date': date_str,
+                'stadium_code': stadium_code,
+                'stadium_name': STADIUM_CODES.get(stadium_code, stadium_code),
+                'race_number': row['race_number'],
+                'deadline_time': _to_jst(row['deadline_at']),
+            })
+        return races
+
+    def _load_from_website(self) -> List[Dict]:
+        """公式サイトからスケジュールを取得（racesテーブル未登録時のフォールバック）"""
+        from collect_odds import OddsCollector
+
+        try:
+            races = OddsCollector(self.database_url).get_today_race_schedule()
+        except Exception as e:
+            logger.warning(f"公式サイトからのスケジュール取得エラー: {e}")
+            return []
+
+        for race in races:
+            race['deadline_time'] = _to_jst(race['deadline_time'])
+        return races
+
+
+def _to_jst(value: datetime) -> datetime:
+    """naiveな日時はJSTとみなし、aware datetime(JST)に変換"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=JST)
+    return value.astimezone(JST)
+
+
+# プロセス内で共有するキャッシュ
+_shared_cache: Optional[RaceScheduleCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_schedule_cache(database_url: str = None) -> RaceScheduleCache:
+    """プロセス共有のスケジュールキャッシュを取得"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = RaceScheduleCache(database_url)
+        elif database_url and not _shared_cache.database_url:
+            _shared_cache.database_url = database_url
+        return _shared_cache
@@ -0,0 +1,327 @@
+"""
+仮想購入の結果精算（集合演算）
+
+結果待ち（status = 'confirmed'）の virtual_bets を、レース結果・払戻金と1本のSQLで結合し、
+的中・不的中・返還をまとめて判定する。購入の更新と、戦略ごとに集計した資金（virtual_funds）の
+更新は1つの文（＝1トランザクション）で行うため、購入件数・戦略数が増えても
+往復回数は変わらない。
+
+- 的中判定: 単勝は1着、2連単は1着-2着、2連複（auto を含む）は1着・2着の組（順不同）
+- 払戻金: payoffs の英語・日本語どちらの賭式名でも参照する（100円あたり）
+- レース不成立（race_status が '成立' 以外）は 'canceled'（返還: 払戻=購入額、損益0）。
+  資金の集計には含めない
+- 結果が不完全（1着・2着が未確定）の購入はそのまま残し、次回に精算する
+
+boatrace-collector/src/settlement.py と boatrace-dashboard/settlement.py は同じ内容のコピー（別サービスとしてデプロイするため）。
+変更時は両方を揃えること（boatrace-collector/tests/test_shared_modules.py で一致を確認している）。
+
+使用例:
+    from settlement import settle_virtual_bets
+    summary = settle_virtual_bets(conn)
+"""
+
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 賭式 -> payoffs.bet_type の候補（収集元によって英語・日本語のどちらかで保存されている）
+PAYOFF_BET_TYPES = {
+    'win': ('win', '単勝'),
+    'exacta': ('exacta', '2連単'),
+    'quinella': ('quinella', '2連複'),
+}
+
+SETTLE_SQL = """
+WITH pending AS (
+    SELECT vb.id, vb.strategy_type, vb.bet_type, vb.combination,
+           COALESCE(vb.bet_amount, 100) AS bet_amount,
+           vb.race_id,
+           rr.first_place, rr.second_place, rr.third_place,
+           (rr.race_status IS NOT NULL AND rr.race_status <> '成立') AS is_canceled,
+           rr.race_status,
+           regexp_split_to_array(vb.combination, '\\s*[-=]\\s*') AS parts
+    FROM virtual_bets vb
+    JOIN race_results rr ON rr.race_id = vb.race_id
+    WHERE vb.status = 'confirmed'
+      AND ((rr.race_status IS NOT NULL AND rr.race_status <> '成立')
+           OR (rr.first_place IS NOT NULL AND rr.second_place IS NOT NULL))
+    FOR UPDATE OF vb SKIP LOCKED
+),
+judged AS (
+    SELECT p.*,
+           CASE
+               WHEN p.is_canceled THEN FALSE
+               WHEN p.bet_type = 'win' THEN
+                   p.combination = p.first_place::text
+               WHEN p.bet_type = 'exacta' THEN
+                   array_length(p.parts, 1) = 2
+                   AND p.parts[1] = p.first_place::text AND p.parts[2] = p.second_place::text
+               WHEN p.bet_type IN ('quinella', 'auto') THEN
+                   array_length(p.parts, 1) = 2
+                   AND LEAST(p.parts[1], p.parts[2]) = LEAST(p.first_place, p.second_place)::text
+                   AND GREATEST(p.parts[1], p.parts[2]) = GREATEST(p.first_place, p.second_place)::text
+               ELSE FALSE
+           END AS is_hit,
+           CASE
+               WHEN p.bet_type = 'win' THEN p.first_place::text
+               WHEN p.bet_type = 'exacta' THEN p.first_place || '-' || p.second_place
+               ELSE LEAST(p.first_place, p.second_place) || '-' || GREATEST(p.first_place, p.second_place)
+           END AS result_key,
+           CASE
+               WHEN p.bet_type = 'win' THEN ARRAY['win', '単勝']
+               WHEN p.bet_type = 'exacta' THEN ARRAY['exacta', '2連単']
+               ELSE ARRAY['quinella', '2連複']
+           END AS payoff_types
+    FROM pending p
+),
+priced AS (
+    SELECT j.id, j.strategy_type, j.bet_amount,
+           CASE WHEN j.is_canceled THEN 'canceled'
+                WHEN j.is_hit THEN 'won'
+                ELSE 'lost' END AS status,
+           CASE WHEN j.is_canceled THEN j.race_status
+                WHEN j.third_place IS NOT NULL THEN j.first_place || '-' || j.second_place || '-' || j.third_place
+                ELSE j.first_place || '-' || j.second_place END AS actual_result,
+           COALESCE(po.payoff, 0) AS payoff,
+           CASE WHEN j.is_canceled THEN j.bet_amount
+                ELSE FLOOR(COALESCE(po.payoff, 0) * j.bet_amount / 100)::int END AS return_amount
+    FROM judged j
+    LEFT JOIN LATERAL (
+        SELECT MAX(pf.payoff) AS payoff
+        FROM payoffs pf
+        WHERE pf.race_id = j.race_id
+          AND pf.bet_type = ANY(j.payoff_types)
+          AND regexp_replace(pf.combination, '\\s*[-=]\\s*', '-', 'g') = j.result_key
+    ) po ON j.is_hit
+),
+settled AS (
+    UPDATE virtual_bets vb
+    SET status = pr.status,
+        actual_result = pr.actual_result,
+        payoff = pr.payoff,
+        return_amount = pr.return_amount,
+        profit = pr.return_amount - pr.bet_amount,
+        result_confirmed_at = NOW(),
+        updated_at = NOW()
+    FROM priced pr
+    WHERE vb.id = pr.id
+    RETURNING pr.strategy_type, pr.status, pr.bet_amount, pr.return_amount
+),
+totals AS (
+    SELECT strategy_type,
+           COUNT(*) AS settled,
+           COUNT(*) FILTER (WHERE status = 'canceled') AS canceled,
+           COUNT(*) FILTER (WHERE status <> 'canceled') AS bets,
+           COUNT(*) FILTER (WHERE status = 'won') AS hits,
+           COALESCE(SUM(bet_amount) FILTER (WHERE status <> 'canceled'), 0) AS bet_amount,
+           COALESCE(SUM(return_amount) FILTER (WHERE status <> 'canceled'), 0) AS return_amount
+    FROM settled
+    GROUP BY strategy_type
+),
+targets AS (
+    SELECT t.*,
+           (SELECT f.id FROM virtual_funds f
+            WHERE f.strategy_type = t.strategy_type AND f.is_active = TRUE
+            ORDER BY f.id
+            LIMIT 1) AS fund_id
+    FROM totals t
+),
+funds AS (
+    UPDATE virtual_funds f
+    SET current_fund = f.current_fund + (t.return_amount - t.bet_amount),
+        total_profit = f.total_profit + (t.return_amount - t.bet_amount),
+        total_bets = f.total_bets + t.bets,
+        total_hits = f.total_hits + t.hits,
+        hit_rate = CASE WHEN f.total_bets + t.bets > 0
+                        THEN (f.total_hits + t.hits) * 100.0 / (f.total_bets + t.bets)
+                        ELSE 0 END,
+        total_bet_amount = f.total_bet_amount + t.bet_amount,
+        total_return_amount = f.total_return_amount + t.return_amount,
+        return_rate = CASE WHEN f.total_bet_amount + t.bet_amount > 0
+                           THEN (f.total_return_amount + t.return_amount) * 100.0
+                                / (f.total_bet_amount + t.bet_amount)
+                           ELSE 0 END,
+        updated_at = NOW()
+    FROM targets t
+    WHERE f.id = t.fund_id AND t.bets > 0
+    RETURNING f.id, f.current_fund
+)
+SELECT t.strategy_type, t.settled, t.canceled, t.bets, t.hits,
+       t.bet_amount, t.return_amount, fu.current_fund
+FROM targets t
+LEFT JOIN funds fu ON fu.id = t.fund_id
+ORDER BY t.strategy_type
+"""
+
+
+def settle_virtual_bets(conn) -> Dict:
+    """
+    結果が出ている virtual_bets をまとめて精算し、戦略ごとの資金を更新してコミット
+
+    Args:
+        conn: psycopg2 の接続
+
+    Returns:
+        {'settled': 精算件数, 'won': 的中, 'lost': 不的中, 'canceled': 返還,
+         'strategies': 戦略ごとの集計のリスト}
+    """
+    from psycopg2.extras import RealDictCursor
+
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SETTLE_SQL)
+            strategies = [dict(row) for row in cur.fetchall()]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    summary = {
+        'settled': sum(s['settled'] for s in strategies),
+        'won': sum(s['hits'] for s in strategies),
+        'lost': sum(s['bets'] - s['hits'] for s in strategies),
+        'canceled': sum(s['canceled'] for s in strategies),
+        'strategies': strategies,
+    }
+    for s in strategies:
+        if s['bets'] and s['current_fund'] is None:
+            logger.warning(f"アクティブな資金が見つかりません: {s['strategy_type']}")
+        else:
+            logger.info(
+                f"精算: {s['strategy_type']} {s['settled']}件 "
+                f"(的中{s['hits']} 返還{s['canceled']}) "
+                f"損益={float(s['return_amount']) - float(s['bet_amount']):+.0f} "
+                f"資金={s['current_fund']}"
+            )
+    logger.info(
+        f"仮想購入精算完了: {summary['settled']}件 "
+        f"(的中{summary['won']} 不的中{summary['lost']} 返還{summary['canceled']})"
+    )
+    return summary
+
+
+def judge_bet(bet_type: str, combination: str, first, second) -> Tuple[bool, str]:
+    """
+    1件の的中判定（SETTLE_SQL と同じ規則。SQLで精算できないDB向け）
+
+    Args:
+        bet_type: 'win' / 'exacta' / 'quinella'（'auto' は2連複扱い）
+        combination: 買い目（'1', '1-2', '1=2' など）
+        first: 1着の艇番
+        second: 2着の艇番
+
+    Returns:
+        (的中したか, 払戻金を引くための組番 '1' / '1-2')
+    """
+    first, second = str(first), str(second)
+    parts = [p.strip() for p in str(combination).replace('=', '-').split('-')]
+    if bet_type == 'win':
+        return parts == [first], first
+    if bet_type == 'exacta':
+        key = f"{first}-{second}"
+        return parts == [first, second], key
+    key = '-'.join(sorted([first, second]))
+    if bet_type in ('quinella', 'auto'):
+        return len(parts) == 2 and sorted(parts) == sorted([first, second]), key
+    return False, key
+
+
+def fetch_race_outcomes(cur, races: Iterable[Tuple[str, str, int]]) -> Dict[Tuple[str, str, int], Dict]:
+    """
+    複数レースの着順と払戻金を1回のクエリで取得
+
+    着順は historical_race_results を優先し、なければ race_results を使う。
+
+    Args:
+        cur: psycopg2 のカーソル（RealDictCursor / DictCursor）
+        races: (レース日 YYYYMMDD, 場コード '01', R番号) の iterable
+
+    Returns:
+        {(レース日, 場コード, R番号): {'rank1', 'rank2', 'rank3',
+                                        'payoffs': {(賭式, 組番): 払戻金}}}
+        1着が確定していないレースは含まない
+    """
+    keys = sorted({(str(d).replace('-', ''), str(s).zfill(2), int(n)) for d, s, n in races})
+    if not keys:
+        return {}
+
+    cur.execute("""
+        WITH keys(race_date, stadium_code, race_number) AS (
+            SELECT k.race_date, k.stadium_code, k.race_number
+            FROM unnest(%s::text[], %s::text[], %s::int[]) AS k(race_date, stadium_code, race_number)
+        ),
+        historical AS (
+            SELECT k.race_date, k.stadium_code, k.race_number,
+                   MAX(CASE WHEN hrr.rank IN ('1', '01') THEN hrr.boat_no::integer END) AS rank1,
+                   MAX(CASE WHEN hrr.rank IN ('2', '02') THEN hrr.boat_no::integer END) AS rank2,
+                   MAX(CASE WHEN hrr.rank IN ('3', '03') THEN hrr.boat_no::integer END) AS rank3
+            FROM keys k
+            JOIN historical_race_results hrr
+              ON hrr.race_date = k.race_date
+             AND hrr.stadium_code = k.stadium_code
+             AND hrr.race_no = lpad(k.race_number::text, 2, '0')
+            GROUP BY k.race_date, k.stadium_code, k.race_number
+        )
+        SELECT k.race_date, k.stadium_code, k.race_number, r.id AS race_id,
+               COALESCE(h.rank1, rr.first_place) AS rank1,
+               COALESCE(h.rank2, rr.second_place) AS rank2,
+               COALESCE(h.rank3, rr.third_place) AS rank3
+        FROM keys k
+        LEFT JOIN historical h USING (race_date, stadium_code, race_number)
+        LEFT JOIN races r ON r.race_date = to_date(k.race_date, 'YYYYMMDD')
+            AND r.stadium_code = k.stadium_code::int
+            AND r.race_number = k.race_number
+        LEFT JOIN race_results rr ON rr.race_id = r.id
+    """, ([k[0] for k in keys], [k[1] for k in keys], [k[2] for k in keys]))
+
+    outcomes: Dict[Tuple[str, str, int], Dict] = {}
+    race_ids: Dict[int, Tuple[str, str, int]] = {}
+    for row in cur.fetchall():
+        if not row['rank1']:
+            continue
+        key = (row['race_date'], row['stadium_code'], row['race_number'])
+        outcomes[key] = {
+            'rank1': row['rank1'], 'rank2': row['rank2'], 'rank3': row['rank3'],
+            'payoffs': {},
+        }
+        if row['race_id'] is not None:
+            race_ids[row['race_id']] = key
+
+    if race_ids:
+        names = {name: bet_type for bet_type, names in PAYOFF_BET_TYPES.items() for name in names}
+        cur.execute("""
+            SELECT race_id, bet_type, combination, payoff
+            FROM payoffs
+            WHERE race_id = ANY(%s) AND bet_type = ANY(%s)
+        """, (list(race_ids), list(names)))
+        for row in cur.fetchall():
+            combo = '-'.join(p.strip() for p in row['combination'].replace('=', '-').split('-'))
+            outcomes[race_ids[row['race_id']]]['payoffs'][(names[row['bet_type']], combo)] = row['payoff']
+
+    return outcomes
+
+
+def collect_fund_deltas(settled: List[Dict]) -> Dict[str, Dict]:
+    """
+    精算結果を戦略ごとに集計（返還は含めない）
+
+    Args:
+        settled: {'strategy_type', 'status', 'bet_amount', 'return_amount'} のリスト
+
+    Returns:
+        {戦略: {'bets', 'hits', 'bet_amount', 'return_amount', 'profit'}}
+    """
+    deltas: Dict[str, Dict] = {}
+    for bet in settled:
+        if bet['status'] == 'canceled':
+            continue
+        d = deltas.setdefault(bet['strategy_type'], {
+            'bets': 0, 'hits': 0, 'bet_amount': 0.0, 'return_amount': 0.0, 'profit': 0.0,
+        })
+        d['bets'] += 1
+        d['hits'] += 1 if bet['status'] == 'won' else 0
+        d['bet_amount'] += float(bet['bet_amount'])
+        d['return_amount'] += float(bet['return_amount'])
+        d['profit'] += float(bet['return_amount']) - float(bet['bet_amount'])
+    return deltas
@@ -12,12 +12,9 @@ try:
         cur.execute("""
             SELECT vb.id, vb.bet_type, vb.combination, vb.bet_amount,
                    rr.first_place, rr.second_place, rr.third_place,
-                   r.id as race_id
+                   vb.race_id
             FROM virtual_bets vb
-            JOIN races r ON vb.race_date = r.race_date
-                AND vb.stadium_code::int = r.stadium_code
-                AND vb.race_number = r.race_number
-            JOIN race_results rr ON r.id = rr.race_id
+            JOIN race_results rr ON rr.race_id = vb.race_id
             WHERE vb.status = 'confirmed'
               AND rr.first_place IS NOT NULL
         """)
@@ -14,8 +14,15 @@ from bs4 import BeautifulSoup
 from datetime import datetime, time, timedelta, timezone
 
 from typing import Dict, List, Optional, Tuple, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+from db_pool import get_connection
+from settlement import judge_bet
+from page_parser import parse_odds_2tf, parse_odds_tf
+from odds_store import (
+    ODDS_TYPE_CODES, encode_stadium, encode_odds_type, encode_combination,
+    decode_odds_type, decode_combination,
+)
 
 # ロガー設定
 logger = logging.getLogger(__name__)
@@ -84,6 +91,11 @@ class VirtualBettingManager:
         if not self.db_url:
             raise ValueError("DATABASE_URL is required")
 
+        # 購入判断パス中のオッズスナップショット（パス外はNone）
+        # db: (日付, 場コード, レース番号) -> {(オッズタイプ, 買い目): オッズ}
+        # web: (日付, 場コード, レース番号, ページ) -> {(オッズタイプ, 買い目): オッズ}
+        self._odds_pass: Optional[Dict[str, Dict]] = None
+
 
     def register_daily_bets(self):
         """本日分の日次ベット登録"""
@@ -116,11 +128,11 @@ class VirtualBettingManager:
 
                 # 既存のベットを確認（重複登録防止）
                 cursor.execute("""
-                    SELECT stadium_code, race_number, strategy_type
-                    FROM virtual_bets
-                    WHERE race_date = %s
-                """, (today_date,))
-                existing = set((str(row['stadium_code']), row['race_number'], row['strategy_type']) for row in cursor.fetchall())
+                    SELECT vb.race_id, vb.strategy_type
+                    FROM virtual_bets vb
+                    WHERE vb.race_id = ANY(%s)
+                """, ([race['id'] for race in races],))
+                existing = set((row['race_id'], row['strategy_type']) for row in cursor.fetchall())
 
                 # 番組表から1号艇の勝率を一括取得
                 race_date_str = today_date.strftime('%Y%m%d')
@@ -167,11 +179,12 @@ class VirtualBettingManager:
                             continue
 
                         # 既に登録済みかチェック
-                        if (stadium_code, race_number, strategy_key) in existing:
+                        if (race['id'], strategy_key) in existing:
                             continue
 
                         # 登録処理
                         self.create_bet(
+                            race_id=race['id'],
                             race_date=today_date,
                             stadium_code=stadium_code,
                             race_number=race_number,
@@ -196,19 +209,20 @@ class VirtualBettingManager:
     def get_db_connection(self):
         """データベース接続を取得"""
         try:
-            conn = psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
+            conn = get_connection(self.db_url, cursor_factory=RealDictCursor)
             return conn
         except Exception as e:
             logger.error(f"DB接続エラー: {e}")
             return None
 
-    def create_bet(self, race_date: str, stadium_code: str, race_number: int,
+    def create_bet(self, race_id: int, race_date: str, stadium_code: str, race_number: int,
                    strategy_type: str, combination: str, bet_type: str,
                    amount: int = 1000, reason: dict = None) -> Optional[int]:
         """
         仮想購入を作成
 
         Args:
+            race_id: races.id
             race_date: レース日（YYYY-MM-DD）
             stadium_code: 競艇場コード
             race_number: レース番号
@@ -229,12 +243,12 @@ class VirtualBettingManager:
             with conn.cursor() as cursor:
                 cursor.execute("""
                     INSERT INTO virtual_bets (
-                        race_date, stadium_code, race_number, strategy_type,
+                        race_id, race_date, stadium_code, race_number, strategy_type,
                         combination, bet_type, amount, status, reason, created_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending', %s, %s)
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'pending', %s, %s)
                     RETURNING id
                 """, (
-                    race_date, stadium_code, race_number, strategy_type,
+                    race_id, race_date, stadium_code, race_number, strategy_type,
                     combination, bet_type, amount,
                     json.dumps(reason) if reason else None,
                     datetime.now(JST)  # aware datetime(JST)で保存
@@ -264,29 +278,33 @@ class VirtualBettingManager:
 
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE virtual_bets
-                    SET status = 'confirmed',
-                        final_odds = %s,
-                        reason = %s,
-                        confirmed_at = %s,
-                        updated_at = %s
-                    WHERE id = %s
-                """, (
-                    final_odds,
-                    json.dumps(reason, ensure_ascii=False) if reason else None,
-                    datetime.now(JST),  # aware datetime(JST)で保存
-                    datetime.now(JST),  # aware datetime(JST)で保存
-                    bet_id
-                ))
+                self._confirm_bet(cursor, bet_id, final_odds, reason)
                 conn.commit()
-                logger.info(f"購入確定: bet_id={bet_id}, odds={final_odds}")
         except Exception as e:
             logger.error(f"購入確定エラー: {e}")
             conn.rollback()
         finally:
             conn.close()
 
+    def _confirm_bet(self, cursor, bet_id: int, final_odds: float, reason: dict = None):
+        """購入を確定（呼び出し側のトランザクション内で更新、コミットは呼び出し側）"""
+        cursor.execute("""
+            UPDATE virtual_bets
+            SET status = 'confirmed',
+                final_odds = %s,
+                reason = %s,
+                confirmed_at = %s,
+                updated_at = %s
+            WHERE id = %s
+        """, (
+            final_odds,
+            json.dumps(reason, ensure_ascii=False) if reason else None,
+            datetime.now(JST),  # aware datetime(JST)で保存
+            datetime.now(JST),  # aware datetime(JST)で保存
+            bet_id
+        ))
+        logger.info(f"購入確定: bet_id={bet_id}, odds={final_odds}")
+
     def skip_bet(self, bet_id: int, reason: str):
         """
         購入を見送り
@@ -301,41 +319,45 @@ class VirtualBettingManager:
 
         try:
             with conn.cursor() as cursor:
-                # 既存のreasonを取得
-                cursor.execute("SELECT reason FROM virtual_bets WHERE id = %s", (bet_id,))
-                row = cursor.fetchone()
-                existing_reason = {}
-                if row and row.get('reason'):
-                    try:
-                        if isinstance(row['reason'], str):
-                            existing_reason = json.loads(row['reason'])
-                        elif isinstance(row['reason'], dict):
-                            existing_reason = row['reason']
-                    except:
-                        pass
-
-                existing_reason['skipReason'] = reason
-                existing_reason['decision'] = 'skipped'
-
-                cursor.execute("""
-                    UPDATE virtual_bets
-                    SET status = 'skipped',
-                        reason = %s,
-                        updated_at = %s
-                    WHERE id = %s
-                """, (
-                    json.dumps(existing_reason, ensure_ascii=False),
-                    datetime.now(JST),  # aware datetime(JST)で保存
-                    bet_id
-                ))
+                self._skip_bet(cursor, bet_id, reason)
                 conn.commit()
-                logger.info(f"購入見送り: bet_id={bet_id}, reason={reason}")
         except Exception as e:
             logger.error(f"購入見送りエラー: {e}")
             conn.rollback()
         finally:
             conn.close()
 
+    def _skip_bet(self, cursor, bet_id: int, reason: str):
+        """購入を見送り（呼び出し側のトランザクション内で更新、コミットは呼び出し側）"""
+        # 既存のreasonを取得
+        cursor.execute("SELECT reason FROM virtual_bets WHERE id = %s", (bet_id,))
+        row = cursor.fetchone()
+        existing_reason = {}
+        if row and row.get('reason'):
+            try:
+                if isinstance(row['reason'], str):
+                    existing_reason = json.loads(row['reason'])
+                elif isinstance(row['reason'], dict):
+                    existing_reason = row['reason']
+            except:
+                pass
+
+        existing_reason['skipReason'] = reason
+        existing_reason['decision'] = 'skipped'
+
+        cursor.execute("""
+            UPDATE virtual_bets
+            SET status = 'skipped',
+                reason = %s,
+                updated_at = %s
+            WHERE id = %s
+        """, (
+            json.dumps(existing_reason, ensure_ascii=False),
+            datetime.now(JST),  # aware datetime(JST)で保存
+            bet_id
+        ))
+        logger.info(f"購入見送り: bet_id={bet_id}, reason={reason}")
+
     def update_result(self, bet_id: int, is_won: bool, payout: int = 0):
         """
         結果を更新
@@ -439,15 +461,11 @@ class VirtualBettingManager:
                 # デバッグログ
                 logger.info(f"[DEBUG] now_jst={now_jst}, deadline_threshold={deadline_threshold}")
 
-                # 型の不一致を解消: virtual_bets."stadiumCode"(varchar) vs races.stadium_code(smallint)
-                # virtual_betsテーブルはキャメルケースのカラム名を使用
                 # 締切2分前〜現在時刻の間のレースを取得
                 cursor.execute("""
                     SELECT vb.*, r.deadline_at
                     FROM virtual_bets vb
-                    JOIN races r ON vb.race_date::date = r.race_date
-                        AND CAST(vb.stadium_code AS smallint) = r.stadium_code
-                        AND vb.race_number = CAST(r.race_number AS integer)
+                    JOIN races r ON r.id = vb.race_id
                     WHERE vb.status = 'pending'
                     AND r.deadline_at <= %s
                     AND r.deadline_at > %s
@@ -468,9 +486,7 @@ class VirtualBettingManager:
                         SELECT vb.id, vb.race_date, vb.stadium_code, vb.race_number,
                                vb.status, r.deadline_at
                         FROM virtual_bets vb
-                        JOIN races r ON vb.race_date::date = r.race_date
-                            AND CAST(vb.stadium_code AS smallint) = r.stadium_code
-                            AND vb.race_number = CAST(r.race_number AS integer)
+                        JOIN races r ON r.id = vb.race_id
                         WHERE vb.status = 'pending'
                         ORDER BY r.deadline_at
                         LIMIT 5
@@ -494,7 +510,7 @@ class VirtualBettingManager:
     def get_latest_odds(self, race_date: str, stadium_code: str, race_number: int,
                         odds_type: str, combination: str) -> Optional[float]:
         """
-        最新オッズを取得（odds_historyテーブルから）
+        最新オッズを取得（odds_latestテーブルから主キーで取得）
 
         Args:
             race_date: レース日（YYYYMMDD）
@@ -506,6 +522,16 @@ class VirtualBettingManager:
         Returns:
             オッズ（取得できない場合はNone）
         """
+        if self._odds_pass is not None:
+            # 購入判断パス中はレース単位のスナップショットから返す
+            snapshot = self._get_odds_snapshot(race_date, stadium_code, race_number)
+            odds_val = snapshot.get((odds_type, combination.replace('=', '-')))
+            # 0.0は発売前または投票が少ない状態なので、有効なオッズとして扱わない
+            return odds_val if odds_val is not None and odds_val > 0 else None
+
+        if odds_type not in ODDS_TYPE_CODES:
+            return None
+
         conn = self.get_db_connection()
         if not conn:
             return None
@@ -518,27 +544,17 @@ class VirtualBettingManager:
                 else:
                     race_date_formatted = race_date
 
-                # オッズタイプはodds_historyではそのまま保存されている
-                # win -> win, 2f -> 2f, 2t -> 2t
-                db_odds_type = odds_type
-
-                # 組み合わせを正規化
-                # 単勝: "1" -> "1"
-                # 2連複: "1=3" -> "1-3" (odds_historyでは1-3形式で保存)
-                normalized_combination = combination.replace('=', '-')
-
-                # odds_historyテーブルから最新オッズを取得
-                # stadium_codeは文字列（'01', '02'等）で保存されている
+                # 場コード・オッズ種別・買い目はコード化して保存されている
+                # （odds_store参照。'01' -> 1, '2f' -> 4, "1=3" -> 13）
                 cursor.execute("""
-                    SELECT odds_value FROM odds_history
+                    SELECT odds_value FROM odds_latest
                     WHERE race_date = %s
                     AND stadium_code = %s
                     AND race_number = %s
                     AND odds_type = %s
                     AND combination = %s
-                    ORDER BY scraped_at DESC
-                    LIMIT 1
-                """, (race_date_formatted, stadium_code, race_number, db_odds_type, normalized_combination))
+                """, (race_date_formatted, encode_stadium(stadium_code), race_number,
+                      encode_odds_type(odds_type), encode_combination(combination)))
                 row = cursor.fetchone()
 
                 if row and row.get('odds_value') is not None:
@@ -547,41 +563,76 @@ class VirtualBettingManager:
                     if odds_val > 0:
                         return odds_val
 
-                # 見つからない場合、stadium_codeを2桁にパディングして再試行
-                if len(str(stadium_code)) == 1:
-                    padded_code = f"0{stadium_code}"
-                else:
-                    padded_code = str(stadium_code).zfill(2)
+                return None
+        except Exception as e:
+            logger.error(f"オッズ取得エラー: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def begin_odds_pass(self):
+        """購入判断パスを開始（レースごとのオッズスナップショットをメモする）"""
+        self._odds_pass = {'db': {}, 'web': {}}
+
+    def end_odds_pass(self):
+        """購入判断パスを終了（メモを破棄）"""
+        self._odds_pass = None
+
+    @staticmethod
+    def _odds_snapshot_key(race_date: str, stadium_code: str, race_number: int) -> Tuple[str, str, int]:
+        """スナップショットのキー（YYYYMMDD, 2桁の場コード, レース番号）"""
+        return (str(race_date).replace('-', ''), str(stadium_code).zfill(2), int(race_number))
+
+    def _get_odds_snapshot(self, race_date: str, stadium_code: str,
+                           race_number: int) -> Dict[Tuple[str, str], float]:
+        """
+        レースの最新オッズ一式を1クエリで取得（購入判断パス中はメモ）
+
+        Returns:
+            (オッズタイプ, 買い目) -> 最新オッズ
+        """
+        key = self._odds_snapshot_key(race_date, stadium_code, race_number)
+        snapshots = self._odds_pass['db'] if self._odds_pass is not None else {}
+        if key in snapshots:
+            return snapshots[key]
+
+        date_str, padded_code, race_no = key
+        race_date_formatted = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]}"
+
+        snapshot = {}
+        conn = self.get_db_connection()
+        if not conn:
+            return snapshot
 
+        try:
+            with conn.cursor() as cursor:
                 cursor.execute("""
-                    SELECT odds_value FROM odds_history
+                    SELECT odds_type, combination, odds_value
+                    FROM odds_latest
                     WHERE race_date = %s
                     AND stadium_code = %s
                     AND race_number = %s
-                    AND odds_type = %s
-                    AND combination = %s
-                    ORDER BY scraped_at DESC
-                    LIMIT 1
-                """, (race_date_formatted, padded_code, race_number, db_odds_type, normalized_combination))
-                row = cursor.fetchone()
-
-                if row and row.get('odds_value') is not None:
-                    odds_val = float(row['odds_value'])
-                    if odds_val > 0:
-                        return odds_val
-
-                return None
+                    AND odds_value IS NOT NULL
+                """, (race_date_formatted, encode_stadium(padded_code), race_no))
+                for row in cursor.fetchall():
+                    key_type = decode_odds_type(row['odds_type'])
+                    snapshot[(key_type, decode_combination(row['combination']))] = float(row['odds_value'])
         except Exception as e:
             logger.error(f"オッズ取得エラー: {e}")
-            return None
+            return snapshot
         finally:
             conn.close()
 
+        snapshots[key] = snapshot
+        return snapshot
+
     def fetch_odds_from_website(self, race_date: str, stadium_code: str, race_number: int,
                                   odds_type: str, combination: str) -> Optional[float]:
         """
         競艇公式サイトから直接オッズを取得する（DBにない場合のフォールバック）
 
+        購入判断パス中はページごとに1回だけ取得・パースし、以降はメモから返す
+
         Args:
             race_date: レース日（YYYYMMDD形式）
             stadium_code: 競艇場コード
@@ -592,6 +643,38 @@ class VirtualBettingManager:
         Returns:
             オッズ（取得できない場合はNone）
         """
+        if odds_type in ['2t', '2f']:
+            page = 'odds2tf'  # 2連単・2連複オッズページ
+        elif odds_type == 'win':
+            page = 'oddstf'  # 単勝・複勝オッズページ
+        else:
+            logger.warning(f"未対応のオッズタイプ: {odds_type}")
+            return None
+
+        # 組み合わせを正規化
+        normalized_combination = combination.replace('=', '-')
+
+        if self._odds_pass is not None:
+            key = self._odds_snapshot_key(race_date, stadium_code, race_number) + (page,)
+            if key not in self._odds_pass['web']:
+                self._odds_pass['web'][key] = self._fetch_odds_page(race_date, stadium_code, race_number, page)
+            odds_table = self._odds_pass['web'][key]
+        else:
+            odds_table = self._fetch_odds_page(race_date, stadium_code, race_number, page)
+
+        odds_val = odds_table.get((odds_type, normalized_combination))
+        if odds_val:
+            logger.info(f"  -> Webから取得成功: {odds_type} {normalized_combination} = {odds_val}")
+        return odds_val
+
+    def _fetch_odds_page(self, race_date: str, stadium_code: str, race_number: int,
+                         page: str) -> Dict[Tuple[str, str], float]:
+        """
+        オッズページを取得してページ内の全オッズをパース
+
+        Returns:
+            (オッズタイプ, 買い目) -> オッズ（取得失敗時は空）
+        """
         try:
             # race_dateをYYYYMMDD形式に統一
             if '-' in race_date:
@@ -601,169 +684,69 @@ class VirtualBettingManager:
             padded_code = str(stadium_code).zfill(2)
 
             BASE_URL = "https://www.boatrace.jp/owpc/pc/race"
-
-            if odds_type in ['2t', '2f']:
-                # 2連単・2連複オッズページ
-                url = f"{BASE_URL}/odds2tf?rno={race_number}&jcd={padded_code}&hd={race_date}"
-            elif odds_type == 'win':
-                # 単勝・複勝オッズページ
-                url = f"{BASE_URL}/oddstf?rno={race_number}&jcd={padded_code}&hd={race_date}"
-            else:
-                logger.warning(f"未対応のオッズタイプ: {odds_type}")
-                return None
+            url = f"{BASE_URL}/{page}?rno={race_number}&jcd={padded_code}&hd={race_date}"
 
             logger.info(f"Webサイトからオッズ取得: {url}")
 
             response = requests.get(url, timeout=10)
             if response.status_code != 200:
                 logger.warning(f"オッズページ取得失敗: status={response.status_code}")
-                return None
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # 組み合わせを正規化
-            normalized_combination = combination.replace('=', '-')
+                return {}
 
-            if odds_type in ['2t', '2f']:
-                return self._parse_2tf_odds(soup, odds_type, normalized_combination)
-            elif odds_type == 'win':
-                return self._parse_win_odds(soup, normalized_combination)
-
-            return None
+            if page == 'odds2tf':
+                return self._parse_2tf_odds(response.text)
+            return self._parse_win_odds(response.text)
 
         except Exception as e:
             logger.error(f"Webサイトからのオッズ取得エラー: {e}")
-            return None
+            return {}
 
-    def _parse_2tf_odds(self, soup: BeautifulSoup, odds_type: str, combination: str) -> Optional[float]:
+    def _parse_2tf_odds(self, html: str) -> Dict[Tuple[str, str], float]:
         """
         2連単・2連複オッズをパース
 
         Args:
-            soup: BeautifulSoupオブジェクト
-            odds_type: '2t'（2連単）または'2f'（2連複）
-            combination: 買い目（"1-3"形式）
+            html: odds2tf ページのHTML
 
         Returns:
-            オッズ値
+            ('2t' または '2f', "1-3"形式の買い目) -> オッズ値
         """
+        odds_table = {}
         try:
-            # 組み合わせを分解
-            parts = combination.split('-')
-            if len(parts) != 2:
-                return None
-
-            first_boat = int(parts[0])
-            second_boat = int(parts[1])
-
-            # テーブルを取得
-            tables = soup.find_all('table')
-
-            # 2連単は2番目のテーブル、2連複は1番目のテーブル
-            target_table_idx = 1 if odds_type == '2t' else 0
-
-            for table_idx, table in enumerate(tables):
-                rows = table.find_all('tr')
-                if len(rows) < 2:
-                    continue
-
-                first_row = rows[0]
-                first_cells = first_row.find_all(['th', 'td'])
-                if not first_cells:
-                    continue
-
-                has_boat_color = any('is-boatColor' in ' '.join(c.get('class', [])) for c in first_cells)
-                if not has_boat_color:
-                    continue
-
-                # このテーブルがターゲットかチェック
-                current_odds_type = '2t' if table_idx == 1 else '2f'
-                if current_odds_type != odds_type:
-                    continue
-
-                # 1着の艇番を取得
-                first_place_boats = []
-                for i, cell in enumerate(first_cells):
-                    if i % 2 == 0:
-                        text = cell.get_text(strip=True)
-                        if text.isdigit():
-                            first_place_boats.append(int(text))
-
-                # 行を走査して該当する組み合わせを探す
-                for row in rows[1:]:
-                    cells = row.find_all('td')
-                    if not cells:
-                        continue
-
-                    for pair_idx in range(0, len(cells), 2):
-                        if pair_idx + 1 >= len(cells):
-                            break
-
-                        boat_cell = cells[pair_idx]
-                        odds_cell = cells[pair_idx + 1]
-
-                        boat_text = boat_cell.get_text(strip=True)
-                        if not boat_text.isdigit():
-                            continue
-
-                        row_boat = int(boat_text)
-                        col_idx = pair_idx // 2
-
-                        if col_idx < len(first_place_boats):
-                            col_boat = first_place_boats[col_idx]
-
-                            # 組み合わせが一致するかチェック
-                            if col_boat == first_boat and row_boat == second_boat:
-                                odds_text = odds_cell.get_text(strip=True)
-                                odds_val = self._parse_odds_text(odds_text)
-                                if odds_val and odds_val > 0:
-                                    logger.info(f"  -> Webから取得成功: {combination} = {odds_val}")
-                                    return odds_val
-
-            return None
+            for cell in parse_odds_2tf(html):
+                odds_val = self._parse_odds_text(cell['odds_text'])
+                if odds_val and odds_val > 0:
+                    # 最初に見つかった有効なオッズを採用
+                    odds_table.setdefault((cell['odds_type'], f"{cell['first']}-{cell['second']}"), odds_val)
 
         except Exception as e:
             logger.error(f"2連オッズパースエラー: {e}")
-            return None
 
-    def _parse_win_odds(self, soup: BeautifulSoup, combination: str) -> Optional[float]:
+        return odds_table
+
+    def _parse_win_odds(self, html: str) -> Dict[Tuple[str, str], float]:
         """
         単勝オッズをパース
 
         Args:
-            soup: BeautifulSoupオブジェクト
-            combination: 艇番（"1"等）
+            html: oddstf ページのHTML
 
         Returns:
-            オッズ値
+            ('win', 艇番) -> オッズ値
         """
+        odds_table = {}
         try:
-            target_boat = int(combination)
-
-            # 単勝オッズテーブルを探す
-            tables = soup.find_all('table')
-
-            for table in tables:
-                rows = table.find_all('tr')
-                for row in rows:
-                    cells = row.find_all(['th', 'td'])
-                    if len(cells) >= 2:
-                        boat_cell = cells[0]
-                        odds_cell = cells[1]
-
-                        boat_text = boat_cell.get_text(strip=True)
-                        if boat_text.isdigit() and int(boat_text) == target_boat:
-                            odds_text = odds_cell.get_text(strip=True)
-                            odds_val = self._parse_odds_text(odds_text)
-                            if odds_val and odds_val > 0:
-                                logger.info(f"  -> Webから取得成功: 単勝{combination} = {odds_val}")
-                                return odds_val
-
-            return None
+            for cell in parse_odds_tf(html):
+                if cell['odds_type'] != 'win':
+                    continue
+                odds_val = self._parse_odds_text(cell['odds_text'])
+                if odds_val and odds_val > 0:
+                    odds_table.setdefault(('win', str(int(cell['boat']))), odds_val)
 
         except Exception as e:
             logger.error(f"単勝オッズパースエラー: {e}")
-            return None
+
+        return odds_table
 
     def _parse_odds_text(self, text: str) -> Optional[float]:
         """オッズ文字列をパース"""
@@ -824,16 +807,15 @@ class VirtualBettingManager:
 
             with conn.cursor() as cursor:
                 # 締切が過ぎたpendingの購入予定を取得
-                # 型の不一致を解消: virtual_bets.stadium_code(varchar) vs races.stadium_code(smallint)
                 # 締切後30秒経過したものだけを対象とする
+                # 購入判断中（行ロック中）の購入予定はスキップする
                 cursor.execute("""
                     SELECT vb.id, vb.stadium_code, vb.race_number, vb.reason, r.deadline_at
                     FROM virtual_bets vb
-                    JOIN races r ON vb.race_date::date = r.race_date
-                        AND CAST(vb.stadium_code AS smallint) = r.stadium_code
-                        AND vb.race_number = CAST(r.race_number AS integer)
+                    JOIN races r ON r.id = vb.race_id
                     WHERE vb.status = 'pending'
                     AND r.deadline_at < %s
+                    FOR UPDATE OF vb SKIP LOCKED
                 """, (threshold_time,))
                 expired_bets = cursor.fetchall()
 
@@ -968,21 +950,56 @@ class VirtualBettingManager:
         """
         logger.info("=== 締切3分前の購入判断処理開始 ===")
 
-        # 締切3分前の購入予定を取得（通常戦略）
-        # v9.3: 締切超過対策により3分前に拡大
-        pending_bets = self.get_all_pending_bets_near_deadline(minutes_to_deadline=3)
+        # このパス内ではレースごとのオッズを1回だけ取得し、全戦略・全買い目で共有する
+        self.begin_odds_pass()
+        try:
+            # 締切3分前の購入予定を取得（通常戦略）
+            # v9.3: 締切超過対策により3分前に拡大
+            pending_bets = self.get_all_pending_bets_near_deadline(minutes_to_deadline=3)
+
+            if pending_bets:
+                logger.info(f"処理対象（pending）: {len(pending_bets)}件")
+                self._process_pending_bets(pending_bets)
 
-        if pending_bets:
-            logger.info(f"処理対象（pending）: {len(pending_bets)}件")
+            # 両戦略とも締切3分前のレースを直接チェック
+            self._process_bias_1_3_strategy()
+            self._process_win_10x_strategy()
+        finally:
+            self.end_odds_pass()
+
+    def _process_pending_bets(self, pending_bets: List[Dict]):
+        """
+        購入予定を1件ずつ行ロックしてから購入判断する
+
+        SELECT ... FOR UPDATE SKIP LOCKED で購入予定を確保し、判断結果を同じ
+        トランザクションで書き込む。別のプロセスが判断中・判断済みの購入予定は
+        スキップするため、同じ購入予定を二重に判断しない。
+        """
+        conn = self.get_db_connection()
+        if not conn:
+            return
+
+        try:
             for bet in pending_bets:
                 try:
-                    self._process_single_bet(bet)
+                    with conn.cursor() as cursor:
+                        cursor.execute("""
+                            SELECT id FROM virtual_bets
+                            WHERE id = %s AND status = 'pending'
+                            FOR UPDATE SKIP LOCKED
+                        """, (bet['id'],))
+                        if cursor.fetchone() is None:
+                            logger.info(f"判断中または判断済みのためスキップ: bet_id={bet['id']}")
+                            conn.rollback()
+                            continue
+
+                        self._process_single_bet(cursor, bet)
+                    conn.commit()
                 except Exception as e:
                     logger.error(f"購入処理エラー: bet_id={bet['id']}, error={e}")
-
-        # 両戦略とも締切3分前のレースを直接チェック
-        self._process_bias_1_3_strategy()
-        self._process_win_10x_strategy()
+                    conn.rollback()
+        finally:
+            conn.close()
 
     def _process_bias_1_3_strategy(self):
         """
@@ -1019,9 +1036,7 @@ class VirtualBettingManager:
                     AND r.deadline_at <= %s
                     AND NOT EXISTS (
                         SELECT 1 FROM virtual_bets vb
-                        WHERE vb.race_date = r.race_date
-                        AND vb.stadium_code = LPAD(r.stadium_code::text, 2, '0')
-                        AND vb.race_number = r.race_number
+                        WHERE vb.race_id = r.id
                         AND vb.strategy_type = 'bias_1_3_2nd'
                     )
                     ORDER BY r.deadline_at
@@ -1085,12 +1100,12 @@ class VirtualBettingManager:
                     # 購入レコードを作成（confirmed状態で）
                     cursor.execute("""
                         INSERT INTO virtual_bets (
-                            race_date, stadium_code, race_number, strategy_type,
+                            race_id, race_date, stadium_code, race_number, strategy_type,
                             bet_type, combination, amount, odds, status,
                             created_at, updated_at, reason
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     """, (
-                        race_date, stadium_code, race_number, 'bias_1_3_2nd',
+                        race['id'], race_date, stadium_code, race_number, 'bias_1_3_2nd',
                         bet_type, '1-3', strategy.get('base_amount', 1000),
                         selected_odds, 'confirmed',
                         now, now,
@@ -1137,9 +1152,7 @@ class VirtualBettingManager:
                     AND r.deadline_at <= %s
                     AND NOT EXISTS (
                         SELECT 1 FROM virtual_bets vb
-                        WHERE vb.race_date = r.race_date
-                        AND vb.stadium_code = LPAD(r.stadium_code::text, 2, '0')
-                        AND vb.race_number = r.race_number
+                        WHERE vb.race_id = r.id
                         AND vb.strategy_type = 'win_10x_1_3'
                     )
                     ORDER BY r.deadline_at
@@ -1180,12 +1193,12 @@ class VirtualBettingManager:
                     # 直接購入レコードを作成（confirmed状態で）
                     cursor.execute("""
                         INSERT INTO virtual_bets (
-                            race_date, stadium_code, race_number, strategy_type,
+                            race_id, race_date, stadium_code, race_number, strategy_type,
                             bet_type, combination, amount, odds, status,
                             created_at, updated_at, reason
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     """, (
-                        race_date, stadium_code, race_number, 'win_10x_1_3',
+                        race['id'], race_date, stadium_code, race_number, 'win_10x_1_3',
                         'exacta', '1-3', strategy.get('base_amount', 1000),
                         exacta_odds, 'confirmed',
                         now, now,
@@ -1199,8 +1212,14 @@ class VirtualBettingManager:
             logger.error(f"win_10x_1_3戦略エラー: {e}")
             conn.rollback()
 
-    def _process_single_bet(self, bet: Dict):
-        """単一の購入予定を処理"""
+    def _process_single_bet(self, cursor, bet: Dict):
+        """
+        単一の購入予定を処理
+
+        Args:
+            cursor: 購入予定の行ロックを保持している接続のカーソル
+            bet: 購入予定
+        """
         bet_id = bet['id']
         strategy_type = bet['strategy_type']
         # virtual_betsテーブルはキャメルケースのカラム名を使用
@@ -1217,7 +1236,7 @@ class VirtualBettingManager:
             local_win_rate = self.get_boat1_local_win_rate(race_date, stadium_code, race_number)
 
             if local_win_rate is None:
-                self.skip_bet(bet_id, "当地勝率取得失敗")
+                self._skip_bet(cursor, bet_id, "当地勝率取得失敗")
                 return
 
             strategy_config = STRATEGIES.get(strategy_type, {})
@@ -1226,7 +1245,7 @@ class VirtualBettingManager:
             max_rate = strategy_config.get('max_local_win_rate', 6.0)
 
             if not (min_rate <= local_win_rate < max_rate):
-                self.skip_bet(bet_id, f"当地勝率範囲外: {local_win_rate} (基準: {min_rate}-{max_rate})")
+                self._skip_bet(cursor, bet_id, f"当地勝率範囲外: {local_win_rate} (基準: {min_rate}-{max_rate})")
                 return
 
         elif strategy_type == 'win_10x_1_3':
@@ -1234,14 +1253,14 @@ class VirtualBettingManager:
             win_odds = self.get_odds_with_fallback(race_date, stadium_code, race_number, 'win', '1')
 
             if win_odds is None:
-                self.skip_bet(bet_id, "1号艇単勝オッズ取得失敗")
+                self._skip_bet(cursor, bet_id, "1号艇単勝オッズ取得失敗")
                 return
 
             strategy_config = STRATEGIES.get(strategy_type, {})
             min_win_odds = strategy_config.get('min_win_odds', 10.0)
 
             if win_odds < min_win_odds:
-                self.skip_bet(bet_id, f"1号艇単勝オッズ不足: {win_odds} < {min_win_odds}")
+                self._skip_bet(cursor, bet_id, f"1号艇単勝オッズ不足: {win_odds} < {min_win_odds}")
                 return
 
             logger.info(f"  1号艇単勝オッズ条件クリア: {win_odds} >= {min_win_odds}")
@@ -1256,7 +1275,7 @@ class VirtualBettingManager:
 
             if odds_2t is None and odds_2f is None:
                 logger.warning(f"オッズ取得失敗: {stadium_code} {race_number}R {combination} (2連単/2連複両方なし)")
-                self.skip_bet(bet_id, "オッズ取得失敗")
+                self._skip_bet(cursor, bet_id, "オッズ取得失敗")
                 return
 
             # 高い方を選択（Noneの場合は0として比較）
@@ -1282,7 +1301,7 @@ class VirtualBettingManager:
 
         if final_odds is None:
             logger.warning(f"オッズ取得失敗: {stadium_code} {race_number}R {combination}")
-            self.skip_bet(bet_id, "オッズ取得失敗")
+            self._skip_bet(cursor, bet_id, "オッズ取得失敗")
             return
 
         # 戦略設定を取得
@@ -1306,11 +1325,11 @@ class VirtualBettingManager:
         if final_odds < min_odds:
             reason['decision'] = 'skipped'
             reason['skipReason'] = f'オッズが低すぎる ({final_odds} < {min_odds})'
-            self.skip_bet(bet_id, reason['skipReason'])
+            self._skip_bet(cursor, bet_id, reason['skipReason'])
         elif final_odds > max_odds:
             reason['decision'] = 'skipped'
             reason['skipReason'] = f'オッズが高すぎる ({final_odds} > {max_odds})'
-            self.skip_bet(bet_id, reason['skipReason'])
+            self._skip_bet(cursor, bet_id, reason['skipReason'])
         else:
             # 期待値計算（単勝戦略の場合）
             if strategy_type == '11r12r_win':
@@ -1322,19 +1341,19 @@ class VirtualBettingManager:
                 if expected_value < strategy.get('min_expected_value', 1.0):
                     reason['decision'] = 'skipped'
                     reason['skipReason'] = f'期待値が低い ({expected_value:.2f} < 1.0)'
-                    self.skip_bet(bet_id, reason['skipReason'])
+                    self._skip_bet(cursor, bet_id, reason['skipReason'])
                     return
 
             reason['decision'] = 'confirmed'
-            self.confirm_bet(bet_id, final_odds, reason)
+            self._confirm_bet(cursor, bet_id, final_odds, reason)
 
     def process_results(self):
         """
         確定済みレースの結果を更新する
 
-        - confirmedステータスのレースを取得
-        - 結果を確認
-        - won/lostに更新し、資金を反映
+        - confirmedステータスで結果未確定の購入を、レース結果と1回のクエリで結合して取得
+        - 的中判定は settlement.judge_bet（精算エンジンと同じ規則）
+        - won/lost への更新は1回のバルクUPDATEで反映
         """
         logger.info("=== 結果更新処理開始 ===")
 
@@ -1344,121 +1363,50 @@ class VirtualBettingManager:
 
         try:
             with conn.cursor() as cursor:
-                # 確定済みで結果未確定のレースを取得
+                # 確定済みで結果未確定の購入と、1着・2着が出ているレース結果を結合
                 cursor.execute("""
-                    SELECT * FROM virtual_bets
-                    WHERE status = 'confirmed'
-                    AND result_confirmed_at IS NULL
+                    SELECT vb.id, vb.bet_type, vb.combination, vb.amount, vb.final_odds,
+                           rr.first_place, rr.second_place
+                    FROM virtual_bets vb
+                    JOIN race_results rr ON rr.race_id = vb.race_id
+                    WHERE vb.status = 'confirmed'
+                    AND vb.result_confirmed_at IS NULL
+                    AND rr.first_place IS NOT NULL
+                    AND rr.second_place IS NOT NULL
                 """)
-                confirmed_bets = cursor.fetchall()
-        finally:
-            conn.close()
-
-        if not confirmed_bets:
-            logger.info("結果待ちの購入がありません")
-            return
-
-        logger.info(f"結果確認対象: {len(confirmed_bets)}件")
-
-        for bet in confirmed_bets:
-            try:
-                self._process_single_result(bet)
-            except Exception as e:
-                logger.error(f"結果処理エラー: bet_id={bet['id']}, error={e}")
-
-    def _process_single_result(self, bet: Dict):
-        """単一の結果を処理"""
-        bet_id = bet['id']
-        race_date = bet['race_date'].strftime('%Y-%m-%d') if hasattr(bet['race_date'], 'strftime') else str(bet['race_date'])
-        stadium_code = bet['stadium_code']
-        race_number = bet['race_number']
-        combination = bet['combination']
-        bet_type = bet['bet_type']
-        amount = float(bet.get('amount', 1000))
-        final_odds = float(bet.get('final_odds', 0) or 0)
-
-        logger.info(f"結果確認: {stadium_code} {race_number}R {combination}")
-
-        # レース結果を取得
-        result = self._get_race_result(race_date, stadium_code, race_number)
+                bets = cursor.fetchall()
 
-        if not result:
-            logger.info(f"  結果未確定")
-            return
-
-        # 的中判定
-        is_won = self._check_win(combination, bet_type, result)
-
-        if is_won:
-            # 払戻金を計算
-            payout = int(amount * final_odds)
-            logger.info(f"  的中！ 払戻金: {payout}円")
-        else:
-            payout = 0
-            logger.info(f"  不的中")
-
-        self.update_result(bet_id, is_won, payout)
-
-    def _get_race_result(self, race_date: str, stadium_code: str, race_number: int) -> Optional[Dict]:
-        """レース結果を取得（racesテーブル経由でrace_idを取得してからrace_resultsを検索）"""
-        conn = self.get_db_connection()
-        if not conn:
-            return None
-
-        try:
-            with conn.cursor() as cursor:
-                # まずracesテーブルからrace_idを取得
-                cursor.execute("""
-                    SELECT id FROM races
-                    WHERE race_date = %s::date
-                    AND stadium_code = %s
-                    AND race_number = %s
-                """, (race_date, stadium_code, race_number))
-                race_row = cursor.fetchone()
-
-                if not race_row:
-                    logger.debug(f"レースが見つかりません: {race_date} {stadium_code} {race_number}R")
-                    return None
+                if not bets:
+                    logger.info("結果待ちの購入がありません")
+                    return
 
-                race_id = race_row['id']
+                updates = []
+                for bet in bets:
+                    is_won, _ = judge_bet(bet['bet_type'], bet['combination'],
+                                          bet['first_place'], bet['second_place'])
+                    # 払戻金 = 購入額 × 確定オッズ
+                    payout = int(float(bet['amount'] or 1000) * float(bet['final_odds'] or 0)) if is_won else 0
+                    updates.append((bet['id'], 'won' if is_won else 'lost', payout))
+
+                execute_values(cursor, """
+                    UPDATE virtual_bets AS vb
+                    SET status = v.status,
+                        payout = v.payout,
+                        result_confirmed_at = NOW(),
+                        updated_at = NOW()
+                    FROM (VALUES %s) AS v(id, status, payout)
+                    WHERE vb.id = v.id
+                """, updates)
+            conn.commit()
 
-                # race_resultsテーブルから結果を取得
-                cursor.execute("""
-                    SELECT * FROM race_results
-                    WHERE race_id = %s
-                """, (race_id,))
-                return cursor.fetchone()
+            won = sum(1 for u in updates if u[1] == 'won')
+            logger.info(f"結果更新完了: {len(updates)}件（的中{won}件）")
         except Exception as e:
-            logger.error(f"結果取得エラー: {e}")
-            return None
+            logger.error(f"結果処理エラー: {e}")
+            conn.rollback()
         finally:
             conn.close()
 
-    def _check_win(self, combination: str, bet_type: str, result: Dict) -> bool:
-        """的中判定"""
-        if not result:
-            return False
-
-        # 結果の着順を取得
-        first = str(result.get('first_place', ''))
-        second = str(result.get('second_place', ''))
-        third = str(result.get('third_place', ''))
-
-        if bet_type == 'win':
-            # 単勝: 1着が一致
-            return combination == first
-        elif bet_type == 'quinella':
-            # 2連複: 1-2着の組み合わせ（順不同）
-            combo_set = set(combination.replace('=', '-').split('-'))
-            result_set = {first, second}
-            return combo_set == result_set
-        elif bet_type == 'exacta':
-            # 2連単: 1-2着の順番が一致
-            combo_parts = combination.replace('=', '-').split('-')
-            return combo_parts[0] == first and combo_parts[1] == second
-
-        return False
-
     def get_summary(self, race_date: str = None) -> Dict:
         """
         購入サマリーを取得
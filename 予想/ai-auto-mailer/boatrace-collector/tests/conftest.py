@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src/ のモジュールをそのまま import できるようにする
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -0,0 +1,97 @@
+"""
+page_parser のゴールデンファイルテスト
+
+fixtures/<ページ種別>.html をパースした結果が fixtures/<ページ種別>.json と一致することを確認する。
+HTML は boatrace.jp の各ページのマークアップ（パース対象の表まわり）を固定値で再現したもの。
+パーサの仕様を変えた場合は、差分を確認してから .json を更新する。
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip('lxml')
+
+import page_parser  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_html(page: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, f'{page}.html'), encoding='utf-8') as f:
+        return f.read()
+
+
+def read_expected(page: str) -> dict:
+    with open(os.path.join(FIXTURE_DIR, f'{page}.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def normalize(value):
+    """JSON と同じ形にする（タプルはリスト、dict のキーは文字列）"""
+    return json.loads(json.dumps(value, ensure_ascii=False))
+
+
+@pytest.mark.parametrize('page, parser, args', [
+    ('odds2tf', 'parse_odds_2tf', ()),
+    ('odds2tf', 'parse_deadlines', ()),
+    ('oddstf', 'parse_odds_tf', ()),
+    ('odds3t', 'parse_odds_3tf', ('3t',)),
+    ('odds3f', 'parse_odds_3tf', ('3f',)),
+    ('raceresult', 'parse_race_result', ()),
+    ('resultlist', 'parse_result_list', ()),
+    ('beforeinfo', 'parse_beforeinfo', ()),
+])
+def test_matches_golden_file(page, parser, args):
+    result = getattr(page_parser, parser)(read_html(page), *args)
+    assert normalize(result) == read_expected(page)[parser]
+
+
+def test_odds_2tf_types_and_disabled_cells():
+    cells = page_parser.parse_odds_2tf(read_html('odds2tf'))
+    exacta = [c for c in cells if c['odds_type'] == '2t']
+    quinella = [c for c in cells if c['odds_type'] == '2f' and not c['disabled']]
+
+    assert len(exacta) == 30
+    assert {(c['first'], c['second']) for c in quinella} == {
+        (a, b) for a in range(1, 7) for b in range(a + 1, 7)}
+    absent = [c for c in exacta if c['disabled']]
+    assert [(c['first'], c['second'], c['odds_text']) for c in absent] == [(6, 5, '欠場')]
+
+
+def test_odds_3t_carries_rowspan_second_place():
+    cells = page_parser.parse_odds_3tf(read_html('odds3t'), '3t')
+    combos = {(c['first'], c['second'], c['third']): c for c in cells}
+
+    assert len(combos) == 120
+    assert combos[(1, 2, 3)]['odds_text'] == '123.3'
+    # 2着のセルは rowspan=4 で、4行目の組み合わせも同じ2着を引き継ぐ
+    assert combos[(3, 1, 6)]['odds_text'] == '316.6'
+    assert combos[(6, 4, 5)]['disabled']
+
+
+def test_odds_3f_has_twenty_open_combinations():
+    cells = page_parser.parse_odds_3tf(read_html('odds3f'), '3f')
+    open_cells = {(c['first'], c['second'], c['third']) for c in cells if not c['disabled']}
+
+    assert open_cells == {(a, b, c) for a in range(1, 7) for b in range(a + 1, 7) for c in range(b + 1, 7)}
+
+
+def test_race_result_skips_unranked_boat():
+    result = page_parser.parse_race_result(read_html('raceresult'))
+
+    assert sorted(result['result']) == ['1', '2', '3', '4', '6']
+    assert result['payoff']['3連単'] == {'result': '1-4-2', 'payoff': 2870, 'popularity': 9}
+    assert [p['result'] for p in result['payoff']['ワイド_list']] == ['1=4', '1=2', '2=4']
+
+
+def test_result_list_places_and_cancelled_race():
+    races = page_parser.parse_result_list(read_html('resultlist'))
+
+    assert sorted(races) == [1, 2, 3, 12]
+    assert races[2]['places'] == [3, 1, 6]
+    assert races[2]['payoff']['3連単']['payoff'] == 45600
+    assert races[3] == {'places': [], 'payoff': {}}
+    # 2組が1セルに入った複勝は読まない
+    assert '複勝' not in races[1]['payoff']
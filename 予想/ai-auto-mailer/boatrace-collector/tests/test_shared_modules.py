@@ -0,0 +1,32 @@
+"""
+collector と dashboard で共有しているモジュールのコピーが一致していることを確認する
+
+両サービスは別々にデプロイするため、共通モジュールは同じ内容を両方に置いている。
+片方だけを変更した場合にここで検出する。
+"""
+
+import hashlib
+import os
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+
+# (collector 側, dashboard 側)
+SHARED_MODULES = [
+    ('boatrace-collector/src/db_pool.py', 'boatrace-dashboard/db_pool.py'),
+    ('boatrace-collector/src/settlement.py', 'boatrace-dashboard/settlement.py'),
+]
+
+
+def sha256(path: str) -> str:
+    with open(os.path.join(ROOT, path), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.mark.parametrize('collector_path,dashboard_path', SHARED_MODULES)
+def test_shared_module_copies_match(collector_path, dashboard_path):
+    if not os.path.exists(os.path.join(ROOT, dashboard_path)):
+        pytest.skip(f'{dashboard_path} がありません')
+    assert sha256(collector_path) == sha256(dashboard_path), \
+        f'{collector_path} と {dashboard_path} の内容が異なります（両方を揃えてください）'
@@ -5,6 +5,7 @@ PostgreSQL（kokotomo-db-staging）のみを使用
 
 import os
 import json
+import asyncio
 from datetime import datetime, date, timedelta, timezone
 from typing import List, Optional, Dict, Any
 from decimal import Decimal
@@ -12,11 +13,16 @@ from decimal import Decimal
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from db_pool import get_connection
+import db_async
+import stats_cache
+from stats_cache import cached_stats
+from live_feed import get_feed
+
 app = FastAPI(title="競艇予想ダッシュボード API")
 
 # CORS設定
@@ -31,6 +37,12 @@ app.add_middleware(
 # データベース接続
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    """非同期DBプールを閉じる"""
+    await db_async.close_pool()
+
 # タイムゾーン設定
 JST = timezone(timedelta(hours=9))
 
@@ -44,7 +56,7 @@ def get_db_connection():
     """データベース接続を取得"""
     if not DATABASE_URL:
         raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return get_connection(DATABASE_URL, cursor_factory=RealDictCursor)
 
 
 def decimal_to_float(obj):
@@ -193,155 +205,29 @@ def get_today_races():
 
 
 @app.get("/api/races/today/with-odds")
-def get_today_races_with_odds():
-    """今日のレース一覧（単勝・2連複オッズ付き）を取得"""
-    today = get_adjusted_date()
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            # 今日のレース一覧を取得
-            cur.execute("""
-                SELECT r.id, r.race_date, r.stadium_code, s.name as stadium_name,
-                       r.race_number, r.title, r.deadline_at, r.is_canceled
-                FROM races r
-                JOIN stadiums s ON r.stadium_code = s.stadium_code
-                WHERE r.race_date = %s
-                ORDER BY r.stadium_code, r.race_number
-            """, (today,))
-            races = cur.fetchall()
-
-            # レース結果を取得
-            cur.execute("""
-                SELECT rr.race_id, rr.first_place, rr.second_place, rr.third_place, rr.race_status
-                FROM race_results rr
-                JOIN races r ON rr.race_id = r.id
-                WHERE r.race_date = %s
-            """, (today,))
-            results_map = {row['race_id']: row for row in cur.fetchall()}
-
-            # 払戻金を取得
-            cur.execute("""
-                SELECT p.race_id, p.bet_type, p.combination, p.payoff
-                FROM payoffs p
-                JOIN races r ON p.race_id = r.id
-                WHERE r.race_date = %s
-            """, (today,))
+async def get_today_races_with_odds():
+    """今日のレース一覧（単勝・2連複オッズ付き）を取得（live_feed が保持する当日の状態を返す）"""
+    if not DATABASE_URL:
+        raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
+    feed = get_feed()
+    await feed.ready()
+    return feed.races()
 
-            # bet_type名を正規化するマッピング
-            bet_type_normalize = {
-                '単勝': 'win', 'win': 'win',
-                '複勝': 'place', 'place': 'place',
-                '2連単': 'exacta', '２連単': 'exacta', 'exacta': 'exacta',
-                '2連複': 'quinella', '２連複': 'quinella', 'quinella': 'quinella',
-                'ワイド': 'wide', '拡連複': 'wide', 'wide': 'wide',
-                '3連単': 'trifecta', '３連単': 'trifecta', 'trifecta': 'trifecta',
-                '3連複': 'trio', '３連複': 'trio', 'trio': 'trio'
-            }
 
-            payoffs_map = {}
-            for row in cur.fetchall():
-                race_id = row['race_id']
-                if race_id not in payoffs_map:
-                    payoffs_map[race_id] = {}
-                # bet_typeを正規化
-                bet_type = bet_type_normalize.get(row['bet_type'], row['bet_type'])
-                if bet_type not in payoffs_map[race_id]:
-                    payoffs_map[race_id][bet_type] = []
-                payoffs_map[race_id][bet_type].append({
-                    'combination': row['combination'],
-                    'payoff': row['payoff']
-                })
-
-            # 最新オッズを取得（単勝と2連複）
-            cur.execute("""
-                WITH latest_odds AS (
-                    SELECT race_date, stadium_code, race_number, odds_type, combination, odds_value,
-                           ROW_NUMBER() OVER (
-                               PARTITION BY race_date, stadium_code, race_number, odds_type, combination
-                               ORDER BY scraped_at DESC
-                           ) as rn
-                    FROM odds_history
-                    WHERE race_date = %s AND odds_type IN ('win', '2f')
-                )
-                SELECT race_date, stadium_code, race_number, odds_type, combination, odds_value
-                FROM latest_odds
-                WHERE rn = 1
-            """, (today,))
-
-            odds_map = {}
-            for row in cur.fetchall():
-                key = (row['stadium_code'], row['race_number'])
-                if key not in odds_map:
-                    odds_map[key] = {'win': {}, '2f': {}}
-                odds_type = row['odds_type']
-                odds_map[key][odds_type][row['combination']] = float(row['odds_value']) if row['odds_value'] else None
-
-            # レース情報を組み立て
-            result = []
-            for race in races:
-                race_id = race['id']
-                stadium_code = str(race['stadium_code']).zfill(2)
-                race_number = race['race_number']
-                key = (stadium_code, race_number)
-
-                odds_data = odds_map.get(key, {'win': {}, '2f': {}})
-                race_result = results_map.get(race_id)
-                payoffs = payoffs_map.get(race_id, {})
-
-                # レース状態を判定（現在時刻ベース）
-                # aware datetime(JST)で統一して比較
-                now = datetime.now(JST)
-                deadline = race['deadline_at']
-                # deadlineがnaiveの場合はJSTとして扱う
-                if deadline and deadline.tzinfo is None:
-                    deadline = deadline.replace(tzinfo=JST)
-                status = 'upcoming'
-
-                if race['is_canceled']:
-                    status = 'canceled'
-                elif race_result and race_result.get('first_place'):
-                    # 結果が入っていれば確定
-                    status = 'finished'
-                elif deadline and deadline.tzinfo is not None:
-                    # 締切時刻から判定（deadlineはawareに変換済み）
-                    minutes_since_deadline = (now - deadline).total_seconds() / 60
-                    if minutes_since_deadline > 10:
-                        # 締切から10分以上経過 → 確定（結果待ち）
-                        status = 'finished'
-                    elif minutes_since_deadline > 0:
-                        # 締切後10分以内 → レース中
-                        status = 'in_progress'
-                    # それ以外は発売中(upcoming)
-
-                result.append({
-                    'id': race_id,
-                    'race_date': str(race['race_date']),
-                    'stadium_code': race['stadium_code'],
-                    'stadium_name': race['stadium_name'],
-                    'race_number': race_number,
-                    'title': race['title'],
-                    'deadline_at': race['deadline_at'].isoformat() if race['deadline_at'] else None,
-                    'status': status,
-                    'result': {
-                        'first': race_result['first_place'] if race_result else None,
-                        'second': race_result['second_place'] if race_result else None,
-                        'third': race_result['third_place'] if race_result else None,
-                    } if race_result else None,
-                    'odds': {
-                        'win': odds_data.get('win', {}),
-                        'quinella': odds_data.get('2f', {})  # 2連複
-                    },
-                    'payoffs': {
-                        'win': payoffs.get('win', []),
-                        'place': payoffs.get('place', []),  # 複勝（2組）
-                        'quinella': payoffs.get('quinella', []),
-                        'wide': payoffs.get('wide', []),  # ワイド（3組）
-                    }
-                })
+@app.get("/api/races/today/stream")
+async def stream_today_races():
+    """
+    今日のレース一覧のライブ配信（Server-Sent Events）
 
-            return result
-    finally:
-        conn.close()
+    接続直後に snapshot（with-odds と同じ一覧）を送り、以降はオッズ・状態・結果の差分だけを送る。
+    """
+    if not DATABASE_URL:
+        raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
+    return StreamingResponse(
+        get_feed().stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/api/races/{race_date}", response_model=List[RaceInfo])
@@ -500,107 +386,125 @@ def get_virtual_funds():
         conn.close()
 
 
-@app.get("/api/stats/dashboard", response_model=DashboardStats)
-def get_dashboard_stats():
-    """ダッシュボード統計を取得"""
-    today = get_adjusted_date()
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            # 今日のレース数
-            cur.execute("SELECT COUNT(*) as cnt FROM races WHERE race_date = %s", (today,))
-            total_races_today = cur.fetchone()['cnt']
+def summarize_by_status(rows) -> Dict[str, Dict[str, float]]:
+    """virtual_bets_summary の集計行を状態ごとの辞書にする"""
+    return {
+        row['status']: {
+            'count': int(row['cnt']),
+            'bet_amount': float(row['bet_amount']),
+            'return_amount': float(row['return_amount']),
+            'profit': float(row['profit']),
+        }
+        for row in rows
+    }
 
-            # 完了したレース数
-            cur.execute("""
-                SELECT COUNT(*) as cnt FROM races r
-                JOIN race_results rr ON r.id = rr.race_id
-                WHERE r.race_date = %s
-            """, (today,))
-            completed_races = cur.fetchone()['cnt']
 
-            # 今日の購入状況
-            cur.execute("""
-                SELECT status, COUNT(*) as cnt, COALESCE(SUM(profit), 0) as profit
-                FROM virtual_bets
-                WHERE race_date = %s
-                GROUP BY status
-            """, (today,))
-            status_counts = {row['status']: {'count': row['cnt'], 'profit': float(row['profit'])} for row in cur.fetchall()}
+def settled_totals(by_status: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """的中・不的中（won/lost）の件数と金額を合計"""
+    won = by_status.get('won', {})
+    lost = by_status.get('lost', {})
+    return {
+        'hits': won.get('count', 0),
+        'losses': lost.get('count', 0),
+        'bet_amount': won.get('bet_amount', 0) + lost.get('bet_amount', 0),
+        'return_amount': won.get('return_amount', 0) + lost.get('return_amount', 0),
+        'profit': won.get('profit', 0) + lost.get('profit', 0),
+    }
 
-            pending_bets = status_counts.get('pending', {}).get('count', 0)
-            confirmed_bets = status_counts.get('confirmed', {}).get('count', 0)
-            won_bets = status_counts.get('won', {}).get('count', 0)
-            lost_bets = status_counts.get('lost', {}).get('count', 0)
-            skipped_bets = status_counts.get('skipped', {}).get('count', 0)
 
-            today_profit = sum(s.get('profit', 0) for s in status_counts.values())
+@app.get("/api/stats/dashboard", response_model=DashboardStats)
+@cached_stats
+async def get_dashboard_stats():
+    """
+    ダッシュボード統計を取得
 
-            # 今日の詳細統計
-            cur.execute("""
-                SELECT
-                    COUNT(CASE WHEN status IN ('won', 'lost') THEN 1 END) as today_bet_count,
-                    COUNT(CASE WHEN status = 'won' THEN 1 END) as today_hit_count,
-                    COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN bet_amount ELSE 0 END), 0) as today_bet_amount,
-                    COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN return_amount ELSE 0 END), 0) as today_return_amount
-                FROM virtual_bets
-                WHERE race_date = %s
-            """, (today,))
-            today_stats = cur.fetchone()
-            today_bet_count = today_stats['today_bet_count']
-            today_hit_count = today_stats['today_hit_count']
-            today_hit_rate = (today_hit_count / today_bet_count * 100) if today_bet_count > 0 else 0
-            today_bet_amount = float(today_stats['today_bet_amount'])
-            today_return_amount = float(today_stats['today_return_amount'])
-            today_return_rate = (today_return_amount / today_bet_amount * 100) if today_bet_amount > 0 else 0
-
-            # 全体統計（累計）
-            cur.execute("""
-                SELECT
-                    COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN profit ELSE 0 END), 0) as total_profit,
-                    COUNT(CASE WHEN status IN ('won', 'lost') THEN 1 END) as total_bets,
-                    COUNT(CASE WHEN status = 'won' THEN 1 END) as total_hits,
-                    COUNT(CASE WHEN status = 'lost' THEN 1 END) as total_lost,
-                    COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN bet_amount ELSE 0 END), 0) as total_bet_amount,
-                    COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN return_amount ELSE 0 END), 0) as total_return_amount
-                FROM virtual_bets
-            """)
-            totals = cur.fetchone()
-
-            total_profit = float(totals['total_profit'])
-            total_bet_count = totals['total_bets']
-            total_hit_count = totals['total_hits']
-            total_won_count = totals['total_hits']  # 累計的中数
-            total_lost_count = totals['total_lost']  # 累計不的中数
-            hit_rate = (total_hit_count / total_bet_count * 100) if total_bet_count > 0 else 0
-            total_bet_amount = float(totals['total_bet_amount'])
-            total_return_amount = float(totals['total_return_amount'])
-            return_rate = (total_return_amount / total_bet_amount * 100) if total_bet_amount > 0 else 0
-
-            return DashboardStats(
-                total_races_today=total_races_today,
-                completed_races=completed_races,
-                pending_bets=pending_bets,
-                confirmed_bets=confirmed_bets,
-                won_bets=won_bets,
-                lost_bets=lost_bets,
-                skipped_bets=skipped_bets,
-                today_profit=today_profit,
-                today_bet_count=today_bet_count,
-                today_hit_count=today_hit_count,
-                today_hit_rate=today_hit_rate,
-                today_return_rate=today_return_rate,
-                total_profit=total_profit,
-                total_bet_count=total_bet_count,
-                total_hit_count=total_hit_count,
-                total_won_count=total_won_count,
-                total_lost_count=total_lost_count,
-                total_bet_amount=total_bet_amount,
-                hit_rate=hit_rate,
-                return_rate=return_rate
-            )
-    finally:
-        conn.close()
+    購入の件数・金額は virtual_bets_summary（トリガーで差分更新される集計テーブル）から読む。
+    互いに依存しない4つの集計は並列に実行する。
+    """
+    if not DATABASE_URL:
+        raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
+    today = get_adjusted_date()
+
+    total_races_today, completed_races, today_rows, total_rows = await asyncio.gather(
+        # 今日のレース数
+        db_async.fetchval("SELECT COUNT(*) FROM races WHERE race_date = $1", today),
+        # 完了したレース数
+        db_async.fetchval("""
+            SELECT COUNT(*) FROM races r
+            JOIN race_results rr ON r.id = rr.race_id
+            WHERE r.race_date = $1
+        """, today),
+        # 今日の購入状況
+        db_async.fetch("""
+            SELECT status, SUM(bet_count) as cnt, SUM(bet_amount) as bet_amount,
+                   SUM(return_amount) as return_amount, SUM(profit) as profit
+            FROM virtual_bets_summary
+            WHERE race_date = $1
+            GROUP BY status
+        """, today),
+        # 全体統計（累計）
+        db_async.fetch("""
+            SELECT status, SUM(bet_count) as cnt, SUM(bet_amount) as bet_amount,
+                   SUM(return_amount) as return_amount, SUM(profit) as profit
+            FROM virtual_bets_summary
+            WHERE status IN ('won', 'lost')
+            GROUP BY status
+        """),
+    )
+    status_counts = summarize_by_status(today_rows)
+
+    pending_bets = status_counts.get('pending', {}).get('count', 0)
+    confirmed_bets = status_counts.get('confirmed', {}).get('count', 0)
+    won_bets = status_counts.get('won', {}).get('count', 0)
+    lost_bets = status_counts.get('lost', {}).get('count', 0)
+    skipped_bets = status_counts.get('skipped', {}).get('count', 0)
+
+    today_profit = sum(s.get('profit', 0) for s in status_counts.values())
+
+    # 今日の詳細統計
+    today_stats = settled_totals(status_counts)
+    today_bet_count = today_stats['hits'] + today_stats['losses']
+    today_hit_count = today_stats['hits']
+    today_hit_rate = (today_hit_count / today_bet_count * 100) if today_bet_count > 0 else 0
+    today_bet_amount = today_stats['bet_amount']
+    today_return_amount = today_stats['return_amount']
+    today_return_rate = (today_return_amount / today_bet_amount * 100) if today_bet_amount > 0 else 0
+
+    # 全体統計（累計）
+    totals = settled_totals(summarize_by_status(total_rows))
+
+    total_profit = totals['profit']
+    total_bet_count = totals['hits'] + totals['losses']
+    total_hit_count = totals['hits']
+    total_won_count = totals['hits']  # 累計的中数
+    total_lost_count = totals['losses']  # 累計不的中数
+    hit_rate = (total_hit_count / total_bet_count * 100) if total_bet_count > 0 else 0
+    total_bet_amount = totals['bet_amount']
+    total_return_amount = totals['return_amount']
+    return_rate = (total_return_amount / total_bet_amount * 100) if total_bet_amount > 0 else 0
+
+    return DashboardStats(
+        total_races_today=total_races_today,
+        completed_races=completed_races,
+        pending_bets=pending_bets,
+        confirmed_bets=confirmed_bets,
+        won_bets=won_bets,
+        lost_bets=lost_bets,
+        skipped_bets=skipped_bets,
+        today_profit=today_profit,
+        today_bet_count=today_bet_count,
+        today_hit_count=today_hit_count,
+        today_hit_rate=today_hit_rate,
+        today_return_rate=today_return_rate,
+        total_profit=total_profit,
+        total_bet_count=total_bet_count,
+        total_hit_count=total_hit_count,
+        total_won_count=total_won_count,
+        total_lost_count=total_lost_count,
+        total_bet_amount=total_bet_amount,
+        hit_rate=hit_rate,
+        return_rate=return_rate
+    )
 
 
 @app.get("/api/odds/latest/{race_date}/{stadium_code}/{race_number}")
@@ -610,15 +514,13 @@ def get_latest_odds(race_date: str, stadium_code: str, race_number: int):
     try:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT odds_type, combination, odds_value, odds_min, odds_max, scraped_at
-                FROM odds_history
-                WHERE race_date = %s AND stadium_code = %s AND race_number = %s
-                AND scraped_at = (
-                    SELECT MAX(scraped_at) FROM odds_history
-                    WHERE race_date = %s AND stadium_code = %s AND race_number = %s
-                )
+                SELECT odds_type_name(odds_type) AS odds_type,
+                       odds_combination_text(combination) AS combination,
+                       odds_value, odds_min, odds_max, scraped_at
+                FROM odds_latest
+                WHERE race_date = %s AND stadium_code = %s::smallint AND race_number = %s
                 ORDER BY odds_type, combination
-            """, (race_date, stadium_code, race_number, race_date, stadium_code, race_number))
+            """, (race_date, stadium_code, race_number))
             rows = cur.fetchall()
 
             result = {}
@@ -652,18 +554,15 @@ def get_bets_with_results(
                 SELECT
                     vb.*,
                     s.name as stadium_name,
-                    r.id as race_id,
                     r.deadline_at as scheduled_deadline,
                     rr.first_place,
                     rr.second_place,
                     rr.third_place,
                     rr.race_status
                 FROM virtual_bets vb
-                LEFT JOIN stadiums s ON vb.stadium_code::int = s.stadium_code
-                LEFT JOIN races r ON vb.race_date = r.race_date
-                    AND vb.stadium_code::int = r.stadium_code
-                    AND vb.race_number = r.race_number
-                LEFT JOIN race_results rr ON r.id = rr.race_id
+                LEFT JOIN races r ON r.id = vb.race_id
+                LEFT JOIN stadiums s ON s.stadium_code = r.stadium_code
+                LEFT JOIN race_results rr ON rr.race_id = vb.race_id
                 WHERE 1=1
             """
             params = []
@@ -894,7 +793,7 @@ def get_bets_with_results(
 # ==================== 過去レースAPI ====================
 
 @app.get("/api/historical/races/{race_date}")
-def get_historical_races(race_date: str):
+async def get_historical_races(race_date: str):
     """
     過去のレース一覧を取得（historical_race_resultsテーブルから）
     日付形式: YYYY-MM-DD
@@ -904,210 +803,197 @@ def get_historical_races(race_date: str):
         target_date_str = target_date.strftime("%Y%m%d")  # DBは YYYYMMDD形式
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if not DATABASE_URL:
+        raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
 
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            # 過去レース結果を取得（着順データ）
-            cur.execute("""
-                SELECT DISTINCT
-                    race_date,
-                    stadium_code,
-                    race_no,
-                    MAX(CASE WHEN rank = '01' THEN boat_no END) as first_place,
-                    MAX(CASE WHEN rank = '02' THEN boat_no END) as second_place,
-                    MAX(CASE WHEN rank = '03' THEN boat_no END) as third_place
-                FROM historical_race_results
-                WHERE race_date = %s
-                GROUP BY race_date, stadium_code, race_no
-                ORDER BY stadium_code, race_no
-            """, (target_date_str,))
-            races = cur.fetchall()
-
-            # 競艇場名を取得
-            cur.execute("SELECT stadium_code, name FROM stadiums")
-            stadiums_map = {str(row['stadium_code']).zfill(2): row['name'] for row in cur.fetchall()}
-
-            result = []
-            for race in races:
-                stadium_code = race['stadium_code']
-                stadium_name = stadiums_map.get(stadium_code, f"場{stadium_code}")
-
-                result.append({
-                    'race_date': race['race_date'],
-                    'stadium_code': stadium_code,
-                    'stadium_name': stadium_name,
-                    'race_no': race['race_no'],
-                    'result': {
-                        'first': race['first_place'],
-                        'second': race['second_place'],
-                        'third': race['third_place']
-                    } if race['first_place'] else None
-                })
-
-            return result
-    finally:
-        conn.close()
+    races, stadium_rows = await asyncio.gather(
+        # 過去レース結果を取得（着順データ）
+        db_async.fetch("""
+            SELECT DISTINCT
+                race_date,
+                stadium_code,
+                race_no,
+                MAX(CASE WHEN rank = '01' THEN boat_no END) as first_place,
+                MAX(CASE WHEN rank = '02' THEN boat_no END) as second_place,
+                MAX(CASE WHEN rank = '03' THEN boat_no END) as third_place
+            FROM historical_race_results
+            WHERE race_date = $1
+            GROUP BY race_date, stadium_code, race_no
+            ORDER BY stadium_code, race_no
+        """, target_date_str),
+        # 競艇場名を取得
+        db_async.fetch("SELECT stadium_code, name FROM stadiums"),
+    )
+    stadiums_map = {str(row['stadium_code']).zfill(2): row['name'] for row in stadium_rows}
+
+    result = []
+    for race in races:
+        stadium_code = race['stadium_code']
+        stadium_name = stadiums_map.get(stadium_code, f"場{stadium_code}")
+
+        result.append({
+            'race_date': race['race_date'],
+            'stadium_code': stadium_code,
+            'stadium_name': stadium_name,
+            'race_no': race['race_no'],
+            'result': {
+                'first': race['first_place'],
+                'second': race['second_place'],
+                'third': race['third_place']
+            } if race['first_place'] else None
+        })
+
+    return result
 
 
 @app.get("/api/historical/race/{race_date}/{stadium_code}/{race_no}")
-def get_historical_race_detail(race_date: str, stadium_code: str, race_no: str):
+async def get_historical_race_detail(race_date: str, stadium_code: str, race_no: str):
     """
     過去レースの詳細を取得（着順、払戻金、選手情報）
+
+    着順・払戻金・番組表・場名は互いに依存しないため並列に取得する。
     """
     try:
         target_date = datetime.strptime(race_date, "%Y-%m-%d").date()
         target_date_str = target_date.strftime("%Y%m%d")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-
-    conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            # 着順データを取得
-            cur.execute("""
-                SELECT boat_no, racer_no, rank, race_time
-                FROM historical_race_results
-                WHERE race_date = %s AND stadium_code = %s AND race_no = %s
-                ORDER BY
-                    CASE WHEN rank ~ '^[0-9]+$' THEN rank::int ELSE 99 END,
-                    boat_no
-            """, (target_date_str, stadium_code, race_no.zfill(2)))
-            results = cur.fetchall()
-
-            # 払戻金データを取得（historical_payoffsから）
-            cur.execute("""
-                SELECT bet_type, combination, payout, popularity
-                FROM historical_payoffs
-                WHERE race_date = %s AND stadium_code = %s AND race_no = %s
-                ORDER BY
-                    CASE bet_type
-                        WHEN 'tansho' THEN 1
-                        WHEN 'fukusho' THEN 2
-                        WHEN 'nirentan' THEN 3
-                        WHEN 'nirenpuku' THEN 4
-                        WHEN 'wide' THEN 5
-                        WHEN 'sanrentan' THEN 6
-                        WHEN 'sanrenpuku' THEN 7
-                        ELSE 8
-                    END,
-                    popularity
-            """, (target_date_str, stadium_code, race_no.zfill(2)))
-            payoffs = cur.fetchall()
-
-            # LZHからのデータがない場合（当日分等）はpayoffsテーブルからフォールバック
-            if not payoffs:
-                # racesテーブルからrace_idを取得
-                cur.execute("""
-                    SELECT id FROM races
-                    WHERE race_date = %s AND stadium_code = %s AND race_number = %s
-                """, (target_date, int(stadium_code), int(race_no)))
-                race_row = cur.fetchone()
-                if race_row:
-                    race_id = race_row['id']
-                    # payoffsテーブルから取得（bet_type名を変換）
-                    cur.execute("""
-                        SELECT bet_type, combination, payoff as payout, NULL as popularity
-                        FROM payoffs
-                        WHERE race_id = %s
-                        ORDER BY
-                            CASE bet_type
-                                WHEN 'win' THEN 1
-                                WHEN 'place' THEN 2
-                                WHEN 'exacta' THEN 3
-                                WHEN 'quinella' THEN 4
-                                WHEN 'wide' THEN 5
-                                WHEN 'trifecta' THEN 6
-                                WHEN 'trio' THEN 7
-                                ELSE 8
-                            END
-                    """, (race_id,))
-                    payoffs_raw = cur.fetchall()
-                    # bet_type名をhistorical_payoffs形式に変換
-                    # payoffsテーブルは日本語名で保存されている
-                    bet_type_map = {
-                        # 英語名
-                        'win': 'tansho',
-                        'place': 'fukusho',
-                        'exacta': 'nirentan',
-                        'quinella': 'nirenpuku',
-                        'wide': 'wide',
-                        'trifecta': 'sanrentan',
-                        'trio': 'sanrenpuku',
-                        # 日本語名
-                        '単勝': 'tansho',
-                        '複勝': 'fukusho',
-                        '2連単': 'nirentan',
-                        '2連複': 'nirenpuku',
-                        'ワイド': 'wide',
-                        '3連単': 'sanrentan',
-                        '3連複': 'sanrenpuku',
-                    }
-                    payoffs = []
-                    for p in payoffs_raw:
-                        payoffs.append({
-                            'bet_type': bet_type_map.get(p['bet_type'], p['bet_type']),
-                            'combination': p['combination'],
-                            'payout': p['payout'],
-                            'popularity': p['popularity']
-                        })
-
-            # 番組表データを取得（選手情報）
-            cur.execute("""
-                SELECT boat_no, racer_no, racer_name, age, branch, weight, rank,
-                       national_win_rate, national_2nd_rate, local_win_rate, local_2nd_rate,
-                       motor_no, motor_2nd_rate, boat_no_assigned, boat_2nd_rate
-                FROM historical_programs
-                WHERE race_date = %s AND stadium_code = %s AND race_no = %s
-                ORDER BY boat_no
-            """, (target_date_str, stadium_code, race_no.zfill(2)))
-            programs = cur.fetchall()
-
-            # 競艇場名を取得
-            cur.execute("SELECT name FROM stadiums WHERE stadium_code = %s", (int(stadium_code),))
-            stadium_row = cur.fetchone()
-            stadium_name = stadium_row['name'] if stadium_row else f"場{stadium_code}"
-
-            # 払戻金を種類別に整理
-            payoffs_by_type = {}
-            bet_type_names = {
-                'tansho': '単勝',
-                'fukusho': '複勝',
-                'nirentan': '2連単',
-                'nirenpuku': '2連複',
-                'wide': 'ワイド',
-                'sanrentan': '3連単',
-                'sanrenpuku': '3連複'
-            }
-            for p in payoffs:
-                bet_type = p['bet_type']
-                if bet_type not in payoffs_by_type:
-                    payoffs_by_type[bet_type] = {
-                        'name': bet_type_names.get(bet_type, bet_type),
-                        'items': []
-                    }
-                payoffs_by_type[bet_type]['items'].append({
-                    'combination': p['combination'],
-                    'payout': p['payout'],
-                    'popularity': p['popularity']
-                })
-
-            return {
-                'race_date': race_date,
-                'stadium_code': stadium_code,
-                'stadium_name': stadium_name,
-                'race_no': race_no,
-                'results': [{
-                    'boat_no': r['boat_no'],
-                    'racer_no': r['racer_no'],
-                    'rank': r['rank'],
-                    'race_time': r['race_time']
-                } for r in results],
-                'payoffs': payoffs_by_type,
-                'programs': [decimal_to_float(dict(p)) for p in programs]
+        stadium_number, race_number = int(stadium_code), int(race_no)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="stadium_code and race_no must be numeric")
+    if not DATABASE_URL:
+        raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
+    key = (target_date_str, stadium_code, race_no.zfill(2))
+
+    results, payoffs, fallback_payoffs, programs, stadium_name = await asyncio.gather(
+        # 着順データを取得
+        db_async.fetch("""
+            SELECT boat_no, racer_no, rank, race_time
+            FROM historical_race_results
+            WHERE race_date = $1 AND stadium_code = $2 AND race_no = $3
+            ORDER BY
+                CASE WHEN rank ~ '^[0-9]+$' THEN rank::int ELSE 99 END,
+                boat_no
+        """, *key),
+        # 払戻金データを取得（historical_payoffsから）
+        db_async.fetch("""
+            SELECT bet_type, combination, payout, popularity
+            FROM historical_payoffs
+            WHERE race_date = $1 AND stadium_code = $2 AND race_no = $3
+            ORDER BY
+                CASE bet_type
+                    WHEN 'tansho' THEN 1
+                    WHEN 'fukusho' THEN 2
+                    WHEN 'nirentan' THEN 3
+                    WHEN 'nirenpuku' THEN 4
+                    WHEN 'wide' THEN 5
+                    WHEN 'sanrentan' THEN 6
+                    WHEN 'sanrenpuku' THEN 7
+                    ELSE 8
+                END,
+                popularity
+        """, *key),
+        # LZHからのデータがない場合（当日分等）のフォールバック用にpayoffsテーブルも読む
+        db_async.fetch("""
+            SELECT p.bet_type, p.combination, p.payoff as payout, NULL as popularity
+            FROM payoffs p
+            JOIN races r ON r.id = p.race_id
+            WHERE r.race_date = $1 AND r.stadium_code = $2 AND r.race_number = $3
+            ORDER BY
+                CASE p.bet_type
+                    WHEN 'win' THEN 1
+                    WHEN 'place' THEN 2
+                    WHEN 'exacta' THEN 3
+                    WHEN 'quinella' THEN 4
+                    WHEN 'wide' THEN 5
+                    WHEN 'trifecta' THEN 6
+                    WHEN 'trio' THEN 7
+                    ELSE 8
+                END
+        """, target_date, stadium_number, race_number),
+        # 番組表データを取得（選手情報）
+        db_async.fetch("""
+            SELECT boat_no, racer_no, racer_name, age, branch, weight, rank,
+                   national_win_rate, national_2nd_rate, local_win_rate, local_2nd_rate,
+                   motor_no, motor_2nd_rate, boat_no_assigned, boat_2nd_rate
+            FROM historical_programs
+            WHERE race_date = $1 AND stadium_code = $2 AND race_no = $3
+            ORDER BY boat_no
+        """, *key),
+        # 競艇場名を取得
+        db_async.fetchval("SELECT name FROM stadiums WHERE stadium_code = $1", stadium_number),
+    )
+    stadium_name = stadium_name or f"場{stadium_code}"
+
+    if not payoffs:
+        # bet_type名をhistorical_payoffs形式に変換
+        # payoffsテーブルは日本語名で保存されている
+        bet_type_map = {
+            # 英語名
+            'win': 'tansho',
+            'place': 'fukusho',
+            'exacta': 'nirentan',
+            'quinella': 'nirenpuku',
+            'wide': 'wide',
+            'trifecta': 'sanrentan',
+            'trio': 'sanrenpuku',
+            # 日本語名
+            '単勝': 'tansho',
+            '複勝': 'fukusho',
+            '2連単': 'nirentan',
+            '2連複': 'nirenpuku',
+            'ワイド': 'wide',
+            '3連単': 'sanrentan',
+            '3連複': 'sanrenpuku',
+        }
+        payoffs = []
+        for p in fallback_payoffs:
+            payoffs.append({
+                'bet_type': bet_type_map.get(p['bet_type'], p['bet_type']),
+                'combination': p['combination'],
+                'payout': p['payout'],
+                'popularity': p['popularity']
+            })
+
+    # 払戻金を種類別に整理
+    payoffs_by_type = {}
+    bet_type_names = {
+        'tansho': '単勝',
+        'fukusho': '複勝',
+        'nirentan': '2連単',
+        'nirenpuku': '2連複',
+        'wide': 'ワイド',
+        'sanrentan': '3連単',
+        'sanrenpuku': '3連複'
+    }
+    for p in payoffs:
+        bet_type = p['bet_type']
+        if bet_type not in payoffs_by_type:
+            payoffs_by_type[bet_type] = {
+                'name': bet_type_names.get(bet_type, bet_type),
+                'items': []
             }
-    finally:
-        conn.close()
+        payoffs_by_type[bet_type]['items'].append({
+            'combination': p['combination'],
+            'payout': p['payout'],
+            'popularity': p['popularity']
+        })
+
+    return {
+        'race_date': race_date,
+        'stadium_code': stadium_code,
+        'stadium_name': stadium_name,
+        'race_no': race_no,
+        'results': [{
+            'boat_no': r['boat_no'],
+            'racer_no': r['racer_no'],
+            'rank': r['rank'],
+            'race_time': r['race_time']
+        } for r in results],
+        'payoffs': payoffs_by_type,
+        'programs': [decimal_to_float(dict(p)) for p in programs]
+    }
 
 
 @app.get("/api/historical/dates")
@@ -1181,6 +1067,8 @@ def update_skip_reasons():
                     updated_count += 1
 
             conn.commit()
+            # reason だけの更新は集計テーブルに出ないためDBから通知が来ない
+            stats_cache.invalidate()
             return {"message": f"更新完了: {updated_count}件"}
     finally:
         conn.close()
@@ -1189,6 +1077,7 @@ def update_skip_reasons():
 # ==================== 見送り分析・周期別統計API ====================
 
 @app.get("/api/stats/skipped-analysis")
+@cached_stats
 def get_skipped_analysis(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
@@ -1257,15 +1146,11 @@ def get_skipped_analysis(
             cur.execute(f"""
                 SELECT
                     vb.*,
-                    r.id as race_id,
                     rr.first_place,
                     rr.second_place,
                     rr.third_place
                 FROM virtual_bets vb
-                LEFT JOIN races r ON vb.race_date = r.race_date
-                    AND vb.stadium_code::smallint = r.stadium_code
-                    AND vb.race_number = r.race_number
-                LEFT JOIN race_results rr ON r.id = rr.race_id
+                LEFT JOIN race_results rr ON rr.race_id = vb.race_id
                 WHERE {where_clause}
             """, params)
             skipped_bets = cur.fetchall()
@@ -1371,13 +1256,14 @@ def get_skipped_analysis(
 
 
 @app.get("/api/stats/period-summary")
+@cached_stats
 def get_period_summary(
     period: str = Query(default="daily", regex="^(daily|weekly|monthly)$"),
     limit: int = Query(default=30, le=365)
 ):
     """
     周期別のサマリーを取得（日別/週別/月別）
-    購入レースと見送りレースの両方を含む
+    購入レースと見送りレースの両方を含む（集計テーブル virtual_bets_summary から）
     """
     conn = get_db_connection()
     try:
@@ -1396,14 +1282,14 @@ def get_period_summary(
             cur.execute(f"""
                 SELECT
                     {date_format} as period_date,
-                    COUNT(*) as total_bets,
-                    COUNT(CASE WHEN status = 'won' THEN 1 END) as hits,
-                    COUNT(CASE WHEN status = 'lost' THEN 1 END) as losses,
-                    COUNT(CASE WHEN status = 'skipped' THEN 1 END) as skipped,
+                    SUM(bet_count) as total_bets,
+                    COALESCE(SUM(CASE WHEN status = 'won' THEN bet_count END), 0) as hits,
+                    COALESCE(SUM(CASE WHEN status = 'lost' THEN bet_count END), 0) as losses,
+                    COALESCE(SUM(CASE WHEN status = 'skipped' THEN bet_count END), 0) as skipped,
                     COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN bet_amount END), 0) as total_bet_amount,
                     COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN return_amount END), 0) as total_return_amount,
                     COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN profit END), 0) as total_profit
-                FROM virtual_bets
+                FROM virtual_bets_summary
                 GROUP BY {date_format}
                 ORDER BY period_date DESC
                 LIMIT %s
@@ -1435,12 +1321,13 @@ def get_period_summary(
 
 
 @app.get("/api/stats/strategy-comparison")
+@cached_stats
 def get_strategy_comparison(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None
 ):
     """
-    戦略別の比較統計を取得
+    戦略別の比較統計を取得（集計テーブル virtual_bets_summary から）
     """
     conn = get_db_connection()
     try:
@@ -1460,15 +1347,15 @@ def get_strategy_comparison(
             cur.execute(f"""
                 SELECT
                     strategy_type,
-                    COUNT(*) as total_bets,
-                    COUNT(CASE WHEN status = 'won' THEN 1 END) as hits,
-                    COUNT(CASE WHEN status = 'lost' THEN 1 END) as losses,
-                    COUNT(CASE WHEN status = 'skipped' THEN 1 END) as skipped,
-                    COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
+                    SUM(bet_count) as total_bets,
+                    COALESCE(SUM(CASE WHEN status = 'won' THEN bet_count END), 0) as hits,
+                    COALESCE(SUM(CASE WHEN status = 'lost' THEN bet_count END), 0) as losses,
+                    COALESCE(SUM(CASE WHEN status = 'skipped' THEN bet_count END), 0) as skipped,
+                    COALESCE(SUM(CASE WHEN status = 'pending' THEN bet_count END), 0) as pending,
                     COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN bet_amount END), 0) as total_bet_amount,
                     COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN return_amount END), 0) as total_return_amount,
                     COALESCE(SUM(CASE WHEN status IN ('won', 'lost') THEN profit END), 0) as total_profit
-                FROM virtual_bets
+                FROM virtual_bets_summary
                 WHERE {where_clause}
                 GROUP BY strategy_type
                 ORDER BY strategy_type
@@ -1533,16 +1420,13 @@ def get_skipped_virtual_results(
                 SELECT
                     vb.*,
                     s.name as stadium_name,
-                    r.id as race_id,
                     rr.first_place,
                     rr.second_place,
                     rr.third_place
                 FROM virtual_bets vb
-                LEFT JOIN stadiums s ON vb.stadium_code::int = s.stadium_code
-                LEFT JOIN races r ON vb.race_date = r.race_date
-                    AND vb.stadium_code::smallint = r.stadium_code
-                    AND vb.race_number = r.race_number
-                LEFT JOIN race_results rr ON r.id = rr.race_id
+                LEFT JOIN races r ON r.id = vb.race_id
+                LEFT JOIN stadiums s ON s.stadium_code = r.stadium_code
+                LEFT JOIN race_results rr ON rr.race_id = vb.race_id
                 WHERE {where_clause}
                 ORDER BY vb.race_date DESC, vb.created_at DESC
                 LIMIT %s
@@ -1662,68 +1546,74 @@ async def debug_odds_history(
     """
     odds_historyテーブルのデバッグ用API
     """
-    conn = get_db_connection()
+    if not DATABASE_URL:
+        raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
     try:
-        with conn.cursor() as cursor:
-            # テーブルのサンプルデータを取得
-            if race_date and stadium_code and race_number:
-                # 特定レースのオッズを検索
-                cursor.execute("""
-                    SELECT race_date, stadium_code, race_number, odds_type, combination,
-                           odds_value, scraped_at
-                    FROM odds_history
-                    WHERE race_date = %s
-                    AND (stadium_code = %s OR stadium_code = %s)
-                    AND race_number = %s
-                    ORDER BY scraped_at DESC
-                    LIMIT 50
-                """, (race_date, stadium_code, stadium_code.zfill(2), race_number))
-            else:
-                # 最新のオッズデータを取得
-                cursor.execute("""
-                    SELECT race_date, stadium_code, race_number, odds_type, combination,
-                           odds_value, scraped_at
-                    FROM odds_history
-                    ORDER BY scraped_at DESC
-                    LIMIT 50
-                """)
-
-            rows = cursor.fetchall()
-
-            # stadium_codeの分布を確認
-            cursor.execute("""
-                SELECT stadium_code, COUNT(*) as count
-                FROM odds_history
-                WHERE race_date = %s
-                GROUP BY stadium_code
-                ORDER BY count DESC
-                LIMIT 30
-            """, (race_date or get_adjusted_date().isoformat(),))
-            stadium_distribution = cursor.fetchall()
-
-            # odds_typeの分布を確認
-            cursor.execute("""
-                SELECT odds_type, COUNT(*) as count
-                FROM odds_history
-                WHERE race_date = %s
-                GROUP BY odds_type
-                ORDER BY count DESC
-            """, (race_date or get_adjusted_date().isoformat(),))
-            type_distribution = cursor.fetchall()
-
-            return {
-                "sample_data": [decimal_to_float(dict(row)) for row in rows],
-                "stadium_code_distribution": [dict(row) for row in stadium_distribution],
-                "odds_type_distribution": [dict(row) for row in type_distribution],
-                "query_params": {
-                    "race_date": race_date,
-                    "stadium_code": stadium_code,
-                    "race_number": race_number,
-                    "combination": combination
-                }
-            }
-    finally:
-        conn.close()
+        target_date = datetime.strptime(race_date, "%Y-%m-%d").date() if race_date else get_adjusted_date()
+        stadium_number = int(stadium_code) if stadium_code else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid race_date or stadium_code")
+
+    # テーブルのサンプルデータを取得
+    if race_date and stadium_code and race_number:
+        # 特定レースのオッズを検索
+        sample_query = db_async.fetch("""
+            SELECT race_date, lpad(stadium_code::text, 2, '0') AS stadium_code, race_number,
+                   odds_type_name(odds_type) AS odds_type,
+                   odds_combination_text(combination) AS combination,
+                   odds_value, scraped_at
+            FROM odds_history
+            WHERE race_date = $1
+            AND stadium_code = $2
+            AND race_number = $3
+            ORDER BY scraped_at DESC
+            LIMIT 50
+        """, target_date, stadium_number, race_number)
+    else:
+        # 最新のオッズデータを取得
+        sample_query = db_async.fetch("""
+            SELECT race_date, lpad(stadium_code::text, 2, '0') AS stadium_code, race_number,
+                   odds_type_name(odds_type) AS odds_type,
+                   odds_combination_text(combination) AS combination,
+                   odds_value, scraped_at
+            FROM odds_history
+            WHERE race_date >= CURRENT_DATE - 1
+            ORDER BY scraped_at DESC
+            LIMIT 50
+        """)
+
+    rows, stadium_distribution, type_distribution = await asyncio.gather(
+        sample_query,
+        # stadium_codeの分布を確認
+        db_async.fetch("""
+            SELECT lpad(stadium_code::text, 2, '0') AS stadium_code, COUNT(*) as count
+            FROM odds_history
+            WHERE race_date = $1
+            GROUP BY stadium_code
+            ORDER BY count DESC
+            LIMIT 30
+        """, target_date),
+        # odds_typeの分布を確認
+        db_async.fetch("""
+            SELECT odds_type_name(odds_type) AS odds_type, COUNT(*) as count
+            FROM odds_history
+            WHERE race_date = $1
+            GROUP BY odds_type
+            ORDER BY count DESC
+        """, target_date),
+    )
+
+    return {
+        "sample_data": [decimal_to_float(row) for row in rows],
+        "stadium_code_distribution": stadium_distribution,
+        "odds_type_distribution": type_distribution,
+        "query_params": {
+            "race_date": race_date,
+            "stadium_code": stadium_code,
+            "race_number": race_number,
+            "combination": combination
+        }
+    }
 
 
 # ==================== データ補正API ====================
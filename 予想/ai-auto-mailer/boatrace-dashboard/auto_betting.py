@@ -23,11 +23,13 @@ from decimal import Decimal
 import json
 import re
 
-import psycopg2
 from psycopg2.extras import RealDictCursor, execute_values
 import requests
 from bs4 import BeautifulSoup
 
+from db_pool import get_connection
+from settlement import settle_virtual_bets
+
 # ログ設定
 logging.basicConfig(
     level=logging.INFO,
@@ -198,7 +200,7 @@ def get_db_connection():
     """データベース接続を取得"""
     if not DATABASE_URL:
         raise Exception("DATABASE_URL not configured")
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return get_connection(DATABASE_URL, cursor_factory=RealDictCursor)
 
 
 def collect_today_races() -> List[Dict[str, Any]]:
@@ -404,11 +406,11 @@ def register_daily_bets():
 
             # 既存の購入予定を取得
             cur.execute("""
-                SELECT strategy_type, stadium_code, race_number
+                SELECT strategy_type, race_id
                 FROM virtual_bets
-                WHERE race_date = %s
-            """, (today,))
-            existing = set((r['strategy_type'], r['stadium_code'], r['race_number']) for r in cur.fetchall())
+                WHERE race_id = ANY(%s)
+            """, ([race['id'] for race in races],))
+            existing = set((r['strategy_type'], r['race_id']) for r in cur.fetchall())
 
             # 一括登録用のデータを準備
             insert_data = []
@@ -446,7 +448,7 @@ def register_daily_bets():
                             continue
 
                     # 既存チェック
-                    if (strategy_type, stadium_code, race_number) in existing:
+                    if (strategy_type, race['id']) in existing:
                         continue
 
                     # 組み合わせと購入タイプを決定
@@ -464,6 +466,7 @@ def register_daily_bets():
 
                     insert_data.append((
                         strategy_type,
+                        race['id'],
                         today,
                         stadium_code,
                         race_number,
@@ -478,7 +481,7 @@ def register_daily_bets():
             if insert_data:
                 execute_values(cur, """
                     INSERT INTO virtual_bets (
-                        strategy_type, race_date, stadium_code, race_number,
+                        strategy_type, race_id, race_date, stadium_code, race_number,
                         bet_type, combination, bet_amount, scheduled_deadline, reason
                     ) VALUES %s
                 """, insert_data)
@@ -725,14 +728,12 @@ def process_single_bet(cur, bet: Dict):
 
 
 def get_odds(cur, race_date_str: str, stadium_code: str, race_number: int, odds_type: str, combination: str) -> Optional[float]:
-    """オッズを取得"""
+    """オッズを取得（最新値テーブルodds_latestを主キーで参照。場コード・種別・買い目はコード化されている）"""
     cur.execute("""
         SELECT odds_value, odds_min, odds_max
-        FROM odds_history
-        WHERE race_date = %s AND stadium_code = %s AND race_number = %s
-        AND odds_type = %s AND combination = %s
-        ORDER BY scraped_at DESC
-        LIMIT 1
+        FROM odds_latest
+        WHERE race_date = %s AND stadium_code = %s::smallint AND race_number = %s
+        AND odds_type = odds_type_code(%s) AND combination = odds_combination_code(%s)
     """, (race_date_str, stadium_code, race_number, odds_type, combination))
 
     odds_row = cur.fetchone()
@@ -942,182 +943,23 @@ def skip_bet(cur, bet_id: int, reason: str):
 def update_results():
     """
     結果を更新
-    confirmed状態の購入で、レース結果が出ているものを更新
+    confirmed状態の購入で、レース結果が出ているものを精算する
+    （結果・払戻金との結合、購入の更新、戦略ごとの資金更新を1トランザクションで行う）
     """
     logger.info("=== 結果更新処理開始 ===")
 
     conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            # 結果待ちの購入を取得
-            cur.execute("""
-                SELECT vb.*, r.id as race_id
-                FROM virtual_bets vb
-                JOIN races r ON vb.race_date = r.race_date
-                    AND vb.stadium_code::int = r.stadium_code
-                    AND vb.race_number = r.race_number
-                WHERE vb.status = 'confirmed'
-            """)
-            confirmed_bets = cur.fetchall()
-
-            if not confirmed_bets:
-                logger.info("結果待ちの購入がありません")
-                return
-
-            logger.info(f"結果待ち: {len(confirmed_bets)}件")
-
-            for bet in confirmed_bets:
-                try:
-                    update_single_result(cur, bet)
-                except Exception as e:
-                    logger.error(f"結果更新エラー: bet_id={bet['id']}, error={e}")
-
-            conn.commit()
-
+        summary = settle_virtual_bets(conn)
+        if not summary['settled']:
+            logger.info("結果が確定した購入がありません")
     except Exception as e:
         logger.error(f"結果更新処理エラー: {e}")
-        conn.rollback()
         raise
     finally:
         conn.close()
 
 
-def update_single_result(cur, bet: Dict):
-    """単一の購入結果を更新"""
-    bet_id = bet['id']
-    race_id = bet['race_id']
-    bet_type = bet['bet_type']
-    combination = bet['combination']
-    bet_amount = bet['bet_amount']
-    odds = float(bet['odds']) if bet['odds'] else 0
-    strategy_type = bet['strategy_type']
-
-    # レース結果を取得
-    cur.execute("""
-        SELECT first_place, second_place, third_place, race_status
-        FROM race_results
-        WHERE race_id = %s
-    """, (race_id,))
-    result = cur.fetchone()
-
-    if not result:
-        return  # まだ結果が出ていない
-
-    if result['race_status'] and result['race_status'] != '成立':
-        # レース不成立
-        cur.execute("""
-            UPDATE virtual_bets
-            SET status = 'canceled',
-                actual_result = %s,
-                updated_at = NOW()
-            WHERE id = %s
-        """, (result['race_status'], bet_id))
-        logger.info(f"レース不成立: bet_id={bet_id}, status={result['race_status']}")
-        return
-
-    first = result['first_place']
-    second = result['second_place']
-    third = result['third_place']
-
-    if not first or not second:
-        return  # 結果が不完全
-
-    actual_result = f"{first}-{second}-{third}" if third else f"{first}-{second}"
-
-    # 的中判定
-    is_hit = False
-    if bet_type == 'win':
-        is_hit = str(first) == combination
-    elif bet_type == 'quinella':
-        # 2連複: 順不同
-        actual_pair = set([str(first), str(second)])
-        bet_pair = set(combination.replace('-', '=').split('='))
-        is_hit = actual_pair == bet_pair
-    elif bet_type == 'exacta':
-        # 2連単: 順番通り
-        actual_exacta = f"{first}-{second}"
-        is_hit = actual_exacta == combination
-
-    # 払戻金を取得
-    payoff = 0
-    if is_hit:
-        payoff_type_map = {'win': 'win', 'quinella': 'quinella', 'exacta': 'exacta'}
-        payoff_type = payoff_type_map.get(bet_type, bet_type)
-
-        cur.execute("""
-            SELECT payoff FROM payoffs
-            WHERE race_id = %s AND bet_type = %s AND combination = %s
-        """, (race_id, payoff_type, combination))
-        payoff_row = cur.fetchone()
-        if payoff_row:
-            payoff = payoff_row['payoff']
-
-    # 損益計算
-    return_amount = int(payoff * bet_amount / 100) if is_hit else 0
-    profit = return_amount - bet_amount
-
-    now = datetime.now(JST)
-    status = 'won' if is_hit else 'lost'
-
-    cur.execute("""
-        UPDATE virtual_bets
-        SET status = %s,
-            actual_result = %s,
-            payoff = %s,
-            return_amount = %s,
-            profit = %s,
-            result_confirmed_at = %s,
-            updated_at = %s
-        WHERE id = %s
-    """, (status, actual_result, payoff, return_amount, profit, now, now, bet_id))
-
-    logger.info(f"結果更新: bet_id={bet_id}, status={status}, profit={profit}")
-
-    # 資金を更新
-    update_fund(cur, strategy_type, profit, is_hit, bet_amount, return_amount)
-
-
-def update_fund(cur, strategy_type: str, profit: float, is_hit: bool, bet_amount: int, return_amount: int):
-    """資金を更新"""
-    cur.execute("""
-        SELECT * FROM virtual_funds
-        WHERE strategy_type = %s AND is_active = TRUE
-        LIMIT 1
-    """, (strategy_type,))
-    fund = cur.fetchone()
-
-    if not fund:
-        logger.warning(f"アクティブな資金が見つかりません: {strategy_type}")
-        return
-
-    current_fund = float(fund['current_fund']) + profit
-    total_profit = float(fund['total_profit']) + profit
-    total_bets = fund['total_bets'] + 1
-    total_hits = fund['total_hits'] + (1 if is_hit else 0)
-    hit_rate = (total_hits / total_bets * 100) if total_bets > 0 else 0
-
-    total_bet_amount = float(fund['total_bet_amount']) + bet_amount
-    total_return_amount = float(fund['total_return_amount']) + return_amount
-    return_rate = (total_return_amount / total_bet_amount * 100) if total_bet_amount > 0 else 0
-
-    cur.execute("""
-        UPDATE virtual_funds
-        SET current_fund = %s,
-            total_profit = %s,
-            total_bets = %s,
-            total_hits = %s,
-            hit_rate = %s,
-            total_bet_amount = %s,
-            total_return_amount = %s,
-            return_rate = %s,
-            updated_at = NOW()
-        WHERE id = %s
-    """, (current_fund, total_profit, total_bets, total_hits, hit_rate,
-          total_bet_amount, total_return_amount, return_rate, fund['id']))
-
-    logger.info(f"資金更新: {strategy_type}, current={current_fund}, profit={profit}")
-
-
 def update_skipped_results():
     """
     見送りレースの結果も更新（表示用）
@@ -1129,13 +971,11 @@ def update_skipped_results():
         with conn.cursor() as cur:
             # 見送りで結果未設定の購入を取得
             cur.execute("""
-                SELECT vb.*, r.id as race_id
+                SELECT vb.*
                 FROM virtual_bets vb
-                JOIN races r ON vb.race_date = r.race_date
-                    AND vb.stadium_code::int = r.stadium_code
-                    AND vb.race_number = r.race_number
                 WHERE vb.status = 'skipped'
                 AND vb.actual_result IS NULL
+                AND vb.race_id IS NOT NULL
             """)
             skipped_bets = cur.fetchall()
 
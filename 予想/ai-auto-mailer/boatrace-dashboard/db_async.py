@@ -0,0 +1,136 @@
+"""
+ダッシュボードAPIの非同期DBアクセス
+
+同期の def エンドポイントは FastAPI のスレッドプール（既定40スレッド）で動くため、
+重い集計クエリが重なるとスレッドが埋まり、軽いリクエストまで待たされる。
+よく呼ばれるエンドポイントは async def にし、ここから asyncpg のプールでクエリを投げる。
+
+- クエリのプレースホルダは asyncpg 形式（$1, $2, ...）
+- fetch / fetchrow / fetchval は1回ごとにプールから接続を借りるため、
+  互いに依存しないクエリは asyncio.gather で並列に実行できる
+- 結果は dict（RealDictCursor と同じ形）で返す
+- asyncpg がない環境では、同じクエリを db_pool（psycopg2）でスレッドプールから実行する
+
+使用例:
+    import db_async
+
+    races, results = await asyncio.gather(
+        db_async.fetch("SELECT ... WHERE race_date = $1", today),
+        db_async.fetch("SELECT ... WHERE race_date = $1", today),
+    )
+"""
+
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+from db_pool import connection
+
+# asyncpg（非同期のPostgreSQLドライバ）
+try:
+    import asyncpg
+    HAS_ASYNCPG = True
+except ImportError:
+    HAS_ASYNCPG = False
+
+logger = logging.getLogger(__name__)
+
+# 非同期プールの最大接続数（同期の db_pool とは別枠）
+ASYNC_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_ASYNC_POOL_MAX', '10'))
+# 1クエリの上限秒数
+QUERY_TIMEOUT_SECONDS = 30
+
+_pool = None
+_pool_lock: Optional[asyncio.Lock] = None
+
+if not HAS_ASYNCPG:
+    logger.warning("asyncpgがインストールされていません。非同期APIはスレッドプールでpsycopg2を使います（pip install asyncpg）。")
+
+
+async def get_pool():
+    """プロセス共通の asyncpg プール（未作成なら作成）"""
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            dsn = os.environ.get('DATABASE_URL')
+            if not dsn:
+                raise ValueError("DATABASE_URL is required")
+            _pool = await asyncpg.create_pool(
+                dsn, min_size=1, max_size=ASYNC_POOL_MAX_CONNECTIONS,
+                command_timeout=QUERY_TIMEOUT_SECONDS,
+            )
+            logger.info(f"非同期DBプールを作成しました（最大{ASYNC_POOL_MAX_CONNECTIONS}接続）")
+    return _pool
+
+
+async def close_pool():
+    """プールを閉じる（アプリ終了時）"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def fetch(query: str, *args) -> List[Dict[str, Any]]:
+    """
+    クエリを実行して全行を返す
+
+    Args:
+        query: SQL（プレースホルダは $1, $2, ...）
+        *args: パラメータ
+
+    Returns:
+        行（dict）のリスト
+    """
+    if not HAS_ASYNCPG:
+        return await _fetch_in_thread(query, args)
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, *args)
+    return [dict(row) for row in rows]
+
+
+async def fetchrow(query: str, *args) -> Optional[Dict[str, Any]]:
+    """クエリを実行して先頭行を返す（なければ None）"""
+    rows = await fetch(query, *args)
+    return rows[0] if rows else None
+
+
+async def fetchval(query: str, *args) -> Any:
+    """クエリを実行して先頭行の先頭列を返す（なければ None）"""
+    row = await fetchrow(query, *args)
+    return next(iter(row.values())) if row else None
+
+
+# ==================== asyncpg がない場合 ====================
+
+_PLACEHOLDER = re.compile(r'\$(\d+)')
+
+
+def to_pyformat(query: str, args) -> tuple:
+    """$1 形式のクエリを psycopg2 の %(p1)s 形式に変換"""
+    query = _PLACEHOLDER.sub(r'%(p\1)s', query.replace('%', '%%'))
+    return query, {f'p{i + 1}': value for i, value in enumerate(args)}
+
+
+def _fetch_sync(query: str, args) -> List[Dict[str, Any]]:
+    query, params = to_pyformat(query, args)
+    with connection(cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = [dict(row) for row in cur.fetchall()] if cur.description else []
+        conn.commit()
+    return rows
+
+
+async def _fetch_in_thread(query: str, args) -> List[Dict[str, Any]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _fetch_sync, query, args)
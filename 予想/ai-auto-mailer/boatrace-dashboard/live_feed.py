@@ -0,0 +1,570 @@
+"""
+当日レースのライブ配信（オッズ・レース状態・結果）
+
+/api/races/today/with-odds を各ブラウザがポーリングすると、開いている画面の数だけ
+当日全レースの集計クエリが走る。ここではプロセス内に当日レースの状態を1つだけ持ち、
+変わった部分だけを購読中の全クライアントへ配信する。
+
+- 変更の検知: collector の書き込み（odds_latest / race_results / payoffs / races）ごとに
+  DBのトリガー（schema/add_race_feed_notify.sql）が pg_notify('race_feed') で
+  変わったレースのキーを送る。専用の接続で LISTEN し、通知をまとめてから
+  該当レースだけを1回読み直して前回の状態と比較する
+- レース中・確定待ちへの状態遷移は締切時刻から決まるため、STATUS_TICK_SECONDS ごとに
+  手元の状態から判定し直す（DBは読まない）
+- 通知の取りこぼしに備え、再接続時と FEED_RESYNC_SECONDS ごとに当日全体を読み直す
+- 配信するメッセージ（SSE形式の文字列）は変更1回につき1度だけ作り、全クライアントで共有する
+- 処理の遅いクライアントのキューがあふれた場合は、差分を捨ててスナップショットを送り直す
+
+イベント:
+    snapshot: {"date": "YYYY-MM-DD", "races": [レース, ...]}（接続直後・日付が変わったとき）
+    race:     レース（追加・締切時刻などの変更）
+    odds:     {"id": races.id, "odds": {"win": {買い目: オッズ}, "quinella": {...}}}（変わった買い目のみ）
+    status:   {"id": races.id, "status": "upcoming" | "in_progress" | "finished" | "canceled"}
+    result:   {"id": races.id, "result": {...}, "payoffs": {...}}
+
+使用例:
+    from live_feed import get_feed
+
+    feed = get_feed()
+    await feed.ready()
+    races = feed.races()                  # with-odds と同じ形式のリスト
+    async for message in feed.stream():   # SSE のメッセージ
+        ...
+"""
+
+import os
+import json
+import time
+import select
+import asyncio
+import logging
+import threading
+from datetime import datetime, date, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+from db_pool import connection
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# DBトリガーが送る通知のチャネル
+NOTIFY_CHANNEL = 'race_feed'
+# 通知を受けてから読み直すまでの待ち時間（秒）。同じ収集処理の連続した書き込みをまとめる
+FEED_DEBOUNCE_SECONDS = float(os.environ.get('FEED_DEBOUNCE_SECONDS', '1'))
+# 当日全体を読み直す間隔（秒）
+FEED_RESYNC_SECONDS = float(os.environ.get('FEED_RESYNC_SECONDS', '300'))
+# 締切時刻からの状態遷移を判定し直す間隔（秒）
+STATUS_TICK_SECONDS = 30
+# 通知を受信できていないときに races() が読み直す間隔（秒）
+FALLBACK_TTL_SECONDS = 30
+# 接続中のクライアントに送るコメント行（プロキシによる切断を防ぐ）の間隔（秒）
+HEARTBEAT_SECONDS = 15
+# クライアントごとに溜めておくメッセージ数の上限
+SUBSCRIBER_QUEUE_SIZE = 200
+# LISTEN 接続が切れたときの再接続間隔（秒）
+LISTEN_RETRY_SECONDS = 30
+
+# bet_type名を正規化するマッピング
+BET_TYPE_NORMALIZE = {
+    '単勝': 'win', 'win': 'win',
+    '複勝': 'place', 'place': 'place',
+    '2連単': 'exacta', '２連単': 'exacta', 'exacta': 'exacta',
+    '2連複': 'quinella', '２連複': 'quinella', 'quinella': 'quinella',
+    'ワイド': 'wide', '拡連複': 'wide', 'wide': 'wide',
+    '3連単': 'trifecta', '３連単': 'trifecta', 'trifecta': 'trifecta',
+    '3連複': 'trio', '３連複': 'trio', 'trio': 'trio'
+}
+
+# キューがあふれたクライアントへの印（スナップショットを送り直す）
+_RESYNC = None
+
+
+def today_jst() -> date:
+    """現在の日付を返す（JST）"""
+    now_jst = datetime.now(JST)
+    return date(now_jst.year, now_jst.month, now_jst.day)
+
+
+# ==================== 読み込み ====================
+
+def race_status(is_canceled: bool, has_result: bool, deadline: Optional[datetime],
+                now: datetime) -> str:
+    """
+    レース状態を判定（現在時刻ベース）
+
+    Args:
+        is_canceled: 中止かどうか
+        has_result: 着順が入っているかどうか
+        deadline: 締切時刻（naiveの場合はJSTとして扱う）
+        now: 現在時刻（aware）
+
+    Returns:
+        'upcoming' / 'in_progress' / 'finished' / 'canceled'
+    """
+    if is_canceled:
+        return 'canceled'
+    if has_result:
+        # 結果が入っていれば確定
+        return 'finished'
+    if deadline is None:
+        return 'upcoming'
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=JST)
+    minutes_since_deadline = (now - deadline).total_seconds() / 60
+    if minutes_since_deadline > 10:
+        # 締切から10分以上経過 → 確定（結果待ち）
+        return 'finished'
+    if minutes_since_deadline > 0:
+        # 締切後10分以内 → レース中
+        return 'in_progress'
+    # それ以外は発売中
+    return 'upcoming'
+
+
+def load_races(cur, race_date: date, race_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict]:
+    """
+    指定日のレース（単勝・2連複オッズ、結果、払戻金付き）を読み込む
+
+    Args:
+        cur: RealDictCursor
+        race_date: レース日
+        race_ids: 対象の races.id（None なら指定日の全レース）
+
+    Returns:
+        races.id -> レース（/api/races/today/with-odds の1要素と同じ形式）。
+        締切時刻・中止フラグは状態の再判定用に '_deadline' / '_canceled' に入れる
+    """
+    ids = None if race_ids is None else sorted(set(race_ids))
+    if ids is not None and not ids:
+        return {}
+    race_filter = "" if ids is None else "AND r.id = ANY(%s)"
+    params = (race_date,) if ids is None else (race_date, ids)
+
+    cur.execute(f"""
+        SELECT r.id, r.race_date, r.stadium_code, s.name as stadium_name,
+               r.race_number, r.title, r.deadline_at, r.is_canceled
+        FROM races r
+        JOIN stadiums s ON r.stadium_code = s.stadium_code
+        WHERE r.race_date = %s {race_filter}
+        ORDER BY r.stadium_code, r.race_number
+    """, params)
+    races = cur.fetchall()
+    if not races:
+        return {}
+
+    # レース結果を取得
+    cur.execute(f"""
+        SELECT rr.race_id, rr.first_place, rr.second_place, rr.third_place, rr.race_status
+        FROM race_results rr
+        JOIN races r ON rr.race_id = r.id
+        WHERE r.race_date = %s {race_filter}
+    """, params)
+    results_map = {row['race_id']: row for row in cur.fetchall()}
+
+    # 払戻金を取得
+    cur.execute(f"""
+        SELECT p.race_id, p.bet_type, p.combination, p.payoff
+        FROM payoffs p
+        JOIN races r ON p.race_id = r.id
+        WHERE r.race_date = %s {race_filter}
+    """, params)
+    payoffs_map: Dict[int, Dict[str, List]] = {}
+    for row in cur.fetchall():
+        bet_type = BET_TYPE_NORMALIZE.get(row['bet_type'], row['bet_type'])
+        payoffs_map.setdefault(row['race_id'], {}).setdefault(bet_type, []).append({
+            'combination': row['combination'],
+            'payoff': row['payoff']
+        })
+
+    # 最新オッズを取得（単勝と2連複）
+    # odds_latestは収集時に更新される最新値テーブル。場コード・種別・買い目はコード化されている
+    cur.execute(f"""
+        SELECT r.id AS race_id, odds_type_name(ol.odds_type) AS odds_type,
+               odds_combination_text(ol.combination) AS combination, ol.odds_value
+        FROM odds_latest ol
+        JOIN races r ON r.race_date = ol.race_date
+            AND r.stadium_code = ol.stadium_code AND r.race_number = ol.race_number
+        WHERE ol.race_date = %s {race_filter}
+        AND ol.odds_type IN (odds_type_code('win'), odds_type_code('2f'))
+    """, params)
+    odds_map: Dict[int, Dict[str, Dict]] = {}
+    for row in cur.fetchall():
+        odds = odds_map.setdefault(row['race_id'], {'win': {}, '2f': {}})
+        odds[row['odds_type']][row['combination']] = float(row['odds_value']) if row['odds_value'] else None
+
+    # レース情報を組み立て
+    now = datetime.now(JST)
+    loaded = {}
+    for race in races:
+        race_id = race['id']
+        race_result = results_map.get(race_id)
+        payoffs = payoffs_map.get(race_id, {})
+        odds_data = odds_map.get(race_id, {'win': {}, '2f': {}})
+        has_result = bool(race_result and race_result.get('first_place'))
+
+        loaded[race_id] = {
+            'id': race_id,
+            'race_date': str(race['race_date']),
+            'stadium_code': race['stadium_code'],
+            'stadium_name': race['stadium_name'],
+            'race_number': race['race_number'],
+            'title': race['title'],
+            'deadline_at': race['deadline_at'].isoformat() if race['deadline_at'] else None,
+            'status': race_status(race['is_canceled'], has_result, race['deadline_at'], now),
+            'result': {
+                'first': race_result['first_place'],
+                'second': race_result['second_place'],
+                'third': race_result['third_place'],
+            } if race_result else None,
+            'odds': {
+                'win': odds_data.get('win', {}),
+                'quinella': odds_data.get('2f', {})  # 2連複
+            },
+            'payoffs': {
+                'win': payoffs.get('win', []),
+                'place': payoffs.get('place', []),  # 複勝（2組）
+                'quinella': payoffs.get('quinella', []),
+                'wide': payoffs.get('wide', []),  # ワイド（3組）
+            },
+            '_deadline': race['deadline_at'],
+            '_canceled': bool(race['is_canceled']),
+        }
+    return loaded
+
+
+def public_race(race: Dict) -> Dict:
+    """内部用のキー（'_' 始まり）を除いたレース"""
+    return {k: v for k, v in race.items() if not k.startswith('_')}
+
+
+def diff_race(old: Optional[Dict], new: Dict) -> List[Tuple[str, Dict]]:
+    """
+    同じレースの前回と今回を比較し、送るイベントを返す
+
+    Args:
+        old: 前回のレース（初めて見るレースなら None）
+        new: 今回のレース
+
+    Returns:
+        (イベント名, データ) のリスト
+    """
+    if old is None:
+        return [('race', public_race(new))]
+
+    events = []
+    if any(old[k] != new[k] for k in ('title', 'deadline_at', 'stadium_name')):
+        return [('race', public_race(new))]
+
+    odds_changes = {}
+    for odds_type in ('win', 'quinella'):
+        before, after = old['odds'][odds_type], new['odds'][odds_type]
+        changed = {c: v for c, v in after.items() if before.get(c) != v}
+        changed.update({c: None for c in before if c not in after})
+        if changed:
+            odds_changes[odds_type] = changed
+    if odds_changes:
+        events.append(('odds', {'id': new['id'], 'odds': odds_changes}))
+
+    if old['result'] != new['result'] or old['payoffs'] != new['payoffs']:
+        events.append(('result', {'id': new['id'], 'result': new['result'], 'payoffs': new['payoffs']}))
+
+    if old['status'] != new['status']:
+        events.append(('status', {'id': new['id'], 'status': new['status']}))
+    return events
+
+
+def format_event(seq: int, event: str, data: Any) -> str:
+    """SSE のメッセージを作る"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+    return f"id: {seq}\nevent: {event}\ndata: {payload}\n\n"
+
+
+# ==================== 配信 ====================
+
+class Subscriber:
+    """1クライアント分の配信キュー（クライアントのイベントループ上で読む）"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, message: Optional[str]):
+        """キューに積む（イベントループのスレッドで呼ばれる）"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 追いつけないクライアントは差分を捨ててスナップショットからやり直す
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESYNC)
+
+
+class RaceFeed:
+    """当日レースの状態を保持し、変更を購読者に配信する"""
+
+    def __init__(self, dsn: Optional[str]):
+        self.dsn = dsn
+        # 状態と購読者の保護（DBの読み込み中は持たない）
+        self._lock = threading.Lock()
+        # 読み込み〜反映を直列化する
+        self._update_lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._races: Dict[int, Dict] = {}
+        self._keys: Dict[Tuple[int, int], int] = {}
+        self._seq = 0
+        self._snapshot_message: Optional[Tuple[int, str]] = None
+        self._refreshed_at = 0.0
+        self._subscribers: Set[Subscriber] = set()
+        self._listening = False
+        self._listener: Optional[threading.Thread] = None
+
+    # ---------- 読み出し ----------
+
+    def races(self) -> List[Dict]:
+        """当日のレース一覧（/api/races/today/with-odds の形式。先に ready() / ensure_ready() を呼ぶ）"""
+        with self._lock:
+            return [public_race(r) for r in self._races.values()]
+
+    def ensure_ready(self):
+        """状態がなければ（または通知を受信できておらず古ければ）読み直す"""
+        self._start_listener()
+        if self._is_stale():
+            self.refresh()
+
+    async def ready(self):
+        """ensure_ready の非同期版（読み直しが必要なときだけスレッドプールで実行）"""
+        self._start_listener()
+        if self._is_stale():
+            await asyncio.get_running_loop().run_in_executor(None, self.refresh)
+
+    def _is_stale(self) -> bool:
+        return (self._day != today_jst()
+                or (not self._listening
+                    and time.monotonic() - self._refreshed_at > FALLBACK_TTL_SECONDS))
+
+    async def stream(self) -> AsyncIterator[str]:
+        """
+        SSE のメッセージを返す非同期ジェネレータ
+
+        最初にスナップショットを送り、以降は差分を送る。一定時間なにもなければコメント行を送る。
+        """
+        await self.ready()
+
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            # 登録とスナップショット取得を同じロック内で行い、差分の抜け・重複を防ぐ
+            self._subscribers.add(subscriber)
+            snapshot = self._snapshot()
+        try:
+            yield "retry: 5000\n\n"
+            yield snapshot
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is _RESYNC:
+                    with self._lock:
+                        message = self._snapshot()
+                yield message
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    # ---------- 更新 ----------
+
+    def refresh(self):
+        """当日全体を読み直して反映"""
+        with self._update_lock:
+            day = today_jst()
+            with connection(self.dsn, cursor_factory=RealDictCursor) as conn:
+                with conn.cursor() as cur:
+                    loaded = load_races(cur, day)
+            self._apply(day, loaded, full=True)
+            self._refreshed_at = time.monotonic()
+
+    def reload(self, race_ids: Iterable[int]):
+        """指定レースだけを読み直して反映"""
+        race_ids = set(race_ids)
+        if not race_ids:
+            return
+        with self._update_lock:
+            day = self._day
+            if day is None or day != today_jst():
+                return
+            with connection(self.dsn, cursor_factory=RealDictCursor) as conn:
+                with conn.cursor() as cur:
+                    loaded = load_races(cur, day, race_ids)
+            self._apply(day, loaded, full=False)
+
+    def tick_status(self):
+        """締切時刻からレース状態を判定し直し、変わったものを配信"""
+        now = datetime.now(JST)
+        with self._lock:
+            events = []
+            for race in self._races.values():
+                status = race_status(race['_canceled'], bool(race['result'] and race['result']['first']),
+                                     race['_deadline'], now)
+                if status != race['status']:
+                    race['status'] = status
+                    events.append(('status', {'id': race['id'], 'status': status}))
+            self._publish(events)
+
+    def race_ids_for_keys(self, keys: Optional[Iterable[Tuple[int, int]]]) -> Optional[Set[int]]:
+        """(場コード, レース番号) を races.id に変換（None は当日全体）"""
+        if keys is None:
+            return None
+        with self._lock:
+            return {self._keys[k] for k in keys if k in self._keys}
+
+    def _apply(self, day: date, loaded: Dict[int, Dict], full: bool):
+        with self._lock:
+            if day != self._day or (full and set(loaded) != set(self._races)):
+                # 日付が変わった・レースが消えた場合はスナップショットを送り直す
+                self._day = day
+                self._set_races(loaded)
+                self._seq += 1
+                self._publish_message(self._snapshot())
+                return
+
+            events = []
+            for race_id, race in loaded.items():
+                events.extend(diff_race(self._races.get(race_id), race))
+            if full:
+                self._set_races(loaded)
+            else:
+                self._races.update(loaded)
+                self._keys.update({(r['stadium_code'], r['race_number']): i for i, r in loaded.items()})
+            self._publish(events)
+
+    def _set_races(self, races: Dict[int, Dict]):
+        self._races = races
+        self._keys = {(r['stadium_code'], r['race_number']): i for i, r in races.items()}
+
+    def _snapshot(self) -> str:
+        """現在の状態のスナップショット（self._lock 内で呼ぶ。同じ状態なら作り直さない）"""
+        if self._snapshot_message is None or self._snapshot_message[0] != self._seq:
+            data = {
+                'date': self._day.isoformat() if self._day else None,
+                'races': [public_race(r) for r in self._races.values()],
+            }
+            self._snapshot_message = (self._seq, format_event(self._seq, 'snapshot', data))
+        return self._snapshot_message[1]
+
+    def _publish(self, events: List[Tuple[str, Dict]]):
+        """イベントを全購読者に送る（self._lock 内で呼ぶ）"""
+        for event, data in events:
+            self._seq += 1
+            self._publish_message(format_event(self._seq, event, data))
+
+    def _publish_message(self, message: str):
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, message)
+            except RuntimeError:
+                # イベントループが終了済み
+                self._subscribers.discard(subscriber)
+
+    # ---------- 通知の受信 ----------
+
+    def _start_listener(self):
+        if self._listener is not None or not self.dsn:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='race-feed-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self._listening = True
+                logger.info(f"ライブ配信: {NOTIFY_CHANNEL} の通知を待機")
+                # 接続が切れていた間の変更を取り込む
+                self.refresh()
+                next_tick = time.monotonic() + STATUS_TICK_SECONDS
+
+                while True:
+                    timeout = max(0.0, next_tick - time.monotonic())
+                    if select.select([conn], [], [], timeout) != ([], [], []):
+                        # 続けて届く通知をまとめてから読み直す
+                        time.sleep(FEED_DEBOUNCE_SECONDS)
+                        conn.poll()
+                        self._handle_notifies(conn.notifies)
+                        conn.notifies.clear()
+
+                    if time.monotonic() >= next_tick:
+                        next_tick = time.monotonic() + STATUS_TICK_SECONDS
+                        if (self._day != today_jst()
+                                or time.monotonic() - self._refreshed_at > FEED_RESYNC_SECONDS):
+                            self.refresh()
+                        else:
+                            self.tick_status()
+                        # タイムアウト時は接続が生きているか確認
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1")
+            except Exception as e:
+                logger.warning(f"ライブ配信の通知受信エラー（{LISTEN_RETRY_SECONDS}秒後に再接続）: {e}")
+            finally:
+                self._listening = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(LISTEN_RETRY_SECONDS)
+
+    def _handle_notifies(self, notifies: List):
+        """通知をまとめて、読み直すレースを決める"""
+        day = self._day.isoformat() if self._day else None
+        race_ids: Set[int] = set()
+        full = False
+        for notify in notifies:
+            try:
+                payload = json.loads(notify.payload)
+            except ValueError:
+                continue
+            if payload.get('kind') == 'odds':
+                if payload.get('date') != day:
+                    continue
+                keys = payload.get('races')
+                if keys is None:
+                    full = True
+                else:
+                    race_ids |= self.race_ids_for_keys(tuple(k) for k in keys)
+            else:
+                ids = payload.get('ids')
+                if ids is None:
+                    full = True
+                else:
+                    race_ids.update(ids)
+
+        if full:
+            self.refresh()
+        else:
+            self.reload(race_ids)
+
+
+_feed: Optional[RaceFeed] = None
+_feed_lock = threading.Lock()
+
+
+def get_feed() -> RaceFeed:
+    """プロセス共通のライブ配信（初回呼び出しで通知の受信を開始）"""
+    global _feed
+    if _feed is None:
+        with _feed_lock:
+            if _feed is None:
+                _feed = RaceFeed(os.environ.get('DATABASE_URL'))
+    return _feed
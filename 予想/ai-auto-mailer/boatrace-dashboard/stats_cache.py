@@ -0,0 +1,220 @@
+"""
+統計APIのレスポンスキャッシュ
+
+/api/stats/* の結果を (エンドポイント, クエリパラメータ) ごとにプロセス内で保持する。
+複数のブラウザがダッシュボードをポーリングしても、DBへの集計クエリは
+キャッシュが切れたときの1回だけになる。
+
+- 有効期限: STATS_CACHE_TTL 秒（既定120秒）
+- 書き込み時の破棄: virtual_bets の集計が変わると、DBのトリガー
+  （schema/add_virtual_bets_summary.sql）が pg_notify('virtual_bets_changed') を送る。
+  購入判断・精算はダッシュボードとは別プロセス（cron・collector）で動くため、
+  専用の接続で LISTEN し、通知を受けたらキャッシュ全体を破棄する
+- 同じキーの同時リクエストは1回だけ集計し、残りはその結果を待つ
+- 集計中に破棄された場合、その結果は返すがキャッシュには入れない
+- async def のエンドポイントにも使える（待ち合わせは asyncio.Lock）
+
+使用例:
+    from stats_cache import cached_stats
+
+    @app.get("/api/stats/dashboard")
+    @cached_stats
+    def get_dashboard_stats():
+        ...
+"""
+
+import os
+import time
+import select
+import asyncio
+import inspect
+import logging
+import threading
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効期限（秒）。通知が届かない場合でもこの時間で入れ替わる
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', '120'))
+# DBトリガーが送る通知のチャネル
+NOTIFY_CHANNEL = 'virtual_bets_changed'
+# LISTEN 接続が切れたときの再接続間隔（秒）
+LISTEN_RETRY_SECONDS = 30
+
+
+class StatsCache:
+    """TTL＋書き込み時破棄のキャッシュ"""
+
+    def __init__(self, ttl: float = STATS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._async_key_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._lock = threading.Lock()
+        # invalidate() のたびに進む。集計中に破棄されたかどうかの判定に使う
+        self._generation = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        キャッシュがあれば返し、なければ compute() の結果を保存して返す
+
+        Args:
+            key: キャッシュキー
+            compute: 集計関数
+
+        Returns:
+            集計結果
+        """
+        value = self._lookup(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # 待っている間に別のリクエストが集計した場合はそれを使う
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            generation = self._generation
+            value = compute()
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+
+    async def get_or_compute_async(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        get_or_compute の非同期版（イベントループをブロックせずに待ち合わせる）
+
+        Args:
+            key: キャッシュキー
+            compute: 集計関数（コルーチンを返す）
+
+        Returns:
+            集計結果
+        """
+        value = self._lookup(key)
+        if value is not None:
+            return value
+
+        key_lock = self._async_key_locks.setdefault(key, asyncio.Lock())
+        async with key_lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            generation = self._generation
+            value = await compute()
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+
+    def _lookup(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def invalidate(self):
+        """キャッシュを全て破棄"""
+        with self._lock:
+            self._generation += 1
+            self._entries = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ChangeListener(threading.Thread):
+    """
+    virtual_bets の変更通知を受けてキャッシュを破棄するスレッド
+
+    通知は接続が切れている間に失われるため、再接続したときにも一度破棄する。
+    """
+
+    def __init__(self, cache: StatsCache, dsn: str):
+        super().__init__(name='stats-cache-listener', daemon=True)
+        self.cache = cache
+        self.dsn = dsn
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self.cache.invalidate()
+                logger.info(f"統計キャッシュ: {NOTIFY_CHANNEL} の通知を待機")
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        # タイムアウト時は接続が生きているか確認
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1")
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.cache.invalidate()
+            except Exception as e:
+                logger.warning(f"統計キャッシュの通知受信エラー（{LISTEN_RETRY_SECONDS}秒後に再接続）: {e}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(LISTEN_RETRY_SECONDS)
+
+
+_cache = StatsCache()
+_listener: Optional[ChangeListener] = None
+_listener_lock = threading.Lock()
+
+
+def get_cache() -> StatsCache:
+    """プロセス共通のキャッシュ（初回に通知の受信を開始）"""
+    global _listener
+    if _listener is None:
+        dsn = os.environ.get('DATABASE_URL')
+        with _listener_lock:
+            if _listener is None and dsn:
+                _listener = ChangeListener(_cache, dsn)
+                _listener.start()
+    return _cache
+
+
+def invalidate():
+    """統計キャッシュを破棄（集計に出ない列だけを更新した場合など、通知が来ない書き込みの後に呼ぶ）"""
+    _cache.invalidate()
+
+
+def cached_stats(func: Callable) -> Callable:
+    """
+    FastAPIのエンドポイントの結果を、関数名とクエリパラメータをキーにキャッシュする
+
+    FastAPI は functools.wraps で残る元の関数のシグネチャからパラメータを読む。
+    async def の関数には async def のラッパーを返す（FastAPI がイベントループ上で実行する）。
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return await get_cache().get_or_compute_async(key, lambda: func(*args, **kwargs))
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        return get_cache().get_or_compute(key, lambda: func(*args, **kwargs))
+    return wrapper